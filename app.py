@@ -5,6 +5,9 @@ from dotenv import load_dotenv
 import openai
 import json
 import re
+from chatbot.geodata import OfficeLocator
+from chatbot.pipeline import Pipeline, Stage
+from chatbot.traffic import TrafficRecorder, annotate, install_flask_recorder
 
 # Load environment variables
 load_dotenv()
@@ -12,9 +15,16 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# Record anonymized chat traffic for replay when a path is configured
+if os.getenv('TRAFFIC_RECORD_PATH'):
+    install_flask_recorder(app, TrafficRecorder(os.getenv('TRAFFIC_RECORD_PATH')))
+
 # Configure OpenAI
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# Nearest DMV offices to the user's location, resolved offline and added to the prompt
+office_locator = OfficeLocator.load(os.getenv('GEODATA_OFFICES_FILE'), os.getenv('GEODATA_GAZETTEER_FILE'))
+
 # Store conversation history
 conversation_history = []
 
@@ -73,22 +83,7 @@ def home():
     return render_template('chatbot/index.html')
 
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    data = request.json
-    user_message = data.get('message', '')
-    # Get location from request, default to California
-    user_location = data.get('location', 'California')
-
-    # Add user message to conversation history
-    conversation_history.append({"role": "user", "content": user_message})
-
-    # Load the MCP system prompt
-    try:
-        with open('mcp_location_prompt.txt', 'r') as f:
-            system_prompt = f.read()
-    except FileNotFoundError:
-        system_prompt = """You are a helpful government services assistant. You can help users with various government services and forms.
+DEFAULT_SYSTEM_PROMPT = """You are a helpful government services assistant. You can help users with various government services and forms.
         When users want to update their address, collect the following information:
         - Current address
         - New address
@@ -100,27 +95,69 @@ def chat():
         If you receive multiple pieces of information, acknowledge them all.
         Once you have all the information, inform the user that they can submit the form."""
 
-    # Add location context to the system message
-    system_message = f"{system_prompt}\n\nCurrent user location: {user_location}"
+COMPLETION_TIMEOUT_SECONDS = 30
+
 
+def load_system_prompt():
+    """Load the MCP system prompt, falling back to a built-in default."""
     try:
-        # Prepare messages for the API call
-        messages = [{"role": "system", "content": system_message}
-                    ] + conversation_history[-5:]  # Keep last 5 messages
+        with open('mcp_location_prompt.txt', 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return DEFAULT_SYSTEM_PROMPT
+
 
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
+def complete(values):
+    # Add location context to the system message
+    system_message = f"{values['system_prompt']}\n\nCurrent user location: {values['location']}"
+    nearby = office_locator.context_block(values['location'], ('dmv',))
+    if nearby:
+        system_message = f"{system_message}\n\n{nearby}"
+
+    # Prepare messages for the API call
+    messages = [{"role": "system", "content": system_message}] + values['history']
+
+    response = openai.ChatCompletion.create(
+        model="gpt-4o-mini",
+        messages=messages
+    )
+    return response.choices[0].message.content
+
+
+# Form extraction runs while the completion is in flight
+chat_pipeline = Pipeline([
+    Stage('system_prompt', lambda v: load_system_prompt(), timeout=1.0, fallback=DEFAULT_SYSTEM_PROMPT),
+    Stage('form_data', lambda v: extract_form_data(v['message']), timeout=1.0, fallback=lambda v, e: {}),
+    Stage('completion', complete, deps=('system_prompt',), timeout=COMPLETION_TIMEOUT_SECONDS),
+], name='app-chat-pipeline')
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    data = request.json
+    user_message = data.get('message', '')
+    # Get location from request, default to California
+    user_location = data.get('location', 'California')
+
+    # Add user message to conversation history
+    conversation_history.append({"role": "user", "content": user_message})
+
+    try:
+        result = chat_pipeline.run({
+            'message': user_message,
+            'location': user_location,
+            'history': conversation_history[-5:]  # Keep last 5 messages
+        })
 
-        bot_response = response.choices[0].message.content
+        bot_response = result['completion']
+        annotate(stages={name: round(ms, 2) for name, ms in result.timings.items()}, fallbacks=result.fallbacks)
 
         # Add bot response to conversation history
         conversation_history.append(
             {"role": "assistant", "content": bot_response})
 
-        # Extract form data from the conversation
-        form_data = extract_form_data(user_message)
+        # Update the form with data extracted from the message
+        form_data = result['form_data']
         if form_data:
             dmv_forms['address_update'].update(form_data)
 
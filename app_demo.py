@@ -1,17 +1,29 @@
 from flask import Flask, request, jsonify, render_template_string
 import os
 from dotenv import load_dotenv
+from chatbot.pipeline import Pipeline, rag_stages
+from chatbot.prefetch import Prefetcher
 from chatbot.rag_system import RAGSystem
+from chatbot.reloader import KnowledgeBaseWatcher
+from chatbot.singleflight import SingleFlight, make_key, prompt_version
+from chatbot.traffic import TrafficRecorder, annotate, install_flask_recorder
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 
+# Record anonymized chat traffic for replay when a path is configured
+if os.getenv('TRAFFIC_RECORD_PATH'):
+    install_flask_recorder(app, TrafficRecorder(os.getenv('TRAFFIC_RECORD_PATH')))
+
 # Initialize the RAG system
 openai_api_key = os.getenv('OPENAI_API_KEY')
 knowledge_base_dir = os.path.join(os.path.dirname(__file__), 'knowledge_base')
 rag_system = None
+kb_watcher = None
+response_flight = SingleFlight()
+prefetcher = Prefetcher(lambda: rag_system)
 
 # System prompt for the chatbot
 system_prompt = """You are GovFlowAI, an AI assistant for government services in California. 
@@ -158,6 +170,9 @@ HTML_TEMPLATE = '''
     
     <script>
         let indexBuilt = false;
+        const clientId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+        let prefetchTimer = null;
+        let lastPrefetched = '';
         
         // First build the index when the page loads
         window.onload = async function() {
@@ -194,6 +209,8 @@ HTML_TEMPLATE = '''
             // Add user message to chat
             addMessage('user', message);
             input.value = '';
+            clearTimeout(prefetchTimer);
+            lastPrefetched = '';
             
             // Show loading indicator
             document.getElementById('loading-indicator').style.display = 'block';
@@ -205,7 +222,7 @@ HTML_TEMPLATE = '''
                     headers: {
                         'Content-Type': 'application/json'
                     },
-                    body: JSON.stringify({ message })
+                    body: JSON.stringify({ message, client_id: clientId })
                 });
                 
                 const data = await response.json();
@@ -250,6 +267,23 @@ HTML_TEMPLATE = '''
             input.focus();
         }
         
+        // Start retrieval for the draft once typing pauses
+        document.getElementById('user-input').addEventListener('input', function() {
+            clearTimeout(prefetchTimer);
+            prefetchTimer = setTimeout(function() {
+                const partial = document.getElementById('user-input').value.trim();
+                if (!indexBuilt || partial.length < 12 || partial === lastPrefetched) return;
+                lastPrefetched = partial;
+                fetch('/prefetch', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({ partial, client_id: clientId })
+                }).catch(function() {});
+            }, 400);
+        });
+        
         // Allow Enter key to send message
         document.getElementById('user-input').addEventListener('keypress', function(event) {
             if (event.key === 'Enter') {
@@ -267,23 +301,37 @@ def home():
 
 @app.route('/build-index', methods=['GET'])
 def build_index():
-    global rag_system
+    global rag_system, kb_watcher
     
     try:
         if not rag_system:
             if not openai_api_key:
                 return jsonify({'status': 'error', 'error': 'OpenAI API key not found'}), 500
                 
-            rag_system = RAGSystem(
+            system = RAGSystem(
                 knowledge_base_dir=knowledge_base_dir,
                 openai_api_key=openai_api_key
             )
+            system.build_index()
+            kb_watcher = KnowledgeBaseWatcher(system).start()
+            rag_system = system
+        else:
+            # Already serving: rebuild in the background and swap when ready
+            kb_watcher.request_reload()
             
-        rag_system.build_index()
-        return jsonify({'status': 'success'})
+        return jsonify({'status': 'success', 'generation': rag_system.generation})
     except Exception as e:
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
+def coalesced_generation(values, answer):
+    """Share the completion with identical in-flight questions."""
+    flight_key = make_key(values['message'], values['location'], prompt_version(values['system_prompt']))
+    return response_flight.do(flight_key, answer, timeout=60)
+
+
+# Same retrieval and generation stages as the Django chat view
+chat_pipeline = Pipeline(rag_stages(lambda: rag_system, generate=coalesced_generation), name='demo-chat-pipeline')
+
 @app.route('/chat', methods=['POST'])
 def chat():
     global rag_system
@@ -298,11 +346,19 @@ def chat():
         return jsonify({'status': 'error', 'message': 'No message provided'}), 400
         
     try:
-        # Generate response using RAG
-        response, sources = rag_system.generate_response(
-            user_query=user_message,
-            system_prompt=system_prompt,
-            location="California"
+        client_id = str(data.get('client_id', ''))[:64]
+        result = chat_pipeline.run({
+            'message': user_message,
+            'location': "California",
+            'system_prompt': system_prompt,
+            'prefetched': prefetcher.lookup(client_id, user_message, "California", rag_system.generation)
+        })
+        response, sources = result['generation']
+        annotate(
+            stages={name: round(ms, 2) for name, ms in result.timings.items()},
+            fallbacks=result.fallbacks,
+            route=result['retrieval'][0].name,
+            prefetched=result['prefetched'] is not None
         )
         
         return jsonify({
@@ -313,5 +369,20 @@ def chat():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+    if not rag_system:
+        return jsonify({'status': 'not_ready'})
+    
+    data = request.json
+    client_id = str(data.get('client_id', ''))[:64]
+    if not client_id:
+        return jsonify({'status': 'error', 'message': 'No client_id provided'}), 400
+    
+    status = prefetcher.submit(client_id, str(data.get('partial', '')), "California", rate_key=request.remote_addr)
+    if status == 'rate_limited':
+        return jsonify({'status': status}), 429
+    return jsonify({'status': status}), 202 if status == 'accepted' else 200
+
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
@@ -0,0 +1,122 @@
+"""
+Near-duplicate elimination benchmark for GovFlowAI
+
+Splits the knowledge base into its sections, adds county layers that copy a
+share of them with a few words changed (the way local guidance repeats the
+statewide text), and compares retrieval over the full chunk set with
+retrieval over the deduplicated one:
+1. Index size: chunks before and after, and the time deduplication takes
+2. Group quality: the lowest estimated similarity between any merged chunk
+   and the canonical text that replaced it
+3. Retrieval: how often the section that answers a question is among the
+   first --top-k chunks (directly or through a merged chunk's attributions),
+   and how many different sections those chunks cover
+
+No embedding service is called: chunks and questions are ranked by the
+hashed character-trigram vectors of benchmark_rerank.
+
+Usage: python benchmark_dedup.py --layers 20 --share 0.5 --edit 0.03 --top-k 5
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmark_rerank import QUERIES, embed, load_sections
+from chatbot.dedup import SIMILARITY_THRESHOLD, deduplicate_documents, minhash_signature
+
+FILLER_WORDS = ["county", "office", "local", "resident", "form", "fee", "online", "service", "visit", "hours"]
+
+
+def county_layers(sections, layers: int, share: float, edit: float, rng: random.Random):
+    """Copies of a share of the sections per layer, with a fraction of their words replaced."""
+    copies = []
+    for layer in range(layers):
+        for section in sections:
+            if rng.random() >= share:
+                continue
+            words = section.page_content.split(' ')
+            for _ in range(max(1, int(len(words) * edit))):
+                words[rng.randrange(len(words))] = rng.choice(FILLER_WORDS)
+            copies.append(Document(page_content=' '.join(words),
+                                   metadata=dict(section.metadata, source=f"county-{layer}.md")))
+    return copies
+
+
+def retrieve(query: str, matrix: np.ndarray, top_k: int):
+    """Indices of the top_k rows closest to the query."""
+    distances = np.linalg.norm(matrix - embed(query), axis=1)
+    return np.argsort(distances)[:top_k]
+
+
+def labels_of(document: Document, labels) -> set:
+    """Section labels a retrieved chunk stands for, including the chunks merged into it."""
+    sources = document.metadata.get("sources") or [document.metadata]
+    return {labels[source["chunk_id"]] for source in sources}
+
+
+def answered(found: set, label: str) -> bool:
+    return any(name == label or name.endswith(f"/ {label}") for name in found)
+
+
+def report(name: str, documents, labels, top_k: int) -> None:
+    matrix = np.stack([embed(doc.page_content) for doc in documents])
+    hits = []
+    sections = []
+    for query, label, _ in QUERIES:
+        retrieved = [documents[i] for i in retrieve(query, matrix, top_k)]
+        hits.append(answered(set().union(*(labels_of(doc, labels) for doc in retrieved)), label))
+        # Sections the prompt actually gets: one per retrieved chunk (its canonical text)
+        sections.append(len({labels[doc.metadata["chunk_id"]] for doc in retrieved}))
+    print(f"{name:<14} chunks {len(documents):6d}   R@{top_k} {sum(hits) / len(hits):6.1%}   "
+          f"distinct sections in top {top_k} {sum(sections) / len(sections):4.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure near-duplicate elimination and its effect on retrieval")
+    parser.add_argument('--knowledge-base', default='knowledge_base')
+    parser.add_argument('--layers', type=int, default=20, help='county layers copying statewide sections')
+    parser.add_argument('--share', type=float, default=0.5, help='fraction of sections each layer copies')
+    parser.add_argument('--edit', type=float, default=0.03, help='fraction of words changed in a copy')
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    sections = load_sections(args.knowledge_base)
+    documents = sections + county_layers(sections, args.layers, args.share, args.edit, random.Random(args.seed))
+    labels = []
+    for chunk_id, document in enumerate(documents):
+        labels.append(document.metadata["label"])
+        document.metadata["chunk_id"] = chunk_id
+    print(f"== {len(sections)} sections + {len(documents) - len(sections)} county copies "
+          f"({args.edit:.0%} of words changed), threshold {args.threshold:g}")
+
+    started = time.perf_counter()
+    deduplicated, stats = deduplicate_documents(documents, threshold=args.threshold)
+    elapsed = time.perf_counter() - started
+    print(f"\n-- index size\n{stats['chunks_in']} -> {stats['chunks_out']} chunks "
+          f"({stats['reduction']:.1%} smaller) in {elapsed * 1000:.0f} ms")
+
+    lowest = 1.0
+    for document in deduplicated:
+        sources = document.metadata.get("sources")
+        if not sources:
+            continue
+        canonical = minhash_signature(document.page_content)
+        for source in sources:
+            similarity = float((minhash_signature(documents[source["chunk_id"]].page_content) == canonical).mean())
+            lowest = min(lowest, similarity)
+    print(f"lowest similarity of a merged chunk to its canonical text: {lowest:.2f}")
+
+    print("\n-- retrieval")
+    report("sections only", sections, labels, args.top_k)
+    report("with copies", documents, labels, args.top_k)
+    report("deduplicated", deduplicated, labels, args.top_k)
+
+
+if __name__ == '__main__':
+    main()
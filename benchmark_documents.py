@@ -0,0 +1,157 @@
+"""
+Document intake benchmark for GovFlowAI
+
+Uploads synthetic utility bills and out-of-state licenses (PDFs padded with
+an embedded image to a realistic size) from many threads at once and
+measures:
+1. Upload throughput: bodies streamed to the spool directory per second
+2. Extraction throughput: jobs finished by the process pool per second,
+   and the time from upload to fields being available
+3. Memory per concurrent upload: the Python heap peak while the uploads
+   are in flight, divided by the number in flight, next to the same
+   measurement for reading each body into memory first
+
+Usage: python benchmark_documents.py --uploads 200 --concurrency 16 --size-mb 2 --workers 4
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+
+from chatbot.documents import DocumentIntake
+
+BILL = ["Pacific Gas and Electric Company", "Statement Date: 09/14/2026", "Account Holder: Maria Lopez",
+        "Service Address:", "1234 Oak Street Apt 5", "Sacramento, CA 95814", "Electric usage 412 kWh", "Amount Due $88.10"]
+LICENSE = ["NEVADA DRIVER LICENSE", "DL NO B1234567", "LN GARCIA", "FN JOSE LUIS", "DOB 04/02/1988",
+           "EXP 04/02/2029", "500 Desert Rd", "Las Vegas, NV 89101"]
+PAD_BLOCK = os.urandom(64 * 1024)
+
+
+class SyntheticPdf:
+    """A PDF body generated as it is read, so the benchmark holds no whole files itself."""
+
+    def __init__(self, lines, size: int):
+        text = "\n".join(["BT /F1 11 Tf 72 740 Td 14 TL"] + [f"({line}) Tj T*" for line in lines] + ["ET"])
+        content = zlib.compress(text.encode("latin-1"))
+        self.head = (b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n"
+                     b"2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n"
+                     b"3 0 obj\n<< /Type /Page /Parent 2 0 R /Contents 4 0 R >>\nendobj\n"
+                     + b"4 0 obj\n<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content +
+                     b"\nendstream\nendobj\n5 0 obj\n<< /Subtype /Image /Filter /DCTDecode >>\nstream\n")
+        self.tail = b"\nendstream\nendobj\ntrailer\n<< /Root 1 0 R >>\n%%EOF\n"
+        self.pad = max(0, size - len(self.head) - len(self.tail))
+        self.size = len(self.head) + self.pad + len(self.tail)
+        self.position = 0
+
+    def read(self, n: int = -1) -> bytes:
+        if n < 0:
+            n = self.size - self.position
+        out = bytearray()
+        while len(out) < n and self.position < self.size:
+            position = self.position
+            if position < len(self.head):
+                piece = self.head[position:position + n - len(out)]
+            elif position < len(self.head) + self.pad:
+                offset = (position - len(self.head)) % len(PAD_BLOCK)
+                piece = PAD_BLOCK[offset:offset + min(n - len(out), len(self.head) + self.pad - position)]
+            else:
+                offset = position - len(self.head) - self.pad
+                piece = self.tail[offset:offset + n - len(out)]
+            out += piece
+            self.position += len(piece)
+        return bytes(out)
+
+
+def run_uploads(intake, count: int, concurrency: int, size: int, buffered: bool = False):
+    """Upload count documents from concurrency threads; returns (job ids, seconds)."""
+    job_ids = []
+    ids_lock = threading.Lock()
+    next_index = iter(range(count))
+    index_lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def upload():
+        barrier.wait()
+        while True:
+            with index_lock:
+                index = next(next_index, None)
+            if index is None:
+                return
+            body = SyntheticPdf(BILL if index % 2 else LICENSE, size)
+            if buffered:
+                # What reading request.body first would cost
+                whole = body.read()
+                body = SyntheticPdf(BILL if index % 2 else LICENSE, size)
+                del whole
+            job = intake.receive(body, "real_id" if index % 2 else "new_resident", f"client-{index}", body.size)
+            with ids_lock:
+                job_ids.append(job["job_id"])
+
+    threads = [threading.Thread(target=upload) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return job_ids, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure document upload and extraction throughput")
+    parser.add_argument('--uploads', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16, help='uploads in flight at once')
+    parser.add_argument('--size-mb', type=float, default=2.0, help='size of each document')
+    parser.add_argument('--workers', type=int, default=4, help='extraction processes')
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as directory:
+        intake = DocumentIntake(os.path.join(directory, 'uploads'), os.path.join(directory, 'documents.sqlite3'),
+                                workers=args.workers, max_bytes=size * 2, max_pending=args.uploads)
+        # Start the pool before timing anything
+        intake.receive(SyntheticPdf(BILL, 1024), "real_id")
+
+        print(f"== {args.uploads} uploads of {args.size_mb:g} MB, {args.concurrency} at a time, {args.workers} workers")
+        for buffered in (False, True):
+            tracemalloc.start()
+            job_ids, upload_seconds = run_uploads(intake, args.uploads, args.concurrency, size, buffered)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            label = "read whole body first" if buffered else "streamed"
+            print(f"\n-- {label}")
+            print(f"Uploads                  {args.uploads / upload_seconds:10,.1f} /s  "
+                  f"({args.uploads * size / upload_seconds / 2 ** 20:,.0f} MB/s)")
+            print(f"Heap peak                {peak / 2 ** 20:10,.1f} MB  "
+                  f"({peak / args.concurrency / 1024:,.0f} KB per concurrent upload)")
+
+            started = time.perf_counter()
+            waiting = set(job_ids)
+            latencies = []
+            while waiting:
+                for job_id in list(waiting):
+                    job = intake.status(job_id)
+                    if job["status"] != "queued":
+                        waiting.discard(job_id)
+                        latencies.append(job["seconds"])
+                time.sleep(0.05)
+            drain_seconds = upload_seconds + time.perf_counter() - started
+            latencies.sort()
+            print(f"Extracted                {args.uploads / drain_seconds:10,.1f} jobs/s  "
+                  f"(upload to fields p50 {latencies[len(latencies) // 2]:.2f}s, "
+                  f"p95 {latencies[int(len(latencies) * 0.95)]:.2f}s)")
+
+        snapshot = intake.snapshot()
+        print(f"\nDone {snapshot['done']}, failed {snapshot['failed']}, rejected {snapshot['rejected']}; "
+              f"process max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.0f} MB; "
+              f"spool files left: {len(os.listdir(intake.upload_dir))}")
+        sample = intake.status(job_ids[0])
+        print(f"Sample job: {sample['document_type']} {sample['fields']}")
+
+
+if __name__ == '__main__':
+    main()
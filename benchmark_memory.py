@@ -0,0 +1,131 @@
+"""
+Memory benchmark for GovFlowAI workers
+
+Measures with tracemalloc what each indexed chunk and each client session
+costs, at scale, and compares it with the estimates the memory accountant
+reports under "memory" in /api/metrics/:
+1. Per chunk: LangChain Documents (what InMemoryDocstore keeps) versus the
+   compact ChunkStore, plus the flat search cache (vector norms; the
+   vectors themselves are read in place from the FAISS index)
+2. Per cached query vector, per cached answer and per prefetch session
+
+FAISS allocates its index outside the Python allocator, so tracemalloc
+can't see it; its size is ntotal * dimensions * 4 bytes for the flat index.
+
+Usage: python benchmark_memory.py --chunks 20000 --sessions 5000
+"""
+
+import argparse
+import gc
+import random
+import string
+import time
+import tracemalloc
+
+import numpy as np
+from langchain_core.documents import Document
+
+from chatbot.chunk_store import ChunkStore
+from chatbot.embedding_batcher import EmbeddingDispatcher
+from chatbot.prefetch import Prefetcher, _Entry
+from chatbot.response_cache import ResponseCache, response_key
+
+CHUNK_CHARS = 800
+TOP_K = 8
+
+
+def random_text(chars: int) -> str:
+    words = []
+    while sum(len(word) + 1 for word in words) < chars:
+        words.append(''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))))
+    return ' '.join(words)[:chars]
+
+
+def make_documents(count: int):
+    return [
+        Document(page_content=random_text(CHUNK_CHARS), metadata={
+            "source": f"knowledge_base/topic_{i % 40}.md",
+            "category": f"category_{i % 8}",
+            "chunk_id": i,
+        })
+        for i in range(count)
+    ]
+
+
+def measure(build):
+    """Bytes still allocated after build() returns, and the object it built."""
+    gc.collect()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    return after - before, result
+
+
+def report(label: str, total: int, count: int, estimate: int = None) -> None:
+    line = f"{label:<34} {total / 2 ** 20:9.1f} MB  {total / count:9.0f} B each"
+    if estimate is not None:
+        line += f"   (accountant: {estimate / 2 ** 20:.1f} MB)"
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure per-chunk and per-session memory overhead")
+    parser.add_argument('--chunks', type=int, default=20000)
+    parser.add_argument('--sessions', type=int, default=5000)
+    parser.add_argument('--dim', type=int, default=1536)
+    args = parser.parse_args()
+
+    random.seed(0)
+    tracemalloc.start()
+    started = time.time()
+
+    print(f"== Per chunk ({args.chunks} chunks of {CHUNK_CHARS} chars, {args.dim} dimensions)")
+    documents_bytes, documents = measure(lambda: make_documents(args.chunks))
+    report("LangChain Documents", documents_bytes, args.chunks)
+
+    store_bytes, store = measure(lambda: ChunkStore.from_documents(documents))
+    usage = store.memory_usage()
+    report("ChunkStore", store_bytes, args.chunks, usage["chunk_text"] + usage["chunk_metadata"])
+
+    vectors_bytes, vectors = measure(lambda: np.random.default_rng(0).standard_normal((args.chunks, args.dim), dtype=np.float32))
+    norms_bytes, norms = measure(lambda: np.einsum('ij,ij->i', vectors, vectors))
+    report("Flat search cache norms", norms_bytes, args.chunks, norms.nbytes)
+    print(f"{'FAISS flat index (not traced)':<34} {args.chunks * args.dim * 4 / 2 ** 20:9.1f} MB  {args.dim * 4:9.0f} B each")
+
+    print(f"\n== Per session ({args.sessions} clients)")
+    dispatcher = EmbeddingDispatcher(None, cache_size=args.sessions)
+    cache_bytes, _ = measure(lambda: [dispatcher._remember(f"question {i}", vectors[i % args.chunks].tolist())
+                                      for i in range(args.sessions)])
+    report("Query vector cache entry", cache_bytes, args.sessions, dispatcher.memory_usage()["embedding_cache"])
+
+    response_cache = ResponseCache(max_entries=args.sessions)
+
+    def fill_response_cache():
+        for i in range(args.sessions):
+            key = response_key(f"question {i}", "California", "system prompt", "llm")
+            sources = [{"source": documents[j].metadata["source"], "category": documents[j].metadata["category"]}
+                       for j in range(TOP_K)]
+            response_cache.put(key, 0, (random_text(600), sources))
+
+    answers_bytes, _ = measure(fill_response_cache)
+    report("Cached answer", answers_bytes, args.sessions, response_cache.memory_usage()["response_cache"])
+
+    prefetcher = Prefetcher(lambda: None, max_clients=args.sessions)
+
+    def fill_prefetcher():
+        for i in range(args.sessions):
+            rows = random.sample(range(args.chunks), TOP_K)
+            scored = [(store.document(row), random.random()) for row in rows]
+            prefetcher._entries[f"client-{i}"] = [_Entry(f"question {i}", "California", 0, scored, time.monotonic())]
+
+    prefetch_bytes, _ = measure(fill_prefetcher)
+    report("Prefetch session", prefetch_bytes, args.sessions, prefetcher.memory_usage()["prefetch_sessions"])
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"\nPeak traced: {peak / 2 ** 20:.1f} MB in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
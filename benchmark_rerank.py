@@ -0,0 +1,185 @@
+"""
+Reranking benchmark for GovFlowAI
+
+Splits the knowledge base into its sections, asks labeled questions whose
+answer lives in one known section, and compares the first-stage order with
+the reranked order:
+1. Precision: how often the right section is first (P@1), within the first
+   three chunks (R@3), and the mean reciprocal rank
+2. Context size: chunks left after the low-scoring tail is dropped
+3. Latency: per query with a cold and a warm feature cache, and how many
+   queries fall back to the first-stage order under a tight budget
+
+No embedding service is called: the first stage is a stand-in that ranks
+sections by hashed character-trigram vectors with added noise (--noise), so
+it is about as imprecise as a small embedding model on short questions.
+
+Usage: python benchmark_rerank.py --noise 0.15 --budget-ms 20 --rounds 20
+"""
+
+import argparse
+import glob
+import os
+import random
+import re
+import time
+import zlib
+
+import numpy as np
+from langchain_core.documents import Document
+
+from chatbot.rerank import Reranker
+
+DIMENSIONS = 512
+
+# (question, section heading that answers it, intent)
+QUERIES = [
+    ("How do I renew my driver's license online?", "License Renewal", "license_renewal"),
+    ("What documents do I need for a REAL ID?", "REAL ID", "real_id"),
+    ("I just moved here, how do I get a new license?", "New License", "new_resident"),
+    ("How do I register my car in California?", "Vehicle Registration", "vehicle_registration"),
+    ("I moved, how do I update my address with the DMV?", "Address Change", "address_change"),
+    ("I sold my car, what do I need to do?", "Vehicle Transfer", "vehicle_transfer"),
+    ("How can I book a DMV appointment?", "DMV Appointments", "dmv_appointment"),
+    ("Do I have to file a state income tax return?", "Filing Requirements", None),
+    ("What are the California income tax rates?", "Tax Rates", None),
+    ("When is my state tax return due?", "Filing Deadlines", None),
+    ("How can I pay my state income tax?", "Payment Options", None),
+    ("How is my property tax assessed?", "Assessment", None),
+    ("When are property tax installments due?", "Payment Deadlines", None),
+    ("Is there a homeowners exemption for property tax?", "Exemptions", None),
+    ("What is the sales tax rate?", "Sales and Use Tax", None),
+    ("How do I register a new business for taxes?", "Business Registration", None),
+    ("Where can I get free help preparing my taxes?", "Free Tax Preparation", None),
+    ("Can I set up a payment plan for taxes I owe?", "Payment Plans", None),
+    ("Who is eligible for CalFresh food benefits?", "CalFresh (Food Stamps) / Eligibility", None),
+    ("How do I apply for Medi-Cal?", "Medi-Cal (California's Medicaid Program) / Application Process", None),
+    ("What services does Medi-Cal cover?", "Covered Services", None),
+    ("How much cash aid does CalWORKs pay?", "California Work Opportunity and Responsibility to Kids (CalWORKs) / Benefits", None),
+    ("How do I claim the CalEITC?", "How to Claim", None),
+    ("How do I get a Section 8 housing voucher?", "Section 8 Housing Choice Voucher Program", None),
+]
+
+
+def load_sections(knowledge_base_dir: str):
+    """One Document per ### section, with its ## parent heading as the first lines."""
+    docs = []
+    for path in sorted(glob.glob(os.path.join(knowledge_base_dir, '*.md'))):
+        parent = ''
+        current = None
+        for line in open(path, encoding='utf-8').read().split('\n'):
+            if line.startswith('## '):
+                parent = line[3:].strip()
+                current = None
+            elif line.startswith('### '):
+                current = {"heading": line[4:].strip(), "parent": parent, "lines": [parent, line[4:].strip()]}
+                docs.append((path, current))
+            elif parent and line.strip():
+                if current is None:
+                    # A ## section without ### subsections
+                    current = {"heading": parent, "parent": parent, "lines": [parent]}
+                    docs.append((path, current))
+                current["lines"].append(re.sub(r'^[-*] |\*\*', '', line.strip()))
+    documents = []
+    for path, section in docs:
+        text = '\n'.join(line for line in section["lines"] if line)
+        documents.append(Document(page_content=text, metadata={
+            "source": os.path.basename(path),
+            "category": os.path.splitext(os.path.basename(path))[0],
+            "label": f"{section['parent']} / {section['heading']}",
+        }))
+    return documents
+
+
+def embed(text: str) -> np.ndarray:
+    """Hashed character-trigram vector, normalized."""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    text = f"  {text.lower()} "
+    for i in range(len(text) - 2):
+        vector[zlib.crc32(text[i:i + 3].encode()) % DIMENSIONS] += 1.0
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def first_stage(query: str, documents, matrix: np.ndarray, noise: float, rng: random.Random):
+    """(document, L2 distance) pairs for every section, closest first."""
+    distances = np.linalg.norm(matrix - embed(query), axis=1)
+    distances = distances + np.array([rng.gauss(0.0, noise) for _ in documents], dtype=np.float32)
+    order = np.argsort(distances)
+    return [(documents[i], float(distances[i])) for i in order]
+
+
+def rank_of(scored, label: str) -> int:
+    for rank, (doc, _) in enumerate(scored, start=1):
+        if doc.metadata["label"] == label or doc.metadata["label"].endswith(f"/ {label}"):
+            return rank
+    return 0
+
+
+def summarize(name: str, ranks, kept=None) -> None:
+    count = len(ranks)
+    p1 = sum(1 for rank in ranks if rank == 1) / count
+    r3 = sum(1 for rank in ranks if 0 < rank <= 3) / count
+    mrr = sum(1 / rank for rank in ranks if rank) / count
+    line = f"{name:<14} P@1 {p1:6.1%}   R@3 {r3:6.1%}   MRR {mrr:.3f}"
+    if kept is not None:
+        line += f"   chunks kept {sum(kept) / len(kept):5.1f}   answer dropped {sum(1 for rank in ranks if rank == 0)}"
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure reranking precision and latency")
+    parser.add_argument('--knowledge-base', default='knowledge_base')
+    parser.add_argument('--noise', type=float, default=0.15, help='first-stage distance noise')
+    parser.add_argument('--budget-ms', type=float, default=20.0)
+    parser.add_argument('--rounds', type=int, default=20, help='noisy first-stage draws per query')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    documents = load_sections(args.knowledge_base)
+    matrix = np.stack([embed(doc.page_content) for doc in documents])
+    rng = random.Random(args.seed)
+    runs = [(query, label, intent, first_stage(query, documents, matrix, args.noise, rng))
+            for _ in range(args.rounds) for query, label, intent in QUERIES]
+    print(f"== {len(QUERIES)} questions x {args.rounds} first-stage draws over {len(documents)} sections, "
+          f"noise {args.noise:g}")
+
+    print("\n-- precision")
+    summarize("first stage", [rank_of(scored, label) for _, label, _, scored in runs])
+    for name, min_relative in (("reranked", 0.0), ("reranked+trim", 0.5)):
+        reranker = Reranker(candidates=len(documents), budget_ms=1000.0, min_relative_score=min_relative)
+        results = [reranker.rerank(query, scored, intent=intent) for query, _, intent, scored in runs]
+        summarize(name, [rank_of(result, label) for result, (_, label, _, _) in zip(results, runs)],
+                  [len(result) for result in results] if min_relative else None)
+
+    print("\n-- latency")
+    reranker = Reranker(candidates=len(documents), budget_ms=args.budget_ms)
+    for label in ("cold cache", "warm cache"):
+        if label == "cold cache":
+            timings = []
+            for query, _, intent, scored in runs[:len(QUERIES)]:
+                reranker._cache.clear()
+                started = time.perf_counter()
+                reranker.rerank(query, scored, intent=intent)
+                timings.append((time.perf_counter() - started) * 1000)
+        else:
+            timings = []
+            for query, _, intent, scored in runs:
+                started = time.perf_counter()
+                reranker.rerank(query, scored, intent=intent)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{label:<14} p50 {timings[len(timings) // 2]:6.2f} ms   p99 {timings[int(len(timings) * 0.99)]:6.2f} ms "
+              f"for {len(documents)} candidates")
+
+    tight = Reranker(candidates=len(documents), budget_ms=0.05)
+    for query, _, intent, scored in runs[:len(QUERIES)]:
+        tight._cache.clear()
+        tight.rerank(query, scored, intent=intent)
+    snapshot = tight.snapshot()
+    print(f"budget 0.05 ms  {snapshot['over_budget']} of {len(QUERIES)} cold queries fell back to first-stage order")
+    print(f"\nStats: {reranker.snapshot()}")
+    print(f"Feature cache: {reranker.memory_usage()['rerank_features'] / 1024:,.0f} KB for {len(reranker._cache)} chunks")
+
+
+if __name__ == '__main__':
+    main()
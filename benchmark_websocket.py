@@ -0,0 +1,350 @@
+"""
+WebSocket chat load test for GovFlowAI
+
+Opens many persistent chat connections and measures how many one worker
+holds and what they cost:
+1. Ramp: connections opened per second and refusals at the limit
+2. Memory per open connection
+3. Heartbeats: pings answered across every connection
+4. Streaming: a share of the connections run chat turns at once; time to
+   the first token and tokens delivered per second
+5. Backpressure: a client that stops reading is disconnected, not buffered
+
+By default the transport runs in this process with a synthetic model that
+streams tokens at a fixed pace, so no server or API key is needed; memory is
+then the application's own per-connection state. With --url it connects to
+a running worker over real sockets instead (a small stdlib client), and
+reads the worker's RSS from /api/metrics/, e.g.:
+
+    python -m chatbot.mock_llm --port 8765 &
+    OPENAI_API_KEY=mock OPENAI_API_BASE=http://127.0.0.1:8765/v1 uvicorn govchat.asgi:application --port 8000 --workers 1
+    python benchmark_websocket.py --url ws://127.0.0.1:8000/ws/chat/ --connections 2000 --active 100
+
+(Raise the open-files limit for large runs: ulimit -n 65536.)
+
+Usage: python benchmark_websocket.py --connections 5000 --active 200
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import time
+import tracemalloc
+import urllib.request
+from collections import Counter
+from urllib.parse import urlparse
+
+from chatbot.websocket import ChatSocketApp
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def synthetic_turn(first_token_ms: float, token_ms: float, tokens: int):
+    """A chat handler that streams like a model: a pause, then tokens at a steady pace."""
+    def handler(data, emit):
+        emit({'type': 'form', 'intent': None, 'form_template': None, 'form_data': {}})
+        time.sleep(first_token_ms / 1000.0)
+        emit({'type': 'sources', 'sources': [{'title': 'DMV Handbook', 'source': 'dmv.md'}]})
+        for i in range(tokens):
+            emit({'type': 'token', 'content': f'word{i} '})
+            time.sleep(token_ms / 1000.0)
+        emit({'type': 'done', 'intent': None, 'location': data['location']})
+    return handler
+
+
+class TurnTimer:
+    """Collects first-token and completion times of chat turns."""
+
+    def __init__(self):
+        self.started = {}
+        self.waiting_first = set()
+        self.first_token = []
+        self.complete = []
+        self.tokens = 0
+        self.outcomes = Counter()
+
+    def start(self, key):
+        self.started[key] = time.perf_counter()
+        self.waiting_first.add(key)
+
+    def on_message(self, key, message):
+        kind = message.get('type')
+        if kind == 'token':
+            self.tokens += 1
+            if key in self.waiting_first:
+                self.waiting_first.discard(key)
+                self.first_token.append(time.perf_counter() - self.started[key])
+        elif kind in ('done', 'error', 'cancelled'):
+            self.outcomes[kind] += 1
+            started = self.started.pop(key, None)
+            if kind == 'done' and started is not None:
+                self.complete.append(time.perf_counter() - started)
+
+    def report(self, seconds: float) -> None:
+        print(f"Turns: {dict(self.outcomes)}")
+        print(f"First token   p50 {percentile(self.first_token, 0.5) * 1000:8.1f} ms   "
+              f"p95 {percentile(self.first_token, 0.95) * 1000:8.1f} ms")
+        print(f"Whole answer  p50 {percentile(self.complete, 0.5) * 1000:8.1f} ms   "
+              f"p95 {percentile(self.complete, 0.95) * 1000:8.1f} ms")
+        print(f"Tokens delivered {self.tokens / seconds:10,.0f} /s")
+
+
+class FakeSocket:
+    """In-process ASGI WebSocket transport for one client."""
+
+    def __init__(self, key, on_message, send_delay: float = 0.0):
+        self.key = key
+        self.on_message = on_message
+        self.send_delay = send_delay
+        self.inbox = asyncio.Queue()
+        self.inbox.put_nowait({'type': 'websocket.connect'})
+        self.ready = asyncio.Event()
+        self.close_code = None
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, event):
+        if self.send_delay and event['type'] == 'websocket.send':
+            await asyncio.sleep(self.send_delay)
+        if event['type'] == 'websocket.send':
+            message = json.loads(event['text'])
+            if message['type'] == 'ready':
+                self.ready.set()
+            elif message['type'] == 'ping':
+                self.push({'type': 'pong'})
+            self.on_message(self.key, message)
+        elif event['type'] == 'websocket.close':
+            self.close_code = event.get('code')
+            self.ready.set()
+            self.inbox.put_nowait({'type': 'websocket.disconnect', 'code': self.close_code})
+
+    def push(self, payload):
+        self.inbox.put_nowait({'type': 'websocket.receive', 'text': json.dumps(payload)})
+
+
+async def run_in_process(args) -> None:
+    app = ChatSocketApp(synthetic_turn(args.first_token_ms, args.token_ms, args.tokens),
+                        max_connections=args.connections, max_per_client=args.connections + args.extra,
+                        heartbeat_interval=args.heartbeat, idle_timeout=args.heartbeat * 3,
+                        send_timeout=args.send_timeout, turn_workers=args.turn_workers)
+    timer = TurnTimer()
+    pings = Counter()
+
+    def on_message(key, message):
+        if message['type'] == 'ping':
+            pings['received'] += 1
+        timer.on_message(key, message)
+
+    scope = {'type': 'websocket', 'path': '/ws/chat/', 'client': ('10.0.0.1', 0), 'query_string': b''}
+    total = args.connections + args.extra
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    sockets, tasks = [], []
+    for i in range(total):
+        socket = FakeSocket(i, on_message)
+        sockets.append(socket)
+        tasks.append(asyncio.ensure_future(app(scope, socket.receive, socket.send)))
+    await asyncio.gather(*(socket.ready.wait() for socket in sockets))
+    elapsed = time.perf_counter() - started
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    open_sockets = [socket for socket in sockets if socket.close_code is None]
+    refused = sum(1 for socket in sockets if socket.close_code is not None)
+    print(f"== In-process, {args.connections} connection limit, {args.turn_workers} turn threads")
+    print(f"Opened {len(open_sockets)} connections in {elapsed:.2f}s ({total / elapsed:,.0f}/s); "
+          f"refused over the limit: {refused}")
+    print(f"Memory per open connection {(current - baseline) / max(1, len(open_sockets)) / 1024:8.1f} KB "
+          f"(application state, transport queue and task; socket buffers excluded)")
+
+    await asyncio.sleep(args.heartbeat * 1.5)
+    print(f"Heartbeat pings answered in {args.heartbeat * 1.5:.1f}s: {pings['received']:,} "
+          f"(open {app.snapshot()['open']:,}, idle-closed {app.stats['idle_closed']})")
+
+    active = open_sockets[:args.active]
+    started = time.perf_counter()
+    for socket in active:
+        timer.start(socket.key)
+        socket.push({'type': 'chat', 'message': 'How do I renew my license?', 'location': 'Sacramento'})
+    while timer.started and time.perf_counter() - started < 120:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    print(f"\n== {len(active)} concurrent turns ({args.tokens} tokens, first after {args.first_token_ms:g} ms, "
+          f"then every {args.token_ms:g} ms)")
+    timer.report(elapsed)
+
+    print(f"Transport stats: {app.snapshot()}")
+
+    # A reader that stops taking messages, on a transport of its own (the main one is full)
+    slow_app = ChatSocketApp(synthetic_turn(0, 0, args.tokens * 4), send_timeout=args.send_timeout)
+    slow = FakeSocket('slow', lambda key, message: None)
+    slow_task = asyncio.ensure_future(slow_app(scope, slow.receive, slow.send))
+    await slow.ready.wait()
+    slow.send_delay = 3600
+    slow.push({'type': 'chat', 'message': 'slow reader'})
+    started = time.perf_counter()
+    while slow.close_code is None and time.perf_counter() - started < args.send_timeout * 10:
+        await asyncio.sleep(0.05)
+    print(f"\nStalled reader closed with code {slow.close_code} after {time.perf_counter() - started:.1f}s "
+          f"({slow_app.stats['messages_sent']} messages sent, window {slow_app.send_window})")
+
+    for socket in sockets + [slow]:
+        socket.send_delay = 0
+        socket.inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+    await asyncio.gather(*tasks, slow_task, return_exceptions=True)
+
+
+def ws_frame(text: str, opcode: int = 0x1) -> bytes:
+    """A masked client frame."""
+    payload = text.encode('utf-8')
+    mask = os.urandom(4)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+    repeated = (mask * (length // 4 + 1))[:length]
+    masked = (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big') if length else b''
+    return header + mask + masked
+
+
+async def ws_read(reader):
+    """(opcode, payload) of the next server frame."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    return first & 0x0F, await reader.readexactly(length)
+
+
+async def ws_connect(url: str, client_id: str):
+    parts = urlparse(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET {parts.path}?client_id={client_id} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                  f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                  f"Sec-WebSocket-Version: 13\r\n\r\n").encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in head.split(b"\r\n", 1)[0]:
+        writer.close()
+        raise ConnectionError(head.split(b"\r\n", 1)[0].decode(errors='replace'))
+    return reader, writer
+
+
+def worker_rss(url: str):
+    parts = urlparse(url)
+    try:
+        with urllib.request.urlopen(f"http://{parts.netloc}/api/metrics/", timeout=60) as response:
+            data = json.loads(response.read())
+        return data['memory']['rss_bytes'], data.get('chat_sockets', {})
+    except (OSError, ValueError, KeyError):
+        return None, {}
+
+
+async def run_over_network(args) -> None:
+    timer = TurnTimer()
+    outcomes = Counter()
+    connections = {}
+    stop = asyncio.Event()
+
+    async def client(index: int):
+        try:
+            reader, writer = await ws_connect(args.url, f"load-{index}")
+        except (OSError, ConnectionError, asyncio.IncompleteReadError):
+            outcomes['connect_failed'] += 1
+            return
+        connections[index] = writer
+        try:
+            while not stop.is_set():
+                opcode, payload = await ws_read(reader)
+                if opcode == 0x8:
+                    code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else None
+                    outcomes[f'closed {code}'] += 1
+                    return
+                if opcode == 0x9:
+                    writer.write(ws_frame(payload.decode('latin-1'), opcode=0xA))
+                    continue
+                if opcode != 0x1:
+                    continue
+                message = json.loads(payload)
+                if message['type'] == 'ready':
+                    outcomes['ready'] += 1
+                elif message['type'] == 'ping':
+                    outcomes['pings'] += 1
+                    writer.write(ws_frame(json.dumps({'type': 'pong'})))
+                timer.on_message(index, message)
+        except (OSError, asyncio.IncompleteReadError):
+            outcomes['dropped'] += 1
+        finally:
+            connections.pop(index, None)
+            writer.close()
+
+    rss_before, _ = worker_rss(args.url)
+    started = time.perf_counter()
+    tasks = []
+    for start in range(0, args.connections, args.ramp_batch):
+        tasks.extend(asyncio.ensure_future(client(i)) for i in range(start, min(args.connections, start + args.ramp_batch)))
+        await asyncio.sleep(0.05)
+    while outcomes['ready'] + outcomes['connect_failed'] + sum(v for k, v in outcomes.items() if k.startswith('closed')) < args.connections \
+            and time.perf_counter() - started < 120:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    rss_after, sockets = worker_rss(args.url)
+    print(f"== {args.url}")
+    print(f"Open connections: {len(connections):,} of {args.connections:,} in {elapsed:.1f}s; outcomes {dict(outcomes)}")
+    if rss_before and rss_after:
+        print(f"Worker RSS {rss_before / 2 ** 20:,.0f} MB -> {rss_after / 2 ** 20:,.0f} MB "
+              f"({(rss_after - rss_before) / max(1, len(connections)) / 1024:,.1f} KB per connection)")
+    if sockets:
+        print(f"Worker chat_sockets: {sockets}")
+
+    started = time.perf_counter()
+    for index in list(connections)[:args.active]:
+        timer.start(index)
+        connections[index].write(ws_frame(json.dumps({'type': 'chat', 'id': 1, 'location': 'Sacramento',
+                                                      'message': 'How do I renew my driver license?'})))
+    while timer.started and time.perf_counter() - started < 120:
+        await asyncio.sleep(0.05)
+    print(f"\n== {min(args.active, len(connections))} concurrent turns")
+    timer.report(time.perf_counter() - started)
+    print(f"Still open: {len(connections):,}; outcomes {dict(outcomes)}")
+
+    stop.set()
+    for writer in list(connections.values()):
+        writer.write(ws_frame('', opcode=0x8))
+        writer.close()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure how many chat sockets one worker holds")
+    parser.add_argument('--url', default='', help='ws:// URL of a running worker; in-process when empty')
+    parser.add_argument('--connections', type=int, default=5000)
+    parser.add_argument('--active', type=int, default=200, help='connections running a chat turn at once')
+    parser.add_argument('--extra', type=int, default=20, help='connections beyond the limit (in-process)')
+    parser.add_argument('--turn-workers', type=int, default=64)
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--first-token-ms', type=float, default=300.0)
+    parser.add_argument('--token-ms', type=float, default=15.0)
+    parser.add_argument('--heartbeat', type=float, default=2.0, help='seconds between pings (in-process)')
+    parser.add_argument('--send-timeout', type=float, default=1.0, help='seconds before a stalled reader is closed')
+    parser.add_argument('--ramp-batch', type=int, default=200, help='connections opened per 50 ms (network)')
+    args = parser.parse_args()
+    asyncio.run(run_over_network(args) if args.url else run_in_process(args))
+
+
+if __name__ == '__main__':
+    main()
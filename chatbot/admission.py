@@ -0,0 +1,180 @@
+"""
+Admission control and load shedding for GovFlowAI chat requests
+
+When the LLM slows down, unbounded concurrency turns into a pile of blocked
+worker threads. This module bounds it:
+1. AdmissionController caps how many requests run the RAG pipeline at once
+   and queues the rest by priority class
+2. A request that cannot be admitted within its queue budget (or finds the
+   queue full) is shed immediately with Overloaded, so the caller can send a
+   fast degraded response instead of timing out
+3. Deadline travels with the request in a context variable, so the embedding
+   and LLM clients can size their own timeouts from the time that is left
+"""
+
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Lower values are admitted first
+PRIORITY_FORM = 0
+PRIORITY_FAQ = 1
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being admitted."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request has no time left for the next stage."""
+
+
+class Deadline:
+    """A point in time by which a request must be answered."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str = "request") -> float:
+        """Return the remaining seconds, raising DeadlineExceeded if none are left."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+        return remaining
+
+
+_current_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """The deadline of the request running in this thread or task, if any."""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """Make a deadline visible to downstream clients for the duration of a block."""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "abandoned")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.abandoned = False
+
+
+class AdmissionController:
+    """
+    Bounded concurrency limiter with a priority queue and queue-wait budget.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 64, queue_timeout: float = 2.0):
+        """
+        Initialize the controller.
+
+        Args:
+            max_concurrent: Requests allowed to run at once
+            max_queue: Requests allowed to wait; beyond this they are shed at once
+            queue_timeout: Longest a request may wait for a slot before being shed
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = []
+        self._queued = 0
+        self._sequence = itertools.count()
+        self.stats = {"admitted": 0, "shed_queue_full": 0, "shed_timeout": 0}
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @contextmanager
+    def admit(self, priority: int = PRIORITY_FAQ, deadline: Optional[Deadline] = None) -> Iterator[None]:
+        """
+        Hold a concurrency slot for the duration of a block.
+
+        Args:
+            priority: PRIORITY_FORM or PRIORITY_FAQ (lower runs first)
+            deadline: Request deadline; the queue wait never exceeds it
+
+        Raises:
+            Overloaded: The queue is full or no slot freed up in time
+        """
+        self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, priority: int = PRIORITY_FAQ, deadline: Optional[Deadline] = None) -> None:
+        """
+        Take a concurrency slot, waiting in the priority queue if needed; the
+        caller must release() it. Use admit() when the slot's lifetime is a block.
+
+        Raises:
+            Overloaded: The queue is full or no slot freed up in time
+        """
+        with self._lock:
+            if self._active < self.max_concurrent and not self._queued:
+                self._active += 1
+                self.stats["admitted"] += 1
+                return
+            if self._queued >= self.max_queue:
+                self.stats["shed_queue_full"] += 1
+                raise Overloaded("Too many requests are waiting")
+            waiter = _Waiter()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+            self._queued += 1
+
+        budget = self.queue_timeout
+        if deadline is not None:
+            budget = min(budget, deadline.remaining())
+        waiter.event.wait(budget)
+
+        with self._lock:
+            if waiter.granted:
+                self.stats["admitted"] += 1
+                return
+            # Leave the slot for someone else; release() skips abandoned waiters
+            waiter.abandoned = True
+            self._queued -= 1
+            self.stats["shed_timeout"] += 1
+        raise Overloaded("Timed out waiting for a free slot")
+
+    def release(self) -> None:
+        """Give back a slot taken with acquire()."""
+        with self._lock:
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if waiter.abandoned:
+                    continue
+                # Hand the slot straight to the next waiter
+                waiter.granted = True
+                self._queued -= 1
+                waiter.event.set()
+                return
+            self._active -= 1
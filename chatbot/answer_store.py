@@ -0,0 +1,201 @@
+"""
+Precomputed answers for info-only intents
+
+Intents such as fix_it_ticket or smog_check have no form fields and get
+nearly the same answer every time. Their answers are generated offline per
+(intent, location) with `python manage.py regenerate_answers` and served from
+this store at cache latency.
+
+Each answer file records the corpus version (a hash of the knowledge base
+files) and the prompt version it was generated with. If either no longer
+matches, the store serves nothing and requests take the normal RAG path
+until answers are regenerated.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .jurisdictions import candidate_jurisdictions
+from .memory import deep_sizeof
+
+STATEWIDE_LOCATION = "california"
+
+
+def _markdown_files(knowledge_base_dir: str) -> List[str]:
+    """Every markdown file in the knowledge base, including jurisdiction layers, in a stable order."""
+    paths = []
+    for root, dirs, files in sorted(os.walk(knowledge_base_dir)):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.endswith('.md'))
+    return paths
+
+
+def corpus_version(knowledge_base_dir: str) -> str:
+    """Hash of every markdown file in the knowledge base, including jurisdiction layers."""
+    digest = hashlib.sha1()
+    for path in _markdown_files(knowledge_base_dir):
+        digest.update(os.path.relpath(path, knowledge_base_dir).encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def corpus_signature(knowledge_base_dir: str) -> List[Tuple[str, int, int]]:
+    """(path, mtime, size) of every knowledge base markdown file; changes whenever one is edited."""
+    signature = []
+    for path in _markdown_files(knowledge_base_dir):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return signature
+
+
+def answer_key(intent: str, location: str) -> str:
+    return f"{intent}|{location}"
+
+
+class PrecomputedAnswerStore:
+    """
+    JSON-backed store of answers keyed by (intent, location).
+    """
+
+    def __init__(self, path: str, knowledge_base_dir: str, version_ttl: float = 5.0):
+        """
+        Initialize the store.
+
+        Args:
+            path: JSON file written by regenerate()
+            knowledge_base_dir: Knowledge base the answers were generated from
+            version_ttl: Seconds between checks of the knowledge base for edits
+        """
+        self.path = path
+        self.knowledge_base_dir = knowledge_base_dir
+        self.version_ttl = version_ttl
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Any]] = None
+        self._loaded_mtime = None
+        self._version = None
+        self._version_checked_at = 0.0
+        # Files seen when _version was computed; the corpus is rehashed only when they change
+        self._signature = None
+        self._version_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    def current_corpus_version(self) -> str:
+        """
+        The knowledge base's corpus version. One thread at a time checks the
+        files for edits, at most every version_ttl seconds, and rehashes them
+        only if one changed; meanwhile other requests use the last version.
+        """
+        version = self._version
+        if version is not None and time.monotonic() - self._version_checked_at <= self.version_ttl:
+            return version
+        if not self._version_lock.acquire(blocking=version is None):
+            return version
+        try:
+            if self._version is None or time.monotonic() - self._version_checked_at > self.version_ttl:
+                signature = corpus_signature(self.knowledge_base_dir)
+                if self._version is None or signature != self._signature:
+                    self._version = corpus_version(self.knowledge_base_dir)
+                    self._signature = signature
+                self._version_checked_at = time.monotonic()
+            return self._version
+        finally:
+            self._version_lock.release()
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        """(Re)read the answer file if it changed on disk."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if self._data is None or mtime != self._loaded_mtime:
+                with open(self.path, 'r') as f:
+                    self._data = json.load(f)
+                self._loaded_mtime = mtime
+            return self._data
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by the loaded answer file."""
+        return {"precomputed_answers": deep_sizeof(self._data)}
+
+    def lookup(self, intent: str, location: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored answer for an intent at the most specific matching
+        location, or None if there is none or the store is out of date.
+        """
+        data = self._load()
+        if data is None:
+            self.stats["misses"] += 1
+            return None
+        if data.get("corpus_version") != self.current_corpus_version() or data.get("prompt_version") != prompt_version:
+            self.stats["stale"] += 1
+            return None
+
+        answers = data.get("answers", {})
+        for slug in candidate_jurisdictions(location) + [STATEWIDE_LOCATION]:
+            answer = answers.get(answer_key(intent, slug))
+            if answer is not None:
+                self.stats["hits"] += 1
+                return answer
+        self.stats["misses"] += 1
+        return None
+
+    def regenerate(self, rag_system, intents: Dict[str, str], system_prompt: str, prompt_version: str, locations: Iterable[str]) -> int:
+        """
+        Generate and atomically write answers for every (intent, location).
+
+        Args:
+            rag_system: RAGSystem used to generate the answers
+            intents: Intent name -> question asked on its behalf
+            system_prompt: System prompt used for generation
+            prompt_version: Fingerprint of system_prompt stored with the answers
+            locations: Jurisdiction slugs to generate for, besides statewide
+
+        Returns:
+            Number of answers written
+        """
+        version = corpus_version(self.knowledge_base_dir)
+        answers = {}
+        location_list: List[str] = [STATEWIDE_LOCATION] + [slug for slug in locations if slug != STATEWIDE_LOCATION]
+        for slug in location_list:
+            location_name = "California" if slug == STATEWIDE_LOCATION else f"{slug.replace('-', ' ').title()}, California"
+            if slug != STATEWIDE_LOCATION and rag_system.retriever is None:
+                # Build the layer now; a request would search statewide only until it is ready
+                rag_system.jurisdictions.get(slug, wait=True)
+            for intent, question in intents.items():
+                response, sources = rag_system.generate_response(
+                    user_query=question,
+                    system_prompt=system_prompt,
+                    location=location_name,
+                    mode="llm",
+                    intent=intent
+                )
+                answers[answer_key(intent, slug)] = {
+                    "response": response,
+                    "sources": sources,
+                    "question": question,
+                }
+
+        data = {
+            "corpus_version": version,
+            "prompt_version": prompt_version,
+            "generated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "answers": answers,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._data = None
+        with self._version_lock:
+            self._version_checked_at = 0.0
+        return len(answers)
@@ -0,0 +1,667 @@
+"""
+DMV appointment availability for GovFlowAI
+
+The dmv_appointment intent collects a service type and a preferred date, but
+nothing could say when an office actually has room. AppointmentScheduler
+keeps every office's capacity in memory and answers that directly:
+1. Each (office, service) calendar is a run of 15-minute slots over the
+   booking horizon, with a byte of remaining capacity per slot and an
+   integer bitset of the slots that still have room. "Earliest slot after
+   t" jumps to the next set bit and checks a chunk of slots from there;
+   "free slots between a and b" is a shift and a mask. Both are word-wide
+   integer operations in C rather than per-slot Python loops. Services
+   longer than one slot AND the bitset with shifted copies of itself, so a
+   set bit marks the start of enough consecutive free slots
+2. Booking is two steps. hold() takes the capacity at once under the
+   office's lock, so concurrent attempts on the last slot can't both win.
+   The hold lapses after APPOINTMENT_HOLD_SECONDS unless confirm() turns it
+   into an appointment
+3. Confirmed appointments are written to SQLite (WAL) before confirm()
+   returns and are replayed into the calendars on start-up; holds live only
+   in memory. Each worker process has its own calendars, so confirm()
+   re-checks capacity against the database inside the write transaction,
+   and workers pick up each other's bookings and cancellations from an
+   event table about once a second
+4. Slot numbers count from the day the scheduler started, but each day the
+   calendars drop the days that have passed (and the appointments in them),
+   so memory stays at one horizon's worth of slots however long the process
+   runs. Times are naive office-local times; offsets are rejected
+
+Offices and services default to DEFAULT_OFFICES and DEFAULT_SERVICES; a JSON
+file with "offices" and "services" keys of the same shape replaces them.
+"""
+
+import heapq
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SLOT_MINUTES = 15
+SLOT = timedelta(minutes=SLOT_MINUTES)
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DEFAULT_HOURS = {day: "08:00-17:00" for day in WEEKDAYS[:5]}
+
+DEFAULT_SERVICES: Dict[str, Dict[str, Any]] = {
+    "driver_license": {"name": "Driver License or ID Card", "minutes": 30,
+                       "keywords": ["license", "licence", "id", "card", "renewal", "replacement", "real"]},
+    "vehicle_registration": {"name": "Vehicle Registration", "minutes": 15,
+                             "keywords": ["registration", "register", "title", "transfer", "plates", "vehicle"]},
+    "driving_test": {"name": "Behind-the-Wheel Drive Test", "minutes": 45,
+                     "keywords": ["drive", "driving", "road", "behind", "wheel"]},
+    "knowledge_test": {"name": "Knowledge Test", "minutes": 30,
+                       "keywords": ["knowledge", "written", "permit", "exam"]},
+}
+
+# Slots per service that run in parallel at each office (counters or examiners)
+DEFAULT_CAPACITY = {"driver_license": 4, "vehicle_registration": 3, "driving_test": 2, "knowledge_test": 2}
+
+DEFAULT_OFFICES: List[Dict[str, Any]] = [
+    {"id": "sacramento", "name": "Sacramento DMV", "city": "Sacramento", "county": "Sacramento", "lat": 38.5616, "lon": -121.4655},
+    {"id": "san-francisco", "name": "San Francisco DMV", "city": "San Francisco", "county": "San Francisco", "lat": 37.7744, "lon": -122.4389},
+    {"id": "oakland-claremont", "name": "Oakland Claremont DMV", "city": "Oakland", "county": "Alameda", "lat": 37.8366, "lon": -122.2545},
+    {"id": "san-jose", "name": "San Jose DMV", "city": "San Jose", "county": "Santa Clara", "lat": 37.3121, "lon": -121.8651},
+    {"id": "fresno", "name": "Fresno DMV", "city": "Fresno", "county": "Fresno", "lat": 36.7645, "lon": -119.7896},
+    {"id": "los-angeles-hope-st", "name": "Los Angeles DMV", "city": "Los Angeles", "county": "Los Angeles", "lat": 34.0434, "lon": -118.2653},
+    {"id": "hollywood", "name": "Hollywood DMV", "city": "Los Angeles", "county": "Los Angeles", "lat": 34.0925, "lon": -118.3087},
+    {"id": "santa-ana", "name": "Santa Ana DMV", "city": "Santa Ana", "county": "Orange", "lat": 33.7313, "lon": -117.8636},
+    {"id": "riverside", "name": "Riverside DMV", "city": "Riverside", "county": "Riverside", "lat": 33.9480, "lon": -117.3960},
+    {"id": "san-diego-clairemont", "name": "San Diego Clairemont DMV", "city": "San Diego", "county": "San Diego", "lat": 32.8327, "lon": -117.1870},
+    {"id": "redding", "name": "Redding DMV", "city": "Redding", "county": "Shasta", "lat": 40.5746, "lon": -122.3705},
+    {"id": "bakersfield", "name": "Bakersfield DMV", "city": "Bakersfield", "county": "Kern", "lat": 35.3555, "lon": -119.0603},
+]
+
+_WORD = re.compile(r"[a-z]+")
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS appointments (
+    id TEXT PRIMARY KEY,
+    office_id TEXT NOT NULL,
+    service TEXT NOT NULL,
+    start TEXT NOT NULL,
+    client_id TEXT NOT NULL,
+    details TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    cancelled_at REAL
+);
+CREATE INDEX IF NOT EXISTS appointments_slot ON appointments (office_id, service, start);
+CREATE TABLE IF NOT EXISTS appointment_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    appointment_id TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+"""
+# Seconds between checks for appointments made or cancelled by other worker processes
+SYNC_INTERVAL = 1.0
+
+
+class SlotUnavailable(Exception):
+    """Raised when a requested slot has no capacity left (or never had any)."""
+
+
+def load_offices(path: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Offices and services from a JSON file, or the defaults."""
+    offices, services = DEFAULT_OFFICES, DEFAULT_SERVICES
+    if path:
+        with open(path, 'r') as f:
+            config = json.load(f)
+        offices = config.get("offices", offices)
+        services = config.get("services", services)
+    return offices, services
+
+
+def lowest_bit(bits: int) -> int:
+    """Index of the lowest set bit of a non-zero integer."""
+    return (bits & -bits).bit_length() - 1
+
+
+def runs_of(bits: int, length: int) -> int:
+    """Bits set where `length` consecutive bits of `bits` are set, starting there."""
+    run = bits
+    span = 1
+    # Doubling: after each step a set bit covers 2x as many slots
+    while span * 2 <= length:
+        run &= run >> span
+        span *= 2
+    if span < length:
+        run &= run >> (length - span)
+    return run
+
+
+def _parse_hours(spec: Optional[str]) -> Optional[Tuple[int, int]]:
+    """"08:00-17:00" as (first slot, end slot) of the day; None when closed."""
+    if not spec:
+        return None
+    opens, closes = spec.split("-")
+    first = [int(part) for part in opens.split(":")]
+    last = [int(part) for part in closes.split(":")]
+    return (first[0] * 60 + first[1]) // SLOT_MINUTES, (last[0] * 60 + last[1]) // SLOT_MINUTES
+
+
+class Calendar:
+    """Remaining capacity of one service at one office, slot by slot."""
+
+    __slots__ = ("capacity", "bits", "offset")
+
+    def __init__(self):
+        self.capacity = bytearray()
+        self.bits = 0
+        # Slot number of capacity[0] and bit 0; earlier slots have been trimmed
+        self.offset = 0
+
+    def extend(self, day_templates: List[Tuple[bytes, int]], first_day: date, days: int) -> None:
+        """Append `days` days of opening capacity, starting on first_day."""
+        slots_per_day = 24 * 60 // SLOT_MINUTES
+        offset = len(self.capacity)
+        added = 0
+        for day in range(days):
+            capacity, bits = day_templates[(first_day + timedelta(days=day)).weekday()]
+            self.capacity += capacity
+            added |= bits << (day * slots_per_day)
+        self.bits |= added << offset
+
+    def trim(self, slots: int) -> None:
+        """Drop the first `slots` slots (days that have passed)."""
+        slots = min(slots, len(self.capacity))
+        self.capacity = self.capacity[slots:]
+        self.bits >>= slots
+        self.offset += slots
+
+    def take(self, start: int, length: int) -> bool:
+        """Use one unit of capacity in slots start..start+length-1, if all have some."""
+        start -= self.offset
+        end = start + length
+        if start < 0 or end > len(self.capacity):
+            return False
+        mask = ((1 << length) - 1) << start
+        if self.bits & mask != mask:
+            return False
+        for slot in range(start, end):
+            self.capacity[slot] -= 1
+            if not self.capacity[slot]:
+                self.bits &= ~(1 << slot)
+        return True
+
+    def first_start(self, lo: int, length: int, chunk: int = 1024) -> Optional[int]:
+        """First slot >= lo starting `length` free slots, or None."""
+        lo = max(lo, self.offset)
+        bits = self.bits >> (lo - self.offset)
+        offset = lo
+        while bits:
+            # Jump straight to the next free slot, then look a chunk ahead of it
+            skip = lowest_bit(bits)
+            bits >>= skip
+            offset += skip
+            window = runs_of(bits & ((1 << (chunk + length - 1)) - 1), length) & ((1 << chunk) - 1)
+            if window:
+                return offset + lowest_bit(window)
+            bits >>= chunk
+            offset += chunk
+        return None
+
+    def starts_between(self, lo: int, hi: int, length: int) -> int:
+        """Bitset (bit 0 = slot lo) of the slots in [lo, hi) starting `length` free slots."""
+        shift = lo - self.offset
+        bits = self.bits >> shift if shift >= 0 else self.bits << -shift
+        window = bits & ((1 << (hi - lo + length - 1)) - 1)
+        return runs_of(window, length) & ((1 << (hi - lo)) - 1)
+
+    def give_back(self, start: int, length: int) -> None:
+        start -= self.offset
+        for slot in range(max(start, 0), min(start + length, len(self.capacity))):
+            self.capacity[slot] += 1
+            self.bits |= 1 << slot
+
+
+class Hold:
+    """Capacity taken for a client until it is confirmed or expires."""
+
+    __slots__ = ("id", "office_id", "service", "start", "slots", "client_id", "expires_at")
+
+    def __init__(self, office_id: str, service: str, start: int, slots: int, client_id: str, expires_at: float):
+        self.id = uuid.uuid4().hex
+        self.office_id = office_id
+        self.service = service
+        self.start = start
+        self.slots = slots
+        self.client_id = client_id
+        self.expires_at = expires_at
+
+
+class AppointmentScheduler:
+    """
+    In-memory appointment capacity for every office and service, with
+    holds, confirmations persisted to SQLite, and earliest-slot queries.
+    """
+
+    def __init__(self, offices: Iterable[Dict[str, Any]], services: Dict[str, Dict[str, Any]],
+                 path: Optional[str] = None, horizon_days: int = 90, hold_seconds: float = 300.0,
+                 today: Optional[date] = None):
+        """
+        Initialize the scheduler and load confirmed appointments.
+
+        Args:
+            offices: Office dicts with "id", "name", optional "hours" (weekday
+                to "HH:MM-HH:MM") and "capacity" (service to parallel slots)
+            services: Service key to {"name", "minutes", "keywords"}
+            path: SQLite file for confirmed appointments; None keeps them in memory only
+            horizon_days: Days ahead that can be booked
+            hold_seconds: How long a hold keeps its slot without confirmation
+            today: First bookable day (defaults to today)
+        """
+        self.services = dict(services)
+        self.offices = {office["id"]: dict(office) for office in offices}
+        self.horizon_days = horizon_days
+        self.hold_seconds = hold_seconds
+        self.path = path
+        self.base = datetime.combine(today or date.today(), datetime.min.time())
+        # Days from base covered by the calendars: [_first_day, _days)
+        self._first_day = 0
+        self._days = 0
+        self._slots_per_day = 24 * 60 // SLOT_MINUTES
+        self._service_slots = {key: max(1, -(-int(info.get("minutes", SLOT_MINUTES)) // SLOT_MINUTES))
+                               for key, info in self.services.items()}
+        self._keywords = {key: {word for text in [key.replace("_", " "), info.get("name", "")] + list(info.get("keywords", []))
+                                for word in _WORD.findall(text.lower())}
+                          for key, info in self.services.items()}
+        self._calendars: Dict[Tuple[str, str], Calendar] = {}
+        self._templates: Dict[Tuple[str, str], List[Tuple[bytes, int]]] = {}
+        self._units: Dict[Tuple[str, str], int] = {}
+        self._office_locks = {office_id: threading.Lock() for office_id in self.offices}
+        self._lock = threading.Lock()
+        self._holds: Dict[str, Hold] = {}
+        self._expiries: List[Tuple[float, str]] = []
+        # Appointment id to (office, service, start slot, slots, counted in the calendar)
+        self._appointments: Dict[str, Tuple[str, str, int, int, bool]] = {}
+        self._uncounted = set()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._seen_event = 0
+        self._synced_at = 0.0
+        self.stats = {"queries": 0, "held": 0, "conflicts": 0, "expired": 0, "confirmed": 0, "cancelled": 0}
+
+        for office_id, office in self.offices.items():
+            hours = office.get("hours", DEFAULT_HOURS)
+            capacities = office.get("capacity", DEFAULT_CAPACITY)
+            for service, units in capacities.items():
+                if service in self.services and units > 0:
+                    self._units[(office_id, service)] = min(int(units), 255)
+                    self._templates[(office_id, service)] = self._day_templates(hours, self._units[(office_id, service)])
+                    self._calendars[(office_id, service)] = Calendar()
+        self._ensure_horizon()
+        if path:
+            self._open_db()
+
+    def _day_templates(self, hours: Dict[str, str], units: int) -> List[Tuple[bytes, int]]:
+        """(capacity bytes, free-slot bits) of one day, per weekday."""
+        templates = []
+        for day in WEEKDAYS:
+            capacity = bytearray(self._slots_per_day)
+            bits = 0
+            span = _parse_hours(hours.get(day))
+            if span is not None:
+                first, end = span
+                capacity[first:end] = bytes([units]) * (end - first)
+                bits = ((1 << (end - first)) - 1) << first
+            templates.append((bytes(capacity), bits))
+        return templates
+
+    def _ensure_horizon(self) -> None:
+        """Keep every calendar covering today through horizon_days ahead, and no earlier."""
+        elapsed = (date.today() - self.base.date()).days
+        needed = elapsed + self.horizon_days
+        if needed <= self._days and elapsed <= self._first_day:
+            return
+        with self._lock:
+            if needed > self._days:
+                first_day = self.base.date() + timedelta(days=self._days)
+                for (office_id, service), calendar in self._calendars.items():
+                    with self._office_locks[office_id]:
+                        calendar.extend(self._templates[(office_id, service)], first_day, needed - self._days)
+                self._days = needed
+            if elapsed > self._first_day:
+                self._trim_days(elapsed)
+
+    def _trim_days(self, first_day: int) -> None:
+        """Drop the calendar days before first_day and the appointments in them (lock held)."""
+        drop = (first_day - self._first_day) * self._slots_per_day
+        for (office_id, _), calendar in self._calendars.items():
+            with self._office_locks[office_id]:
+                calendar.trim(drop)
+        self._first_day = first_day
+        first_slot = first_day * self._slots_per_day
+        past = [appointment_id for appointment_id, (_, _, start, slots, _) in self._appointments.items()
+                if start + slots <= first_slot]
+        for appointment_id in past:
+            del self._appointments[appointment_id]
+            self._uncounted.discard(appointment_id)
+
+    def _open_db(self) -> None:
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA_SQL)
+        with self._db_lock:
+            self._seen_event = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM appointment_events").fetchone()[0]
+            rows = self._db.execute(
+                "SELECT id, office_id, service, start FROM appointments WHERE cancelled_at IS NULL AND start >= ?",
+                (self.slot_time(self._first_day * self._slots_per_day).isoformat(timespec="minutes"),)
+            ).fetchall()
+            for row in rows:
+                self._apply_booking(*row)
+        self._synced_at = time.monotonic()
+
+    def _apply_booking(self, appointment_id: str, office_id: str, service: str, start: str) -> None:
+        """Count an appointment made elsewhere (db lock held)."""
+        calendar = self._calendars.get((office_id, service))
+        if calendar is None or appointment_id in self._appointments:
+            return
+        index = self.slot_index(datetime.fromisoformat(start))
+        slots = self._service_slots[service]
+        if index + slots <= self._first_day * self._slots_per_day:
+            return
+        with self._office_locks[office_id]:
+            counted = calendar.take(index, slots)
+        # Not counted: the slot is full here (e.g. capacity was lowered, or
+        # local holds took it); confirm() checks the database anyway
+        with self._lock:
+            self._appointments[appointment_id] = (office_id, service, index, slots, counted)
+            if not counted:
+                self._uncounted.add(appointment_id)
+
+    def _sync(self) -> None:
+        """Apply appointments made or cancelled by other processes since the last sync."""
+        if self._db is None or time.monotonic() - self._synced_at < SYNC_INTERVAL:
+            return
+        with self._db_lock:
+            self._synced_at = time.monotonic()
+            events = self._db.execute(
+                "SELECT e.seq, e.kind, a.id, a.office_id, a.service, a.start FROM appointment_events e"
+                " JOIN appointments a ON a.id = e.appointment_id WHERE e.seq > ? ORDER BY e.seq",
+                (self._seen_event,)
+            ).fetchall()
+            for seq, kind, appointment_id, office_id, service, start in events:
+                self._seen_event = seq
+                if kind == "booked":
+                    self._apply_booking(appointment_id, office_id, service, start)
+                else:
+                    self._forget(appointment_id)
+
+    def _forget(self, appointment_id: str) -> bool:
+        """Drop an appointment and give back its capacity; False if unknown."""
+        with self._lock:
+            appointment = self._appointments.pop(appointment_id, None)
+            self._uncounted.discard(appointment_id)
+        if appointment is None:
+            return False
+        office_id, service, start, slots, counted = appointment
+        if counted:
+            self._release(office_id, service, start, slots)
+        return True
+
+    def _release(self, office_id: str, service: str, start: int, slots: int) -> None:
+        """Give back capacity, first to appointments that didn't fit when they were synced."""
+        with self._office_locks[office_id]:
+            self._calendars[(office_id, service)].give_back(start, slots)
+        if not self._uncounted:
+            return
+        with self._lock:
+            waiting = [appointment_id for appointment_id in self._uncounted
+                       if self._appointments[appointment_id][:2] == (office_id, service)]
+            for appointment_id in waiting:
+                _, _, index, length, _ = self._appointments[appointment_id]
+                with self._office_locks[office_id]:
+                    if self._calendars[(office_id, service)].take(index, length):
+                        self._appointments[appointment_id] = (office_id, service, index, length, True)
+                        self._uncounted.discard(appointment_id)
+
+    def slot_index(self, when: datetime) -> int:
+        """Slot number of a slot-aligned, naive (office-local) time."""
+        if when.tzinfo is not None:
+            raise ValueError(f"{when.isoformat()} has a UTC offset; appointment times are office-local")
+        minutes, remainder = divmod(int((when - self.base).total_seconds()), 60)
+        if remainder or minutes % SLOT_MINUTES:
+            raise ValueError(f"{when.isoformat()} is not on a {SLOT_MINUTES}-minute boundary")
+        return minutes // SLOT_MINUTES
+
+    def slot_time(self, index: int) -> datetime:
+        return self.base + index * SLOT
+
+    def _first_open_slot(self, after: Optional[datetime]) -> int:
+        """First slot that starts at or after `after`, and not in the past."""
+        now = datetime.now()
+        after = max(after, now) if after else now
+        minutes = (after - self.base).total_seconds() / 60.0
+        return max(0, -int(-minutes // SLOT_MINUTES))
+
+    def resolve_service(self, text: Optional[str]) -> Optional[str]:
+        """Service key for a key or free-text description ("renew my license")."""
+        if not text:
+            return None
+        if text in self.services:
+            return text
+        words = set(_WORD.findall(text.lower()))
+        best, best_hits = None, 0
+        for key, keywords in self._keywords.items():
+            hits = len(words & keywords)
+            if hits > best_hits:
+                best, best_hits = key, hits
+        return best
+
+    def offices_in(self, location: Optional[str]) -> Optional[List[str]]:
+        """Offices whose city or county the location names; None (all offices) if none do."""
+        text = (location or "").lower()
+        matches = [office_id for office_id, office in self.offices.items()
+                   if any(office.get(key) and office[key].lower() in text for key in ("city", "county"))]
+        return matches or None
+
+    def _expire_holds(self) -> None:
+        """Give back the capacity of holds that ran out."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                _, hold_id = heapq.heappop(self._expiries)
+                hold = self._holds.pop(hold_id, None)
+                if hold is not None:
+                    expired.append(hold)
+            self.stats["expired"] += len(expired)
+        for hold in expired:
+            self._release(hold.office_id, hold.service, hold.start, hold.slots)
+
+    def _prepare(self) -> None:
+        self._ensure_horizon()
+        self._sync()
+        if self._expiries:
+            self._expire_holds()
+
+    def earliest(self, service: str, office_ids: Optional[Iterable[str]] = None,
+                 after: Optional[datetime] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        The earliest free slot of a service at each office, soonest first.
+
+        Args:
+            service: Service key
+            office_ids: Offices to consider (default: all)
+            after: Earliest acceptable start (default: now)
+            limit: Offices returned
+
+        Returns:
+            [{"office_id", "office", "start"}] with start as a datetime
+        """
+        self._prepare()
+        slots = self._service_slots[service]
+        lo = self._first_open_slot(after)
+        found = []
+        for office_id in (self.offices if office_ids is None else office_ids):
+            calendar = self._calendars.get((office_id, service))
+            if calendar is None:
+                continue
+            # The bitset is replaced, never mutated, so reading it needs no lock
+            start = calendar.first_start(lo, slots)
+            if start is not None:
+                found.append((start, office_id))
+        with self._lock:
+            self.stats["queries"] += 1
+        found.sort()
+        return [{"office_id": office_id, "office": self.offices[office_id]["name"], "start": self.slot_time(index)}
+                for index, office_id in found[:limit]]
+
+    def available(self, office_id: str, service: str, start: datetime, end: datetime, limit: int = 200) -> List[datetime]:
+        """Start times with room for the service at one office between start and end."""
+        self._prepare()
+        calendar = self._calendars.get((office_id, service))
+        if calendar is None:
+            return []
+        lo = self._first_open_slot(start)
+        hi = self._first_open_slot(end)
+        if hi <= lo:
+            return []
+        window = calendar.starts_between(lo, hi, self._service_slots[service])
+        times = []
+        while window and len(times) < limit:
+            low = window & -window
+            times.append(self.slot_time(lo + low.bit_length() - 1))
+            window ^= low
+        with self._lock:
+            self.stats["queries"] += 1
+        return times
+
+    def hold(self, office_id: str, service: str, start: datetime, client_id: str = "") -> Dict[str, Any]:
+        """
+        Take a slot for a client until confirm() or expiry.
+
+        Raises:
+            SlotUnavailable: The slot is full, closed, past or outside the horizon
+            KeyError: Unknown office or service at that office
+            ValueError: The start is not slot-aligned or has a UTC offset
+        """
+        self._prepare()
+        index = self.slot_index(start)
+        if start < datetime.now():
+            raise SlotUnavailable("That time has already passed")
+        calendar = self._calendars[(office_id, service)]
+        slots = self._service_slots[service]
+        with self._office_locks[office_id]:
+            taken = calendar.take(index, slots)
+        if not taken:
+            with self._lock:
+                self.stats["conflicts"] += 1
+            raise SlotUnavailable(f"No {self.services[service]['name']} capacity at {start.isoformat(timespec='minutes')}")
+        hold = Hold(office_id, service, index, slots, client_id, time.monotonic() + self.hold_seconds)
+        with self._lock:
+            self._holds[hold.id] = hold
+            heapq.heappush(self._expiries, (hold.expires_at, hold.id))
+            self.stats["held"] += 1
+        return {"hold_id": hold.id, "office_id": office_id, "service": service, "start": start,
+                "expires_in": self.hold_seconds}
+
+    def confirm(self, hold_id: str, details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Turn a hold into an appointment, stored before this returns.
+
+        Raises:
+            KeyError: Unknown or expired hold
+            SlotUnavailable: Another worker process booked the slot first
+        """
+        self._prepare()
+        with self._lock:
+            hold = self._holds.pop(hold_id, None)
+        if hold is None:
+            raise KeyError(hold_id)
+        start = self.slot_time(hold.start)
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    self._store(hold, start, details or {})
+            except SlotUnavailable:
+                self._release(hold.office_id, hold.service, hold.start, hold.slots)
+                with self._lock:
+                    self.stats["conflicts"] += 1
+                raise
+            except sqlite3.Error:
+                # Keep the hold so the client can retry the confirmation
+                with self._lock:
+                    self._holds[hold.id] = hold
+                raise
+        else:
+            with self._lock:
+                self._appointments[hold.id] = (hold.office_id, hold.service, hold.start, hold.slots, True)
+        with self._lock:
+            self.stats["confirmed"] += 1
+        return {"appointment_id": hold.id, "office_id": hold.office_id, "office": self.offices[hold.office_id]["name"],
+                "service": hold.service, "start": start}
+
+    def _store(self, hold: Hold, start: datetime, details: Dict[str, Any]) -> None:
+        """Insert a held appointment if the database still has room for it (db lock held)."""
+        first = self.slot_time(hold.start - hold.slots + 1).isoformat(timespec="minutes")
+        last = self.slot_time(hold.start + hold.slots - 1).isoformat(timespec="minutes")
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            booked = self._db.execute(
+                "SELECT start FROM appointments WHERE office_id = ? AND service = ? AND cancelled_at IS NULL"
+                " AND start BETWEEN ? AND ?",
+                (hold.office_id, hold.service, first, last)
+            ).fetchall()
+            # Appointments of one service all have the same length, so each booked
+            # start overlaps the held slots from its own start onwards
+            occupied = [0] * hold.slots
+            for (booked_start,) in booked:
+                offset = self.slot_index(datetime.fromisoformat(booked_start)) - hold.start
+                for slot in range(max(0, offset), min(hold.slots, offset + hold.slots)):
+                    occupied[slot] += 1
+            if max(occupied) >= self._units[(hold.office_id, hold.service)]:
+                raise SlotUnavailable(f"No {self.services[hold.service]['name']} capacity at {start.isoformat(timespec='minutes')}")
+            self._db.execute(
+                "INSERT INTO appointments (id, office_id, service, start, client_id, details, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (hold.id, hold.office_id, hold.service, start.isoformat(timespec="minutes"), hold.client_id,
+                 json.dumps(details), time.time())
+            )
+            self._db.execute("INSERT INTO appointment_events (appointment_id, kind) VALUES (?, 'booked')", (hold.id,))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._appointments[hold.id] = (hold.office_id, hold.service, hold.start, hold.slots, True)
+
+    def cancel(self, reservation_id: str) -> bool:
+        """Release a hold or cancel an appointment; False if there is none."""
+        with self._lock:
+            hold = self._holds.pop(reservation_id, None)
+        if hold is not None:
+            self._release(hold.office_id, hold.service, hold.start, hold.slots)
+        elif self._db is not None:
+            self._sync()
+            with self._db_lock:
+                if reservation_id not in self._appointments:
+                    return False
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._db.execute("UPDATE appointments SET cancelled_at = ? WHERE id = ?", (time.time(), reservation_id))
+                    self._db.execute("INSERT INTO appointment_events (appointment_id, kind) VALUES (?, 'cancelled')", (reservation_id,))
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+                self._forget(reservation_id)
+        elif not self._forget(reservation_id):
+            return False
+        with self._lock:
+            self.stats["cancelled"] += 1
+        return True
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes of the slot calendars (capacity bytes plus free-slot bitsets)."""
+        total = sum(len(calendar.capacity) + len(calendar.capacity) // 8 for calendar in self._calendars.values())
+        return {"appointment_calendars": total}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, offices=len(self.offices), calendars=len(self._calendars),
+                        holds=len(self._holds), appointments=len(self._appointments), horizon_days=self._days - self._first_day)
@@ -0,0 +1,335 @@
+"""
+Compact, array-backed chunk storage for GovFlowAI
+
+LangChain's InMemoryDocstore keeps one Document, one metadata dict and a
+handful of strings alive per chunk, and save_local pickles all of them. This
+module keeps the same information in a few flat arrays instead:
+1. Chunk text in one contiguous UTF-8 buffer, addressed through an offsets array
+2. Source and category as integer ids into small interned string tables
+3. chunk_id in a NumPy array
+
+Documents are only materialized for the rows a search actually returns. A
+saved store is a directory of raw/.npy files that can be memory-mapped, so
+several processes can share one copy of the chunk data through the page
+cache. The FAISS index beside them is read into each process: faiss can only
+map inverted-list indexes, not the flat one used here. Saving never
+rewrites files another process may have mapped: each save goes to a new
+version directory, and the store's path is a symlink switched to it at once.
+"""
+
+import json
+import os
+import re
+import shutil
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+from .memory import deep_sizeof
+
+TEXT_FILE = "text.bin"
+TABLES_FILE = "tables.json"
+INDEX_FILE = "index.faiss"
+# Written last; a version directory without it is incomplete
+COMPLETE_FILE = "complete"
+ARRAY_FIELDS = ("offsets", "source_ids", "category_ids", "chunk_ids")
+
+
+class ChunkStore:
+    """
+    Read-only table of chunks stored column-wise in NumPy arrays.
+    """
+
+    def __init__(
+        self,
+        text: np.ndarray,
+        offsets: np.ndarray,
+        source_ids: np.ndarray,
+        category_ids: np.ndarray,
+        chunk_ids: np.ndarray,
+        sources: List[str],
+        categories: List[str],
+        attributions: Optional[Dict[int, List[List[int]]]] = None,
+        common_metadata: Optional[Dict[str, Any]] = None,
+    ):
+        self.text = text
+        self.offsets = offsets
+        self.source_ids = source_ids
+        self.category_ids = category_ids
+        self.chunk_ids = chunk_ids
+        self.sources = sources
+        self.categories = categories
+        # Rows that stand in for merged near-duplicates: row -> [[source_id, category_id, chunk_id], ...]
+        self.attributions = attributions or {}
+        self.common_metadata = common_metadata or {}
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document], common_metadata: Optional[Dict[str, Any]] = None) -> "ChunkStore":
+        """
+        Pack chunk Documents into a store.
+
+        Args:
+            documents: Chunks carrying "source", "category" and "chunk_id"
+                metadata, plus an optional "sources" attribution list
+            common_metadata: Metadata shared by every chunk (e.g. jurisdiction)
+        """
+        source_table: Dict[str, int] = {}
+        category_table: Dict[str, int] = {}
+
+        def intern(table: Dict[str, int], value: str) -> int:
+            return table.setdefault(value, len(table))
+
+        count = len(documents)
+        encoded = [doc.page_content.encode('utf-8') for doc in documents]
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum([len(chunk) for chunk in encoded], out=offsets[1:])
+        source_ids = np.empty(count, dtype=np.int32)
+        category_ids = np.empty(count, dtype=np.int32)
+        chunk_ids = np.empty(count, dtype=np.int32)
+        attributions = {}
+
+        for row, doc in enumerate(documents):
+            metadata = doc.metadata
+            source_ids[row] = intern(source_table, metadata.get("source", "Unknown"))
+            category_ids[row] = intern(category_table, metadata.get("category", "Unknown"))
+            chunk_ids[row] = metadata.get("chunk_id", row)
+            if metadata.get("sources"):
+                attributions[row] = [
+                    [
+                        intern(source_table, attribution.get("source", "Unknown")),
+                        intern(category_table, attribution.get("category", "Unknown")),
+                        attribution.get("chunk_id", -1),
+                    ]
+                    for attribution in metadata["sources"]
+                ]
+
+        text = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(
+            text=text,
+            offsets=offsets,
+            source_ids=source_ids,
+            category_ids=category_ids,
+            chunk_ids=chunk_ids,
+            sources=list(source_table),
+            categories=list(category_table),
+            attributions=attributions,
+            common_metadata=common_metadata,
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the column arrays (mapped pages count once they are touched)."""
+        arrays = (self.text, self.offsets, self.source_ids, self.category_ids, self.chunk_ids)
+        return sum(array.nbytes for array in arrays)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes of chunk text (with its offsets) and of the per-chunk metadata."""
+        tables = [self.sources, self.categories, self.attributions, self.common_metadata]
+        return {
+            "chunk_text": self.text.nbytes + self.offsets.nbytes,
+            "chunk_metadata": self.source_ids.nbytes + self.category_ids.nbytes + self.chunk_ids.nbytes + deep_sizeof(tables),
+        }
+
+    def page_content(self, row: int) -> str:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.text[start:end].tobytes().decode('utf-8')
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        metadata = dict(self.common_metadata)
+        metadata["source"] = self.sources[self.source_ids[row]]
+        metadata["category"] = self.categories[self.category_ids[row]]
+        metadata["chunk_id"] = int(self.chunk_ids[row])
+        if row in self.attributions:
+            metadata["sources"] = [
+                {"source": self.sources[s], "category": self.categories[c], "chunk_id": chunk_id}
+                for s, c, chunk_id in self.attributions[row]
+            ]
+        return metadata
+
+    def document(self, row: int) -> Document:
+        """Materialize a single chunk as a LangChain Document."""
+        return Document(page_content=self.page_content(row), metadata=self.metadata(row))
+
+    def save(self, directory: str) -> None:
+        """
+        Write the store as raw/.npy files that load() can memory-map.
+
+        Overwrites files in place, so directory must not be in use; see
+        save_compact_store() for replacing a store other processes read.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.text.tofile(os.path.join(directory, TEXT_FILE))
+        for field in ARRAY_FIELDS:
+            np.save(os.path.join(directory, f"{field}.npy"), getattr(self, field))
+        tables = {
+            "sources": self.sources,
+            "categories": self.categories,
+            "attributions": {str(row): value for row, value in self.attributions.items()},
+            "common_metadata": self.common_metadata,
+        }
+        with open(os.path.join(directory, TABLES_FILE), 'w') as f:
+            json.dump(tables, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ChunkStore":
+        """
+        Load a saved store.
+
+        Args:
+            directory: Directory written by save()
+            mmap: Map the arrays read-only instead of reading them into memory
+        """
+        with open(os.path.join(directory, TABLES_FILE), 'r') as f:
+            tables = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        text_path = os.path.join(directory, TEXT_FILE)
+        if mmap and os.path.getsize(text_path) > 0:
+            text = np.memmap(text_path, dtype=np.uint8, mode='r')
+        else:
+            text = np.fromfile(text_path, dtype=np.uint8)
+        arrays = {
+            field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode=mmap_mode)
+            for field in ARRAY_FIELDS
+        }
+        return cls(
+            text=text,
+            sources=tables["sources"],
+            categories=tables["categories"],
+            attributions={int(row): value for row, value in tables.get("attributions", {}).items()},
+            common_metadata=tables.get("common_metadata", {}),
+            **arrays,
+        )
+
+
+class ChunkDocstore(Docstore):
+    """LangChain Docstore view over a ChunkStore, keyed by row number."""
+
+    def __init__(self, chunk_store: ChunkStore):
+        self.chunk_store = chunk_store
+
+    def search(self, search: str):
+        row = int(search)
+        if row < 0 or row >= len(self.chunk_store):
+            return f"ID {search} not found."
+        return self.chunk_store.document(row)
+
+
+class RowIds:
+    """
+    Stand-in for FAISS.index_to_docstore_id when docstore ids are row numbers.
+
+    Avoids keeping a per-chunk dict of uuid strings alive.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0 or index >= self.count:
+            raise KeyError(index)
+        return str(index)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.count))
+
+    def values(self) -> Iterator[str]:
+        return (str(i) for i in range(self.count))
+
+    def items(self):
+        return ((i, str(i)) for i in range(self.count))
+
+
+def _wrap(index, chunk_store: ChunkStore, embeddings) -> FAISS:
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=ChunkDocstore(chunk_store),
+        index_to_docstore_id=RowIds(len(chunk_store)),
+    )
+
+
+def build_compact_store(documents: Sequence[Document], embeddings, common_metadata: Optional[Dict[str, Any]] = None) -> FAISS:
+    """
+    Embed chunks and build a FAISS vector store backed by a ChunkStore.
+
+    The returned object is a regular LangChain FAISS store, so similarity
+    search works unchanged; only the storage behind it is compact.
+    """
+    chunk_store = ChunkStore.from_documents(documents, common_metadata=common_metadata)
+    vectors = np.asarray(
+        embeddings.embed_documents([doc.page_content for doc in documents]), dtype=np.float32
+    )
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return _wrap(index, chunk_store, embeddings)
+
+
+def save_compact_store(store: FAISS, directory: str) -> None:
+    """
+    Save a store built by build_compact_store() without pickling.
+
+    The files go to a new sibling version directory, which is marked complete
+    and then swapped in by replacing the directory symlink in one os.replace.
+    Processes that have the previous files memory-mapped keep reading them
+    intact. The previous version stays for readers still opening it; older
+    ones are removed.
+    """
+    directory = os.path.abspath(directory)
+    parent, name = os.path.split(directory)
+    os.makedirs(parent, exist_ok=True)
+    version = f"{name}.v{time.time_ns()}-{os.getpid()}"
+    version_dir = os.path.join(parent, version)
+    os.makedirs(version_dir)
+    store.docstore.chunk_store.save(version_dir)
+    faiss.write_index(store.index, os.path.join(version_dir, INDEX_FILE))
+    with open(os.path.join(version_dir, COMPLETE_FILE), 'w') as f:
+        f.write(version)
+
+    previous = os.path.basename(os.path.realpath(directory)) if os.path.islink(directory) else None
+    if os.path.isdir(directory) and not os.path.islink(directory):
+        # Saved before versioning: move the directory aside so the link can take its place
+        os.replace(directory, os.path.join(parent, f"{name}.v0-{os.getpid()}"))
+    link = os.path.join(parent, f".{version}.link")
+    os.symlink(version, link)
+    os.replace(link, directory)
+    _remove_old_versions(parent, name, keep={version, previous})
+
+
+def _remove_old_versions(parent: str, name: str, keep) -> None:
+    # Another process may have swapped in its own version meanwhile
+    keep = set(keep) | {os.path.basename(os.path.realpath(os.path.join(parent, name)))}
+    pattern = re.compile(re.escape(name) + r"\.v\d+-\d+$")
+    for entry in os.listdir(parent):
+        if pattern.match(entry) and entry not in keep:
+            # Unlinking mapped files is safe: mappings keep the data until they close
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+def saved_at(directory: str) -> Optional[float]:
+    """When the store at directory was completely saved; None if it never was."""
+    try:
+        return os.path.getmtime(os.path.join(directory, COMPLETE_FILE))
+    except OSError:
+        return None
+
+
+def load_compact_store(directory: str, embeddings, mmap: bool = True) -> FAISS:
+    """Load a store saved by save_compact_store(), memory-mapping the chunk arrays if mmap is set."""
+    # Resolve the link once so every file comes from the same version
+    directory = os.path.realpath(directory)
+    if saved_at(directory) is None:
+        raise FileNotFoundError(f"No completely saved index in {directory}")
+    chunk_store = ChunkStore.load(directory, mmap=mmap)
+    index = faiss.read_index(os.path.join(directory, INDEX_FILE))
+    return _wrap(index, chunk_store, embeddings)
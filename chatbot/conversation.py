@@ -0,0 +1,223 @@
+"""
+Follow-up-aware retrieval for multi-turn GovFlowAI conversations
+
+A follow-up such as "what documents do I need for that?" searched on its
+own costs an embedding and a search, and usually retrieves the wrong
+chunks. ConversationMemory keeps the last turn's retrieved chunks and query
+vector per client and decides locally, without any model call, how each
+new turn relates to it:
+1. "continue": the turn refers back (that, it, those, what about ...) and
+   its words are covered by the last turn's question; the cached context is
+   reused without embedding or searching
+2. "extend": the turn refers back but brings in new terms; the index is
+   searched with the mean of the previous and new query vectors and the
+   hits are merged into the cached context
+3. "shift" (or "new" for a first turn): full retrieval, which becomes the
+   context for the following turns. A turn with no follow-up cue is always
+   a shift, as is one whose query vector (when it is already cached) is far
+   from the last turn's
+
+Coverage is measured against the questions only, not the retrieved chunks:
+with a small knowledge base the chunks of any one turn mention most of the
+corpus's vocabulary.
+
+Answers that drew on session context are never shared through the response
+cache or request coalescing, since they depend on the conversation.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from .memory import sampled_sizeof
+
+_WORD = re.compile(r"[a-z0-9]+")
+_FOLLOWUP_CUE = re.compile(
+    r"^\s*(and|also|so|then|ok|okay|what about|how about)\b"
+    r"|\b(that|this|it|its|those|these|them|they|there|same|above)\b",
+    re.IGNORECASE
+)
+_STOPWORDS = frozenset("""
+    a an and are as at be been but by can could do does did for from get got had has have how i if in into is it
+    its just me my need needs of on or our should so than that the their them then there these they this those to
+    too us was we what when where which who why will with would you your also about okay ok same above please
+    tell know want much many any some more
+""".split())
+
+CONTINUE_COVERAGE = 0.5
+# Cosine similarity to the last turn's query vector below which a cued turn is a shift
+MIN_FOLLOWUP_SIMILARITY = 0.5
+# Extended topics keep only the tail of the accumulated questions
+MAX_TOPIC_CHARS = 500
+
+
+def content_words(text: str) -> FrozenSet[str]:
+    """Lower-cased words of text, minus stopwords and very short tokens."""
+    return frozenset(word for word in _WORD.findall(text.lower()) if len(word) > 2 and word not in _STOPWORDS)
+
+
+class Turn:
+    """Retrieval state carried from one conversation turn to the next."""
+
+    __slots__ = ("query", "location", "generation", "vector", "scored", "topic_words", "updated_at")
+
+    def __init__(self, query: str, location: str, generation: int, vector: Optional[np.ndarray],
+                 scored: List[Tuple[Any, float]]):
+        self.query = query
+        self.location = location
+        self.generation = generation
+        self.vector = vector
+        self.scored = scored
+        self.topic_words = content_words(query)
+        self.updated_at = time.monotonic()
+
+
+def classify_followup(query: str, turn: Optional[Turn], vector: Optional[np.ndarray] = None) -> str:
+    """
+    Decide how a new query relates to the previous turn: "continue",
+    "extend", "shift", or "new" when there is no previous turn.
+
+    Args:
+        query: The new message
+        turn: The client's previous turn
+        vector: The query's embedding, if it is already cached
+    """
+    if turn is None:
+        return "new"
+    if not _FOLLOWUP_CUE.search(query):
+        return "shift"
+    if vector is not None and turn.vector is not None:
+        norms = float(np.linalg.norm(vector) * np.linalg.norm(turn.vector))
+        if norms and float(np.dot(vector, turn.vector)) / norms < MIN_FOLLOWUP_SIMILARITY:
+            return "shift"
+    words = content_words(query)
+    coverage = len(words & turn.topic_words) / len(words) if words else 1.0
+    return "continue" if coverage >= CONTINUE_COVERAGE else "extend"
+
+
+def merge_scored(cached: List[Tuple[Any, float]], fresh: List[Tuple[Any, float]], top_k: int) -> List[Tuple[Any, float]]:
+    """Union of two (document, distance) lists by text, closest first."""
+    best: Dict[str, Tuple[Any, float]] = {}
+    for doc, distance in list(cached) + list(fresh):
+        current = best.get(doc.page_content)
+        if current is None or distance < current[1]:
+            best[doc.page_content] = (doc, distance)
+    return sorted(best.values(), key=lambda item: item[1])[:top_k]
+
+
+class ConversationMemory:
+    """
+    Per-client retrieval context of the last conversation turn.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 1800.0):
+        """
+        Initialize the memory.
+
+        Args:
+            max_sessions: Clients tracked before the least recent are forgotten
+            ttl: Seconds of inactivity after which a conversation starts over
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._turns: "OrderedDict[str, Turn]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"new": 0, "continue": 0, "extend": 0, "shift": 0}
+
+    def classify(self, client_id: Optional[str], query: str, location: str, generation: int,
+                 conversation_depth: int = 0, vector: Optional[List[float]] = None) -> Tuple[str, Optional[Turn]]:
+        """
+        Classify a query against the client's last turn.
+
+        Args:
+            client_id: Chat session the query comes from
+            query: The new message
+            location: User's location; a different location starts over
+            generation: Current index generation; context from an older one is dropped
+            conversation_depth: Earlier turns the client reports; 0 starts over
+            vector: The query's embedding if already cached (e.g. by a prefetch)
+
+        Returns:
+            (decision, previous turn or None)
+        """
+        turn = None
+        if client_id and conversation_depth > 0:
+            with self._lock:
+                turn = self._turns.get(client_id)
+            if turn is not None and (turn.location != location or turn.generation != generation
+                                     or time.monotonic() - turn.updated_at > self.ttl):
+                turn = None
+        decision = classify_followup(query, turn, None if vector is None else np.asarray(vector, dtype=np.float32))
+        with self._lock:
+            self.stats[decision] += 1
+        return decision, turn
+
+    def retrieve(self, rag_system, client_id: str, query: str, location: str,
+                 followup: Optional[Tuple[str, Optional[Turn]]] = None,
+                 scored: Optional[List[Tuple[Any, float]]] = None) -> List[Tuple[Any, float]]:
+        """
+        Return the (document, distance) pairs to answer query from and
+        remember them for the next turn.
+
+        Args:
+            rag_system: RAGSystem to search
+            client_id: Chat session the query comes from
+            query: The new message
+            location: User's location
+            followup: Result of classify() for this query
+            scored: Chunks already retrieved for the query (e.g. prefetched),
+                used when the turn needs a full retrieval
+        """
+        decision, turn = followup or ("new", None)
+        top_k = rag_system.router.max_top_k
+        if decision == "continue" and turn is not None:
+            # The topic is unchanged, so keep the original question as its anchor
+            turn.updated_at = time.monotonic()
+            return turn.scored
+        if decision == "extend" and turn is not None:
+            vector, fresh = self._search_extended(rag_system, turn, query, location, top_k)
+            scored = merge_scored(turn.scored, fresh, top_k)
+            topic = f"{turn.query} {query}"[-MAX_TOPIC_CHARS:]
+            self._remember(client_id, Turn(topic, location, turn.generation, vector, scored))
+            return scored
+
+        generation = rag_system.generation
+        if scored is None:
+            scored = rag_system.retrieve_scored(query, top_k=top_k, location=location)
+        # Retrieval has just embedded the query, so this is a cache lookup
+        vector = rag_system.embeddings.cached(query)
+        self._remember(client_id, Turn(query, location, generation, None if vector is None else np.asarray(vector, dtype=np.float32), scored))
+        return scored
+
+    @staticmethod
+    def _search_extended(rag_system, turn: Turn, query: str, location: str, top_k: int) -> Tuple[Optional[np.ndarray], List[Tuple[Any, float]]]:
+        """Search for the previous topic and the new terms together."""
+        local = rag_system.retriever is None and rag_system.jurisdictions.resolve(location) is None
+        if turn.vector is None or not local:
+            # Sidecar or jurisdiction layers: search the combined text instead
+            return turn.vector, rag_system.retrieve_scored(f"{turn.query} {query}", top_k=top_k, location=location)
+        vector = (turn.vector + np.asarray(rag_system.embeddings.embed_query(query), dtype=np.float32)) / 2.0
+        return vector, rag_system.search_by_vectors(vector[None, :], top_k)[0]
+
+    def _remember(self, client_id: str, turn: Turn) -> None:
+        with self._lock:
+            self._turns[client_id] = turn
+            self._turns.move_to_end(client_id)
+            while len(self._turns) > self.max_sessions:
+                self._turns.popitem(last=False)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes of the per-client conversation context."""
+        with self._lock:
+            count = len(self._turns)
+            sample = list(islice(self._turns.items(), 32))
+        return {"conversation_sessions": sampled_sizeof(sample, count)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, sessions=len(self._turns))
@@ -0,0 +1,126 @@
+"""
+Near-duplicate chunk elimination for GovFlowAI
+
+Government documents repeat boilerplate (fee tables, office hours, "visit
+dmv.ca.gov" paragraphs) and the splitter's chunk overlap adds more. This
+module collapses near-duplicate chunks before they are embedded:
+1. Each chunk is reduced to a MinHash signature over character shingles
+2. Locality-sensitive hashing (banding) proposes candidate pairs cheaply
+3. Chunks are taken in index order and compared only with the canonical
+   chunk of each existing group; one at or above the Jaccard threshold
+   joins that group, otherwise it starts a new one. Every chunk is thus
+   close to the text that replaces it, and a chain of gradually drifting
+   chunks is not collapsed into its first link
+4. Each group's canonical chunk keeps the attributions of every chunk it
+   replaced
+"""
+
+import re
+import zlib
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16
+SIMILARITY_THRESHOLD = 0.8
+
+# Parameters of the universal hash family h(x) = (a * x + b) mod p
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, _MAX_HASH, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _MAX_HASH, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def _shingles(text: str) -> np.ndarray:
+    """Hash every overlapping character shingle of normalized text to uint32."""
+    normalized = re.sub(r'\s+', ' ', text.lower()).strip()
+    if len(normalized) < SHINGLE_SIZE:
+        normalized = normalized.ljust(SHINGLE_SIZE)
+    hashes = {
+        zlib.crc32(normalized[i:i + SHINGLE_SIZE].encode('utf-8'))
+        for i in range(len(normalized) - SHINGLE_SIZE + 1)
+    }
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature of a text, one uint32 minimum per permutation."""
+    shingles = _shingles(text)
+    # (permutations x shingles) matrix of permuted hashes, then the row minima
+    permuted = (np.outer(_PERM_A, shingles) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return (permuted & _MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+def deduplicate_documents(
+    documents: List[Document],
+    threshold: float = SIMILARITY_THRESHOLD,
+) -> Tuple[List[Document], Dict[str, Any]]:
+    """
+    Collapse near-duplicate chunks into canonical documents.
+
+    The first chunk of each duplicate group is kept as the canonical text, and
+    a chunk joins a group only if it is similar to that text. The canonical
+    chunk's metadata gains a "sources" list with the source, category and
+    chunk_id of every chunk in the group, so attributions survive the merge.
+
+    Args:
+        documents: Chunk documents in index order
+        threshold: Estimated Jaccard similarity above which chunks are merged
+
+    Returns:
+        Tuple of (deduplicated documents, stats dict)
+    """
+    count = len(documents)
+    stats = {"chunks_in": count, "chunks_out": count, "duplicates_removed": 0, "reduction": 0.0}
+    if count < 2:
+        return documents, stats
+
+    signatures = np.stack([minhash_signature(doc.page_content) for doc in documents])
+    rows = NUM_PERMUTATIONS // NUM_BANDS
+
+    # Banding: only canonical chunks are bucketed, so a chunk's candidates are
+    # the canonical chunks it shares an identical band with
+    buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(NUM_BANDS)]
+    groups: Dict[int, List[int]] = {}
+    for i in range(count):
+        keys = [signatures[i, band * rows:(band + 1) * rows].tobytes() for band in range(NUM_BANDS)]
+        candidates = sorted({root for band, key in enumerate(keys) for root in buckets[band].get(key, ())})
+        best = None
+        if candidates:
+            # Verify candidates against the full signature; the most similar wins
+            similarity = (signatures[candidates] == signatures[i]).mean(axis=1)
+            top = int(np.argmax(similarity))
+            if similarity[top] >= threshold:
+                best = candidates[top]
+        if best is not None:
+            groups[best].append(i)
+            continue
+        groups[i] = [i]
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, []).append(i)
+
+    deduplicated = []
+    for root in sorted(groups):
+        members = groups[root]
+        canonical = documents[root]
+        if len(members) > 1:
+            metadata = dict(canonical.metadata)
+            metadata["sources"] = [
+                {
+                    "source": documents[i].metadata.get("source", "Unknown"),
+                    "category": documents[i].metadata.get("category", "Unknown"),
+                    "chunk_id": documents[i].metadata.get("chunk_id"),
+                }
+                for i in members
+            ]
+            canonical = Document(page_content=canonical.page_content, metadata=metadata)
+        deduplicated.append(canonical)
+
+    stats["chunks_out"] = len(deduplicated)
+    stats["duplicates_removed"] = count - len(deduplicated)
+    stats["reduction"] = stats["duplicates_removed"] / count
+    return deduplicated, stats
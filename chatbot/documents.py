@@ -0,0 +1,519 @@
+"""
+Document intake for GovFlowAI: proof of residence and ID uploads
+
+REAL ID needs proof of residence and new residents need their out-of-state
+license details, but the backend had no way to take a document. This module
+adds one that keeps large files off the request thread and out of memory:
+1. Uploads arrive as the raw request body and are copied to a spool file
+   one chunk at a time, so each upload holds a single chunk buffer however
+   big the file. The type is taken from the file's first bytes (PDF, PNG,
+   JPEG, TIFF), not from the client
+2. Text extraction and field detection run in a process pool, off the web
+   workers' GIL. PDFs go through pdftotext when poppler is installed (with
+   tesseract OCR for scanned pages), otherwise through a small built-in
+   reader for text streams; images need tesseract
+3. Job state lives in SQLite, so any worker process can answer a status
+   poll. Only the detected fields are kept; the file is deleted as soon as
+   it has been read
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+CHUNK_SIZE = 64 * 1024
+TOOL_TIMEOUT_SECONDS = 30
+OCR_PAGES = 2
+# A PDF with less text than this is treated as scanned and OCRed when possible
+MIN_PDF_TEXT_CHARS = 40
+# Most a single compressed PDF stream may inflate to; larger streams (e.g. zip bombs) are skipped
+MAX_STREAM_BYTES = 8 * 1024 * 1024
+# Most text kept from one document; bills and IDs are a few pages
+MAX_DOCUMENT_TEXT_CHARS = 200_000
+
+MEDIA_TYPES = (
+    (b"%PDF-", "application/pdf", ".pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"II*\x00", "image/tiff", ".tif"),
+    (b"MM\x00*", "image/tiff", ".tif"),
+)
+
+# Document type: phrases that identify it (checked in order)
+DOCUMENT_TYPES = (
+    ("driver_license", ("driver license", "driver's license", "drivers license", "identification card", "dl no", "class c")),
+    ("utility_bill", ("utility", "electric", "kwh", "water service", "gas service", "service address", "pg&e", "edison")),
+    ("bank_statement", ("bank statement", "statement period", "account summary", "checking account", "savings account")),
+    ("lease", ("lease", "rental agreement", "landlord", "tenant")),
+    ("mortgage_statement", ("mortgage", "escrow", "principal balance")),
+    ("insurance", ("insurance", "policy number", "policyholder")),
+    ("tax_document", ("internal revenue service", "form 1040", "franchise tax board", "w-2", "tax return")),
+)
+PROOF_OF_RESIDENCE_TYPES = {
+    "utility_bill": "Utility bill", "bank_statement": "Bank statement", "lease": "Rental or lease agreement",
+    "mortgage_statement": "Mortgage statement", "insurance": "Insurance document", "tax_document": "Tax document",
+}
+
+_DATE = r"(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|[A-Z][a-z]{2,8}\.? \d{1,2},? \d{4})"
+_PATTERNS = {
+    "license_number": re.compile(r"\b(?:DL|LIC(?:ENSE)?(?:\s*(?:NO|NUMBER|#))?)[.:#\s]*([A-Z]\d{7})\b", re.IGNORECASE),
+    "date_of_birth": re.compile(r"\b(?:DOB|DATE OF BIRTH|BIRTH DATE)[.:\s]*" + _DATE, re.IGNORECASE),
+    "expiration_date": re.compile(r"\b(?:EXP|EXPIRES|EXPIRATION(?: DATE)?)[.:\s]*" + _DATE, re.IGNORECASE),
+    "document_date": re.compile(r"\b(?:STATEMENT|BILL(?:ING)?|ISSUE|INVOICE|SERVICE)\s+DATE[.:\s]*" + _DATE, re.IGNORECASE),
+    "full_name": re.compile(r"^[ \t]*(?:NAME|ACCOUNT HOLDER|CUSTOMER(?: NAME)?|TENANT|POLICYHOLDER)[.:\s]+"
+                            r"([A-Z][A-Za-z'.-]+(?:[ \t]+[A-Z][A-Za-z'.-]+){1,3})[ \t]*$", re.IGNORECASE | re.MULTILINE),
+}
+_LICENSE_NAME = re.compile(r"^[ \t]*(LN|FN)[ \t]+([A-Z][A-Za-z'.-]+(?:[ \t]+[A-Z][A-Za-z'.-]+)*)[ \t]*$", re.MULTILINE)
+_BARE_LICENSE = re.compile(r"\b([A-Z]\d{7})\b")
+_ADDRESS = re.compile(
+    r"(\d{1,6}[ \t]+[A-Za-z0-9.' \t]+?[ \t](?:St|Street|Ave|Avenue|Blvd|Boulevard|Rd|Road|Dr|Drive|Ln|Lane|Way|Ct|Court|"
+    r"Pl|Place|Pkwy|Parkway|Hwy|Highway|Cir|Circle|Ter|Terrace)\.?(?:[ \t]+(?:Apt|Unit|Ste|Suite|#)[ \t]*[\w-]+)?)"
+    r"[ \t]*(?:,|\n)[ \t]*([A-Za-z .'-]+?),?[ \t]+([A-Z]{2})[ \t]+(\d{5})(?:-\d{4})?\b",
+    re.IGNORECASE
+)
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS document_jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    form_type TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    document_type TEXT,
+    fields TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS document_jobs_owner ON document_jobs (owner, finished_at);
+CREATE INDEX IF NOT EXISTS document_jobs_created ON document_jobs (created_at);
+"""
+
+
+class IntakeBusy(Exception):
+    """Raised when too many documents are already waiting to be processed."""
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the size limit."""
+
+
+class UnsupportedDocument(Exception):
+    """Raised when an upload is not a PDF or a supported image."""
+
+
+def sniff_media_type(head: bytes) -> Optional[Tuple[str, str]]:
+    """(media type, file extension) from a file's first bytes, or None."""
+    for magic, media_type, extension in MEDIA_TYPES:
+        if head.startswith(magic):
+            return media_type, extension
+    return None
+
+
+def _run(command: List[str]) -> str:
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=TOOL_TIMEOUT_SECONDS)
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+def _ocr(path: str) -> str:
+    return _run(["tesseract", path, "-", "--psm", "4"]) if shutil.which("tesseract") else ""
+
+
+_PDF_LENGTH = re.compile(rb"/Length\s+(\d+)(?!\s+\d+\s+R)")
+_PDF_TEXT_OP = re.compile(rb"\((?:\\.|[^\\)])*\)\s*(?:Tj|'|\")|\[(?:\\.|[^\]])*\]\s*TJ|T\*|Td|TD", re.DOTALL)
+_PDF_STRING = re.compile(rb"\(((?:\\.|[^\\)])*)\)", re.DOTALL)
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f", b"(": b"(", b")": b")", b"\\": b"\\"}
+
+
+def _pdf_string(raw: bytes) -> bytes:
+    def unescape(match):
+        escaped = match.group(1)
+        if escaped[:1].isdigit():
+            return bytes([int(escaped, 8) & 0xFF])
+        return _PDF_ESCAPES.get(escaped, escaped)
+    return re.sub(rb"\\([0-7]{1,3}|.)", unescape, raw, flags=re.DOTALL)
+
+
+def pdf_text_builtin(path: str) -> str:
+    """
+    Text shown by a PDF's text operators, for PDFs with standard-encoded
+    fonts. Good enough for generated bills and statements; poppler handles
+    everything else.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    lines: List[bytes] = []
+    current: List[bytes] = []
+    size = 0
+    position = 0
+    while size < MAX_DOCUMENT_TEXT_CHARS:
+        # Walk stream keywords, jumping over each stream's data (images are most of a file)
+        keyword = data.find(b"stream", position)
+        if keyword < 0:
+            break
+        position = keyword + 6
+        if data[keyword - 3:keyword] == b"end":
+            continue
+        header = data[data.rfind(b"obj", 0, keyword):keyword]
+        start = keyword + 6 + (2 if data[keyword + 6:keyword + 8] == b"\r\n" else 1)
+        length = _PDF_LENGTH.search(header)
+        end = start + int(length.group(1)) if length else data.find(b"endstream", start)
+        if end < start:
+            break
+        position = end
+        content = data[start:end]
+        if b"/FlateDecode" in header:
+            inflater = zlib.decompressobj()
+            try:
+                content = inflater.decompress(content, MAX_STREAM_BYTES)
+            except zlib.error:
+                continue
+            if inflater.unconsumed_tail:
+                continue
+        elif b"/Filter" in header:
+            # Images and other encodings carry no text
+            continue
+        for op in _PDF_TEXT_OP.finditer(content):
+            token = op.group(0)
+            if token in (b"T*", b"Td", b"TD") or token.endswith((b"'", b'"')):
+                if current:
+                    lines.append(b"".join(current))
+                    current = []
+            for raw in _PDF_STRING.findall(token):
+                current.append(_pdf_string(raw))
+                size += len(current[-1])
+    if current:
+        lines.append(b"".join(current))
+    return b"\n".join(lines)[:MAX_DOCUMENT_TEXT_CHARS].decode("latin-1")
+
+
+def extract_text(path: str, media_type: str) -> Tuple[str, str]:
+    """Text of a document and the tool that read it."""
+    if media_type != "application/pdf":
+        return _ocr(path), "tesseract"
+    if shutil.which("pdftotext"):
+        text, tool = _run(["pdftotext", "-q", "-layout", path, "-"])[:MAX_DOCUMENT_TEXT_CHARS], "pdftotext"
+    else:
+        text, tool = pdf_text_builtin(path), "builtin"
+    if len(text.strip()) < MIN_PDF_TEXT_CHARS and shutil.which("pdftoppm") and shutil.which("tesseract"):
+        # Scanned PDF: render the first pages and OCR them
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, "page")
+            _run(["pdftoppm", "-r", "200", "-png", "-f", "1", "-l", str(OCR_PAGES), path, prefix])
+            pages = sorted(name for name in os.listdir(directory) if name.endswith(".png"))
+            text, tool = "\n".join(_ocr(os.path.join(directory, name)) for name in pages), "tesseract"
+    return text, tool
+
+
+def detect_fields(text: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Document type and the fields found in a document's text.
+
+    Returns:
+        (document type or "unknown", fields such as full_name, address,
+        date_of_birth, license_number, expiration_date, document_date)
+    """
+    lowered = text.lower()
+    document_type = next((name for name, phrases in DOCUMENT_TYPES if any(phrase in lowered for phrase in phrases)), "unknown")
+    fields: Dict[str, Any] = {}
+    for name, pattern in _PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            fields[name] = " ".join(match.group(1).split())
+    if document_type == "driver_license":
+        parts = dict((label.upper(), value.strip()) for label, value in _LICENSE_NAME.findall(text))
+        if "FN" in parts and "LN" in parts:
+            fields["full_name"] = f"{parts['FN']} {parts['LN']}".title()
+        if "license_number" not in fields:
+            bare = _BARE_LICENSE.search(text)
+            if bare:
+                fields["license_number"] = bare.group(1)
+    address = _ADDRESS.search(text)
+    if address:
+        street, city, state, zip_code = (" ".join(part.split()) for part in address.groups())
+        fields["address"] = {"street": street, "city": city.title(), "state": state.upper(), "zip": zip_code}
+    return document_type, fields
+
+
+def extract_document(path: str, media_type: str) -> Dict[str, Any]:
+    """Process-pool job: read a spooled document and detect its fields."""
+    started = time.monotonic()
+    text, tool = extract_text(path, media_type)
+    document_type, fields = detect_fields(text)
+    return {"document_type": document_type, "fields": fields, "text_chars": len(text), "tool": tool,
+            "seconds": round(time.monotonic() - started, 3)}
+
+
+def document_form_data(document_type: Optional[str], fields: Dict[str, Any], form_fields: Sequence[str]) -> Dict[str, Any]:
+    """
+    Map detected fields onto a form's fields.
+
+    Args:
+        document_type: Detected document type
+        fields: Detected fields (see detect_fields)
+        form_fields: Field names of the form being filled in
+    """
+    values: Dict[str, Any] = {}
+    if fields.get("full_name"):
+        values["full_name"] = fields["full_name"]
+    if fields.get("date_of_birth"):
+        values["date_of_birth"] = fields["date_of_birth"]
+    if fields.get("address"):
+        values["current_address"] = dict(fields["address"])
+    if fields.get("license_number"):
+        for name in ("driver_license", "current_license", "out_of_state_license"):
+            values[name] = fields["license_number"]
+    if document_type in PROOF_OF_RESIDENCE_TYPES and fields.get("address"):
+        label = PROOF_OF_RESIDENCE_TYPES[document_type]
+        values["proof_of_residence"] = f"{label} dated {fields['document_date']}" if fields.get("document_date") else label
+    return {name: value for name, value in values.items() if name in form_fields}
+
+
+class DocumentIntake:
+    """
+    Streams uploads to disk and extracts their fields in a process pool.
+    """
+
+    def __init__(self, upload_dir: str, db_path: str, workers: int = 2, max_bytes: int = 20 * 1024 * 1024,
+                 max_pending: int = 64, job_ttl: float = 86400.0, chunk_size: int = CHUNK_SIZE):
+        """
+        Initialize the intake.
+
+        Args:
+            upload_dir: Where uploads are spooled until processed
+            db_path: SQLite file holding job state
+            workers: Extraction processes
+            max_bytes: Largest accepted upload
+            max_pending: Uploads queued or processing before new ones are refused
+            job_ttl: Seconds job results are kept
+            chunk_size: Bytes read from the request per step
+        """
+        self.upload_dir = upload_dir
+        self.db_path = db_path
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.chunk_size = chunk_size
+        os.makedirs(upload_dir, exist_ok=True)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._receiving = 0
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(document_jobs)")]
+        if "client_id" in columns:
+            # Jobs keyed by a client-chosen id; their short-lived results are not carried over
+            self._db.executescript("DROP TABLE document_jobs;")
+        self._db.executescript(SCHEMA_SQL)
+        self.stats = {"uploads": 0, "bytes": 0, "rejected": 0, "done": 0, "failed": 0, "pool_restarts": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Spawned, not forked: the web worker has threads (and locks) a fork would copy mid-use
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _reset_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Forget a pool whose worker died, so the next job starts a new one."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.stats["pool_restarts"] += 1
+        print("Document extraction pool broke (a worker died); starting a new one")
+        broken.shutdown(wait=False)
+
+    def _submit(self, path: str, media_type: str) -> Tuple[ProcessPoolExecutor, Any]:
+        """Queue an extraction job, replacing the pool once if it is broken."""
+        executor = self._pool()
+        try:
+            return executor, executor.submit(extract_document, path, media_type)
+        except BrokenProcessPool:
+            self._reset_pool(executor)
+            executor = self._pool()
+            return executor, executor.submit(extract_document, path, media_type)
+
+    def receive(self, stream: BinaryIO, form_type: str = "", owner: str = "",
+                content_length: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Spool an upload to disk chunk by chunk and queue it for extraction.
+
+        Args:
+            stream: The request body
+            form_type: Form the document is for (its fields are filled in)
+            owner: Server-issued id of the session the document belongs to;
+                only that session sees its fields
+            content_length: Declared size, checked before reading anything
+
+        Returns:
+            {"job_id", "status": "queued", "media_type", "bytes"}
+
+        Raises:
+            IntakeBusy: Too many documents are already waiting
+            UploadTooLarge: The upload is over max_bytes
+            UnsupportedDocument: Not a PDF, PNG, JPEG or TIFF
+        """
+        if content_length is not None and content_length > self.max_bytes:
+            self._reject()
+            raise UploadTooLarge(f"Documents can be at most {self.max_bytes // (1024 * 1024)} MB")
+        with self._lock:
+            if self._pending + self._receiving >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise IntakeBusy(f"{self._pending} documents already waiting")
+            self._receiving += 1
+        job_id = uuid.uuid4().hex
+        part_path = os.path.join(self.upload_dir, job_id + ".part")
+        try:
+            media_type, size, path = self._spool(stream, part_path, job_id)
+        except BaseException:
+            with self._lock:
+                self._receiving -= 1
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+        try:
+            with self._db_lock, self._db:
+                self._db.execute(
+                    "INSERT INTO document_jobs (id, owner, form_type, media_type, bytes, status, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                    (job_id, owner, form_type, media_type, size, time.time())
+                )
+            executor, future = self._submit(path, media_type)
+        except BaseException:
+            # Nothing will process this upload: release its slot and its file
+            with self._lock:
+                self._receiving -= 1
+            os.remove(path)
+            try:
+                with self._db_lock, self._db:
+                    self._db.execute("DELETE FROM document_jobs WHERE id = ?", (job_id,))
+            except sqlite3.Error:
+                pass
+            raise
+        with self._lock:
+            self._receiving -= 1
+            self._pending += 1
+            self.stats["uploads"] += 1
+            self.stats["bytes"] += size
+            purge = self.stats["uploads"] % 100 == 0
+        # Registered after _pending is counted, so _finish never runs first
+        future.add_done_callback(lambda done: self._finish(job_id, path, done, executor))
+        if purge:
+            self._purge()
+        return {"job_id": job_id, "status": "queued", "media_type": media_type, "bytes": size}
+
+    def _reject(self) -> None:
+        with self._lock:
+            self.stats["rejected"] += 1
+
+    def _spool(self, stream: BinaryIO, part_path: str, job_id: str) -> Tuple[str, int, str]:
+        """Copy the stream to part_path; returns (media type, size, final path)."""
+        size = 0
+        sniffed = None
+        head = b""
+        with open(part_path, "wb") as f:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_bytes:
+                    self._reject()
+                    raise UploadTooLarge(f"Documents can be at most {self.max_bytes // (1024 * 1024)} MB")
+                if sniffed is None:
+                    head += chunk[:16]
+                    if len(head) >= 8 or size >= 8:
+                        sniffed = sniff_media_type(head)
+                        if sniffed is None:
+                            self._reject()
+                            raise UnsupportedDocument("Upload a PDF or a PNG, JPEG or TIFF image")
+                f.write(chunk)
+        if sniffed is None:
+            self._reject()
+            raise UnsupportedDocument("The upload is empty or too short to be a document")
+        media_type, extension = sniffed
+        path = os.path.join(self.upload_dir, job_id + extension)
+        os.replace(part_path, path)
+        return media_type, size, path
+
+    def _finish(self, job_id: str, path: str, future, executor: ProcessPoolExecutor) -> None:
+        """Record a job's outcome and delete its file (runs on the pool's result thread)."""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._reset_pool(executor)
+        result = None if error else future.result()
+        with self._lock:
+            self._pending -= 1
+            self.stats["failed" if error else "done"] += 1
+        if error:
+            print(f"Document job {job_id} failed ({type(error).__name__}: {error})")
+        with self._db_lock, self._db:
+            self._db.execute(
+                "UPDATE document_jobs SET status = ?, document_type = ?, fields = ?, error = ?, finished_at = ? WHERE id = ?",
+                ("failed" if error else "done", result and result["document_type"],
+                 json.dumps(result["fields"]) if result else None,
+                 f"{type(error).__name__}: {error}" if error else None, time.time(), job_id)
+            )
+
+    def _purge(self) -> None:
+        """Drop job results older than job_ttl."""
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM document_jobs WHERE created_at < ?", (time.time() - self.job_ttl,))
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job's state and detected fields; None if unknown or expired."""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT owner, form_type, media_type, bytes, status, document_type, fields, error, created_at, finished_at"
+                " FROM document_jobs WHERE id = ? AND created_at >= ?", (job_id, time.time() - self.job_ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        owner, form_type, media_type, size, status, document_type, fields, error, created_at, finished_at = row
+        return {"job_id": job_id, "owner": owner, "form_type": form_type, "media_type": media_type,
+                "bytes": size, "status": status, "document_type": document_type,
+                "fields": json.loads(fields) if fields else {}, "error": error,
+                "seconds": round(finished_at - created_at, 3) if finished_at else None}
+
+    def fields_for(self, owner: str) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+        """(document type, fields) of an owner's finished documents, oldest first."""
+        if not owner:
+            return []
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT document_type, fields FROM document_jobs WHERE owner = ? AND status = 'done'"
+                " AND created_at >= ? ORDER BY finished_at", (owner, time.time() - self.job_ttl)
+            ).fetchall()
+        return [(document_type, json.loads(fields) if fields else {}) for document_type, fields in rows]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Chunk buffers of the uploads being received right now."""
+        with self._lock:
+            return {"document_uploads": self._receiving * self.chunk_size}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, pending=self._pending, receiving=self._receiving, workers=self.workers)
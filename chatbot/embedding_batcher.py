@@ -0,0 +1,207 @@
+"""
+Micro-batching of concurrent query embeddings for GovFlowAI
+
+Under concurrency every request embeds its own query with a single-text call,
+so per-call latency dominates and provider rate limits are hit on request
+count rather than tokens. EmbeddingDispatcher sits in front of an embeddings
+model: queries arriving within a few milliseconds of each other are sent as
+one embed_documents call and the vectors are fanned back out to the callers.
+Recent query vectors are kept in a small LRU cache keyed by the normalized
+question, which warm-up jobs fill through the batched embed_queries path.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from itertools import islice
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from .admission import current_deadline
+from .memory import sampled_sizeof
+from .singleflight import normalize_question
+
+
+class EmbeddingDispatcher(Embeddings):
+    """
+    Embeddings wrapper that coalesces concurrent embed_query calls.
+
+    Works from threaded WSGI workers (embed_query blocks the calling thread)
+    and from asyncio (aembed_query awaits without blocking the loop). Document
+    embedding for index builds is passed straight through.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch: int = 32, max_wait_ms: float = 3.0, timeout: Optional[float] = None,
+                 cache_size: int = 4096):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            embeddings: Underlying embeddings model
+            max_batch: Most queries sent in one embedding request
+            max_wait_ms: How long the first query of a batch waits for company
+            timeout: Default seconds a caller waits for its vector
+            cache_size: Query vectors kept for repeated queries (0 disables)
+        """
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        """Embed one query, sharing the request with concurrent callers."""
+        cached = self._cached(text)
+        if cached is not None:
+            return cached
+        future = self.submit(text)
+        try:
+            return future.result(timeout=self._timeout(timeout))
+        except FutureTimeoutError:
+            # Still queued? Then it is dropped from the next batch
+            future.cancel()
+            raise
+
+    async def aembed_query(self, text: str) -> List[float]:
+        cached = self._cached(text)
+        if cached is not None:
+            return cached
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(text)), self._timeout(None))
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed many queries directly in max_batch-sized requests, filling the
+        query cache. Used to warm the cache before traffic arrives.
+        """
+        vectors: List[Optional[List[float]]] = [self._cached(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        for start in range(0, len(missing), self.max_batch):
+            chunk = missing[start:start + self.max_batch]
+            with self._stats_lock:
+                self._batch_sizes[len(chunk)] += 1
+            for i, vector in zip(chunk, self.embeddings.embed_documents([texts[i] for i in chunk])):
+                vectors[i] = vector
+                self._remember(texts[i], vector)
+        return vectors
+
+    def cached(self, text: str) -> Optional[List[float]]:
+        """Return the cached vector for a query without embedding it."""
+        return self._cached(text)
+
+    def _cached(self, text: str) -> Optional[List[float]]:
+        # "What is REAL ID?" and "what is real id" share a vector
+        key = normalize_question(text)
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self._cache_hits += 1
+            return vector
+
+    def _remember(self, text: str, vector: List[float]) -> None:
+        if not self.cache_size:
+            return
+        key = normalize_question(text)
+        with self._cache_lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _timeout(self, timeout: Optional[float]) -> Optional[float]:
+        """Explicit timeout, else the default, capped by the request deadline."""
+        if timeout is None:
+            timeout = self.timeout
+        deadline = current_deadline()
+        if deadline is not None:
+            remaining = deadline.check("query embedding")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_documents, texts)
+
+    def submit(self, text: str) -> Future:
+        """Queue a query for the next batch and return a Future for its vector."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch) -> None:
+        # Callers that already gave up don't need a vector
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        with self._stats_lock:
+            self._batch_sizes[len(batch)] += 1
+        try:
+            vectors = self.embeddings.embed_documents([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (text, future), vector in zip(batch, vectors):
+            self._remember(text, vector)
+            future.set_result(vector)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes held by the query vector cache."""
+        with self._cache_lock:
+            count = len(self._cache)
+            sample = list(islice(self._cache.items(), 32))
+        return {"embedding_cache": sampled_sizeof(sample, count)}
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch-size distribution of the embedding requests sent so far."""
+        with self._stats_lock:
+            sizes = dict(sorted(self._batch_sizes.items()))
+        batches = sum(sizes.values())
+        queries = sum(size * count for size, count in sizes.items())
+        return {
+            "batches": batches,
+            "queries": queries,
+            "mean_batch_size": queries / batches if batches else 0.0,
+            "batch_size_histogram": sizes,
+            "queued": self._queue.qsize(),
+            "cache_hits": self._cache_hits,
+            "cached_queries": len(self._cache),
+        }
@@ -0,0 +1,190 @@
+"""
+LLM-free extractive answers for GovFlowAI
+
+Scores the sentences of retrieved chunks against the query and returns the
+best ones with citations, in milliseconds and without calling the LLM. Used:
+1. As an explicit mode="extractive" answer
+2. As the fallback when the LLM call fails or misses its deadline
+3. In mode="auto", to answer high-confidence FAQ matches directly
+
+Similarity is TF-IDF cosine computed with NumPy over the candidate sentences
+of a single request, so no model or network access is needed.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_TOKEN = re.compile(r'[a-z0-9$]{2,}')
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "the to what when where which who why will with you your".split()
+)
+
+# Everyday words mapped onto the vocabulary the knowledge base uses
+_SYNONYMS = {"cost": "fee", "price": "fee", "pay": "fee", "charge": "fee", "much": "fee"}
+
+MIN_SENTENCE_TOKENS = 4
+MAX_LIST_ITEMS = 8
+DEFAULT_MAX_SENTENCES = 3
+
+
+def _normalize(token: str) -> str:
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        token = token[:-1]
+    return _SYNONYMS.get(token, token)
+
+
+def tokenize(text: str) -> List[str]:
+    return [_normalize(token) for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def is_heading(line: str) -> bool:
+    """Short Title Case lines without punctuation are section headings."""
+    words = line.split()
+    if len(words) > 6 or line[-1] in '.:;!?':
+        return False
+    return all(word[0].isupper() or word[0].isdigit() or word[0] in '(&' or word in ('of', 'and', 'for', 'the') for word in words)
+
+
+def _is_list_item(line: str) -> bool:
+    return not (line.endswith(':') or line.endswith('.') or is_heading(line))
+
+
+def split_passages(text: str) -> List[str]:
+    """
+    Split chunk text into sentences, keeping list introductions together with
+    their items ("bring:" followed by the documents to bring).
+    """
+    lines = [line.strip(' -*#\t') for line in text.split('\n')]
+    lines = [line for line in lines if line]
+    passages = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if line.endswith(':'):
+            items = []
+            while i < len(lines) and len(items) < MAX_LIST_ITEMS and _is_list_item(lines[i]):
+                items.append(lines[i])
+                i += 1
+            passages.append(f"{line} {'; '.join(items)}." if items else line)
+        else:
+            passages.extend(_SENTENCE_SPLIT.split(line))
+    return passages
+
+
+class ExtractiveAnswerer:
+    """
+    Pick the sentences of retrieved chunks that best answer a query.
+    """
+
+    def __init__(self, max_sentences: int = DEFAULT_MAX_SENTENCES, cache_size: int = 4096):
+        """
+        Initialize the answerer.
+
+        Args:
+            max_sentences: Most sentences included in an answer
+            cache_size: Chunks whose sentence split is kept between requests
+        """
+        self.max_sentences = max_sentences
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[Tuple[str, List[str]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sentences(self, text: str) -> List[Tuple[str, List[str]]]:
+        """Split a chunk into (sentence, tokens) pairs, cached per chunk text."""
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+        sentences = []
+        for sentence in split_passages(text):
+            tokens = tokenize(sentence)
+            # Headings and fragments rarely answer anything on their own
+            if len(tokens) >= MIN_SENTENCE_TOKENS and not is_heading(sentence):
+                sentences.append((sentence, tokens))
+        with self._lock:
+            self._cache[text] = sentences
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return sentences
+
+    def score(self, query: str, docs: List[Document]) -> List[Tuple[float, str, Document]]:
+        """
+        Score every sentence of the given chunks against the query.
+
+        Returns:
+            (cosine similarity, sentence, source chunk) triples, best first
+        """
+        query_tokens = tokenize(query)
+        candidates = [(sentence, tokens, doc) for doc in docs for sentence, tokens in self._sentences(doc.page_content)]
+        if not query_tokens or not candidates:
+            return []
+
+        # Vocabulary of the query and the candidate sentences only
+        vocabulary: Dict[str, int] = {}
+        for token in query_tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+        for _, tokens, _ in candidates:
+            for token in tokens:
+                vocabulary.setdefault(token, len(vocabulary))
+
+        counts = np.zeros((len(candidates) + 1, len(vocabulary)), dtype=np.float32)
+        for token in query_tokens:
+            counts[0, vocabulary[token]] += 1
+        for row, (_, tokens, _) in enumerate(candidates, start=1):
+            for token in tokens:
+                counts[row, vocabulary[token]] += 1
+
+        # Sublinear TF with IDF over the candidate sentences, then cosine
+        document_frequency = np.count_nonzero(counts[1:], axis=0)
+        idf = np.log((1 + len(candidates)) / (1 + document_frequency)) + 1.0
+        weights = np.log1p(counts) * idf
+        norms = np.linalg.norm(weights, axis=1)
+        norms[norms == 0] = 1.0
+        weights /= norms[:, None]
+        similarity = weights[1:] @ weights[0]
+
+        order = np.argsort(-similarity)
+        return [(float(similarity[i]), candidates[i][0], candidates[i][2]) for i in order]
+
+    def answer(self, query: str, docs: List[Document]) -> Tuple[str, List[Dict[str, str]], float]:
+        """
+        Build an extractive answer.
+
+        Returns:
+            Tuple of (answer text, sources list, confidence in [0, 1])
+        """
+        scored = self.score(query, docs)
+        picked = []
+        seen = set()
+        for similarity, sentence, doc in scored:
+            if similarity <= 0 or sentence in seen:
+                continue
+            seen.add(sentence)
+            picked.append((similarity, sentence, doc))
+            if len(picked) == self.max_sentences:
+                break
+
+        if not picked:
+            return ("I couldn't find an answer to that in the official information I have. "
+                    "Please try rephrasing your question.", [], 0.0)
+
+        sources = []
+        lines = []
+        for _, sentence, doc in picked:
+            source = doc.metadata.get("source", "Unknown")
+            category = doc.metadata.get("category", "Unknown")
+            lines.append(f"- {sentence} [{source}]")
+            if not any(s["source"] == source for s in sources):
+                sources.append({"source": source, "category": category})
+
+        text = "Here is what the official information says:\n\n" + "\n".join(lines)
+        return text, sources, picked[0][0]
@@ -0,0 +1,362 @@
+"""
+Offline geodata for GovFlowAI: where the user is and which offices are near
+
+The request location is free text ("San Jose, CA", "95814", "Santa Clara
+County") that used to be pasted into the prompt, leaving the model to guess
+at nearby offices. This module answers that locally:
+1. A gazetteer maps California cities, counties and ZIP codes to
+   coordinates. ZIPs resolve by their three-digit prefix unless a fuller
+   table is loaded from GEODATA_GAZETTEER_FILE (CSV of name,lat,lon, where
+   a name may be a five-digit ZIP)
+2. Offices (DMV, tax, benefits) are bucketed into a grid of half-degree
+   cells per kind. A nearest-k query searches rings of cells outward from
+   the user until no unsearched cell can hold anything closer, so it looks
+   at a handful of offices however many there are
+3. Results are memoized per location string, so a repeat lookup is a dict hit
+
+The nearest offices go into the prompt as a short structured block, so the
+model can name the right office without a geocoding call or a guess.
+"""
+
+import csv
+import json
+import math
+import re
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .appointments import DEFAULT_OFFICES as DMV_OFFICES
+from .memory import sampled_sizeof
+
+EARTH_RADIUS_MILES = 3958.8
+CELL_DEGREES = 0.5
+MILES_PER_DEGREE = 69.05
+MAX_PLACE_WORDS = 4
+
+# Knowledge base categories (file names) and the office kind they are about
+CATEGORY_KINDS = {"dmv_services": "dmv", "tax_services": "tax", "benefits_programs": "benefits"}
+KIND_LABELS = {"dmv": "DMV office", "tax": "Tax assistance office", "benefits": "County social services office"}
+
+# City: (lat, lon)
+CA_CITIES: Dict[str, Tuple[float, float]] = {
+    "alameda": (37.7652, -122.2416), "alhambra": (34.0953, -118.1270), "anaheim": (33.8366, -117.9143),
+    "antioch": (38.0049, -121.8058), "bakersfield": (35.3733, -119.0187), "barstow": (34.8958, -117.0173),
+    "berkeley": (37.8716, -122.2727), "burbank": (34.1808, -118.3090), "carlsbad": (33.1581, -117.3506),
+    "chico": (39.7285, -121.8375), "chula vista": (32.6401, -117.0842), "clovis": (36.8252, -119.7029),
+    "concord": (37.9780, -122.0311), "corona": (33.8753, -117.5664), "costa mesa": (33.6411, -117.9187),
+    "daly city": (37.6879, -122.4702), "davis": (38.5449, -121.7405), "downey": (33.9401, -118.1332),
+    "el cajon": (32.7948, -116.9625), "el centro": (32.7920, -115.5631), "elk grove": (38.4088, -121.3716),
+    "escondido": (33.1192, -117.0864), "eureka": (40.8021, -124.1637), "fairfield": (38.2494, -122.0400),
+    "fontana": (34.0922, -117.4350), "fremont": (37.5485, -121.9886), "fresno": (36.7378, -119.7871),
+    "fullerton": (33.8704, -117.9242), "garden grove": (33.7743, -117.9380), "glendale": (34.1425, -118.2551),
+    "hanford": (36.3275, -119.6457), "hayward": (37.6688, -122.0808), "hemet": (33.7475, -116.9720),
+    "hollywood": (34.0928, -118.3287), "huntington beach": (33.6595, -117.9988), "indio": (33.7206, -116.2156),
+    "inglewood": (33.9617, -118.3531), "irvine": (33.6846, -117.8265), "lancaster": (34.6868, -118.1542),
+    "lodi": (38.1302, -121.2724), "long beach": (33.7701, -118.1937), "los angeles": (34.0522, -118.2437),
+    "madera": (36.9613, -120.0607), "merced": (37.3022, -120.4830), "modesto": (37.6391, -120.9969),
+    "monterey": (36.6002, -121.8947), "moreno valley": (33.9425, -117.2297), "mountain view": (37.3861, -122.0839),
+    "napa": (38.2975, -122.2869), "north hollywood": (34.1870, -118.3813), "oakland": (37.8044, -122.2712),
+    "oceanside": (33.1959, -117.3795), "ontario": (34.0633, -117.6509), "orange": (33.7879, -117.8531),
+    "oxnard": (34.1975, -119.1771), "palm springs": (33.8303, -116.5453), "palmdale": (34.5794, -118.1165),
+    "palo alto": (37.4419, -122.1430), "pasadena": (34.1478, -118.1445), "petaluma": (38.2324, -122.6367),
+    "placerville": (38.7296, -120.7985), "pomona": (34.0551, -117.7500), "porterville": (36.0652, -119.0168),
+    "rancho cucamonga": (34.1064, -117.5931), "red bluff": (40.1785, -122.2358), "redding": (40.5865, -122.3917),
+    "redlands": (34.0556, -117.1825), "redwood city": (37.4852, -122.2364), "richmond": (37.9358, -122.3478),
+    "riverside": (33.9806, -117.3755), "roseville": (38.7521, -121.2880), "sacramento": (38.5816, -121.4944),
+    "salinas": (36.6777, -121.6555), "san bernardino": (34.1083, -117.2898), "san diego": (32.7157, -117.1611),
+    "san francisco": (37.7749, -122.4194), "san jose": (37.3382, -121.8863), "san luis obispo": (35.2828, -120.6596),
+    "san mateo": (37.5630, -122.3255), "san rafael": (37.9735, -122.5311), "santa ana": (33.7455, -117.8677),
+    "santa barbara": (34.4208, -119.6982), "santa clara": (37.3541, -121.9552), "santa clarita": (34.3917, -118.5426),
+    "santa cruz": (36.9741, -122.0308), "santa maria": (34.9530, -120.4357), "santa monica": (34.0195, -118.4912),
+    "santa rosa": (38.4404, -122.7141), "simi valley": (34.2694, -118.7815), "south lake tahoe": (38.9399, -119.9772),
+    "stockton": (37.9577, -121.2908), "sunnyvale": (37.3688, -122.0363), "temecula": (33.4936, -117.1484),
+    "thousand oaks": (34.1706, -118.8376), "torrance": (33.8358, -118.3406), "tracy": (37.7397, -121.4252),
+    "truckee": (39.3280, -120.1833), "turlock": (37.4947, -120.8466), "ukiah": (39.1502, -123.2078),
+    "vallejo": (38.1041, -122.2566), "van nuys": (34.1899, -118.4514), "ventura": (34.2746, -119.2290),
+    "victorville": (34.5362, -117.2928), "visalia": (36.3302, -119.2921), "walnut creek": (37.9101, -122.0652),
+    "west covina": (34.0686, -117.9390), "whittier": (33.9792, -118.0328), "woodland": (38.6785, -121.7733),
+    "yuba city": (39.1404, -121.6169),
+}
+
+# County: seat (or largest) city in CA_CITIES
+CA_COUNTIES: Dict[str, str] = {
+    "alameda": "oakland", "butte": "chico", "contra costa": "walnut creek", "el dorado": "placerville",
+    "fresno": "fresno", "humboldt": "eureka", "imperial": "el centro", "kern": "bakersfield", "kings": "hanford",
+    "los angeles": "los angeles", "madera": "madera", "marin": "san rafael", "mendocino": "ukiah",
+    "merced": "merced", "monterey": "salinas", "napa": "napa", "nevada": "truckee", "orange": "santa ana",
+    "placer": "roseville", "riverside": "riverside", "sacramento": "sacramento", "san bernardino": "san bernardino",
+    "san diego": "san diego", "san francisco": "san francisco", "san joaquin": "stockton",
+    "san luis obispo": "san luis obispo", "san mateo": "redwood city", "santa barbara": "santa barbara",
+    "santa clara": "san jose", "santa cruz": "santa cruz", "shasta": "redding", "solano": "fairfield",
+    "sonoma": "santa rosa", "stanislaus": "modesto", "sutter": "yuba city", "tehama": "red bluff",
+    "tulare": "visalia", "ventura": "ventura", "yolo": "woodland",
+}
+
+# Three-digit ZIP prefix: the city it is centred on
+CA_ZIP3: Dict[str, str] = {
+    "900": "los angeles", "901": "los angeles", "902": "inglewood", "903": "inglewood", "904": "santa monica",
+    "905": "torrance", "906": "whittier", "907": "long beach", "908": "long beach", "910": "pasadena",
+    "911": "pasadena", "912": "glendale", "913": "van nuys", "914": "van nuys", "915": "burbank",
+    "916": "north hollywood", "917": "west covina", "918": "alhambra", "919": "chula vista", "920": "escondido",
+    "921": "san diego", "922": "indio", "923": "san bernardino", "924": "san bernardino", "925": "riverside",
+    "926": "santa ana", "927": "santa ana", "928": "anaheim", "930": "oxnard", "931": "santa barbara",
+    "932": "bakersfield", "933": "bakersfield", "934": "santa maria", "935": "lancaster", "936": "fresno",
+    "937": "fresno", "938": "fresno", "939": "salinas", "940": "san mateo", "941": "san francisco",
+    "942": "sacramento", "943": "palo alto", "944": "san mateo", "945": "walnut creek", "946": "oakland",
+    "947": "berkeley", "948": "richmond", "949": "san rafael", "950": "san jose", "951": "san jose",
+    "952": "stockton", "953": "modesto", "954": "santa rosa", "955": "eureka", "956": "sacramento",
+    "957": "sacramento", "958": "sacramento", "959": "yuba city", "960": "redding", "961": "truckee",
+}
+
+TAX_OFFICES: List[Dict[str, Any]] = [
+    {"id": "tax-" + city.replace(" ", "-"), "name": f"Franchise Tax Board field office, {city.title()}", "city": city.title()}
+    for city in ("sacramento", "oakland", "san francisco", "san jose", "fresno", "los angeles", "santa ana", "san diego")
+]
+
+BENEFITS_OFFICES: List[Dict[str, Any]] = [
+    {"id": "benefits-" + county.replace(" ", "-"), "name": f"{county.title()} County social services", "city": seat.title()}
+    for county, seat in CA_COUNTIES.items()
+]
+
+_ZIP = re.compile(r"\b(9[0-6]\d)(\d{2})(?:-\d{4})?\b")
+_WORDS = re.compile(r"[a-z]+")
+
+
+def haversine_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+class Place:
+    """A resolved location."""
+
+    __slots__ = ("name", "lat", "lon")
+
+    def __init__(self, name: str, lat: float, lon: float):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+
+
+class Gazetteer:
+    """
+    Resolve free-text California locations to coordinates, offline.
+    """
+
+    def __init__(self, cities: Dict[str, Tuple[float, float]] = CA_CITIES, counties: Dict[str, str] = CA_COUNTIES,
+                 zip3: Dict[str, str] = CA_ZIP3, zips: Optional[Dict[str, Tuple[float, float]]] = None):
+        """
+        Initialize the gazetteer.
+
+        Args:
+            cities: Lower-case city name to (lat, lon)
+            counties: Lower-case county name to a city in `cities`
+            zip3: Three-digit ZIP prefix to a city in `cities`
+            zips: Optional five-digit ZIP to (lat, lon), checked before zip3
+        """
+        self.names: Dict[str, Place] = {name: Place(name.title(), lat, lon) for name, (lat, lon) in cities.items()}
+        self.counties = {f"{county} county": self.names[city] for county, city in counties.items() if city in self.names}
+        self.zip3 = {prefix: self.names[city] for prefix, city in zip3.items() if city in self.names}
+        self.zips = {code: Place(code, lat, lon) for code, (lat, lon) in (zips or {}).items()}
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "Gazetteer":
+        """The built-in gazetteer, plus cities and ZIPs from a name,lat,lon CSV if given."""
+        cities = dict(CA_CITIES)
+        zips = {}
+        if path:
+            with open(path, newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) < 3 or row[0].strip().lower() == "name":
+                        continue
+                    name, lat, lon = row[0].strip().lower(), float(row[1]), float(row[2])
+                    if name.isdigit() and len(name) == 5:
+                        zips[name] = (lat, lon)
+                    else:
+                        cities[name] = (lat, lon)
+        return cls(cities=cities, zips=zips)
+
+    def resolve(self, location: Optional[str]) -> Optional[Place]:
+        """
+        Coordinates of the most specific place named in a location string:
+        a ZIP code, then a county ("... County"), then the longest city name.
+        """
+        if not location:
+            return None
+        zip_match = _ZIP.search(location)
+        if zip_match:
+            code = zip_match.group(1) + zip_match.group(2)
+            place = self.zips.get(code) or self.zip3.get(zip_match.group(1))
+            if place is not None:
+                return place
+        words = _WORDS.findall(location.lower())
+        best = None
+        best_words = 0
+        for size in range(min(MAX_PLACE_WORDS, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                name = " ".join(words[start:start + size])
+                if start + size < len(words) and words[start + size] == "county":
+                    place = self.counties.get(f"{name} county")
+                else:
+                    place = self.names.get(name)
+                if place is not None and size > best_words:
+                    best, best_words = place, size
+            if best is not None:
+                return best
+        return None
+
+
+class OfficeGrid:
+    """Offices of one kind bucketed by half-degree cell for nearest-k search."""
+
+    def __init__(self, offices: Iterable[Dict[str, Any]]):
+        self.offices = [office for office in offices if office.get("lat") is not None]
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, office in enumerate(self.offices):
+            self._cells.setdefault(self._cell(office["lat"], office["lon"]), []).append(i)
+        rows = [cell[0] for cell in self._cells] or [0]
+        cols = [cell[1] for cell in self._cells] or [0]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / CELL_DEGREES)), int(math.floor(lon / CELL_DEGREES))
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[Dict[str, Any], float]]:
+        """The k closest offices as (office, miles), closest first."""
+        if not self.offices:
+            return []
+        row, col = self._cell(lat, lon)
+        min_row, max_row, min_col, max_col = self._bounds
+        # Every cell is searched once the rings cover the grid's bounding box
+        max_ring = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+        found: List[Tuple[float, int]] = []
+        for ring in range(max_ring + 1):
+            for cell in self._ring(row, col, ring):
+                for i in self._cells.get(cell, ()):
+                    office = self.offices[i]
+                    found.append((haversine_miles(lat, lon, office["lat"], office["lon"]), i))
+            if len(found) >= k:
+                found.sort()
+                # Anything in the next ring is at least `ring` whole cells away; a
+                # degree of longitude is shortest at the ring's pole-ward edge
+                lon_miles = MILES_PER_DEGREE * math.cos(math.radians(min(89.0, abs(lat) + (ring + 1) * CELL_DEGREES)))
+                if found[k - 1][0] <= ring * CELL_DEGREES * lon_miles:
+                    break
+        found.sort()
+        return [(self.offices[i], distance) for distance, i in found[:k]]
+
+    @staticmethod
+    def _ring(row: int, col: int, ring: int) -> Iterable[Tuple[int, int]]:
+        if ring == 0:
+            yield row, col
+            return
+        for d in range(-ring, ring + 1):
+            yield row - ring, col + d
+            yield row + ring, col + d
+        for d in range(-ring + 1, ring):
+            yield row + d, col - ring
+            yield row + d, col + ring
+
+
+class OfficeLocator:
+    """
+    Nearest DMV, tax and benefits offices to a free-text location.
+    """
+
+    def __init__(self, gazetteer: Gazetteer, offices: Dict[str, List[Dict[str, Any]]], cache_size: int = 4096):
+        """
+        Initialize the locator.
+
+        Args:
+            gazetteer: Resolves locations (and offices without coordinates) to places
+            offices: Office kind ("dmv", "tax", "benefits") to office dicts with
+                "id", "name" and either "lat"/"lon" or a "city" the gazetteer knows
+            cache_size: Memoized (location, kind, k) lookups
+        """
+        self.gazetteer = gazetteer
+        self.grids = {kind: OfficeGrid(self._locate(gazetteer, entries)) for kind, entries in offices.items()}
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str, int], List[Tuple[Dict[str, Any], float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "unresolved": 0}
+
+    @staticmethod
+    def _locate(gazetteer: Gazetteer, offices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        located = []
+        for office in offices:
+            if office.get("lat") is None:
+                place = gazetteer.resolve(office.get("city"))
+                if place is None:
+                    print(f"Office {office.get('id')} has no coordinates and an unknown city; skipped")
+                    continue
+                office = dict(office, lat=place.lat, lon=place.lon)
+            located.append(office)
+        return located
+
+    @classmethod
+    def load(cls, offices_path: Optional[str] = None, gazetteer_path: Optional[str] = None) -> "OfficeLocator":
+        """The built-in offices, or a JSON file of kind to office list, over the gazetteer."""
+        offices = {"dmv": DMV_OFFICES, "tax": TAX_OFFICES, "benefits": BENEFITS_OFFICES}
+        if offices_path:
+            with open(offices_path, 'r') as f:
+                offices = json.load(f)
+        return cls(Gazetteer.load(gazetteer_path), offices)
+
+    def nearest(self, location: Optional[str], kind: str, k: int = 3) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        The k offices of a kind closest to a location.
+
+        Returns:
+            (office, miles) pairs, closest first; empty if the location is unknown
+        """
+        key = (location or "", kind, k)
+        with self._lock:
+            self.stats["lookups"] += 1
+            cached = self._cache.get(key)
+            if cached is not None:
+                self.stats["hits"] += 1
+                self._cache.move_to_end(key)
+                return cached
+        place = self.gazetteer.resolve(location)
+        if place is None or kind not in self.grids:
+            result = []
+            with self._lock:
+                self.stats["unresolved"] += 1
+        else:
+            result = self.grids[kind].nearest(place.lat, place.lon, k)
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def context_block(self, location: Optional[str], kinds: Iterable[str], k: int = 2) -> str:
+        """
+        The nearest offices of each kind as a compact structured block for
+        the prompt, or "" when the location can't be resolved.
+        """
+        entries = []
+        for kind in kinds:
+            for office, miles in self.nearest(location, kind, k):
+                entries.append({"type": KIND_LABELS.get(kind, kind), "name": office["name"],
+                                "city": office.get("city"), "miles": round(miles, 1)})
+        if not entries:
+            return ""
+        lines = "\n".join(json.dumps(entry, separators=(",", ":")) for entry in entries)
+        return f"Nearest offices to the user (straight-line distance):\n{lines}"
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes of the memoized lookups (offices are shared, not counted)."""
+        with self._lock:
+            count = len(self._cache)
+            sample = [(key, [distance for _, distance in result]) for key, result in islice(self._cache.items(), 32)]
+        return {"office_lookups": sampled_sizeof(sample, count)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, cached=len(self._cache),
+                        offices={kind: len(grid.offices) for kind, grid in self.grids.items()})
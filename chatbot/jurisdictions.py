@@ -0,0 +1,276 @@
+"""
+Per-jurisdiction knowledge layers for GovFlowAI
+
+City and county documents live next to the statewide knowledge base:
+
+    knowledge_base/
+        dmv_services.md              <- statewide layer
+        jurisdictions/
+            san-jose/*.md            <- one layer per city or county
+            santa-clara-county/*.md
+
+Each jurisdiction gets its own FAISS index, saved beside its documents so
+later processes only have to load it. A layer without a current saved index
+is built in a background thread; requests for it search only the statewide
+layer until it is ready. Loaded indexes are kept in an LRU bounded by an
+approximate memory budget, so hundreds of jurisdictions can exist on disk
+while only the hot ones stay resident.
+"""
+
+import glob
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+from .chunk_store import build_compact_store, load_compact_store, save_compact_store, saved_at
+from .dedup import deduplicate_documents
+from .singleflight import SingleFlight
+
+INDEX_DIR_NAME = ".index"
+DEFAULT_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024
+# Seconds the listing of jurisdiction directories is reused before it is read again
+AVAILABLE_TTL = 30.0
+
+
+def jurisdiction_slug(name: str) -> str:
+    """Normalize a place name, e.g. "San José" or "san_jose", to "san-jose"."""
+    slug = re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+    return slug
+
+
+def candidate_jurisdictions(location: str) -> List[str]:
+    """
+    Slugs to try for a free-text location, most specific first.
+
+    "San Jose, Santa Clara County, CA" yields ["san-jose", "santa-clara-county",
+    "ca"]; the statewide layer is always searched separately.
+    """
+    if not location:
+        return []
+    parts = [jurisdiction_slug(part) for part in location.split(',')]
+    return [part for part in parts if part and part not in ('california',)]
+
+
+def estimate_store_bytes(store: FAISS) -> int:
+    """Approximate resident size of a FAISS store: vectors plus chunk text."""
+    index = store.index
+    vector_bytes = index.ntotal * index.d * 4
+    chunk_store = getattr(store.docstore, "chunk_store", None)
+    if chunk_store is not None:
+        return vector_bytes + chunk_store.nbytes
+    text_bytes = sum(len(doc.page_content.encode('utf-8')) for doc in store.docstore._dict.values())
+    return vector_bytes + text_bytes
+
+
+class JurisdictionIndexRegistry:
+    """
+    Lazily loaded, LRU-cached FAISS indexes keyed by jurisdiction slug.
+    """
+
+    def __init__(
+        self,
+        jurisdictions_dir: str,
+        embeddings,
+        process_document: Callable[[str], List[Document]],
+        memory_budget_bytes: int = DEFAULT_MEMORY_BUDGET_BYTES,
+    ):
+        """
+        Initialize the registry.
+
+        Args:
+            jurisdictions_dir: Directory holding one sub-directory per jurisdiction
+            embeddings: Embeddings model shared with the statewide index
+            process_document: Turns a markdown file path into chunk Documents
+            memory_budget_bytes: Approximate cap on resident index memory
+        """
+        self.jurisdictions_dir = jurisdictions_dir
+        self.embeddings = embeddings
+        self.process_document = process_document
+        self.memory_budget_bytes = memory_budget_bytes
+        self._lock = threading.Lock()
+        self._loaded: "OrderedDict[str, FAISS]" = OrderedDict()
+        self._sizes = {}
+        # Listed jurisdictions without documents; a subset of the listing, so bounded by it
+        self._missing = set()
+        self._available: frozenset = frozenset()
+        self._listed_at: Optional[float] = None
+        self._loads = SingleFlight()
+        # Layers queued or being built; builds run one at a time so they don't compete with requests
+        self._building = set()
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jurisdiction-build")
+        # Bumped by invalidate() so loads started before it aren't cached
+        self._generation = 0
+        self.stats = {"hits": 0, "loads": 0, "builds": 0, "evictions": 0, "deferred": 0}
+
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def available(self) -> List[str]:
+        """Jurisdictions that have documents on disk."""
+        if not os.path.isdir(self.jurisdictions_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.jurisdictions_dir)
+            if os.path.isdir(os.path.join(self.jurisdictions_dir, name))
+        )
+
+    def _listed(self) -> frozenset:
+        """Jurisdiction directories on disk, listed at most every AVAILABLE_TTL seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if self._listed_at is not None and now - self._listed_at < AVAILABLE_TTL:
+                return self._available
+        available = frozenset(self.available())
+        with self._lock:
+            self._available = available
+            self._listed_at = now
+            self._missing &= available
+        return available
+
+    def resolve(self, location: str) -> Optional[str]:
+        """Return the most specific jurisdiction with its own documents, if any."""
+        # Slugs come from free text, so only names found on disk are ever remembered
+        available = self._listed()
+        with self._lock:
+            missing = set(self._missing)
+        for slug in candidate_jurisdictions(location):
+            if slug in available and slug not in missing:
+                return slug
+        return None
+
+    def get(self, jurisdiction: str, wait: bool = False) -> Optional[FAISS]:
+        """
+        Return the index for a jurisdiction if it can be served now.
+
+        A layer with a current saved index is loaded in the caller. One that
+        has to be built (parsed, embedded and saved) is queued for the
+        background builder, and None is returned until it is ready so the
+        request is answered from the statewide layer alone.
+
+        Args:
+            jurisdiction: Jurisdiction name or slug
+            wait: Build in the caller instead, e.g. when generating answers offline
+
+        Returns:
+            The jurisdiction's FAISS store, or None
+        """
+        slug = jurisdiction_slug(jurisdiction)
+        with self._lock:
+            store = self._loaded.get(slug)
+            if store is not None:
+                self._loaded.move_to_end(slug)
+                self.stats["hits"] += 1
+                return store
+        listed = slug in self._listed()
+        with self._lock:
+            if not listed or slug in self._missing:
+                return None
+            generation = self._generation
+
+        if not wait and not self._index_is_current(slug):
+            self._build_in_background(slug)
+            return None
+        # Concurrent requests for the same cold jurisdiction share one load
+        return self._keep(slug, self._loads.do(slug, lambda: self._load(slug)), generation)
+
+    def invalidate(self, jurisdiction: Optional[str] = None) -> None:
+        """Drop one (or every) loaded jurisdiction so it is reloaded on next use."""
+        with self._lock:
+            if jurisdiction is None:
+                self._loaded.clear()
+                self._sizes.clear()
+            else:
+                slug = jurisdiction_slug(jurisdiction)
+                self._loaded.pop(slug, None)
+                self._sizes.pop(slug, None)
+            self._missing.clear()
+            self._listed_at = None
+            self._generation += 1
+
+    def _keep(self, slug: str, store: Optional[FAISS], generation: int) -> Optional[FAISS]:
+        """Cache a loaded layer, or remember that it has no documents, unless invalidated meanwhile."""
+        with self._lock:
+            if generation != self._generation:
+                return store
+            if store is None:
+                self._missing.add(slug)
+                return None
+            if slug not in self._loaded:
+                self._loaded[slug] = store
+                self._sizes[slug] = estimate_store_bytes(store)
+                self._evict_over_budget(keep=slug)
+        return store
+
+    def _build_in_background(self, slug: str) -> None:
+        """Queue a build of a layer unless one is already queued or running."""
+        with self._lock:
+            self.stats["deferred"] += 1
+            if slug in self._building:
+                return
+            self._building.add(slug)
+            generation = self._generation
+
+        def build() -> None:
+            try:
+                self._keep(slug, self._loads.do(slug, lambda: self._load(slug)), generation)
+            except Exception as e:
+                print(f"Building jurisdiction {slug} failed: {e}")
+            finally:
+                with self._lock:
+                    self._building.discard(slug)
+
+        self._builder.submit(build)
+
+    def _evict_over_budget(self, keep: str) -> None:
+        """Evict least recently used layers until under budget. Caller holds the lock."""
+        while sum(self._sizes.values()) > self.memory_budget_bytes and len(self._loaded) > 1:
+            slug = next(iter(self._loaded))
+            if slug == keep:
+                self._loaded.move_to_end(slug)
+                continue
+            del self._loaded[slug]
+            del self._sizes[slug]
+            self.stats["evictions"] += 1
+
+    def _index_is_current(self, slug: str) -> bool:
+        """Whether the layer loads without a build: it has no documents, or its saved index is newer than them."""
+        docs_dir = os.path.join(self.jurisdictions_dir, slug)
+        md_files = glob.glob(os.path.join(docs_dir, "*.md"))
+        if not md_files:
+            return True
+        index_saved_at = saved_at(os.path.join(docs_dir, INDEX_DIR_NAME))
+        return index_saved_at is not None and index_saved_at >= max(os.path.getmtime(path) for path in md_files)
+
+    def _load(self, slug: str) -> Optional[FAISS]:
+        """Load a saved index from disk, rebuilding it if its documents are newer."""
+        docs_dir = os.path.join(self.jurisdictions_dir, slug)
+        md_files = glob.glob(os.path.join(docs_dir, "*.md"))
+        if not md_files:
+            return None
+
+        index_dir = os.path.join(docs_dir, INDEX_DIR_NAME)
+        if self._index_is_current(slug):
+            self.stats["loads"] += 1
+            return load_compact_store(index_dir, self.embeddings)
+
+        documents = []
+        for file_path in md_files:
+            documents.extend(self.process_document(file_path))
+        if not documents:
+            return None
+
+        documents, _ = deduplicate_documents(documents)
+        store = build_compact_store(documents, self.embeddings, common_metadata={"jurisdiction": slug})
+        save_compact_store(store, index_dir)
+        self.stats["builds"] += 1
+        print(f"Indexed {len(documents)} chunks for jurisdiction {slug}")
+        return store
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.services import get_answer_store, get_rag_system
+from chatbot.singleflight import prompt_version
+from chatbot.views import CA_DMV_INTENTS, load_system_prompt
+
+
+class Command(BaseCommand):
+    help = "Regenerate precomputed answers for info-only intents. Run after the knowledge base changes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--locations',
+            help="Comma-separated jurisdiction slugs to generate for (default: every jurisdiction with its own documents)"
+        )
+
+    def handle(self, *args, **options):
+        rag_system = get_rag_system()
+        if options['locations']:
+            locations = [slug.strip() for slug in options['locations'].split(',') if slug.strip()]
+        else:
+            locations = rag_system.jurisdictions.available()
+
+        intents = {
+            intent: info['faq_question']
+            for intent, info in CA_DMV_INTENTS.items()
+            if not info['fields'] and info.get('faq_question')
+        }
+        system_prompt = load_system_prompt()
+        count = get_answer_store().regenerate(
+            rag_system,
+            intents=intents,
+            system_prompt=system_prompt,
+            prompt_version=prompt_version(system_prompt),
+            locations=locations
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} answers for {len(intents)} intents across {len(locations) + 1} locations"
+        ))
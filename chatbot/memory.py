@@ -0,0 +1,186 @@
+"""
+Memory footprint accounting for GovFlowAI workers
+
+Worker sizing used to be guesswork: index vectors, chunk text, the caches
+and per-client state all grow without any visibility. This module gives
+each of them a number:
+1. Components expose memory_usage() returning {component: bytes}; the
+   accountant collects them (with the process RSS) into one report, which
+   /api/metrics/ includes under "memory"
+2. Array-backed data (FAISS vectors, chunk columns) is counted exactly;
+   object-heavy caches are estimated by deep-sizing a sample of entries
+3. Per-component and total budgets (MEMORY_BUDGETS, MEMORY_TOTAL_BUDGET)
+   are checked on every report and by an optional background monitor, with
+   a warning printed when a budget is first exceeded
+
+See benchmark_memory.py for tracemalloc measurements of the per-chunk and
+per-session overhead behind these estimates.
+"""
+
+import re
+import sys
+import threading
+import time
+import types
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+_SIZE = re.compile(r'^\s*([\d.]+)\s*([kmg]?)i?b?\s*$', re.IGNORECASE)
+_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# Shared or immortal objects that say nothing about a component's own footprint
+_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+               types.MethodType, threading.Thread, type(threading.Lock()))
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte size such as "512MB", "1.5g" or "4096"."""
+    match = _SIZE.match(text)
+    if not match:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """Parse "component=size,component=size" (e.g. "index_vectors=1GB,response_cache=64MB")."""
+    budgets = {}
+    for item in spec.split(','):
+        if item.strip():
+            name, _, size = item.partition('=')
+            budgets[name.strip()] = parse_size(size)
+    return budgets
+
+
+def deep_sizeof(obj: Any) -> int:
+    """
+    Bytes reachable from obj: containers, instance attributes and NumPy
+    buffers, each object counted once. Classes, modules, functions, threads
+    and locks are not followed.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _SKIP_TYPES):
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            # Includes the buffer only when the array owns it (not for views or memory maps)
+            total += sys.getsizeof(item)
+            if item.dtype == object:
+                stack.extend(item.ravel().tolist())
+            continue
+        total += sys.getsizeof(item)
+        if isinstance(item, (str, bytes, bytearray, int, float, bool)) or item is None:
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        else:
+            if hasattr(item, '__dict__'):
+                stack.append(vars(item))
+            for slot in getattr(type(item), '__slots__', ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
+
+
+def sampled_sizeof(items: Iterable[Any], count: int, sample: int = 32) -> int:
+    """Estimate the deep size of `count` similar items from the first `sample` of them."""
+    if count == 0:
+        return 0
+    sampled = list(islice(items, sample))
+    if not sampled:
+        return 0
+    return int(sum(deep_sizeof(item) for item in sampled) / len(sampled) * count)
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, if the platform exposes it."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        import resource
+        return pages * resource.getpagesize()
+    except (OSError, ValueError, ImportError):
+        return None
+
+
+class MemoryAccountant:
+    """
+    Collect per-component memory usage and check it against budgets.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, total_budget: int = 0):
+        """
+        Initialize the accountant.
+
+        Args:
+            budgets: Byte budget per component name
+            total_budget: Byte budget for the process RSS; 0 disables
+        """
+        self.budgets = dict(budgets or {})
+        self.total_budget = total_budget
+        self._sources: List[Callable[[], Dict[str, int]]] = []
+        self._over_budget = set()
+        self._lock = threading.Lock()
+        self.stats = {"reports": 0, "budget_warnings": 0}
+
+    def register(self, usage: Callable[[], Dict[str, int]]) -> None:
+        """Add a callable returning {component: bytes}."""
+        self._sources.append(usage)
+
+    def usage(self) -> Dict[str, int]:
+        components: Dict[str, int] = {}
+        for source in self._sources:
+            try:
+                for name, size in source().items():
+                    components[name] = components.get(name, 0) + int(size)
+            except Exception as e:
+                print(f"Memory accounting failed for {source!r} ({type(e).__name__}: {e})")
+        return components
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Measure every component and check the budgets.
+
+        Returns:
+            Bytes per component, their sum, the process RSS, the budgets and
+            the names of the components (or "total") over budget
+        """
+        components = self.usage()
+        rss = process_rss_bytes()
+        over = [name for name, budget in self.budgets.items() if components.get(name, 0) > budget]
+        if self.total_budget and rss is not None and rss > self.total_budget:
+            over.append("total")
+        with self._lock:
+            self.stats["reports"] += 1
+            for name in over:
+                if name not in self._over_budget:
+                    self.stats["budget_warnings"] += 1
+                    used = rss if name == "total" else components[name]
+                    budget = self.total_budget if name == "total" else self.budgets[name]
+                    print(f"Memory budget exceeded: {name} uses {used / 2 ** 20:.1f} MB of {budget / 2 ** 20:.1f} MB")
+            self._over_budget = set(over)
+        return {
+            "components": components,
+            "accounted_bytes": sum(components.values()),
+            "rss_bytes": rss,
+            "budgets": dict(self.budgets, total=self.total_budget) if self.total_budget else dict(self.budgets),
+            "over_budget": over,
+        }
+
+    def start_monitor(self, interval: float = 60.0) -> "MemoryAccountant":
+        """Check the budgets every `interval` seconds in a daemon thread."""
+        def monitor():
+            while True:
+                time.sleep(interval)
+                self.report()
+
+        threading.Thread(target=monitor, name="memory-monitor", daemon=True).start()
+        return self
@@ -0,0 +1,207 @@
+"""
+Local mock of the OpenAI API for GovFlowAI load tests
+
+Serves /v1/chat/completions (plain and streaming) and /v1/embeddings with
+configurable latency and deterministic output, so a replay (see
+chatbot.replay) measures our own capacity instead of the provider's and
+costs nothing. Point the server under test at it with:
+
+    python -m chatbot.mock_llm --port 8765
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8765/v1 \\
+        OPENAI_API_BASE=http://127.0.0.1:8765/v1 python manage.py runserver
+
+Embeddings are pseudo-random unit vectors seeded by the text, so an index
+built against the mock is internally consistent.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+def mock_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'big')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+def mock_answer_words(messages: List[Dict[str, Any]], max_tokens: int, answer_tokens: int) -> List[str]:
+    question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    words = f"This is a mock answer to: {question}".split()
+    count = min(max_tokens, answer_tokens)
+    return [words[i % len(words)] for i in range(count)]
+
+
+class MockLLMServer:
+    """
+    Minimal HTTP/1.1 server implementing the OpenAI endpoints the app uses.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, first_token_ms: float = 300.0,
+                 token_ms: float = 15.0, embedding_ms: float = 40.0, answer_tokens: int = 120, jitter: float = 0.2):
+        """
+        Initialize the server.
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on
+            first_token_ms: Latency before the first completion token
+            token_ms: Latency per further completion token
+            embedding_ms: Latency per embeddings request
+            answer_tokens: Tokens per answer (capped by the request's max_tokens)
+            jitter: Relative random variation applied to every latency
+        """
+        self.host = host
+        self.port = port
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.embedding_ms = embedding_ms
+        self.answer_tokens = answer_tokens
+        self.jitter = jitter
+        self.stats = {"completions": 0, "streams": 0, "embeddings": 0, "embedded_texts": 0}
+        self._server = None
+
+    def _delay(self, ms: float) -> float:
+        return max(0.0, ms * (1 + random.uniform(-self.jitter, self.jitter))) / 1000.0
+
+    async def start(self) -> "MockLLMServer":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"Mock LLM listening on http://{self.host}:{self.port}/v1")
+        return self
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._dispatch(method, path.split('?')[0], body, writer)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            await self._send_json(writer, 400, {"error": {"message": "Invalid JSON"}})
+            return
+        if method == 'POST' and path.endswith('/chat/completions'):
+            if payload.get("stream"):
+                await self._stream_completion(payload, writer)
+            else:
+                await self._completion(payload, writer)
+        elif method == 'POST' and path.endswith('/embeddings'):
+            await self._embeddings(payload, writer)
+        else:
+            await self._send_json(writer, 404, {"error": {"message": f"No mock for {method} {path}"}})
+
+    async def _completion(self, payload: Dict[str, Any], writer: asyncio.StreamWriter) -> None:
+        words = mock_answer_words(payload.get("messages", []), payload.get("max_tokens") or 4096, self.answer_tokens)
+        await asyncio.sleep(self._delay(self.first_token_ms) + self._delay(self.token_ms) * max(0, len(words) - 1))
+        self.stats["completions"] += 1
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in payload.get("messages", []))
+        await self._send_json(writer, 200, {
+            "id": f"chatcmpl-mock-{self.stats['completions']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+        })
+
+    async def _stream_completion(self, payload: Dict[str, Any], writer: asyncio.StreamWriter) -> None:
+        words = mock_answer_words(payload.get("messages", []), payload.get("max_tokens") or 4096, self.answer_tokens)
+        self.stats["streams"] += 1
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await asyncio.sleep(self._delay(self.first_token_ms))
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-mock-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else f" {word}"}, "finish_reason": None}],
+            }
+            self._write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            await writer.drain()
+            await asyncio.sleep(self._delay(self.token_ms))
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        self._write_chunk(writer, b"")
+        await writer.drain()
+
+    async def _embeddings(self, payload: Dict[str, Any], writer: asyncio.StreamWriter) -> None:
+        texts = payload.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        await asyncio.sleep(self._delay(self.embedding_ms))
+        self.stats["embeddings"] += 1
+        self.stats["embedded_texts"] += len(texts)
+        # The client may send token ids instead of text; hash their repr
+        data = [{"object": "embedding", "index": i, "embedding": mock_embedding(text if isinstance(text, str) else repr(text))}
+                for i, text in enumerate(texts)]
+        await self._send_json(writer, 200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "mock"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+    @staticmethod
+    async def _send_json(writer: asyncio.StreamWriter, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode('utf-8')
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "OK")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+        await writer.drain()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a local mock of the OpenAI API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--first-token-ms', type=float, default=300.0)
+    parser.add_argument('--token-ms', type=float, default=15.0)
+    parser.add_argument('--embedding-ms', type=float, default=40.0)
+    parser.add_argument('--answer-tokens', type=int, default=120)
+    args = parser.parse_args()
+    server = MockLLMServer(args.host, args.port, args.first_token_ms, args.token_ms, args.embedding_ms, args.answer_tokens)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
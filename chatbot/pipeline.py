@@ -0,0 +1,366 @@
+"""
+Staged chat pipeline executor for GovFlowAI
+
+A chat turn is a handful of steps (intent detection, form extraction,
+loading the prompt, retrieval, generation) that used to run one after
+another, in slightly different copies per entry point. Pipeline runs them
+from a declarative list of stages instead:
+1. Each Stage names the stages it depends on; stages whose dependencies are
+   done start together on a thread pool, so e.g. form extraction runs while
+   the query is embedded and searched
+2. Each Stage has its own timeout (capped by the request deadline) and an
+   optional fallback used when it fails or times out
+3. A Stage can be skipped with a `when` predicate, or run inline in the
+   caller's thread when it is too cheap to be worth a thread hop
+
+Stage functions receive a dict with the pipeline inputs and the results of
+every finished stage, keyed by stage name. Stages run on the pool also get a
+"cancelled" Event, set when the run stops waiting for them (a timeout, or
+another stage's error), so a stage that produces side effects as it goes,
+such as streaming tokens, can stop.
+"""
+
+import contextvars
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .admission import current_deadline
+from .profiling import profiled_thread
+
+_NO_FALLBACK = object()
+
+
+class StageTimeout(TimeoutError):
+    """Raised when a stage without a fallback runs out of time."""
+
+
+class Stage:
+    """One step of a pipeline."""
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 timeout: Optional[float] = None, fallback: Any = _NO_FALLBACK,
+                 fallback_on: Tuple[type, ...] = (Exception,),
+                 when: Optional[Callable[[Dict[str, Any]], bool]] = None, inline: bool = False):
+        """
+        Define a stage.
+
+        Args:
+            name: Key the stage's result is stored under
+            fn: Called with the inputs and finished results; returns the result
+            deps: Names of the stages that must finish first
+            timeout: Seconds the stage may take, capped by the request deadline
+            fallback: Result used when the stage fails or times out, or a
+                callable taking (results, exception) that returns it
+            fallback_on: Exception types the fallback covers; others propagate
+            when: Predicate on the results; the stage is skipped (result None) if False
+            inline: Run in the caller's thread (for trivial stages; no timeout)
+        """
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.fallback_on = fallback_on
+        self.when = when
+        self.inline = inline
+
+    def recover(self, values: Dict[str, Any], error: BaseException) -> Any:
+        """Return the fallback result for an error, or re-raise it."""
+        if self.fallback is _NO_FALLBACK or not isinstance(error, self.fallback_on):
+            raise error
+        if callable(self.fallback):
+            return self.fallback(values, error)
+        return self.fallback
+
+
+class PipelineResult:
+    """Results of one pipeline run, with per-stage timings."""
+
+    def __init__(self, values: Dict[str, Any], timings: Dict[str, float], fallbacks: List[str], skipped: List[str], total_ms: float):
+        self.values = values
+        self.timings = timings
+        self.fallbacks = fallbacks
+        self.skipped = skipped
+        self.total_ms = total_ms
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.values.get(name, default)
+
+    @property
+    def serial_ms(self) -> float:
+        """What the run would have taken with the stages one after another."""
+        return sum(self.timings.values())
+
+
+class Pipeline:
+    """
+    Run a set of stages in dependency order, independent stages concurrently.
+    """
+
+    def __init__(self, stages: List[Stage], max_workers: int = 16, name: str = "pipeline"):
+        """
+        Initialize the pipeline.
+
+        Args:
+            stages: Stages in any order; dependencies must form a DAG
+            max_workers: Threads shared by every run of this pipeline
+            name: Prefix of the worker thread names
+        """
+        self.stages = stages
+        self._by_name = {stage.name: stage for stage in stages}
+        if len(self._by_name) != len(stages):
+            raise ValueError("Stage names must be unique")
+        self._check_graph()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._errors = 0
+        self._total_ms = 0.0
+        self._serial_ms = 0.0
+        self._fallbacks: Counter = Counter()
+        self._timeouts: Counter = Counter()
+
+    def _check_graph(self) -> None:
+        """Reject unknown dependencies and cycles."""
+        for stage in self.stages:
+            unknown = [dep for dep in stage.deps if dep not in self._by_name]
+            if unknown:
+                raise ValueError(f"Stage {stage.name!r} depends on unknown stages: {unknown}")
+        resolved = set()
+        remaining = list(self.stages)
+        while remaining:
+            ready = [stage for stage in remaining if all(dep in resolved for dep in stage.deps)]
+            if not ready:
+                raise ValueError(f"Stage dependencies form a cycle: {[stage.name for stage in remaining]}")
+            resolved.update(stage.name for stage in ready)
+            remaining = [stage for stage in remaining if stage.name not in resolved]
+
+    def _timeout(self, stage: Stage) -> Optional[float]:
+        timeout = stage.timeout
+        deadline = current_deadline()
+        if deadline is not None:
+            remaining = deadline.remaining()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    @staticmethod
+    def _call(stage: Stage, values: Dict[str, Any], timings: Dict[str, float]) -> Any:
+        started_at = time.monotonic()
+        try:
+            with profiled_thread():
+                return stage.fn(values)
+        finally:
+            timings[stage.name] = (time.monotonic() - started_at) * 1000.0
+
+    def run(self, inputs: Dict[str, Any]) -> PipelineResult:
+        """
+        Run every stage once.
+
+        Args:
+            inputs: Values available to every stage (e.g. message, location)
+
+        Returns:
+            PipelineResult with each stage's result
+
+        Raises:
+            StageTimeout: A stage without a fallback ran out of time
+            Exception: Whatever a stage without a (matching) fallback raised
+        """
+        started_at = time.monotonic()
+        values = dict(inputs)
+        timings: Dict[str, float] = {}
+        fallbacks: List[str] = []
+        skipped: List[str] = []
+        finished = set()
+        pending = list(self.stages)
+        running = {}
+        try:
+            while pending or running:
+                # Start (or skip, or run inline) everything whose dependencies are done
+                progress = True
+                while progress:
+                    progress = False
+                    for stage in list(pending):
+                        if not all(dep in finished for dep in stage.deps):
+                            continue
+                        pending.remove(stage)
+                        progress = True
+                        if stage.when is not None and not stage.when(values):
+                            values[stage.name] = None
+                            skipped.append(stage.name)
+                        elif stage.inline:
+                            try:
+                                values[stage.name] = self._call(stage, dict(values), timings)
+                            except Exception as e:
+                                values[stage.name] = stage.recover(values, e)
+                                fallbacks.append(stage.name)
+                        else:
+                            timeout = self._timeout(stage)
+                            expires_at = None if timeout is None else time.monotonic() + timeout
+                            # Each stage runs in a copy of the caller's context, so the
+                            # request deadline reaches the clients it calls
+                            cancelled = threading.Event()
+                            future = self._executor.submit(contextvars.copy_context().run, self._call, stage,
+                                                           dict(values, cancelled=cancelled), timings)
+                            running[future] = (stage, expires_at, cancelled)
+                            continue
+                        finished.add(stage.name)
+
+                if not running:
+                    break
+
+                expiries = [expires_at for _, expires_at, _ in running.values() if expires_at is not None]
+                wait_for = max(0.0, min(expiries) - time.monotonic()) if expiries else None
+                done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, _, _ = running.pop(future)
+                    try:
+                        values[stage.name] = future.result()
+                    except Exception as e:
+                        values[stage.name] = stage.recover(values, e)
+                        fallbacks.append(stage.name)
+                    finished.add(stage.name)
+
+                now = time.monotonic()
+                for future, (stage, expires_at, cancelled) in list(running.items()):
+                    if expires_at is None or now < expires_at:
+                        continue
+                    # The thread can't be stopped; it is told to, and its result is ignored
+                    running.pop(future)
+                    cancelled.set()
+                    future.cancel()
+                    with self._lock:
+                        self._timeouts[stage.name] += 1
+                    timings.setdefault(stage.name, (now - started_at) * 1000.0)
+                    values[stage.name] = stage.recover(values, StageTimeout(f"Stage {stage.name!r} timed out"))
+                    fallbacks.append(stage.name)
+                    finished.add(stage.name)
+        except BaseException:
+            for future, (_, _, cancelled) in running.items():
+                cancelled.set()
+                future.cancel()
+            with self._lock:
+                self._errors += 1
+            raise
+
+        result = PipelineResult(values, dict(timings), fallbacks, skipped, (time.monotonic() - started_at) * 1000.0)
+        with self._lock:
+            self._runs += 1
+            self._total_ms += result.total_ms
+            self._serial_ms += result.serial_ms
+            self._fallbacks.update(fallbacks)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Run counts, mean wall-clock vs. serial-sum latency, fallbacks and timeouts per stage."""
+        with self._lock:
+            runs = self._runs
+            return {
+                "runs": runs,
+                "errors": self._errors,
+                "mean_total_ms": self._total_ms / runs if runs else 0.0,
+                "mean_serial_ms": self._serial_ms / runs if runs else 0.0,
+                "fallbacks": dict(self._fallbacks),
+                "timeouts": dict(self._timeouts),
+            }
+
+
+def rag_stages(get_rag_system: Callable[[], Any], mode: str = "llm",
+               retrieval_deps: Iterable[str] = (), generation_deps: Iterable[str] = (),
+               when: Optional[Callable[[Dict[str, Any]], bool]] = None,
+               retrieval_timeout: Optional[float] = None, generation_timeout: Optional[float] = None,
+               generate: Optional[Callable[[Dict[str, Any], Callable[[], Any]], Any]] = None,
+               conversation: Optional[Callable[[], Any]] = None) -> List[Stage]:
+    """
+    The retrieval and generation stages shared by every chat entry point.
+
+    Expects the inputs "message" and "location" and a "system_prompt" value
+    (an input, or a stage listed in generation_deps). Optional "intent", "form_intent" and
+    "conversation_depth" values steer model routing, and a "prefetched"
+    value of scored chunks is used instead of searching. An "emit" input
+    streams the answer: emit() is called with the "sources" and "token"
+    messages of RAGSystem.stream_with_context() as they are produced. With
+    a conversation memory, a "client_id" input and a "followup" value (its classify()
+    result), follow-ups reuse or extend the previous turn's context. The "retrieval" result
+    is (route, documents); "generation" is (response text, sources). If
+    generation fails or times out, the answer is extracted from the
+    retrieved documents instead.
+
+    Args:
+        get_rag_system: Returns the RAGSystem to use
+        mode: Answer mode used unless the values carry a "mode"
+        retrieval_deps: Extra stages retrieval waits for (e.g. intent detection)
+        generation_deps: Extra stages generation waits for (e.g. the system prompt)
+        when: Predicate that skips both stages when False
+        retrieval_timeout: Seconds allowed for embedding and search
+        generation_timeout: Seconds allowed for the completion
+        generate: Optional wrapper called with (values, answer) that must
+            call answer() and return its result, e.g. to add admission
+            control or request coalescing around the completion
+        conversation: Returns the ConversationMemory that keeps each
+            client's retrieval context between turns
+    """
+    def retrieve(values):
+        rag_system = get_rag_system()
+        scored = values.get("prefetched")
+        followup = values.get("followup")
+        if conversation is not None and values.get("client_id"):
+            scored = conversation().retrieve(
+                rag_system, values["client_id"], values["message"], values["location"],
+                followup=followup, scored=scored
+            )
+        return rag_system.prepare_context(
+            values["message"],
+            location=values["location"],
+            intent=values.get("intent"),
+            form_intent=bool(values.get("form_intent")),
+            conversation_depth=values.get("conversation_depth", 0),
+            scored=scored,
+            # Follow-ups answered from the session's context rerank only that context
+            widen=not followup or followup[0] not in ("continue", "extend")
+        )
+
+    def answer_with_context(values):
+        route, docs = values["retrieval"]
+        emit = values.get("emit")
+        if emit is None:
+            return get_rag_system().answer_with_context(
+                values["message"], values["system_prompt"], values["location"], route, docs, mode=values.get("mode", mode)
+            )
+        output, sources = [], []
+        cancelled = values.get("cancelled")
+        for message in get_rag_system().stream_with_context(
+                values["message"], values["system_prompt"], values["location"], route, docs, mode=values.get("mode", mode)):
+            if cancelled is not None and cancelled.is_set():
+                # The stage timed out and the fallback answer has been sent instead
+                break
+            if message["type"] == "sources":
+                sources = message["sources"]
+            else:
+                output.append(message["content"])
+            emit(message)
+        return "".join(output), sources
+
+    def run_generation(values):
+        if generate is None:
+            return answer_with_context(values)
+        return generate(values, lambda: answer_with_context(values))
+
+    def extractive_fallback(values, error):
+        print(f"Generation stage fell back to an extractive answer ({type(error).__name__}: {error})")
+        _, docs = values["retrieval"]
+        text, sources, _ = get_rag_system().extractive.answer(values["message"], docs)
+        return text, sources
+
+    return [
+        Stage("retrieval", retrieve, deps=retrieval_deps, timeout=retrieval_timeout, when=when),
+        Stage("generation", run_generation, deps=("retrieval",) + tuple(generation_deps), timeout=generation_timeout,
+              fallback=extractive_fallback, fallback_on=(TimeoutError,), when=when),
+    ]
@@ -0,0 +1,205 @@
+"""
+Speculative retrieval prefetch for GovFlowAI
+
+The chat frontends send the partial query while the user is still typing
+(debounced). Prefetcher embeds and searches it in the background and keeps
+the scored chunks for that client. When the final message arrives and its
+text is close enough to a prefetched one, the chat pipeline routes and
+answers from those chunks, taking embedding and search off the critical path.
+
+Prefetching is strictly best effort and must never add load under pressure:
+1. Per-client and global token buckets; over the limit the request is refused
+2. A small bounded worker pool; when it is full the prefetch is dropped
+3. Results expire quickly and never survive an index swap
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .memory import sampled_sizeof
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_query(text: str) -> str:
+    """Lower-case text with punctuation and repeated whitespace collapsed."""
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class _Entry:
+    __slots__ = ("query", "location", "generation", "scored", "created_at")
+
+    def __init__(self, query: str, location: str, generation: int, scored, created_at: float):
+        self.query = query
+        self.location = location
+        self.generation = generation
+        self.scored = scored
+        self.created_at = created_at
+
+
+class Prefetcher:
+    """
+    Rate-limited background retrieval for partial queries, keyed by client.
+    """
+
+    def __init__(self, get_rag_system: Callable[[], Any], client_rate: float = 2.0, client_burst: float = 4.0,
+                 global_rate: float = 20.0, max_workers: int = 2, max_pending: int = 4,
+                 ttl: float = 60.0, min_chars: int = 12, similarity: float = 0.8,
+                 entries_per_client: int = 3, max_clients: int = 10000):
+        """
+        Initialize the prefetcher.
+
+        Args:
+            get_rag_system: Returns the RAGSystem to search with
+            client_rate: Prefetches per second allowed per client
+            client_burst: Prefetches a client may send back to back
+            global_rate: Prefetches per second allowed across all clients
+            max_workers: Threads running prefetches
+            max_pending: Prefetches queued or running before new ones are dropped
+            ttl: Seconds a prefetched result stays usable
+            min_chars: Shortest partial query worth prefetching
+            similarity: Lowest text similarity (0-1) at which a final query
+                reuses a prefetched result
+            entries_per_client: Recent prefetches kept per client
+            max_clients: Clients tracked before the least recent are forgotten
+        """
+        self.get_rag_system = get_rag_system
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.min_chars = min_chars
+        self.similarity = similarity
+        self.entries_per_client = entries_per_client
+        self.max_clients = max_clients
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._entries: "OrderedDict[str, List[_Entry]]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.stats = {"requests": 0, "accepted": 0, "rate_limited": 0, "dropped_busy": 0,
+                      "too_short": 0, "errors": 0, "hits": 0, "misses": 0}
+
+    def _allow(self, rate_key: str) -> bool:
+        """Take a token from the client's bucket and the global one (lock held)."""
+        bucket = self._buckets.get(rate_key)
+        if bucket is None:
+            bucket = self._buckets[rate_key] = TokenBucket(self.client_rate, self.client_burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(rate_key)
+        return bucket.take() and self._global_bucket.take()
+
+    def submit(self, client_id: str, partial_query: str, location: str, rate_key: Optional[str] = None) -> str:
+        """
+        Start a prefetch for a partial query.
+
+        Args:
+            client_id: Identifies the chat session the final query will come from
+            partial_query: Text typed so far
+            location: User's location
+            rate_key: Key the per-client rate limit applies to (e.g. the
+                remote address); defaults to client_id
+
+        Returns:
+            "accepted", "rate_limited", "busy" or "too_short"
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            if len(normalize_query(partial_query)) < self.min_chars:
+                self.stats["too_short"] += 1
+                return "too_short"
+            if not self._allow(rate_key or client_id):
+                self.stats["rate_limited"] += 1
+                return "rate_limited"
+            if self._pending >= self.max_pending:
+                self.stats["dropped_busy"] += 1
+                return "busy"
+            self._pending += 1
+            self.stats["accepted"] += 1
+        self._executor.submit(self._run, client_id, partial_query, location)
+        return "accepted"
+
+    def _run(self, client_id: str, partial_query: str, location: str) -> None:
+        try:
+            rag_system = self.get_rag_system()
+            generation = rag_system.generation
+            scored = rag_system.retrieve_scored(partial_query, top_k=rag_system.router.max_top_k, location=location)
+            entry = _Entry(normalize_query(partial_query), location, generation, scored, time.monotonic())
+            with self._lock:
+                entries = self._entries.pop(client_id, [])
+                entries.append(entry)
+                self._entries[client_id] = entries[-self.entries_per_client:]
+                if len(self._entries) > self.max_clients:
+                    self._entries.popitem(last=False)
+        except Exception as e:
+            print(f"Prefetch failed ({type(e).__name__}: {e})")
+            with self._lock:
+                self.stats["errors"] += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def lookup(self, client_id: Optional[str], query: str, location: str, generation: int) -> Optional[List[Tuple[Any, float]]]:
+        """
+        Return the prefetched (document, distance) pairs for a final query,
+        or None if nothing close enough, fresh enough and from the current
+        index generation was prefetched for this client.
+        """
+        if not client_id:
+            return None
+        normalized = normalize_query(query)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.get(client_id, [])
+            best, best_ratio = None, 0.0
+            for entry in entries:
+                if entry.location != location or entry.generation != generation or now - entry.created_at > self.ttl:
+                    continue
+                ratio = 1.0 if entry.query == normalized else SequenceMatcher(None, entry.query, normalized).ratio()
+                if ratio > best_ratio:
+                    best, best_ratio = entry, ratio
+            if best is not None and best_ratio >= self.similarity:
+                self.stats["hits"] += 1
+                return best.scored
+            self.stats["misses"] += 1
+        return None
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes of per-client state: prefetched chunks and rate-limit buckets."""
+        with self._lock:
+            clients, buckets = len(self._entries), len(self._buckets)
+            entries = list(islice(self._entries.items(), 32))
+            bucket_sample = list(islice(self._buckets.items(), 32))
+        return {"prefetch_sessions": sampled_sizeof(entries, clients) + sampled_sizeof(bucket_sample, buckets)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, pending=self._pending, clients=len(self._entries))
@@ -0,0 +1,254 @@
+"""
+On-demand sampling profiler for individual GovFlowAI chat requests
+
+When one request is slow, the per-stage timings say which stage, not
+whether the time went to regex extraction, HTML parsing, FAISS or the LLM
+client. RequestProfiler answers that for chosen requests:
+1. A request is profiled when it carries the admin token in the
+   X-Profile-Token header, or at random with PROFILE_SAMPLE_RATE
+2. While profiled, one shared sampler thread reads the stacks of the
+   request's thread and of the pipeline threads running its stages every
+   few milliseconds (sys._current_frames, no tracing hooks)
+3. Profiles are kept in a bounded in-memory store keyed by request id and
+   exported as collapsed stacks (flamegraph.pl, speedscope) or speedscope
+   JSON
+
+Unprofiled requests pay one header lookup and a context variable read per
+stage; no sampler thread runs while nothing is being profiled.
+"""
+
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .memory import deep_sizeof
+
+MAX_STACK_DEPTH = 128
+
+_active_profile: contextvars.ContextVar = contextvars.ContextVar("active_profile", default=None)
+
+
+def _frame_name(code) -> str:
+    filename = os.path.join(*code.co_filename.split(os.sep)[-2:]) if code.co_filename else "?"
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> Tuple[str, ...]:
+    """Function names from the outermost frame to the innermost."""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
+
+
+class Profile:
+    """Aggregated stack samples of one request, per thread."""
+
+    def __init__(self, request_id: str, interval: float, meta: Optional[Dict[str, Any]] = None):
+        self.request_id = request_id
+        self.interval = interval
+        self.meta = dict(meta or {})
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        self.samples: Counter = Counter()
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def add_thread(self, thread: threading.Thread) -> bool:
+        """Start sampling thread; False if it already was."""
+        with self._lock:
+            if thread.ident in self._threads:
+                return False
+            self._threads[thread.ident] = thread.name
+            return True
+
+    def remove_thread(self, thread: threading.Thread) -> None:
+        with self._lock:
+            self._threads.pop(thread.ident, None)
+
+    def sample(self, frames: Dict[int, Any]) -> None:
+        with self._lock:
+            for ident, thread_name in self._threads.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[(thread_name,) + _stack(frame)] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return dict(self.meta, request_id=self.request_id, started_at=self.started_at,
+                    duration_ms=round(self.duration_ms, 2), samples=sum(self.samples.values()),
+                    interval_ms=self.interval * 1000.0)
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed-stack format, thread name as the root frame."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self) -> Dict[str, Any]:
+        """A speedscope file with one sampled profile per thread."""
+        frames: List[Dict[str, str]] = []
+        frame_index: Dict[str, int] = {}
+        by_thread: Dict[str, List[Tuple[List[int], int]]] = {}
+        for stack, count in self.samples.items():
+            indexes = []
+            for name in stack[1:]:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indexes.append(frame_index[name])
+            by_thread.setdefault(stack[0], []).append((indexes, count))
+
+        interval_ms = self.interval * 1000.0
+        profiles = []
+        for thread_name, stacks in by_thread.items():
+            weights = [count * interval_ms for _, count in stacks]
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": [indexes for indexes, _ in stacks],
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"chat request {self.request_id}",
+            "exporter": "govflowai",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+class _Sampler:
+    """One background thread sampling every active profile; runs only while there are any."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles: List[Profile] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: Profile) -> None:
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+
+
+class RequestProfiler:
+    """
+    Decide which requests to profile, profile them and keep the results.
+    """
+
+    def __init__(self, admin_token: str = '', sample_rate: float = 0.0,
+                 interval: float = 0.005, max_profiles: int = 50):
+        """
+        Initialize the profiler.
+
+        Args:
+            admin_token: Value of the X-Profile-Token header that forces
+                profiling and unlocks the profile endpoints; empty disables both
+            sample_rate: Fraction (0-1) of requests profiled at random
+            interval: Seconds between stack samples
+            max_profiles: Profiles kept before the oldest are dropped
+        """
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self._sampler = _Sampler(interval)
+        self._profiles: "OrderedDict[str, Profile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        return bool(self.admin_token) and bool(token) and hmac.compare_digest(token.encode('utf-8'), self.admin_token.encode('utf-8'))
+
+    def should_profile(self, token: Optional[str]) -> bool:
+        if token and self.is_admin(token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, **meta: Any) -> Iterator[Profile]:
+        """Sample the calling thread, and the pipeline stages it runs, for the duration of the block."""
+        profile = Profile(uuid.uuid4().hex[:12], self.interval, meta)
+        profile.add_thread(threading.current_thread())
+        token = _active_profile.set(profile)
+        started = time.monotonic()
+        self._sampler.add(profile)
+        try:
+            yield profile
+        finally:
+            self._sampler.remove(profile)
+            _active_profile.reset(token)
+            profile.duration_ms = (time.monotonic() - started) * 1000.0
+            with self._lock:
+                self._profiles[profile.request_id] = profile
+                while len(self._profiles) > self.max_profiles:
+                    self._profiles.popitem(last=False)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Summaries of the stored profiles, newest first."""
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [profile.summary() for profile in reversed(profiles)]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by the stored profiles."""
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return {"profiles": sum(deep_sizeof(profile.samples) for profile in profiles)}
+
+    def get(self, request_id: str) -> Optional[Profile]:
+        with self._lock:
+            return self._profiles.get(request_id)
+
+
+@contextmanager
+def profiled_thread() -> Iterator[None]:
+    """
+    Include the current thread in the active profile, if any, for the
+    duration of the block. Worker threads call this around work they do on
+    behalf of a request (the context must have been copied from it).
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        yield
+        return
+    thread = threading.current_thread()
+    if not profile.add_thread(thread):
+        # Already sampled, e.g. an inline stage on the request thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.remove_thread(thread)
@@ -9,7 +9,8 @@ This module provides functionality to:
 
 import os
 import glob
-from typing import List, Dict, Any, Tuple
+import time
+from typing import List, Dict, Any, Tuple, Iterator, Optional
 import markdown
 from bs4 import BeautifulSoup
 import numpy as np
@@ -19,22 +20,52 @@ import faiss
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 
+from .admission import current_deadline
+from .chunk_store import build_compact_store, load_compact_store, save_compact_store
+from .dedup import deduplicate_documents
+from .embedding_batcher import EmbeddingDispatcher
+from .extractive import ExtractiveAnswerer
+from .geodata import CATEGORY_KINDS
+from .jurisdictions import JurisdictionIndexRegistry
+from .memory import sampled_sizeof
+from .routing import ModelRouter, Route, count_tokens, route_features, token_usage
+
+# Distances from a jurisdiction layer are scaled by this factor when merged
+# with statewide results, so local guidance wins close calls.
+LOCAL_LAYER_DISTANCE_FACTOR = 0.9
+
+# In mode="auto", extractive answers at least this confident skip the LLM
+EXTRACTIVE_CONFIDENCE_THRESHOLD = 0.75
+
+ANSWER_MODES = ("llm", "extractive", "auto")
+
+
+def flat_index_vectors(index) -> np.ndarray:
+    """The vectors of a flat index as an (ntotal, d) array, without copying them where faiss allows."""
+    if hasattr(index, "get_xb"):
+        return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+    return index.reconstruct_n(0, index.ntotal)
+
+
 class RAGSystem:
-    def __init__(self, knowledge_base_dir: str, openai_api_key: str):
+    def __init__(self, knowledge_base_dir: str, openai_api_key: str, shard: Optional[Tuple[int, int]] = None):
         """
         Initialize the RAG system.
         
         Args:
             knowledge_base_dir: Directory containing knowledge base documents
             openai_api_key: OpenAI API key for embeddings and completions
+            shard: Optional (shard_index, shard_count); only every
+                shard_count-th knowledge base file is indexed
         """
         self.knowledge_base_dir = knowledge_base_dir
+        self.shard = shard
         self.openai_api_key = openai_api_key
-        self.embeddings = OpenAIEmbeddings(api_key=openai_api_key)
+        # Concurrent query embeddings are coalesced into batched requests
+        self.embeddings = EmbeddingDispatcher(OpenAIEmbeddings(api_key=openai_api_key))
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
@@ -42,6 +73,24 @@ class RAGSystem:
         )
         self.vector_store = None
         self.indexed_docs = []
+        self.dedup_stats = None
+        # Remote retriever (e.g. a retrieval sidecar client) used instead of the local index
+        self.retriever = None
+        self.extractive = ExtractiveAnswerer()
+        # Picks the model, output limit and context budget per request
+        self.router = ModelRouter()
+        # OfficeLocator whose nearest offices to the user are added to prompts
+        self.offices = None
+        # Reranker that rescores a wider candidate set before the route's budget is applied
+        self.reranker = None
+        # Incremented every time a new index is swapped in
+        self.generation = 0
+        # City and county layers searched alongside the statewide index
+        self.jurisdictions = JurisdictionIndexRegistry(
+            jurisdictions_dir=os.path.join(knowledge_base_dir, "jurisdictions"),
+            embeddings=self.embeddings,
+            process_document=self._process_document
+        )
         
     def _read_markdown_file(self, file_path: str) -> str:
         """Read and parse a markdown file."""
@@ -90,43 +139,273 @@ class RAGSystem:
     
     def build_index(self) -> None:
         """Build the vector index from all documents in the knowledge base."""
+        vector_store, indexed_docs, dedup_stats = self.build_vector_store()
+        if vector_store:
+            self.swap_index(vector_store, indexed_docs, dedup_stats)
+    
+    def build_vector_store(self) -> Tuple[Any, List[str], Dict[str, Any]]:
+        """
+        Build a new vector store from the knowledge base without installing it.
+        
+        Returns:
+            Tuple of (vector store or None, indexed file names, dedup stats)
+        """
         all_documents = []
+        indexed_docs = []
         
         # Find all markdown files
-        md_files = glob.glob(os.path.join(self.knowledge_base_dir, "*.md"))
+        md_files = sorted(glob.glob(os.path.join(self.knowledge_base_dir, "*.md")))
+        if self.shard:
+            shard_index, shard_count = self.shard
+            md_files = md_files[shard_index::shard_count]
         
         for file_path in md_files:
             documents = self._process_document(file_path)
             all_documents.extend(documents)
-            self.indexed_docs.append(os.path.basename(file_path))
+            indexed_docs.append(os.path.basename(file_path))
         
         # Create vector store
-        if all_documents:
-            self.vector_store = FAISS.from_documents(all_documents, self.embeddings)
-            print(f"Indexed {len(all_documents)} chunks from {len(md_files)} documents")
-        else:
+        if not all_documents:
             print("No documents found to index")
+            return None, indexed_docs, None
+        
+        # Collapse repeated boilerplate before paying to embed it
+        all_documents, dedup_stats = deduplicate_documents(all_documents)
+        vector_store = build_compact_store(all_documents, self.embeddings)
+        print(f"Indexed {len(all_documents)} chunks from {len(md_files)} documents "
+              f"({dedup_stats['duplicates_removed']} near-duplicates removed, "
+              f"{dedup_stats['reduction']:.1%} smaller)")
+        return vector_store, indexed_docs, dedup_stats
     
-    def retrieve_context(self, query: str, top_k: int = 5) -> List[Document]:
+    def swap_index(self, vector_store, indexed_docs: Optional[List[str]] = None, dedup_stats: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Atomically replace the live index with a new generation.
+        
+        Requests already running keep the store they started with; the old
+        generation is freed once the last of them finishes.
+        """
+        self.vector_store = vector_store
+        self.indexed_docs = indexed_docs if indexed_docs is not None else []
+        self.dedup_stats = dedup_stats
+        self.generation += 1
+    
+    def save_index(self, directory: str) -> None:
+        """Save the statewide index and its chunk store to a directory."""
+        if self.vector_store:
+            save_compact_store(self.vector_store, directory)
+    
+    def load_index(self, directory: str, mmap: bool = True) -> None:
+        """
+        Load an index saved by save_index() instead of rebuilding it.
+        
+        Args:
+            directory: Directory written by save_index()
+            mmap: Memory-map the chunk arrays so processes share one copy
+        """
+        self.swap_index(load_compact_store(directory, self.embeddings, mmap=mmap))
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Approximate bytes held by the statewide index, its search cache, the
+        jurisdiction layers and the query vector cache.
+        """
+        usage = {"index_vectors": 0, "chunk_text": 0, "chunk_metadata": 0, "search_cache": 0}
+        vector_store = self.vector_store
+        if vector_store is not None:
+            usage["index_vectors"] = vector_store.index.ntotal * vector_store.index.d * 4
+            chunk_store = getattr(vector_store.docstore, "chunk_store", None)
+            if chunk_store is not None:
+                usage.update(chunk_store.memory_usage())
+            else:
+                documents = list(vector_store.docstore._dict.values())
+                usage["chunk_text"] = sum(len(doc.page_content.encode('utf-8')) for doc in documents)
+                usage["chunk_metadata"] = sampled_sizeof((doc.metadata for doc in documents), len(documents))
+            flat_cache = getattr(vector_store.index, "flat_cache", None)
+            if flat_cache is not None:
+                usage["search_cache"] = flat_cache[2].nbytes
+        usage["jurisdiction_indexes"] = self.jurisdictions.resident_bytes
+        usage.update(self.embeddings.memory_usage())
+        if self.reranker is not None:
+            usage.update(self.reranker.memory_usage())
+        return usage
+
+    @property
+    def candidate_count(self) -> int:
+        """First-stage chunks to retrieve per query: the largest route budget, or more for reranking."""
+        if self.reranker is not None:
+            return max(self.router.max_top_k, self.reranker.candidates)
+        return self.router.max_top_k
+
+    def retrieve_context(self, query: str, top_k: int = 5, location: Optional[str] = None) -> List[Document]:
         """
         Retrieve relevant context from the knowledge base.
         
         Args:
             query: User query
             top_k: Number of most relevant chunks to retrieve
+            location: User's location; when it matches a jurisdiction with its
+                own documents, that layer is searched and merged in as well
             
         Returns:
             List of relevant document chunks
         """
+        return [doc for doc, _ in self.retrieve_scored(query, top_k=top_k, location=location)]
+    
+    def retrieve_scored(self, query: str, top_k: int = 5, location: Optional[str] = None) -> List[Tuple[Document, float]]:
+        """
+        Retrieve relevant context along with each chunk's distance to the query.
+        
+        Args:
+            query: User query
+            top_k: Number of most relevant chunks to retrieve
+            location: User's location (see retrieve_context)
+            
+        Returns:
+            List of (document chunk, L2 distance) pairs, closest first.
+            Jurisdiction layer distances are scaled by LOCAL_LAYER_DISTANCE_FACTOR.
+        """
+        if self.retriever is not None:
+            return self.retriever.retrieve_scored(query, top_k=top_k, location=location)
+        
         if not self.vector_store:
             print("Vector store not initialized. Building index...")
             self.build_index()
+        # Pin one generation for the whole request in case of a hot swap
+        vector_store = self.vector_store
+        
+        local_store = None
+        if location:
+            jurisdiction = self.jurisdictions.resolve(location)
+            if jurisdiction:
+                local_store = self.jurisdictions.get(jurisdiction)
+        
+        if local_store is None:
+            if vector_store:
+                return vector_store.similarity_search_with_score(query, k=top_k)
+            return []
+        
+        # Embed once and search both layers with the same vector
+        query_vector = self.embeddings.embed_query(query)
+        scored = [
+            (score * LOCAL_LAYER_DISTANCE_FACTOR, doc)
+            for doc, score in local_store.similarity_search_with_score_by_vector(query_vector, k=top_k)
+        ]
+        if vector_store:
+            scored.extend(
+                (score, doc)
+                for doc, score in vector_store.similarity_search_with_score_by_vector(query_vector, k=top_k)
+            )
+        return self._merge_scored(scored, top_k)
+    
+    def _merge_scored(self, scored: List[Tuple[float, Document]], top_k: int) -> List[Tuple[Document, float]]:
+        """Pick the top_k closest chunks from several layers, skipping repeated text."""
+        merged = []
+        seen_text = set()
+        for score, doc in sorted(scored, key=lambda item: item[0]):
+            if doc.page_content in seen_text:
+                continue
+            seen_text.add(doc.page_content)
+            merged.append((doc, float(score)))
+            if len(merged) == top_k:
+                break
+        return merged
+    
+    def retrieve_context_batch(self, queries: List[str], top_k: int = 5) -> List[List[Document]]:
+        """
+        Retrieve relevant context for several queries at once.
+        
+        All queries are embedded in a single request and searched against the
+        index together, so the per-call overhead is paid once per batch rather
+        than once per query.
+        
+        Args:
+            queries: User queries
+            top_k: Number of most relevant chunks to retrieve per query
             
-        if self.vector_store:
-            relevant_docs = self.vector_store.similarity_search(query, k=top_k)
-            return relevant_docs
-        else:
+        Returns:
+            One list of relevant document chunks per query, in input order
+        """
+        return [
+            [doc for doc, _ in hits]
+            for hits in self.retrieve_scored_batch(queries, top_k)
+        ]
+    
+    def retrieve_scored_batch(self, queries: List[str], top_k: int = 5) -> List[List[Tuple[Document, float]]]:
+        """Like retrieve_context_batch, but each hit comes with its L2 distance."""
+        if not queries:
             return []
+        if self.retriever is not None:
+            return self.retriever.retrieve_scored_batch(queries, top_k)
+        
+        # One embedding request for the whole batch
+        query_vectors = np.asarray(self.embeddings.embed_documents(list(queries)), dtype=np.float32)
+        return self.search_by_vectors(query_vectors, top_k)
+    
+    def search_by_vectors(self, query_vectors: np.ndarray, top_k: int = 5) -> List[List[Tuple[Document, float]]]:
+        """
+        Search the statewide index with already-embedded queries.
+        
+        Args:
+            query_vectors: (n_queries x dim) float32 matrix
+            top_k: Number of most relevant chunks to retrieve per query
+            
+        Returns:
+            One list of (document, distance) pairs per query, closest first
+        """
+        if not self.vector_store:
+            print("Vector store not initialized. Building index...")
+            self.build_index()
+        vector_store = self.vector_store
+            
+        if not vector_store:
+            return [[] for _ in query_vectors]
+        
+        distances, indices = self._search_vectors(vector_store, query_vectors, top_k)
+        
+        results = []
+        for row_distances, row in zip(distances, indices):
+            hits = []
+            for distance, idx in zip(row_distances, row):
+                if idx < 0:
+                    continue
+                docstore_id = vector_store.index_to_docstore_id[int(idx)]
+                hits.append((vector_store.docstore.search(docstore_id), float(distance)))
+            results.append(hits)
+        return results
+    
+    def _search_vectors(self, vector_store, query_vectors: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Run one batched nearest-neighbour search for a matrix of query vectors."""
+        index = vector_store.index
+        k = min(top_k, index.ntotal)
+        if k <= 0:
+            empty = np.empty((len(query_vectors), 0))
+            return empty, empty.astype(np.int64)
+        
+        if not isinstance(index, faiss.IndexFlatL2):
+            return index.search(query_vectors, k)
+        
+        # Flat L2 index: ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2, so the whole
+        # batch reduces to a single matrix product against the stored vectors.
+        # The cache lives on the index itself, so it is freed with its generation
+        flat_cache = getattr(index, "flat_cache", None)
+        if flat_cache is None or flat_cache[0] != index.ntotal:
+            flat_vectors = flat_index_vectors(index)
+            flat_cache = (index.ntotal, flat_vectors, np.einsum('ij,ij->i', flat_vectors, flat_vectors))
+            index.flat_cache = flat_cache
+        _, flat_vectors, flat_norms = flat_cache
+        
+        query_norms = np.einsum('ij,ij->i', query_vectors, query_vectors)
+        distances = query_norms[:, None] - 2.0 * (query_vectors @ flat_vectors.T) + flat_norms[None, :]
+        
+        # Partial selection of the k best columns, then sort only those
+        if k < distances.shape[1]:
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+        candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+        order = np.argsort(candidate_distances, axis=1)
+        indices = np.take_along_axis(candidates, order, axis=1)
+        return np.take_along_axis(candidate_distances, order, axis=1), indices
     
     def format_context_for_prompt(self, docs: List[Document]) -> str:
         """Format retrieved documents into a context string for the prompt."""
@@ -141,21 +420,9 @@ class RAGSystem:
             
         return "\n\n".join(context_parts)
     
-    def generate_response(self, user_query: str, system_prompt: str, location: str) -> Tuple[str, List[Dict[str, str]]]:
-        """
-        Generate a response using RAG.
-        
-        Args:
-            user_query: User's question or request
-            system_prompt: System prompt for the LLM
-            location: User's location
-            
-        Returns:
-            Tuple of (response text, sources list)
-        """
-        # Retrieve relevant context
-        relevant_docs = self.retrieve_context(user_query)
-        context_text = self.format_context_for_prompt(relevant_docs)
+    def build_rag_prompt(self, system_prompt: str, docs: List[Document], location: str) -> str:
+        """Combine the system prompt, retrieved context and user location."""
+        context_text = self.format_context_for_prompt(docs)
         
         # Create the augmented prompt with retrieved context
         if context_text:
@@ -170,14 +437,48 @@ Use this information to provide accurate, well-informed responses. Always cite y
         else:
             rag_system_prompt = system_prompt
             
-        # Add location to the system message
+        # Add location to the system message, with the nearest offices for the topics retrieved
         rag_system_prompt = f"{rag_system_prompt}\n\nCurrent user location: {location}"
+        if self.offices is not None:
+            kinds = sorted({CATEGORY_KINDS[doc.metadata["category"]] for doc in docs
+                            if doc.metadata.get("category") in CATEGORY_KINDS})
+            nearby = self.offices.context_block(location, kinds)
+            if nearby:
+                rag_system_prompt = f"{rag_system_prompt}\n\n{nearby}"
+        return rag_system_prompt
+    
+    def extract_sources(self, docs: List[Document]) -> List[Dict[str, str]]:
+        """List the distinct source documents behind a set of chunks."""
+        sources = []
+        for doc in docs:
+            # Deduplicated chunks carry the attributions of every chunk they replaced
+            attributions = doc.metadata.get("sources") or [doc.metadata]
+            for attribution in attributions:
+                source = attribution.get("source", "Unknown")
+                category = attribution.get("category", "Unknown")
+                if any(s.get("source") == source for s in sources):
+                    continue
+                sources.append({
+                    "source": source,
+                    "category": category
+                })
+        return sources
+    
+    def _build_chain(self, rag_system_prompt: str, route: Route):
+        """Create the prompt | model chain for a system prompt on a route."""
+        # Bound the completion by whatever is left of the request deadline
+        timeout_options = {}
+        deadline = current_deadline()
+        if deadline is not None:
+            timeout_options = {"timeout": deadline.check("LLM completion"), "max_retries": 0}
         
         # Create the chat model
         chat_model = ChatOpenAI(
             api_key=self.openai_api_key, 
-            model="gpt-4o-mini",
-            temperature=0.7
+            model=route.model,
+            temperature=route.temperature,
+            max_tokens=route.max_tokens,
+            **timeout_options
         )
         
         # Create the prompt template
@@ -186,21 +487,181 @@ Use this information to provide accurate, well-informed responses. Always cite y
             ("user", "{input}")
         ])
         
-        # Create the chain and run it
-        chain = prompt | chat_model
-        response = chain.invoke({"input": user_query})
+        return prompt | chat_model
+    
+    def prepare_context(self, user_query: str, location: str, intent: Optional[str] = None,
+                        form_intent: bool = False, conversation_depth: int = 0,
+                        scored: Optional[List[Tuple[Document, float]]] = None,
+                        widen: bool = True) -> Tuple[Route, List[Document]]:
+        """
+        Retrieve context for a query and pick the route that will answer it.
         
-        # Extract sources
-        sources = []
-        if relevant_docs:
-            for doc in relevant_docs:
-                source = doc.metadata.get("source", "Unknown")
-                category = doc.metadata.get("category", "Unknown")
-                if any(s.get("source") == source for s in sources):
-                    continue
-                sources.append({
-                    "source": source,
-                    "category": category
-                })
+        Retrieval runs once at the largest context budget of any route (or
+        the reranker's wider candidate set, which is then rescored); the
+        result is trimmed to the chosen route's budget.
+        
+        Args:
+            user_query: User's question or request
+            location: User's location
+            intent: Detected intent, used to route the request
+            form_intent: Whether the intent collects form fields
+            conversation_depth: Earlier turns in the conversation
+            scored: (document, distance) pairs already retrieved for this
+                query (e.g. by a prefetch); skips the search when given
+            widen: With a reranker and given scored pairs, also search the
+                reranker's wider candidate set; False reranks only the given
+                pairs (e.g. a follow-up answered from the session's context)
+            
+        Returns:
+            Tuple of (route, relevant document chunks)
+        """
+        widened = scored is None
+        if scored is None:
+            scored = self.retrieve_scored(user_query, top_k=self.candidate_count, location=location)
+        features = route_features(user_query, scored, intent=intent, form_intent=form_intent, conversation_depth=conversation_depth)
+        route = self.router.choose(features)
+        if self.reranker is not None:
+            if widen and not widened:
+                # The query vector is cached by now, so this is one more search
+                wider = self.retrieve_scored(user_query, top_k=self.reranker.candidates, location=location)
+                scored = self._merge_scored([(distance, doc) for doc, distance in scored + wider], len(scored) + len(wider))
+            scored = self.reranker.rerank(user_query, scored, intent=intent)
+        return route, [doc for doc, _ in scored[:route.top_k]]
+    
+    def answer_with_context(self, user_query: str, system_prompt: str, location: str, route: Route,
+                            relevant_docs: List[Document], mode: str = "llm") -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Answer a query from context already returned by prepare_context().
+        
+        Args:
+            user_query: User's question or request
+            system_prompt: System prompt for the LLM
+            location: User's location
+            route: Route chosen by prepare_context()
+            relevant_docs: Document chunks chosen by prepare_context()
+            mode: Answer mode (see generate_response)
+            
+        Returns:
+            Tuple of (response text, sources list)
+        """
+        if mode not in ANSWER_MODES:
+            raise ValueError(f"Unknown answer mode: {mode}")
+        
+        if mode != "llm":
+            text, sources, confidence = self.extractive.answer(user_query, relevant_docs)
+            if mode == "extractive" or confidence >= EXTRACTIVE_CONFIDENCE_THRESHOLD:
+                return text, sources
+        
+        rag_system_prompt = self.build_rag_prompt(system_prompt, relevant_docs, location)
+        
+        # Create the chain and run it; if the model fails or misses the
+        # deadline, answer from the retrieved context instead of retrying
+        started_at = time.monotonic()
+        try:
+            chain = self._build_chain(rag_system_prompt, route)
+            response = chain.invoke({"input": user_query})
+        except Exception as e:
+            self.router.record(route, started_at, error=True)
+            if not relevant_docs:
+                raise
+            print(f"LLM completion failed ({type(e).__name__}: {e}); using extractive answer")
+            text, sources, _ = self.extractive.answer(user_query, relevant_docs)
+            return text, sources
         
-        return response.content, sources
+        usage = token_usage(response) or {
+            "input_tokens": count_tokens(rag_system_prompt + user_query, route.model),
+            "output_tokens": count_tokens(response.content, route.model),
+        }
+        self.router.record(route, started_at, **usage)
+        return response.content, self.extract_sources(relevant_docs)
+    
+    def generate_response(self, user_query: str, system_prompt: str, location: str, mode: str = "llm",
+                          intent: Optional[str] = None, form_intent: bool = False,
+                          conversation_depth: int = 0) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Generate a response using RAG.
+        
+        Args:
+            user_query: User's question or request
+            system_prompt: System prompt for the LLM
+            location: User's location
+            mode: "llm" to generate with the model, "extractive" to answer
+                from retrieved sentences only, or "auto" to skip the model
+                when the extractive answer is a confident match
+            intent: Detected intent, used to route the request
+            form_intent: Whether the intent collects form fields
+            conversation_depth: Earlier turns in the conversation
+            
+        Returns:
+            Tuple of (response text, sources list)
+        """
+        if mode not in ANSWER_MODES:
+            raise ValueError(f"Unknown answer mode: {mode}")
+        
+        # Retrieve relevant context and pick the model tier for this request
+        route, relevant_docs = self.prepare_context(user_query, location, intent, form_intent, conversation_depth)
+        return self.answer_with_context(user_query, system_prompt, location, route, relevant_docs, mode=mode)
+    
+    def stream_response(self, user_query: str, system_prompt: str, location: str,
+                        intent: Optional[str] = None, form_intent: bool = False,
+                        conversation_depth: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Generate a response using RAG, yielding it incrementally.
+        
+        Args:
+            user_query: User's question or request
+            system_prompt: System prompt for the LLM
+            location: User's location
+            intent: Detected intent, used to route the request
+            form_intent: Whether the intent collects form fields
+            conversation_depth: Earlier turns in the conversation
+            
+        Yields:
+            A {"type": "sources"} message once retrieval finishes, followed by
+            {"type": "token"} messages as the model produces output
+        """
+        route, relevant_docs = self.prepare_context(user_query, location, intent, form_intent, conversation_depth)
+        yield from self.stream_with_context(user_query, system_prompt, location, route, relevant_docs)
+    
+    def stream_with_context(self, user_query: str, system_prompt: str, location: str, route: Route,
+                            relevant_docs: List[Document], mode: str = "llm") -> Iterator[Dict[str, Any]]:
+        """
+        Streaming counterpart of answer_with_context().
+        
+        Yields:
+            A {"type": "sources"} message, then {"type": "token"} messages as
+            the model produces output. Extractive answers, and the fallback
+            when the model fails before its first token, come as one token.
+        """
+        if mode not in ANSWER_MODES:
+            raise ValueError(f"Unknown answer mode: {mode}")
+        
+        yield {"type": "sources", "sources": self.extract_sources(relevant_docs)}
+        if mode != "llm":
+            text, _, confidence = self.extractive.answer(user_query, relevant_docs)
+            if mode == "extractive" or confidence >= EXTRACTIVE_CONFIDENCE_THRESHOLD:
+                yield {"type": "token", "content": text}
+                return
+        
+        rag_system_prompt = self.build_rag_prompt(system_prompt, relevant_docs, location)
+        started_at = time.monotonic()
+        output = []
+        try:
+            chain = self._build_chain(rag_system_prompt, route)
+            for chunk in chain.stream({"input": user_query}):
+                if chunk.content:
+                    output.append(chunk.content)
+                    yield {"type": "token", "content": chunk.content}
+        except Exception as e:
+            self.router.record(route, started_at, error=True)
+            if output or not relevant_docs:
+                raise
+            print(f"LLM stream failed ({type(e).__name__}: {e}); using extractive answer")
+            text, _, _ = self.extractive.answer(user_query, relevant_docs)
+            yield {"type": "token", "content": text}
+            return
+        self.router.record(
+            route, started_at,
+            input_tokens=count_tokens(rag_system_prompt + user_query, route.model),
+            output_tokens=count_tokens("".join(output), route.model)
+        )
@@ -0,0 +1,182 @@
+"""
+Zero-downtime knowledge base reloading for GovFlowAI
+
+A KnowledgeBaseWatcher polls the knowledge base directory, waits for edits to
+settle, rebuilds the index on a background thread and swaps the new generation
+into the live RAGSystem in a single assignment. Requests already in progress
+finish on the generation they started with; new requests see the new one.
+
+At most two generations are alive at once: a rebuild is not started while
+the generation retired by the previous swap is still referenced by in-flight
+requests.
+
+Jurisdiction layers are watched separately. Editing a county's documents
+only invalidates that jurisdiction, which is rebuilt on its next use; the
+statewide index is left alone.
+"""
+
+import glob
+import os
+import threading
+import time
+import weakref
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+Snapshot = Dict[str, Tuple[float, int]]
+
+
+def _snapshot_files(paths: Iterable[str]) -> Snapshot:
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshot[path] = (stat.st_mtime, stat.st_size)
+    return snapshot
+
+
+def snapshot_knowledge_base(knowledge_base_dir: str) -> Snapshot:
+    """Map the statewide markdown files (the top level of the knowledge base) to (mtime, size)."""
+    return _snapshot_files(glob.glob(os.path.join(knowledge_base_dir, '*.md')))
+
+
+def snapshot_jurisdictions(jurisdictions_dir: str) -> Dict[str, Snapshot]:
+    """Map each jurisdiction slug to the snapshot of its markdown files."""
+    if not os.path.isdir(jurisdictions_dir):
+        return {}
+    return {
+        slug: _snapshot_files(glob.glob(os.path.join(jurisdictions_dir, slug, '*.md')))
+        for slug in os.listdir(jurisdictions_dir)
+        if not slug.startswith('.') and os.path.isdir(os.path.join(jurisdictions_dir, slug))
+    }
+
+
+def changed_jurisdictions(before: Dict[str, Snapshot], after: Dict[str, Snapshot]) -> Set[str]:
+    """Slugs whose documents were added, edited or removed between two snapshots."""
+    return {slug for slug in before.keys() | after.keys() if before.get(slug) != after.get(slug)}
+
+
+class KnowledgeBaseWatcher:
+    """
+    Poll a RAGSystem's knowledge base and hot-swap rebuilt indexes.
+    """
+
+    def __init__(self, rag_system, interval: float = 5.0, debounce: float = 2.0):
+        """
+        Initialize the watcher.
+
+        Args:
+            rag_system: Live RAGSystem whose index is replaced on change
+            interval: Seconds between polls of the knowledge base
+            debounce: Seconds the files must stay unchanged before rebuilding
+        """
+        self.rag_system = rag_system
+        self.interval = interval
+        self.debounce = debounce
+        self._snapshot = snapshot_knowledge_base(rag_system.knowledge_base_dir)
+        self._changed_at: Optional[float] = None
+        self._jurisdiction_snapshot = snapshot_jurisdictions(rag_system.jurisdictions.jurisdictions_dir)
+        # Edited jurisdictions waiting for their documents to settle
+        self._changed_slugs: Set[str] = set()
+        self._slugs_changed_at: Optional[float] = None
+        self._reload_requested = threading.Event()
+        self._stop = threading.Event()
+        self._retired = None
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"reloads": 0, "failures": 0, "last_reload_seconds": None, "jurisdictions_invalidated": 0}
+
+    def start(self) -> "KnowledgeBaseWatcher":
+        """Start polling on a daemon thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="kb-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def request_reload(self) -> None:
+        """Ask for a rebuild on the watcher thread without waiting for it."""
+        self._reload_requested.set()
+        self.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._poll_jurisdictions()
+            if self._poll():
+                self._reload()
+            if self._reload_requested.is_set():
+                # Requested but the last retired generation is still in use
+                self._stop.wait(min(self.interval, 0.5))
+            else:
+                self._reload_requested.wait(self.interval)
+
+    def _poll(self) -> bool:
+        """Return True when a debounced change (or explicit request) is ready."""
+        if self._reload_requested.is_set():
+            if not self._previous_generation_released():
+                return False
+            self._reload_requested.clear()
+            return True
+
+        current = snapshot_knowledge_base(self.rag_system.knowledge_base_dir)
+        now = time.monotonic()
+        if current != self._snapshot:
+            self._snapshot = current
+            self._changed_at = now
+            return False
+        if self._changed_at is None or now - self._changed_at < self.debounce:
+            return False
+        if not self._previous_generation_released():
+            return False
+        self._changed_at = None
+        return True
+
+    def _poll_jurisdictions(self) -> None:
+        """Invalidate jurisdictions whose documents changed once their edits have settled."""
+        current = snapshot_jurisdictions(self.rag_system.jurisdictions.jurisdictions_dir)
+        now = time.monotonic()
+        changed = changed_jurisdictions(self._jurisdiction_snapshot, current)
+        if changed:
+            self._jurisdiction_snapshot = current
+            self._changed_slugs |= changed
+            self._slugs_changed_at = now
+            return
+        if not self._changed_slugs or now - self._slugs_changed_at < self.debounce:
+            return
+        for slug in sorted(self._changed_slugs):
+            self.rag_system.jurisdictions.invalidate(slug)
+            self.stats["jurisdictions_invalidated"] += 1
+            print(f"Jurisdiction {slug} changed; it will be rebuilt on next use")
+        self._changed_slugs.clear()
+        self._slugs_changed_at = None
+
+    def _previous_generation_released(self) -> bool:
+        return self._retired is None or self._retired() is None
+
+    def _reload(self) -> None:
+        """Build a new generation off the request path and swap it in."""
+        started = time.monotonic()
+        try:
+            vector_store, indexed_docs, dedup_stats = self.rag_system.build_vector_store()
+        except Exception as e:
+            self.stats["failures"] += 1
+            print(f"Knowledge base reload failed, keeping generation {self.rag_system.generation}: {e}")
+            return
+        if vector_store is None:
+            print("Knowledge base is empty, keeping the current index")
+            return
+
+        previous = self.rag_system.vector_store
+        self.rag_system.swap_index(vector_store, indexed_docs, dedup_stats)
+        self._retired = weakref.ref(previous) if previous is not None else None
+        del previous
+
+        elapsed = time.monotonic() - started
+        self.stats["reloads"] += 1
+        self.stats["last_reload_seconds"] = elapsed
+        print(f"Swapped in knowledge base generation {self.rag_system.generation} after {elapsed:.1f}s")
@@ -0,0 +1,223 @@
+"""
+Replay recorded GovFlowAI chat traffic against a target deployment
+
+Reads the JSONL records written by chatbot.traffic and re-sends each chat
+request at its original arrival offset (optionally sped up), so capacity
+and concurrency changes can be compared on the real load shape:
+
+    python -m chatbot.replay records.jsonl.1 records.jsonl \\
+        --target http://127.0.0.1:8000/api/chat/ --speed 4 --report replay.json
+
+Requests are fired on schedule whether or not earlier ones finished (an
+open-loop load), and the report gives latency percentiles overall and per
+intent, throughput, status counts and how far the replayer itself fell
+behind schedule. --mock-llm-port starts chatbot.mock_llm in the same
+process; the target has to be pointed at it (see that module).
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+def load_records(paths: List[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Read traffic records from JSONL files, ordered by arrival time."""
+    records = []
+    for path in paths:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("query"):
+                    records.append(record)
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records[:limit] if limit else records
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p90_ms": round(percentile(latencies, 90), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2) if latencies else 0.0,
+    }
+
+
+async def post_json(url: str, payload: Dict[str, Any], timeout: float) -> Tuple[int, bytes]:
+    """
+    POST a JSON body over plain HTTP/1.1 and return (status, body).
+
+    One connection per request keeps the replayer free of client-side
+    pooling effects; only http:// targets are supported.
+    """
+    parts = urlsplit(url)
+    if parts.scheme != 'http':
+        raise ValueError(f"Only http:// targets are supported, got {url}")
+    host, port = parts.hostname, parts.port or 80
+    path = parts.path or '/'
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    body = json.dumps(payload).encode('utf-8')
+
+    async def exchange() -> Tuple[int, bytes]:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(
+                f"POST {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+            status_line = await reader.readline()
+            status = int(status_line.split()[1])
+            raw = await reader.read()
+            return status, raw.partition(b"\r\n\r\n")[2]
+        finally:
+            writer.close()
+
+    return await asyncio.wait_for(exchange(), timeout)
+
+
+class Replayer:
+    """
+    Open-loop replay of traffic records with per-request measurements.
+    """
+
+    def __init__(self, target: str, speed: float = 1.0, timeout: float = 60.0, max_in_flight: int = 1000):
+        """
+        Initialize the replayer.
+
+        Args:
+            target: URL the chat requests are sent to
+            speed: Time compression; 2.0 replays an hour of traffic in 30 minutes
+            timeout: Seconds before a request counts as failed
+            max_in_flight: Most requests open at once (protects the load generator)
+        """
+        self.target = target
+        self.speed = speed
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.results: List[Dict[str, Any]] = []
+        self._in_flight = 0
+        self._peak_in_flight = 0
+
+    @staticmethod
+    def payload(record: Dict[str, Any]) -> Dict[str, Any]:
+        payload = {"message": record["query"], "location": record.get("location", "California")}
+        for field in ("mode", "conversation_depth"):
+            if field in record:
+                payload[field] = record[field]
+        return payload
+
+    async def _send(self, record: Dict[str, Any], due: float) -> None:
+        async with self._slots:
+            started = time.monotonic()
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            result = {"intent": record.get("intent", "unknown"), "lag_ms": (started - due) * 1000.0,
+                      "recorded_ms": record.get("duration_ms")}
+            try:
+                status, _ = await post_json(self.target, self.payload(record), self.timeout)
+                result["status"] = status
+            except asyncio.TimeoutError:
+                result["status"] = "timeout"
+            except (OSError, ValueError, IndexError) as e:
+                result["status"] = type(e).__name__
+            finally:
+                self._in_flight -= 1
+            result["latency_ms"] = (time.monotonic() - started) * 1000.0
+            self.results.append(result)
+
+    async def run(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Replay records on their original schedule and return the report."""
+        if not records:
+            return self.report(0.0, 0.0)
+        first_ts = records[0].get("ts", 0)
+        started = time.monotonic()
+        tasks = []
+        for record in records:
+            due = started + (record.get("ts", first_ts) - first_ts) / self.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._send(record, due)))
+        await asyncio.gather(*tasks)
+        recorded_span = records[-1].get("ts", first_ts) - first_ts
+        return self.report(time.monotonic() - started, recorded_span)
+
+    def report(self, wall_seconds: float, recorded_span: float) -> Dict[str, Any]:
+        ok = [r for r in self.results if isinstance(r["status"], int) and r["status"] < 400]
+        by_intent: Dict[str, List[float]] = defaultdict(list)
+        for r in ok:
+            by_intent[r["intent"]].append(r["latency_ms"])
+        lags = [r["lag_ms"] for r in self.results]
+        return {
+            "target": self.target,
+            "speed": self.speed,
+            "requests": len(self.results),
+            "succeeded": len(ok),
+            "failed": len(self.results) - len(ok),
+            "statuses": dict(Counter(str(r["status"]) for r in self.results)),
+            "wall_seconds": round(wall_seconds, 3),
+            "offered_rps": round(len(self.results) / (recorded_span / self.speed), 2) if recorded_span else None,
+            "throughput_rps": round(len(ok) / wall_seconds, 2) if wall_seconds else 0.0,
+            "peak_in_flight": self._peak_in_flight,
+            "latency": latency_summary([r["latency_ms"] for r in ok]),
+            "latency_by_intent": {intent: latency_summary(values) for intent, values in sorted(by_intent.items())},
+            "recorded_latency": latency_summary([r["recorded_ms"] for r in self.results if r["recorded_ms"] is not None]),
+            "schedule_lag_ms": {"mean": round(sum(lags) / len(lags), 2) if lags else 0.0,
+                                "max": round(max(lags), 2) if lags else 0.0},
+        }
+
+
+async def _replay(args) -> Dict[str, Any]:
+    mock = None
+    if args.mock_llm_port:
+        from .mock_llm import MockLLMServer
+        mock = await MockLLMServer(port=args.mock_llm_port).start()
+    try:
+        records = load_records(args.records, args.limit)
+        print(f"Replaying {len(records)} requests against {args.target} at {args.speed}x")
+        replayer = Replayer(args.target, speed=args.speed, timeout=args.timeout, max_in_flight=args.max_in_flight)
+        return await replayer.run(records)
+    finally:
+        if mock is not None:
+            mock.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded chat traffic against a target")
+    parser.add_argument('records', nargs='+', help="JSONL files written by the traffic recorder")
+    parser.add_argument('--target', default='http://127.0.0.1:8000/api/chat/')
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--max-in-flight', type=int, default=1000)
+    parser.add_argument('--mock-llm-port', type=int, default=None)
+    parser.add_argument('--report', default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(_replay(args))
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+Second-stage reranking for GovFlowAI
+
+FAISS orders chunks by embedding distance alone. The reranker takes a wider
+first-stage candidate set (e.g. the 50 nearest chunks) and rescores it on the
+CPU, so a route's context budget is filled with the most precise chunks:
+1. Lexical overlap: BM25 over the candidate set, using the extractive
+   answerer's tokenizer (stopwords, plurals, everyday synonyms)
+2. Heading match: query terms found in the chunk's section headings
+3. Phrase match: query word pairs that appear side by side in the chunk
+4. Category prior: the knowledge base file the query's wording (or a
+   detected DMV intent) points at
+5. First-stage similarity: the embedding distance, normalized over the set
+
+Per-chunk features are cached, so a warm rerank is only arithmetic. The stage
+has a hard latency budget: when it runs out, the first-stage order is used
+unchanged. Chunks scoring far below the best one are dropped, so routes often
+send fewer chunks than their budget.
+
+A local model (e.g. a small cross-encoder, see load_cross_encoder) can be
+given as the scorer; it runs within the remaining budget and the feature
+order is used whenever it does not finish in time.
+"""
+
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from itertools import islice
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from .extractive import is_heading, tokenize
+from .memory import sampled_sizeof
+
+# Weights of the features in the combined score (each feature is in [0, 1])
+FEATURE_WEIGHTS = {"lexical": 0.4, "heading": 0.2, "phrase": 0.1, "category": 0.1, "dense": 0.2}
+BM25_K1 = 1.2
+BM25_B = 0.75
+MIN_KEPT = 2
+
+# Words that point a query at one knowledge base file
+CATEGORY_HINTS = {
+    "dmv_services": "dmv driver license licence id vehicle car registration title smog plate "
+                    "appointment permit test renewal renew transfer",
+    "tax_services": "tax taxes irs ftb return filing file refund deduction income property assessment "
+                    "sales business",
+    "benefits_programs": "benefit benefits calfresh food snap medi-cal medical health calworks cash eitc "
+                         "housing section rent assistance eligible eligibility",
+}
+_CATEGORY_TERMS = {category: frozenset(tokenize(words)) for category, words in CATEGORY_HINTS.items()}
+
+
+class ChunkFeatures:
+    """Query-independent features of one chunk, computed once and cached."""
+
+    __slots__ = ("terms", "length", "heading_terms", "pairs")
+
+    def __init__(self, text: str):
+        tokens = tokenize(text)
+        self.terms = Counter(tokens)
+        self.length = len(tokens)
+        headings = [line.strip(' -*#\t') for line in text.split('\n')]
+        self.heading_terms: FrozenSet[str] = frozenset(
+            token for line in headings if line and is_heading(line) for token in tokenize(line)
+        )
+        self.pairs: FrozenSet[Tuple[str, str]] = frozenset(zip(tokens, tokens[1:]))
+
+
+def query_categories(query_terms: List[str], intent: Optional[str] = None) -> Dict[str, float]:
+    """
+    Prior for each knowledge base category given the query.
+
+    Returns:
+        Category -> share of the query's hint words that point at it; a
+        detected intent (all intents are DMV forms) counts as a DMV hint
+    """
+    hits = {category: sum(1 for term in query_terms if term in terms) for category, terms in _CATEGORY_TERMS.items()}
+    if intent:
+        hits["dmv_services"] += 1
+    total = sum(hits.values())
+    if not total:
+        return {}
+    return {category: count / total for category, count in hits.items()}
+
+
+def load_cross_encoder(name: str) -> Optional[Callable[[str, List[str]], List[float]]]:
+    """
+    Load a sentence-transformers cross-encoder to use as the reranking model.
+
+    Args:
+        name: Model name or path (e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+    Returns:
+        A scorer taking (query, chunk texts) and returning one score per
+        text, or None when sentence-transformers is not installed
+    """
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        print(f"sentence-transformers is not installed; reranking without {name}")
+        return None
+    model = CrossEncoder(name, device="cpu")
+
+    def score(query: str, texts: List[str]) -> List[float]:
+        return [float(value) for value in model.predict([(query, text) for text in texts])]
+
+    return score
+
+
+class Reranker:
+    """
+    Rescore first-stage candidates within a latency budget.
+    """
+
+    def __init__(self, candidates: int = 50, budget_ms: float = 20.0, cache_size: int = 8192,
+                 min_relative_score: float = 0.5, model: Optional[Callable[[str, List[str]], List[float]]] = None):
+        """
+        Initialize the reranker.
+
+        Args:
+            candidates: First-stage chunks retrieved for reranking
+            budget_ms: Milliseconds the stage may take before the first-stage
+                order is used instead
+            cache_size: Chunks whose features are kept between requests
+            min_relative_score: Chunks scoring below this fraction of the
+                best chunk are dropped (at least MIN_KEPT are kept); 0 keeps all
+            model: Optional scorer taking (query, chunk texts), e.g. from
+                load_cross_encoder(); replaces the feature order when it
+                finishes within the budget
+        """
+        self.candidates = candidates
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self.min_relative_score = min_relative_score
+        self.model = model
+        self._cache: "OrderedDict[Tuple[str, int], ChunkFeatures]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One model call at a time; a call still running when its budget ran out is not waited for
+        self._model_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank-model") if model else None
+        self._model_busy = False
+        self.stats = {"reranked": 0, "over_budget": 0, "model_scored": 0, "model_timeouts": 0, "model_errors": 0,
+                      "cache_hits": 0, "cache_misses": 0, "candidates": 0, "kept": 0, "total_ms": 0.0}
+
+    def _features(self, doc: Document) -> ChunkFeatures:
+        """Features of a chunk, cached per source and text."""
+        key = (doc.metadata.get("source", ""), hash(doc.page_content))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return cached
+        features = ChunkFeatures(doc.page_content)
+        with self._lock:
+            self._cache[key] = features
+            self.stats["cache_misses"] += 1
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return features
+
+    def score(self, query: str, scored: List[Tuple[Document, float]], intent: Optional[str] = None,
+              deadline: Optional[float] = None) -> Optional[List[float]]:
+        """
+        Combined feature score of each candidate.
+
+        Args:
+            query: User query
+            scored: (document, distance) pairs from the first stage
+            intent: Detected intent, if any
+            deadline: time.perf_counter() value after which to give up
+
+        Returns:
+            One score in [0, 1] per candidate, or None when the deadline passed
+        """
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        features = []
+        for doc, _ in scored:
+            features.append(self._features(doc))
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+        count = len(features)
+        if not query_terms or not count:
+            return [0.0] * count
+
+        # BM25 with document frequencies over the candidate set
+        average_length = sum(f.length for f in features) / count or 1.0
+        idf = {}
+        for term in query_terms:
+            frequency = sum(1 for f in features if term in f.terms)
+            idf[term] = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+        query_weight = sum(idf.values()) or 1.0
+        query_pairs = set(zip(query_terms, query_terms[1:]))
+        categories = query_categories(query_terms, intent)
+
+        distances = [distance for _, distance in scored]
+        nearest, farthest = min(distances), max(distances)
+        spread = farthest - nearest
+
+        lexical = []
+        for f in features:
+            total = 0.0
+            for term in query_terms:
+                tf = f.terms.get(term, 0)
+                if tf:
+                    total += idf[term] * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * f.length / average_length))
+            lexical.append(total)
+        best_lexical = max(lexical) or 1.0
+
+        scores = []
+        for (doc, distance), f, bm25 in zip(scored, features, lexical):
+            values = {
+                "lexical": bm25 / best_lexical,
+                "heading": sum(idf[term] for term in query_terms if term in f.heading_terms) / query_weight,
+                "phrase": len(query_pairs & f.pairs) / len(query_pairs) if query_pairs else 0.0,
+                "category": categories.get(doc.metadata.get("category"), 0.5) if categories else 0.5,
+                "dense": 1.0 - (distance - nearest) / spread if spread > 0 else 1.0,
+            }
+            scores.append(sum(FEATURE_WEIGHTS[name] * value for name, value in values.items()))
+        return scores
+
+    def _model_scores(self, query: str, scored: List[Tuple[Document, float]], deadline: float) -> Optional[List[float]]:
+        """Model scores for the candidates, or None if the model is busy, fails or misses the deadline."""
+        with self._lock:
+            if self._model_busy:
+                return None
+            self._model_busy = True
+
+        def run():
+            try:
+                return self.model(query, [doc.page_content for doc, _ in scored])
+            finally:
+                with self._lock:
+                    self._model_busy = False
+
+        future = self._model_executor.submit(run)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeout:
+            with self._lock:
+                self.stats["model_timeouts"] += 1
+            return None
+        except Exception as e:
+            print(f"Rerank model failed, using the feature order ({type(e).__name__}: {e})")
+            with self._lock:
+                self.stats["model_errors"] += 1
+            return None
+
+    def rerank(self, query: str, scored: List[Tuple[Document, float]], intent: Optional[str] = None) -> List[Tuple[Document, float]]:
+        """
+        Reorder first-stage candidates by their rerank score.
+
+        Args:
+            query: User query
+            scored: (document, distance) pairs from the first stage, closest first
+            intent: Detected intent, if any
+
+        Returns:
+            The same (document, distance) pairs, best first, without the
+            low-scoring tail; the first-stage list unchanged when the budget
+            ran out
+        """
+        if len(scored) < 2:
+            return scored
+        started = time.perf_counter()
+        deadline = started + self.budget_ms / 1000.0
+        scores = self.score(query, scored, intent=intent, deadline=deadline)
+        if scores is None:
+            with self._lock:
+                self.stats["over_budget"] += 1
+                self.stats["total_ms"] += (time.perf_counter() - started) * 1000
+            return scored
+
+        order = sorted(range(len(scored)), key=lambda i: -scores[i])
+        if self.min_relative_score > 0:
+            floor = scores[order[0]] * self.min_relative_score
+            order = [i for rank, i in enumerate(order) if rank < MIN_KEPT or scores[i] >= floor]
+
+        model_used = False
+        if self.model is not None:
+            kept = [scored[i] for i in order]
+            model_scores = self._model_scores(query, kept, deadline)
+            if model_scores is not None and len(model_scores) == len(kept):
+                order = [order[j] for j in sorted(range(len(kept)), key=lambda j: -model_scores[j])]
+                model_used = True
+
+        with self._lock:
+            self.stats["reranked"] += 1
+            self.stats["model_scored"] += model_used
+            self.stats["candidates"] += len(scored)
+            self.stats["kept"] += len(order)
+            self.stats["total_ms"] += (time.perf_counter() - started) * 1000
+        return [scored[i] for i in order]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes of the cached chunk features."""
+        with self._lock:
+            count = len(self._cache)
+            sample = list(islice(self._cache.values(), 32))
+        return {"rerank_features": sampled_sizeof(((f.terms, f.heading_terms, f.pairs) for f in sample), count)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats, cached_chunks=len(self._cache))
+        runs = stats["reranked"] + stats["over_budget"]
+        stats["avg_ms"] = round(stats.pop("total_ms") / runs, 3) if runs else 0.0
+        stats["avg_kept"] = round(stats["kept"] / stats["reranked"], 2) if stats["reranked"] else 0.0
+        return stats
@@ -0,0 +1,93 @@
+"""
+Response cache for GovFlowAI chat answers
+
+General questions (no form fields, so no personal data) get the same answer
+for everyone at a location. ResponseCache keeps recent answers keyed like
+the single-flight coalescing key, so repeats are served without retrieval
+or an LLM call. Entries expire after a TTL and are ignored once a new index
+generation has been swapped in.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from .memory import sampled_sizeof
+from .singleflight import make_key, prompt_version
+
+Answer = Tuple[str, List[Dict[str, str]]]
+
+
+def response_key(query: str, location: str, system_prompt: str, mode: str) -> str:
+    """Cache and coalescing key for an answer to query at location."""
+    return make_key(query, location, f"{prompt_version(system_prompt)}:{mode}")
+
+
+class ResponseCache:
+    """
+    In-memory LRU of (response, sources) answers with a TTL.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 3600.0):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Answers kept before the least recently used are evicted
+            ttl: Seconds an answer stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, int, Answer]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._window: Optional[Dict[str, int]] = None
+
+    def get(self, key: str, generation: int) -> Optional[Answer]:
+        """Return the cached answer for key if it is fresh and from this index generation."""
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and entry[1] == generation and time.monotonic() - entry[0] <= self.ttl
+            if entry is not None and not hit:
+                del self._entries[key]
+            elif hit:
+                self._entries.move_to_end(key)
+            self.stats["hits" if hit else "misses"] += 1
+            if self._window is not None and self._window["lookups"] < self._window["size"]:
+                self._window["lookups"] += 1
+                self._window["hits"] += int(hit)
+            return entry[2] if hit else None
+
+    def put(self, key: str, generation: int, answer: Answer) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), generation, answer)
+            self._entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes held by the cached answers."""
+        with self._lock:
+            count = len(self._entries)
+            sample = list(islice(self._entries.items(), 32))
+        return {"response_cache": sampled_sizeof(sample, count)}
+
+    def start_window(self, size: int) -> None:
+        """Start measuring the hit rate of the next `size` lookups (e.g. right after warm-up)."""
+        with self._lock:
+            self._window = {"size": size, "lookups": 0, "hits": 0}
+
+    def window_stats(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self._window is None:
+                return None
+            window = dict(self._window)
+        window["hit_rate"] = window["hits"] / window["lookups"] if window["lookups"] else 0.0
+        return window
@@ -0,0 +1,375 @@
+"""
+Retrieval sidecar for GovFlowAI
+
+Without a sidecar every gunicorn/Django worker builds and holds its own copy
+of the index and embedder. The sidecar is a standalone process that owns one
+RAGSystem and answers retrieval requests from all local workers over a Unix
+domain socket:
+1. A compact length-prefixed binary protocol (no JSON on the hot path)
+2. Server-side micro-batching: queries arriving within a few milliseconds are
+   embedded and searched as one batch
+3. A blocking client that plugs into RAGSystem.retriever, and a sharded
+   client that scatters a query to several sidecars and merges the hits
+
+Run a sidecar with:
+
+    python -m chatbot.retrieval_sidecar --socket /tmp/govchat-retrieval.sock
+    python -m chatbot.retrieval_sidecar --socket /tmp/shard0.sock --shard 0/2
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# Frame: u32 body length, then the body
+_FRAME = struct.Struct('!I')
+# Request body: request id, top_k, query length, location length, then the UTF-8 strings
+_REQUEST = struct.Struct('!IHHH')
+# Response body: request id, status, hit count, then the hits (or an error message)
+_RESPONSE = struct.Struct('!IBH')
+# Hit: distance, text length, metadata length, then UTF-8 text and JSON metadata
+_HIT = struct.Struct('!fII')
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+DEFAULT_SOCKET_PATH = '/tmp/govchat-retrieval.sock'
+
+ScoredHits = List[Tuple[Document, float]]
+
+
+def encode_request(request_id: int, query: str, top_k: int, location: str = '') -> bytes:
+    query_bytes = query.encode('utf-8')
+    location_bytes = (location or '').encode('utf-8')
+    body = _REQUEST.pack(request_id, top_k, len(query_bytes), len(location_bytes)) + query_bytes + location_bytes
+    return _FRAME.pack(len(body)) + body
+
+
+def decode_request(body: bytes) -> Tuple[int, str, int, str]:
+    request_id, top_k, query_length, location_length = _REQUEST.unpack_from(body)
+    offset = _REQUEST.size
+    query = body[offset:offset + query_length].decode('utf-8')
+    offset += query_length
+    location = body[offset:offset + location_length].decode('utf-8')
+    return request_id, query, top_k, location
+
+
+def encode_response(request_id: int, hits: ScoredHits) -> bytes:
+    parts = [_RESPONSE.pack(request_id, STATUS_OK, len(hits))]
+    for doc, distance in hits:
+        text = doc.page_content.encode('utf-8')
+        metadata = json.dumps(doc.metadata, separators=(',', ':')).encode('utf-8')
+        parts.append(_HIT.pack(distance, len(text), len(metadata)))
+        parts.append(text)
+        parts.append(metadata)
+    body = b''.join(parts)
+    return _FRAME.pack(len(body)) + body
+
+
+def encode_error(request_id: int, message: str) -> bytes:
+    body = _RESPONSE.pack(request_id, STATUS_ERROR, 0) + message.encode('utf-8')
+    return _FRAME.pack(len(body)) + body
+
+
+class SidecarError(RuntimeError):
+    """A server-side error for one request."""
+
+    def __init__(self, request_id: int, message: str):
+        super().__init__(f"Retrieval sidecar error: {message}")
+        self.request_id = request_id
+
+
+def decode_response(body: bytes) -> Tuple[int, ScoredHits]:
+    """Decode a response body, raising SidecarError for server-side errors."""
+    request_id, status, count = _RESPONSE.unpack_from(body)
+    offset = _RESPONSE.size
+    if status != STATUS_OK:
+        raise SidecarError(request_id, body[offset:].decode('utf-8', 'replace'))
+    hits = []
+    for _ in range(count):
+        distance, text_length, metadata_length = _HIT.unpack_from(body, offset)
+        offset += _HIT.size
+        text = body[offset:offset + text_length].decode('utf-8')
+        offset += text_length
+        metadata = json.loads(body[offset:offset + metadata_length])
+        offset += metadata_length
+        hits.append((Document(page_content=text, metadata=metadata), distance))
+    return request_id, hits
+
+
+class RetrievalServer:
+    """
+    Serve one RAGSystem's retrieval to local workers over a Unix socket.
+    """
+
+    def __init__(self, rag_system, socket_path: str = DEFAULT_SOCKET_PATH, max_batch: int = 64, max_wait_ms: float = 2.0):
+        """
+        Initialize the server.
+
+        Args:
+            rag_system: RAGSystem that owns the index and embedder
+            socket_path: Filesystem path of the Unix domain socket
+            max_batch: Most queries searched together in one batch
+            max_wait_ms: How long the first query of a batch waits for company
+        """
+        self.rag_system = rag_system
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        # Batches run one at a time, off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-batch")
+        self.stats = {"requests": 0, "batches": 0, "errors": 0}
+
+    async def serve_forever(self) -> None:
+        self._queue = asyncio.Queue()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+        batcher = asyncio.create_task(self._batch_loop())
+        print(f"Retrieval sidecar listening on {self.socket_path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(_FRAME.size)
+                (length,) = _FRAME.unpack(header)
+                body = await reader.readexactly(length)
+                request_id, query, top_k, location = decode_request(body)
+                self.stats["requests"] += 1
+                # Requests on one connection may be pipelined; reply as each finishes
+                self._queue.put_nowait((request_id, query, top_k, location, writer))
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.stats["batches"] += 1
+            results = await loop.run_in_executor(self._executor, self._run_batch, batch)
+            for (request_id, _, _, _, writer), hits in zip(batch, results):
+                # One unencodable response (e.g. metadata that is not JSON) must not stop the batcher
+                try:
+                    if isinstance(hits, Exception):
+                        raise hits
+                    frame = encode_response(request_id, hits)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    frame = encode_error(request_id, str(e))
+                try:
+                    self._reply(writer, frame)
+                except Exception as e:
+                    print(f"Retrieval sidecar could not reply to request {request_id}: {e}")
+
+    def _run_batch(self, batch) -> List[Any]:
+        """
+        Search a batch: statewide queries together, location queries individually.
+
+        Returns:
+            Hits per request, or the exception that request failed with. When
+            the combined search fails, each query is retried on its own so
+            only the failing one gets an error.
+        """
+        results: List[Any] = [None] * len(batch)
+        plain = [i for i, item in enumerate(batch) if not item[3]]
+        if len(plain) > 1:
+            top_k = max(batch[i][2] for i in plain)
+            try:
+                scored = self.rag_system.retrieve_scored_batch([batch[i][1] for i in plain], top_k=top_k)
+            except Exception as e:
+                print(f"Retrieval batch of {len(plain)} failed, retrying individually: {e}")
+            else:
+                for i, hits in zip(plain, scored):
+                    results[i] = hits[:batch[i][2]]
+        for i, (_, query, top_k, location, _) in enumerate(batch):
+            if results[i] is None:
+                try:
+                    results[i] = self.rag_system.retrieve_scored(query, top_k=top_k, location=location)
+                except Exception as e:
+                    results[i] = e
+        return results
+
+    @staticmethod
+    def _reply(writer: asyncio.StreamWriter, frame: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(frame)
+
+
+class RetrievalClient:
+    """
+    Blocking client for a retrieval sidecar, usable as RAGSystem.retriever.
+
+    Each thread keeps its own connection, so threaded WSGI workers never
+    contend on a socket.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+
+    def _connection(self) -> socket.socket:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _recv_exactly(conn: socket.socket, size: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = conn.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionError("Retrieval sidecar closed the connection")
+            buffer.extend(chunk)
+        return bytes(buffer)
+
+    def search(self, queries: Sequence[str], top_k: int = 5, location: str = '') -> List[ScoredHits]:
+        """Send all queries pipelined on one connection and collect the hits in order."""
+        request_ids = [next(self._ids) & 0xFFFFFFFF for _ in queries]
+        try:
+            conn = self._connection()
+            conn.sendall(b''.join(
+                encode_request(request_id, query, top_k, location)
+                for request_id, query in zip(request_ids, queries)
+            ))
+            # Read every pipelined reply, errors included, so none is left on the socket
+            responses: Dict[int, Any] = {}
+            while len(responses) < len(request_ids):
+                (length,) = _FRAME.unpack(self._recv_exactly(conn, _FRAME.size))
+                try:
+                    request_id, hits = decode_response(self._recv_exactly(conn, length))
+                except SidecarError as e:
+                    request_id, hits = e.request_id, e
+                responses[request_id] = hits
+            results = [responses[request_id] for request_id in request_ids]
+        except BaseException:
+            # Never reuse a connection that may hold unread or half-read frames
+            self._drop_connection()
+            raise
+        for hits in results:
+            if isinstance(hits, SidecarError):
+                raise hits
+        return results
+
+    def retrieve_context(self, query: str, top_k: int = 5, location: Optional[str] = None) -> List[Document]:
+        return [doc for doc, _ in self.retrieve_scored(query, top_k, location)]
+
+    def retrieve_scored(self, query: str, top_k: int = 5, location: Optional[str] = None) -> ScoredHits:
+        return self.search([query], top_k, location or '')[0]
+
+    def retrieve_scored_batch(self, queries: List[str], top_k: int = 5) -> List[ScoredHits]:
+        return self.search(queries, top_k)
+
+
+class ShardedRetrievalClient:
+    """
+    Scatter each query to several sidecars, each holding one shard of the
+    knowledge base, and gather the closest hits across all of them.
+    """
+
+    def __init__(self, socket_paths: Sequence[str], timeout: float = 5.0):
+        self.clients = [RetrievalClient(path, timeout=timeout) for path in socket_paths]
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.clients), thread_name_prefix="retrieval-scatter")
+
+    def retrieve_scored_batch(self, queries: List[str], top_k: int = 5, location: str = '') -> List[ScoredHits]:
+        futures = [self._executor.submit(client.search, queries, top_k, location) for client in self.clients]
+        per_shard = [future.result() for future in futures]
+        merged = []
+        for query_index in range(len(queries)):
+            hits = []
+            for shard_results in per_shard:
+                for rank, (doc, distance) in enumerate(shard_results[query_index]):
+                    hits.append(((distance, rank), doc, distance))
+            hits.sort(key=lambda item: item[0])
+            # Every shard holds the full jurisdiction layers, so local chunks come back once per shard
+            picked = []
+            seen_text = set()
+            for _, doc, distance in hits:
+                if doc.page_content in seen_text:
+                    continue
+                seen_text.add(doc.page_content)
+                picked.append((doc, distance))
+                if len(picked) == top_k:
+                    break
+            merged.append(picked)
+        return merged
+
+    def retrieve_context(self, query: str, top_k: int = 5, location: Optional[str] = None) -> List[Document]:
+        return [doc for doc, _ in self.retrieve_scored(query, top_k, location)]
+
+    def retrieve_scored(self, query: str, top_k: int = 5, location: Optional[str] = None) -> ScoredHits:
+        return self.retrieve_scored_batch([query], top_k, location or '')[0]
+
+
+def make_client(socket_paths: Sequence[str], timeout: float = 5.0):
+    """Return a plain or sharded client for one or more sidecar sockets."""
+    if len(socket_paths) == 1:
+        return RetrievalClient(socket_paths[0], timeout=timeout)
+    return ShardedRetrievalClient(socket_paths, timeout=timeout)
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from .rag_system import RAGSystem
+    from .reloader import KnowledgeBaseWatcher
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve GovFlowAI retrieval over a Unix socket")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH)
+    parser.add_argument('--knowledge-base', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'knowledge_base'))
+    parser.add_argument('--shard', help="shard as INDEX/COUNT, e.g. 0/2")
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    shard = tuple(int(part) for part in args.shard.split('/')) if args.shard else None
+    rag_system = RAGSystem(
+        knowledge_base_dir=args.knowledge_base,
+        openai_api_key=os.getenv('OPENAI_API_KEY'),
+        shard=shard
+    )
+    rag_system.build_index()
+    KnowledgeBaseWatcher(rag_system).start()
+    server = RetrievalServer(rag_system, args.socket, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Cost- and latency-aware model routing for GovFlowAI
+
+Every request used to get the same model, no output limit and five chunks of
+context, so a one-line fee question cost as much as a new-resident
+walkthrough. ModelRouter picks a route per request from cheap local features:
+1. The detected intent, and whether it drives a form
+2. Query length in words
+3. Retrieval confidence (distance of the closest chunk)
+4. Conversation depth (earlier turns in the same conversation)
+
+A route fixes the model, temperature, max output tokens and how many chunks
+go into the prompt. Routes are checked in order and the first whose
+conditions all hold is used; the last route is the fallback. Routes can be
+loaded from a JSON file with the same shape as DEFAULT_ROUTES.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Conditions a route may set under "when"; all present conditions must hold
+ROUTE_CONDITIONS = (
+    "intents", "form_intent",
+    "min_query_words", "max_query_words",
+    "max_distance", "min_distance",
+    "min_depth", "max_depth",
+)
+
+DEFAULT_ROUTES: List[Dict[str, Any]] = [
+    # Short, well-covered questions: small answer, little context
+    {
+        "name": "quick",
+        "model": "gpt-4o-mini",
+        "temperature": 0.3,
+        "max_tokens": 300,
+        "top_k": 3,
+        "when": {"form_intent": False, "max_query_words": 20, "max_distance": 0.35, "max_depth": 2},
+    },
+    # Form flows ask for one field at a time
+    {
+        "name": "form",
+        "model": "gpt-4o-mini",
+        "temperature": 0.3,
+        "max_tokens": 500,
+        "top_k": 4,
+        "when": {"form_intent": True},
+    },
+    # Long, multi-part questions get the larger model and more context
+    {
+        "name": "detailed",
+        "model": "gpt-4o",
+        "temperature": 0.7,
+        "max_tokens": 1000,
+        "top_k": 8,
+        "when": {"min_query_words": 40},
+    },
+    {
+        "name": "standard",
+        "model": "gpt-4o-mini",
+        "temperature": 0.7,
+        "max_tokens": 700,
+        "top_k": 5,
+        "when": {},
+    },
+]
+
+LATENCY_WINDOW = 512
+
+
+class Route:
+    """One routing tier: the model settings and the conditions that select it."""
+
+    def __init__(self, name: str, model: str, max_tokens: int, top_k: int, temperature: float = 0.7, when: Optional[Dict[str, Any]] = None):
+        unknown = set(when or {}) - set(ROUTE_CONDITIONS)
+        if unknown:
+            raise ValueError(f"Route {name!r} has unknown conditions: {sorted(unknown)}")
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.temperature = temperature
+        self.when = dict(when or {})
+
+    def matches(self, features: Dict[str, Any]) -> bool:
+        when = self.when
+        if "intents" in when and features.get("intent") not in when["intents"]:
+            return False
+        if "form_intent" in when and bool(features.get("form_intent")) != when["form_intent"]:
+            return False
+        words = features.get("query_words", 0)
+        if words < when.get("min_query_words", 0) or words > when.get("max_query_words", words):
+            return False
+        depth = features.get("conversation_depth", 0)
+        if depth < when.get("min_depth", 0) or depth > when.get("max_depth", depth):
+            return False
+        if "max_distance" in when or "min_distance" in when:
+            # Unknown retrieval confidence never satisfies a distance condition
+            distance = features.get("best_distance")
+            if distance is None:
+                return False
+            if distance > when.get("max_distance", distance) or distance < when.get("min_distance", distance):
+                return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_k": self.top_k,
+            "when": dict(self.when),
+        }
+
+
+def load_routes(path: Optional[str] = None) -> List[Route]:
+    """Routes from a JSON file (a list shaped like DEFAULT_ROUTES), or the defaults."""
+    specs = DEFAULT_ROUTES
+    if path:
+        with open(path, 'r') as f:
+            specs = json.load(f)
+    return [Route(**spec) for spec in specs]
+
+
+def route_features(query: str, scored_docs, intent: Optional[str] = None, form_intent: bool = False, conversation_depth: int = 0) -> Dict[str, Any]:
+    """
+    Compute the routing features of a request.
+
+    Args:
+        query: User query
+        scored_docs: (document, distance) pairs from retrieval, closest first
+        intent: Detected intent, if any
+        form_intent: Whether the intent collects form fields
+        conversation_depth: Number of earlier turns in the conversation
+
+    Returns:
+        Feature dict passed to ModelRouter.choose()
+    """
+    distances = [distance for _, distance in scored_docs if distance == distance]  # drop NaN
+    return {
+        "intent": intent,
+        "form_intent": form_intent,
+        "query_words": len(query.split()),
+        "best_distance": min(distances) if distances else None,
+        "conversation_depth": conversation_depth,
+    }
+
+
+class ModelRouter:
+    """
+    Pick a route per request and record per-route latency and token usage.
+    """
+
+    def __init__(self, routes: Optional[List[Route]] = None):
+        """
+        Initialize the router.
+
+        Args:
+            routes: Routes in priority order; the last one is the fallback
+        """
+        self.routes = routes or load_routes()
+        names = [route.name for route in self.routes]
+        if len(set(names)) != len(names):
+            raise ValueError("Route names must be unique")
+        self._lock = threading.Lock()
+        self._metrics = {route.name: self._empty_metrics() for route in self.routes}
+        self._latencies = {route.name: deque(maxlen=LATENCY_WINDOW) for route in self.routes}
+
+    @staticmethod
+    def _empty_metrics() -> Dict[str, Any]:
+        return {"requests": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0, "latency_ms_total": 0.0}
+
+    @property
+    def max_top_k(self) -> int:
+        """Most chunks any route may use; retrieval fetches this many once."""
+        return max(route.top_k for route in self.routes)
+
+    def choose(self, features: Dict[str, Any]) -> Route:
+        for route in self.routes:
+            if route.matches(features):
+                return route
+        return self.routes[-1]
+
+    def record(self, route: Route, started_at: float, input_tokens: int = 0, output_tokens: int = 0, error: bool = False) -> None:
+        """
+        Record one completion on a route.
+
+        Args:
+            route: Route the completion ran on
+            started_at: time.monotonic() when the completion started
+            input_tokens: Prompt tokens
+            output_tokens: Completion tokens
+            error: Whether the completion failed
+        """
+        latency_ms = (time.monotonic() - started_at) * 1000.0
+        with self._lock:
+            metrics = self._metrics[route.name]
+            metrics["requests"] += 1
+            metrics["errors"] += int(error)
+            metrics["input_tokens"] += input_tokens
+            metrics["output_tokens"] += output_tokens
+            metrics["latency_ms_total"] += latency_ms
+            self._latencies[route.name].append(latency_ms)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-route request counts, token totals and latency percentiles."""
+        stats = {}
+        with self._lock:
+            for route in self.routes:
+                metrics = dict(self._metrics[route.name])
+                latencies = sorted(self._latencies[route.name])
+                total = metrics.pop("latency_ms_total")
+                metrics["model"] = route.model
+                metrics["mean_latency_ms"] = total / metrics["requests"] if metrics["requests"] else 0.0
+                metrics["p50_latency_ms"] = latencies[len(latencies) // 2] if latencies else 0.0
+                metrics["p95_latency_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+                stats[route.name] = metrics
+        return stats
+
+
+_encodings: Dict[str, Any] = {}
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Estimate the token count of text for a model with tiktoken."""
+    encoding = _encodings.get(model)
+    if encoding is None:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = encoding
+    return len(encoding.encode(text))
+
+
+def token_usage(message) -> Optional[Dict[str, int]]:
+    """Token usage reported with a chat model response, if the client exposes it."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+    usage = (getattr(message, "response_metadata", None) or {}).get("token_usage")
+    if usage:
+        return {"input_tokens": usage.get("prompt_tokens", 0), "output_tokens": usage.get("completion_tokens", 0)}
+    return None
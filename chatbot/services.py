@@ -0,0 +1,309 @@
+"""
+Process-wide services shared by the chatbot views
+
+Building the RAG index is expensive, so each worker process keeps one
+RAGSystem and reuses it across requests instead of constructing it per call.
+When retrieval sidecars are configured the worker holds no index at all.
+"""
+
+import threading
+
+from django.conf import settings
+
+from .admission import AdmissionController
+from .answer_store import PrecomputedAnswerStore
+from .appointments import AppointmentScheduler, load_offices
+from .conversation import ConversationMemory
+from .documents import DocumentIntake
+from .geodata import OfficeLocator
+from .memory import MemoryAccountant, parse_budgets, parse_size
+from .rag_system import RAGSystem
+from .prefetch import Prefetcher
+from .profiling import RequestProfiler
+from .reloader import KnowledgeBaseWatcher
+from .rerank import Reranker, load_cross_encoder
+from .response_cache import ResponseCache
+from .retrieval_sidecar import make_client
+from .routing import ModelRouter, load_routes
+from .submissions import SubmissionWriter
+from .websocket import ChatSocketApp
+from .warmup import CacheWarmer, QueryLog
+
+_lock = threading.RLock()
+_rag_system = None
+_watcher = None
+_admission = None
+_answer_store = None
+_prefetcher = None
+_response_cache = None
+_query_log = None
+_cache_warmer = None
+_profiler = None
+_memory_accountant = None
+_conversations = None
+_submission_writer = None
+_scheduler = None
+_office_locator = None
+_document_intake = None
+_chat_sockets = None
+
+
+def get_rag_system() -> RAGSystem:
+    """Return this process's RAGSystem, building its index on first use."""
+    global _rag_system, _watcher, _cache_warmer
+    if _rag_system is not None:
+        return _rag_system
+    with _lock:
+        if _rag_system is None:
+            rag_system = RAGSystem(
+                knowledge_base_dir=str(settings.KNOWLEDGE_BASE_DIR),
+                openai_api_key=settings.OPENAI_API_KEY
+            )
+            rag_system.router = ModelRouter(load_routes(settings.CHAT_MODEL_ROUTES_FILE))
+            if settings.RERANK_CANDIDATES > 0:
+                rag_system.reranker = Reranker(
+                    candidates=settings.RERANK_CANDIDATES,
+                    budget_ms=settings.RERANK_BUDGET_MS,
+                    cache_size=settings.RERANK_FEATURE_CACHE,
+                    min_relative_score=settings.RERANK_MIN_RELATIVE_SCORE,
+                    model=load_cross_encoder(settings.RERANK_MODEL) if settings.RERANK_MODEL else None
+                )
+            if settings.NEARBY_OFFICES_IN_PROMPT:
+                rag_system.offices = get_office_locator()
+            if settings.RETRIEVAL_SIDECAR_SOCKETS:
+                # The sidecar owns (and hot-reloads) the index; this worker holds none
+                rag_system.retriever = make_client(settings.RETRIEVAL_SIDECAR_SOCKETS)
+            else:
+                rag_system.build_index()
+            if settings.KNOWLEDGE_BASE_WATCH_INTERVAL > 0 and rag_system.retriever is None:
+                _watcher = KnowledgeBaseWatcher(
+                    rag_system,
+                    interval=settings.KNOWLEDGE_BASE_WATCH_INTERVAL
+                ).start()
+            if settings.QUERY_LOG_PATH:
+                _cache_warmer = start_cache_warmer(rag_system)
+            _rag_system = rag_system
+            get_memory_accountant()
+    return _rag_system
+
+
+def get_watcher():
+    """Return the knowledge base watcher, if one is running."""
+    return _watcher
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return this process's chat admission controller."""
+    global _admission
+    if _admission is None:
+        with _lock:
+            if _admission is None:
+                _admission = AdmissionController(
+                    max_concurrent=settings.CHAT_MAX_CONCURRENT,
+                    max_queue=settings.CHAT_MAX_QUEUE,
+                    queue_timeout=settings.CHAT_QUEUE_TIMEOUT
+                )
+    return _admission
+
+
+def get_answer_store() -> PrecomputedAnswerStore:
+    """Return the precomputed answer store for info-only intents."""
+    global _answer_store
+    if _answer_store is None:
+        with _lock:
+            if _answer_store is None:
+                _answer_store = PrecomputedAnswerStore(
+                    path=str(settings.PRECOMPUTED_ANSWERS_PATH),
+                    knowledge_base_dir=str(settings.KNOWLEDGE_BASE_DIR)
+                )
+    return _answer_store
+
+
+def get_prefetcher() -> Prefetcher:
+    """Return this process's speculative retrieval prefetcher."""
+    global _prefetcher
+    if _prefetcher is None:
+        with _lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher(
+                    get_rag_system,
+                    client_rate=settings.PREFETCH_CLIENT_RATE,
+                    global_rate=settings.PREFETCH_GLOBAL_RATE
+                )
+    return _prefetcher
+
+
+def get_response_cache() -> ResponseCache:
+    """Return this process's cache of answers to general questions."""
+    global _response_cache
+    if _response_cache is None:
+        with _lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=settings.RESPONSE_CACHE_SIZE,
+                    ttl=settings.RESPONSE_CACHE_TTL
+                )
+    return _response_cache
+
+
+def get_conversation_memory() -> ConversationMemory:
+    """Return this process's per-client retrieval context for follow-up turns."""
+    global _conversations
+    if _conversations is None:
+        with _lock:
+            if _conversations is None:
+                _conversations = ConversationMemory(
+                    max_sessions=settings.CONVERSATION_MAX_SESSIONS,
+                    ttl=settings.CONVERSATION_TTL
+                )
+    return _conversations
+
+
+def get_submission_writer() -> SubmissionWriter:
+    """Return this process's write-behind queue for DMV form submissions."""
+    global _submission_writer
+    if _submission_writer is None:
+        with _lock:
+            if _submission_writer is None:
+                _submission_writer = SubmissionWriter(
+                    str(settings.FORM_SUBMISSIONS_DB),
+                    batch_size=settings.FORM_SUBMISSION_BATCH_SIZE,
+                    max_pending=settings.FORM_SUBMISSION_MAX_PENDING
+                )
+    return _submission_writer
+
+
+def get_appointment_scheduler() -> AppointmentScheduler:
+    """Return this process's appointment slot calendars, loading confirmed appointments."""
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                offices, services = load_offices(settings.APPOINTMENT_OFFICES_FILE)
+                _scheduler = AppointmentScheduler(
+                    offices, services,
+                    path=str(settings.APPOINTMENTS_DB),
+                    horizon_days=settings.APPOINTMENT_HORIZON_DAYS,
+                    hold_seconds=settings.APPOINTMENT_HOLD_SECONDS
+                )
+    return _scheduler
+
+
+def get_office_locator() -> OfficeLocator:
+    """Return this process's offline gazetteer and nearest-office index."""
+    global _office_locator
+    if _office_locator is None:
+        with _lock:
+            if _office_locator is None:
+                _office_locator = OfficeLocator.load(settings.GEODATA_OFFICES_FILE, settings.GEODATA_GAZETTEER_FILE)
+    return _office_locator
+
+
+def get_document_intake() -> DocumentIntake:
+    """Return this process's document upload spool and extraction pool."""
+    global _document_intake
+    if _document_intake is None:
+        with _lock:
+            if _document_intake is None:
+                _document_intake = DocumentIntake(
+                    str(settings.DOCUMENT_UPLOAD_DIR),
+                    str(settings.DOCUMENTS_DB),
+                    workers=settings.DOCUMENT_WORKERS,
+                    max_bytes=settings.DOCUMENT_MAX_BYTES,
+                    max_pending=settings.DOCUMENT_MAX_PENDING,
+                    job_ttl=settings.DOCUMENT_JOB_TTL
+                )
+    return _document_intake
+
+
+def get_chat_sockets() -> ChatSocketApp:
+    """Return this process's WebSocket chat transport (mounted by govchat/asgi.py)."""
+    global _chat_sockets
+    if _chat_sockets is None:
+        with _lock:
+            if _chat_sockets is None:
+                # Imported here: the views import this module
+                from .views import stream_chat_turn
+                _chat_sockets = ChatSocketApp(
+                    stream_chat_turn,
+                    max_connections=settings.WEBSOCKET_MAX_CONNECTIONS,
+                    max_per_client=settings.WEBSOCKET_MAX_PER_CLIENT,
+                    heartbeat_interval=settings.WEBSOCKET_HEARTBEAT_INTERVAL,
+                    idle_timeout=settings.WEBSOCKET_IDLE_TIMEOUT,
+                    send_timeout=settings.WEBSOCKET_SEND_TIMEOUT,
+                    turn_workers=settings.WEBSOCKET_TURN_WORKERS,
+                    # Django's own default when DEBUG is on and ALLOWED_HOSTS is empty
+                    allowed_hosts=settings.ALLOWED_HOSTS or (['.localhost', '127.0.0.1', '[::1]'] if settings.DEBUG else []),
+                    allowed_origins=settings.WEBSOCKET_ALLOWED_ORIGINS
+                )
+    return _chat_sockets
+
+
+def get_request_profiler() -> RequestProfiler:
+    """Return this process's on-demand request profiler."""
+    global _profiler
+    if _profiler is None:
+        with _lock:
+            if _profiler is None:
+                _profiler = RequestProfiler(
+                    admin_token=settings.PROFILE_ADMIN_TOKEN,
+                    sample_rate=settings.PROFILE_SAMPLE_RATE,
+                    interval=settings.PROFILE_INTERVAL_MS / 1000.0,
+                    max_profiles=settings.PROFILE_MAX_STORED
+                )
+    return _profiler
+
+
+def get_query_log():
+    """Return the query log, or None if QUERY_LOG_PATH is not set."""
+    global _query_log
+    if _query_log is None and settings.QUERY_LOG_PATH:
+        _query_log = QueryLog(settings.QUERY_LOG_PATH)
+    return _query_log
+
+
+def start_cache_warmer(rag_system: RAGSystem) -> CacheWarmer:
+    """Warm the caches from the query log in the background."""
+    # Imported here: the views import this module
+    from .views import load_system_prompt
+    return CacheWarmer(
+        rag_system,
+        get_response_cache(),
+        settings.QUERY_LOG_PATH,
+        get_system_prompt=load_system_prompt,
+        mode=settings.CHAT_ANSWER_MODE,
+        top_n=settings.CACHE_WARM_TOP_N,
+        completions_per_second=settings.CACHE_WARM_RATE
+    ).start()
+
+
+def get_cache_warmer():
+    """Return the cache warmer started with the RAG system, if any."""
+    return _cache_warmer
+
+
+def _memory_usage():
+    """Bytes per component of everything this process has created so far."""
+    usage = {}
+    for component in (_rag_system, _answer_store, _prefetcher, _response_cache, _profiler, _conversations,
+                      _submission_writer, _scheduler, _office_locator, _document_intake, _chat_sockets):
+        if component is not None:
+            usage.update(component.memory_usage())
+    return usage
+
+
+def get_memory_accountant() -> MemoryAccountant:
+    """Return this process's memory accountant, monitoring budgets if any are set."""
+    global _memory_accountant
+    if _memory_accountant is None:
+        with _lock:
+            if _memory_accountant is None:
+                accountant = MemoryAccountant(
+                    budgets=parse_budgets(settings.MEMORY_BUDGETS),
+                    total_budget=parse_size(settings.MEMORY_TOTAL_BUDGET)
+                )
+                accountant.register(_memory_usage)
+                if (accountant.budgets or accountant.total_budget) and settings.MEMORY_CHECK_INTERVAL > 0:
+                    accountant.start_monitor(settings.MEMORY_CHECK_INTERVAL)
+                _memory_accountant = accountant
+    return _memory_accountant
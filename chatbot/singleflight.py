@@ -0,0 +1,236 @@
+"""
+Single-flight request coalescing for GovFlowAI
+
+When many users ask the same question at the same moment, only one of them
+should pay for embedding, retrieval and the LLM completion. This module
+provides:
+1. Normalized coalescing keys built from (query, location, prompt version)
+2. A SingleFlight group that lets concurrent callers share one in-flight call,
+   from threads (WSGI workers) or asyncio tasks (ASGI)
+3. Shared streaming, where late joiners replay what has already been produced
+"""
+
+import asyncio
+import hashlib
+import re
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+
+def prompt_version(system_prompt: str) -> str:
+    """Short, stable fingerprint of a system prompt."""
+    return hashlib.sha1(system_prompt.encode('utf-8')).hexdigest()[:12]
+
+
+def normalize_question(query: str) -> str:
+    """Lower-case a query, collapse whitespace and strip surrounding punctuation."""
+    return re.sub(r'\s+', ' ', query.lower()).strip(' \t\n?!.,')
+
+
+def make_key(query: str, location: str, version: str) -> str:
+    """
+    Build a coalescing key for a chat request.
+
+    Queries are normalized with normalize_question(), so "What is REAL ID?"
+    and "what is real id" share one computation.
+    """
+    normalized_query = normalize_question(query)
+    normalized_location = re.sub(r'\s+', ' ', (location or '').lower()).strip()
+    return f"{version}|{normalized_location}|{normalized_query}"
+
+
+class _Stream:
+    """Chunks produced by a single streaming call, shared by all its consumers."""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+
+    def append(self, chunk: Any) -> None:
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def iterate(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """Yield every chunk from the start, blocking until more arrive."""
+        position = 0
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(
+                    lambda: position < len(self.chunks) or self.done, timeout=timeout
+                ):
+                    raise TimeoutError("Timed out waiting for shared stream")
+                pending = self.chunks[position:]
+                done, error = self.done, self.error
+            for chunk in pending:
+                yield chunk
+            position += len(pending)
+            if done and position >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key becomes the leader and runs the function; any
+    caller arriving while it is in flight waits for the same result. Once the
+    call completes (successfully or not) the key is released, so a failure is
+    delivered to the callers that were waiting on it and never to later ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._streams: Dict[str, _Stream] = {}
+        # Running do_async() calls, referenced so they aren't garbage collected
+        self._tasks = set()
+        self.stats = {"leaders": 0, "shared": 0}
+
+    def _claim(self, key: str):
+        """Return (future, is_leader) for a key."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.stats["shared"] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.stats["leaders"] += 1
+            return future, True
+
+    def _release(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run fn once for all concurrent callers with the same key.
+
+        Args:
+            key: Coalescing key, usually from make_key()
+            fn: Zero-argument callable producing the result
+            timeout: Seconds a waiting caller will wait before giving up; the
+                leader itself is never interrupted
+
+        Returns:
+            The result of fn, shared by every caller in the flight
+        """
+        future, is_leader = self._claim(key)
+        if is_leader:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self._release(key, future)
+            return future.result()
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Timed out waiting for in-flight request {key!r}")
+
+    async def do_async(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Asyncio counterpart of do().
+
+        fn may be a coroutine function or a plain blocking callable; blocking
+        callables run in the default executor. Flights are shared with
+        threaded callers of do() using the same key.
+
+        The call runs in a task of its own, so cancelling the leader's request
+        (a client disconnect or a timeout around it) leaves the flight running
+        for the other callers.
+        """
+        future, is_leader = self._claim(key)
+        if is_leader:
+            task = asyncio.ensure_future(self._run_async(key, future, fn))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for in-flight request {key!r}")
+
+    async def _run_async(self, key: str, future: Future, fn: Callable[[], Any]) -> None:
+        """Run a do_async() call and publish its outcome to every caller."""
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                result = await fn()
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(None, fn)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            if not future.done():
+                # The task itself was cancelled (e.g. the event loop is closing)
+                future.set_exception(RuntimeError(f"In-flight request {key!r} was abandoned"))
+            self._release(key, future)
+
+    def stream(self, key: str, produce: Callable[[], Iterable[Any]], timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Share one streaming producer among all concurrent consumers of a key.
+
+        The leader drives the producer on a background thread so that a slow
+        or disconnected consumer never stalls the others. Every consumer,
+        including ones that join late, receives the full sequence of chunks.
+
+        Args:
+            key: Coalescing key
+            produce: Zero-argument callable returning an iterable of chunks
+            timeout: Maximum seconds to wait for each next chunk
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = _Stream()
+                self._streams[key] = shared
+                self.stats["leaders"] += 1
+                is_leader = True
+            else:
+                self.stats["shared"] += 1
+                is_leader = False
+
+        if is_leader:
+            def run():
+                try:
+                    for chunk in produce():
+                        shared.append(chunk)
+                    shared.finish()
+                except BaseException as e:
+                    shared.finish(e)
+                finally:
+                    with self._lock:
+                        if self._streams.get(key) is shared:
+                            del self._streams[key]
+            threading.Thread(target=run, name="singleflight-stream", daemon=True).start()
+
+        return shared.iterate(timeout=timeout)
+
+    async def astream(self, key: str, produce: Callable[[], Iterable[Any]], timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """Asyncio counterpart of stream()."""
+        loop = asyncio.get_running_loop()
+        iterator = self.stream(key, produce, timeout=timeout)
+        sentinel = object()
+        while True:
+            chunk = await loop.run_in_executor(None, next, iterator, sentinel)
+            if chunk is sentinel:
+                return
+            yield chunk
@@ -1,6 +1,17 @@
 // Constants
 const DEFAULT_LOCATION = 'California';
 
+// Questions already sent in this conversation; the server uses it to route requests
+let conversationDepth = 0;
+
+// Identifies this conversation so the server can match prefetched context to the final message
+const CLIENT_ID = Math.random().toString(36).slice(2) + Date.now().toString(36);
+// Wait this long after the last keystroke before prefetching, and skip short drafts
+const PREFETCH_DEBOUNCE_MS = 400;
+const PREFETCH_MIN_CHARS = 12;
+let prefetchTimer = null;
+let lastPrefetched = '';
+
 // DOM Elements
 const chatMessages = document.getElementById('chat-messages');
 const userInput = document.getElementById('user-input');
@@ -193,6 +204,28 @@ userInput.addEventListener('keypress', (e) => {
         chatForm.dispatchEvent(new Event('submit'));
     }
 });
+userInput.addEventListener('input', schedulePrefetch);
+
+// Send the draft to the server once typing pauses so retrieval can start early
+function schedulePrefetch() {
+    clearTimeout(prefetchTimer);
+    prefetchTimer = setTimeout(() => {
+        const partial = userInput.value.trim();
+        if (partial.length < PREFETCH_MIN_CHARS || partial === lastPrefetched) return;
+        lastPrefetched = partial;
+        fetch('/api/chat/prefetch/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                partial: partial,
+                location: DEFAULT_LOCATION,
+                client_id: CLIENT_ID
+            })
+        }).catch(() => {});  // Best effort only
+    }, PREFETCH_DEBOUNCE_MS);
+}
 
 // Form dismissal event listeners
 closeFormBtn.addEventListener('click', closeForm);
@@ -224,6 +257,8 @@ async function handleUserMessage(e) {
     // Add user message to chat
     addUserMessage(message);
     userInput.value = '';
+    clearTimeout(prefetchTimer);
+    lastPrefetched = '';
 
     // Show typing indicator
     showTypingIndicator();
@@ -243,7 +278,9 @@ async function handleUserMessage(e) {
                 },
                 body: JSON.stringify({
                     message: message,
-                    location: DEFAULT_LOCATION
+                    location: DEFAULT_LOCATION,
+                    conversation_depth: conversationDepth++,
+                    client_id: CLIENT_ID
                 })
             });
             
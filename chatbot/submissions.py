@@ -0,0 +1,375 @@
+"""
+Durable DMV form submission for GovFlowAI
+
+Submitted forms used to be validated and then dropped. This module gives
+them a real path to disk without putting the disk on the request path:
+1. Validation schemas are compiled once per form type from CA_DMV_INTENTS,
+   so checking a form is a handful of precomputed field checks. The schemas
+   accept both the API's field names (full_name, vehicle_info) and the chat
+   frontend's (full-name, vehicle-make/-model/-year), with addresses as
+   nested objects
+2. Accepted forms go on an in-memory write-behind queue and the request
+   returns at once with a submission id; if the queue is full the caller is
+   told to retry rather than blocked
+3. One writer thread drains the queue into SQLite in WAL mode, a batch of
+   forms per transaction. The thread is restarted if it dies, and a batch
+   that keeps failing is retried row by row; rows SQLite still refuses are
+   set aside in a JSON lines file next to the database
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .memory import sampled_sizeof
+
+ADDRESS_FIELDS = ('current_address', 'new_address')
+ADDRESS_PARTS = ('street', 'city', 'state', 'zip')
+OPTIONAL_ADDRESS_PARTS = ('county',)
+# Grouped fields the frontend sends flat, e.g. vehicle-make for vehicle_info.make
+COMPOSITE_FIELDS = {
+    'vehicle_info': ('vehicle_', ('make', 'model', 'year')),
+    'buyer_info': ('buyer_', ('full_name',)),
+}
+# Failed writes of one batch before its rows are written (or set aside) one at a time
+MAX_WRITE_ATTEMPTS = 5
+MAX_RETRY_DELAY = 60.0
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS form_submissions (
+    id TEXT PRIMARY KEY,
+    form_type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    stored_at REAL NOT NULL
+)
+"""
+
+
+class QueueFull(Exception):
+    """Raised when the write-behind queue has no room for a submission."""
+
+
+def _filled(value: Any) -> bool:
+    return value is not None and (not isinstance(value, str) or value.strip() != '')
+
+
+def _normalize_keys(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Accept frontend field ids (full-name) as API names (full_name), at any depth."""
+    return {
+        str(key).replace('-', '_'): _normalize_keys(value) if isinstance(value, dict) else value
+        for key, value in data.items()
+    }
+
+
+def _plain_check(name: str) -> Callable[[Dict[str, Any], Dict[str, Any], List[str]], None]:
+    def check(data, record, missing):
+        value = data.get(name)
+        if _filled(value):
+            record[name] = value
+        else:
+            missing.append(name)
+    return check
+
+
+def _address_check(name: str) -> Callable[[Dict[str, Any], Dict[str, Any], List[str]], None]:
+    def check(data, record, missing):
+        address = data.get(name)
+        if not isinstance(address, dict):
+            missing.append(name)
+            return
+        parts = {}
+        for part in ADDRESS_PARTS:
+            if _filled(address.get(part)):
+                parts[part] = address[part]
+            else:
+                missing.append(f'{name}.{part}')
+        for part in OPTIONAL_ADDRESS_PARTS:
+            if _filled(address.get(part)):
+                parts[part] = address[part]
+        record[name] = parts
+    return check
+
+
+def _composite_check(name: str, prefix: str, parts: Tuple[str, ...]) -> Callable[[Dict[str, Any], Dict[str, Any], List[str]], None]:
+    flat_keys = [(part, prefix + part) for part in parts]
+
+    def check(data, record, missing):
+        grouped = data.get(name)
+        if isinstance(grouped, dict):
+            values = {part: grouped.get(part) for part in parts}
+        elif _filled(grouped):
+            # A single free-text value (e.g. "2019 Honda Civic") is accepted as is
+            record[name] = grouped
+            return
+        else:
+            values = {part: data.get(flat) for part, flat in flat_keys}
+        absent = [part for part, value in values.items() if not _filled(value)]
+        if len(absent) == len(parts):
+            missing.append(name)
+        else:
+            missing.extend(f'{name}.{part}' for part in absent)
+        record[name] = {part: value for part, value in values.items() if _filled(value)}
+    return check
+
+
+class FormSchema:
+    """Precompiled validator for one form type."""
+
+    def __init__(self, form_type: str, name: str, fields: Sequence[str]):
+        self.form_type = form_type
+        self.name = name
+        self.fields = tuple(fields)
+        self._checks = []
+        for field in self.fields:
+            if field in ADDRESS_FIELDS:
+                self._checks.append(_address_check(field))
+            elif field in COMPOSITE_FIELDS:
+                prefix, parts = COMPOSITE_FIELDS[field]
+                self._checks.append(_composite_check(field, prefix, parts))
+            else:
+                self._checks.append(_plain_check(field))
+
+    def validate(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Check a submitted form.
+
+        Args:
+            data: Submitted fields, API or frontend names, addresses nested
+
+        Returns:
+            (record with only the schema's fields, names of missing fields)
+        """
+        data = _normalize_keys(data)
+        record: Dict[str, Any] = {}
+        missing: List[str] = []
+        for check in self._checks:
+            check(data, record, missing)
+        return record, missing
+
+
+def compile_schemas(intents: Dict[str, Dict[str, Any]]) -> Dict[str, FormSchema]:
+    """Build a FormSchema for every intent that collects fields."""
+    return {
+        form_type: FormSchema(form_type, info['name'], info['fields'])
+        for form_type, info in intents.items()
+        if info.get('fields')
+    }
+
+
+class SubmissionWriter:
+    """
+    Write-behind queue persisting form submissions to SQLite in batches.
+    """
+
+    def __init__(self, path: str, batch_size: int = 500, max_pending: int = 100000, flush_interval: float = 0.05):
+        """
+        Initialize the writer.
+
+        Args:
+            path: SQLite database file
+            batch_size: Most submissions written per transaction
+            max_pending: Submissions queued before new ones are refused
+            flush_interval: Seconds the writer waits for more submissions
+                before committing a partial batch
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self._queue: deque = deque()
+        self._pending_ids = set()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        # Rows SQLite refused even one at a time; status() looks them up here
+        self.failed_path = path + '.failed.jsonl'
+        self.stats = {"accepted": 0, "refused": 0, "stored": 0, "transactions": 0, "errors": 0,
+                      "set_aside": 0, "restarts": 0}
+
+    def submit(self, form_type: str, record: Dict[str, Any]) -> str:
+        """Queue one validated form and return its submission id."""
+        return self.submit_many([(form_type, record)])[0]
+
+    def submit_many(self, forms: Sequence[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """
+        Queue validated forms and return their submission ids. Either all
+        are queued or, if there is no room for all of them, none.
+
+        Raises:
+            QueueFull: The queue can't take this many more submissions
+        """
+        received_at = time.time()
+        rows = [(uuid.uuid4().hex, form_type, json.dumps(record), received_at) for form_type, record in forms]
+        with self._condition:
+            if len(self._queue) + len(rows) > self.max_pending:
+                self.stats["refused"] += len(rows)
+                raise QueueFull(f"{len(self._queue)} submissions already waiting to be written")
+            self._queue.extend(rows)
+            self._pending_ids.update(row[0] for row in rows)
+            self.stats["accepted"] += len(rows)
+            self._ensure_started()
+            self._condition.notify()
+        return [row[0] for row in rows]
+
+    def _ensure_started(self) -> None:
+        """Start the writer thread, or restart it if it died (condition held)."""
+        if self._thread is None or not self._thread.is_alive():
+            if self._thread is not None:
+                self.stats["restarts"] += 1
+            self._thread = threading.Thread(target=self._run, name="form-submission-writer", daemon=True)
+            self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL survives process crashes; only a power
+        # loss can drop the last transactions
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(SCHEMA_SQL)
+        connection.commit()
+        return connection
+
+    def _run(self) -> None:
+        """Write batches until the process exits, reconnecting after unexpected errors."""
+        delay = 1.0
+        while True:
+            connection = None
+            try:
+                connection = self._connect()
+                delay = 1.0
+                self._write_batches(connection)
+            except Exception as e:
+                print(f"Form submission writer failed, restarting in {delay:g}s ({type(e).__name__}: {e})")
+                with self._condition:
+                    self.stats["errors"] += 1
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _write_batches(self, connection: sqlite3.Connection) -> None:
+        attempts = 0
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                if len(self._queue) < self.batch_size:
+                    # Give a burst a moment to fill the batch
+                    self._condition.wait(self.flush_interval)
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                stored, set_aside = self._write(connection, batch, one_by_one=attempts >= MAX_WRITE_ATTEMPTS)
+            except BaseException as e:
+                # Nothing of this batch is known to be stored; put it back first
+                with self._condition:
+                    self._queue.extendleft(reversed(batch))
+                if not isinstance(e, sqlite3.Error):
+                    raise
+                attempts += 1
+                print(f"Form submission write failed (attempt {attempts}), retrying ({type(e).__name__}: {e})")
+                with self._condition:
+                    self.stats["errors"] += 1
+                time.sleep(min(2 ** (attempts - 1), MAX_RETRY_DELAY))
+                continue
+            attempts = 0
+            with self._condition:
+                self._pending_ids.difference_update(row[0] for row in batch)
+                self.stats["stored"] += len(stored)
+                self.stats["set_aside"] += len(set_aside)
+                self.stats["transactions"] += 1
+                self._condition.notify_all()
+
+    def _write(self, connection: sqlite3.Connection, batch: List[Tuple], one_by_one: bool = False) -> Tuple[List[Tuple], List[Tuple]]:
+        """
+        Insert a batch in one transaction, or row by row after repeated failures.
+
+        Returns:
+            Tuple of (rows stored, rows set aside in failed_path)
+        """
+        insert = "INSERT OR IGNORE INTO form_submissions (id, form_type, data, received_at, stored_at) VALUES (?, ?, ?, ?, ?)"
+        stored_at = time.time()
+        if not one_by_one:
+            with connection:
+                connection.executemany(insert, [row + (stored_at,) for row in batch])
+            return batch, []
+        stored, refused = [], []
+        for row in batch:
+            try:
+                with connection:
+                    connection.execute(insert, row + (stored_at,))
+                stored.append(row)
+            except sqlite3.Error as e:
+                refused.append((row, str(e)))
+        if refused and len(refused) == len(batch):
+            # Nothing can be written (e.g. a read-only or full disk): keep retrying
+            raise sqlite3.OperationalError(refused[0][1])
+        with open(self.failed_path, 'a', encoding='utf-8') as failed:
+            for (submission_id, form_type, data, received_at), error in refused:
+                print(f"Form submission {submission_id} set aside in {self.failed_path}: {error}")
+                failed.write(json.dumps({"id": submission_id, "form_type": form_type, "data": json.loads(data),
+                                         "received_at": received_at, "error": error}) + "\n")
+        return stored, [row for row, _ in refused]
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is on disk; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            if self._queue:
+                self._ensure_started()
+            while self._pending_ids:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def status(self, submission_id: str) -> Optional[Dict[str, Any]]:
+        """Whether a submission is still queued or stored; None if unknown."""
+        with self._condition:
+            if submission_id in self._pending_ids:
+                return {"id": submission_id, "status": "queued"}
+        connection = sqlite3.connect(self.path)
+        try:
+            row = connection.execute(
+                "SELECT form_type, received_at, stored_at FROM form_submissions WHERE id = ?", (submission_id,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            connection.close()
+        if row is None:
+            return {"id": submission_id, "status": "failed"} if self._was_set_aside(submission_id) else None
+        return {"id": submission_id, "status": "stored", "form_type": row[0], "received_at": row[1], "stored_at": row[2]}
+
+    def _was_set_aside(self, submission_id: str) -> bool:
+        """Whether a submission is in failed_path. The file only holds rows SQLite refused, so it stays small."""
+        try:
+            with open(self.failed_path, encoding='utf-8') as failed:
+                for line in failed:
+                    if submission_id not in line:
+                        continue
+                    try:
+                        if json.loads(line).get("id") == submission_id:
+                            return True
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return False
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes of the submissions waiting to be written."""
+        with self._condition:
+            count = len(self._queue)
+            sample = list(islice(self._queue, 32))
+        return {"submission_queue": sampled_sizeof(sample, count)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._condition:
+            return dict(self.stats, pending=len(self._queue))
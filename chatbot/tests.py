@@ -1,3 +1,749 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from langchain_core.documents import Document
+
+from .admission import PRIORITY_FAQ, PRIORITY_FORM, AdmissionController, Deadline, Overloaded
+from .appointments import AppointmentScheduler, SlotUnavailable
+from .conversation import ConversationMemory
+from .documents import (MAX_DOCUMENT_TEXT_CHARS, MAX_STREAM_BYTES, detect_fields, document_form_data, pdf_text_builtin,
+                        sniff_media_type)
+from .jurisdictions import JurisdictionIndexRegistry
+from .pipeline import Pipeline, Stage, StageTimeout
+from .reloader import KnowledgeBaseWatcher
+from .retrieval_sidecar import (RetrievalServer, SidecarError, decode_request, decode_response, encode_error,
+                                encode_request, encode_response)
+from .singleflight import SingleFlight
+from .submissions import SubmissionWriter
+from .warmup import QueryLog, load_frequent_queries
+from .websocket import CLOSE_FORBIDDEN, ChatSocketApp
+
+
+def wait_until(predicate, timeout=5.0):
+    """Poll a condition set by another thread; False if it never holds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class SingleFlightTests(SimpleTestCase):
+    def start_leader(self, flight, fn, results):
+        """Run flight.do() on a thread and return once fn has started."""
+        thread = threading.Thread(target=lambda: results.append(self.call(flight, fn)))
+        thread.start()
+        self.assertTrue(wait_until(lambda: flight.stats["leaders"] == 1))
+        return thread
+
+    @staticmethod
+    def call(flight, fn):
+        try:
+            return flight.do("key", fn, timeout=5)
+        except Exception as e:
+            return e
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def answer():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+
+        results = []
+        leader = self.start_leader(flight, answer, results)
+        follower = threading.Thread(target=lambda: results.append(self.call(flight, answer)))
+        follower.start()
+        self.assertTrue(wait_until(lambda: flight.stats["shared"] == 1))
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(results, ["answer", "answer"])
+        self.assertEqual(len(calls), 1)
+
+    def test_error_reaches_waiting_callers_but_not_later_ones(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError("LLM unavailable")
+
+        results = []
+        leader = self.start_leader(flight, fail, results)
+        follower = threading.Thread(target=lambda: results.append(self.call(flight, fail)))
+        follower.start()
+        self.assertTrue(wait_until(lambda: flight.stats["shared"] == 1))
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        # The key was released, so the next caller runs its own call
+        self.assertEqual(flight.do("key", lambda: "recovered"), "recovered")
+
+    def test_stream_error_follows_the_chunks_already_produced(self):
+        flight = SingleFlight()
+
+        def produce():
+            yield "first"
+            yield "second"
+            raise RuntimeError("stream broke")
+
+        received = []
+        with self.assertRaises(RuntimeError):
+            for chunk in flight.stream("key", produce, timeout=5):
+                received.append(chunk)
+        self.assertEqual(received, ["first", "second"])
+
+    def test_cancelled_async_leader_does_not_fail_its_followers(self):
+        async def scenario():
+            flight = SingleFlight()
+            release = asyncio.Event()
+            calls = []
+
+            async def answer():
+                calls.append(1)
+                await release.wait()
+                return "answer"
+
+            leader = asyncio.ensure_future(flight.do_async("key", answer))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(flight.do_async("key", answer, timeout=5))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            release.set()
+            return await follower, calls
+
+        result, calls = asyncio.run(scenario())
+        self.assertEqual(result, "answer")
+        self.assertEqual(len(calls), 1)
+
+    def test_async_error_reaches_followers(self):
+        async def scenario():
+            flight = SingleFlight()
+
+            async def fail():
+                await asyncio.sleep(0.05)
+                raise ValueError("LLM unavailable")
+
+            return await asyncio.gather(flight.do_async("key", fail), flight.do_async("key", fail, timeout=5),
+                                        return_exceptions=True)
+
+        for result in asyncio.run(scenario()):
+            self.assertIsInstance(result, ValueError)
+
+
+class SidecarFramingTests(SimpleTestCase):
+    def body(self, frame):
+        """A frame without its length prefix, checking the prefix on the way."""
+        self.assertEqual(int.from_bytes(frame[:4], "big"), len(frame) - 4)
+        return frame[4:]
+
+    def test_request_round_trip(self):
+        frame = encode_request(7, "¿Cómo renuevo mi licencia?", 12, "San José")
+        self.assertEqual(decode_request(self.body(frame)), (7, "¿Cómo renuevo mi licencia?", 12, "San José"))
+
+    def test_response_round_trip(self):
+        hits = [(Document(page_content="Renew online every 5 years.", metadata={"source": "dmv_services.md", "chunk_id": 3}), 0.25),
+                (Document(page_content="Fees: $45", metadata={}), 1.5)]
+        request_id, decoded = decode_response(self.body(encode_response(9, hits)))
+        self.assertEqual(request_id, 9)
+        self.assertEqual([(doc.page_content, doc.metadata) for doc, _ in decoded],
+                         [(doc.page_content, doc.metadata) for doc, _ in hits])
+        self.assertEqual([distance for _, distance in decoded], [0.25, 1.5])
+
+    def test_empty_response(self):
+        self.assertEqual(decode_response(self.body(encode_response(1, []))), (1, []))
+
+    def test_error_frame_raises_for_its_request(self):
+        with self.assertRaises(SidecarError) as raised:
+            decode_response(self.body(encode_error(4, "index not loaded")))
+        self.assertEqual(raised.exception.request_id, 4)
+        self.assertIn("index not loaded", str(raised.exception))
+
+
+    def test_metadata_longer_than_64k_round_trips(self):
+        hits = [(Document(page_content="Fees", metadata={"notes": "x" * 70000}), 0.5)]
+        _, decoded = decode_response(self.body(encode_response(2, hits)))
+        self.assertEqual(decoded[0][0].metadata, hits[0][0].metadata)
+
+
+class SidecarServerTests(SimpleTestCase):
+    class Retrieval:
+        def retrieve_scored(self, query, top_k=4, location=""):
+            # A set is not JSON-serializable, so this hit cannot be encoded
+            metadata = {"tags": {"dmv"}} if query == "bad" else {"source": "dmv_services.md"}
+            return [(Document(page_content=f"about {query}", metadata=metadata), 0.5)]
+
+    def test_unencodable_response_gets_an_error_and_the_next_request_an_answer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            server = RetrievalServer(self.Retrieval(), socket_path=os.path.join(directory, "sidecar.sock"), max_wait_ms=0)
+
+            async def ask(reader, writer, request_id, query):
+                writer.write(encode_request(request_id, query, 3))
+                length = int.from_bytes(await reader.readexactly(4), "big")
+                return decode_response(await reader.readexactly(length))
+
+            async def scenario():
+                serving = asyncio.ensure_future(server.serve_forever())
+                while not os.path.exists(server.socket_path):
+                    await asyncio.sleep(0.005)
+                reader, writer = await asyncio.open_unix_connection(server.socket_path)
+                try:
+                    with self.assertRaises(SidecarError) as raised:
+                        await asyncio.wait_for(ask(reader, writer, 1, "bad"), 5)
+                    self.assertEqual(raised.exception.request_id, 1)
+                    return await asyncio.wait_for(ask(reader, writer, 2, "renewals"), 5)
+                finally:
+                    writer.close()
+                    await writer.wait_closed()
+                    # Let the server read EOF and finish the connection before it stops
+                    await asyncio.sleep(0.05)
+                    serving.cancel()
+                    await asyncio.gather(serving, return_exceptions=True)
+
+            request_id, hits = asyncio.run(scenario())
+        self.assertEqual(request_id, 2)
+        self.assertEqual(hits[0][0].page_content, "about renewals")
+        self.assertEqual(server.stats["errors"], 1)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def test_form_requests_are_admitted_before_earlier_faq_requests(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=5)
+        controller.acquire()
+        order = []
+
+        def request(name, priority):
+            with controller.admit(priority):
+                order.append(name)
+
+        faq = threading.Thread(target=request, args=("faq", PRIORITY_FAQ))
+        faq.start()
+        self.assertTrue(wait_until(lambda: controller.queued == 1))
+        form = threading.Thread(target=request, args=("form", PRIORITY_FORM))
+        form.start()
+        self.assertTrue(wait_until(lambda: controller.queued == 2))
+        controller.release()
+        faq.join(5)
+        form.join(5)
+
+        self.assertEqual(order, ["form", "faq"])
+        self.assertEqual(controller.active, 0)
+
+    def test_full_queue_sheds_at_once(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=5)
+        controller.acquire()
+        started = time.monotonic()
+        with self.assertRaises(Overloaded):
+            controller.acquire()
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(controller.stats["shed_queue_full"], 1)
+
+    def test_wait_is_capped_by_the_request_deadline(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=5)
+        controller.acquire()
+        started = time.monotonic()
+        with self.assertRaises(Overloaded):
+            controller.acquire(deadline=Deadline(0.05))
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(controller.stats["shed_timeout"], 1)
+        self.assertEqual(controller.queued, 0)
+        # The shed request's place in the queue is skipped, not handed the slot
+        controller.release()
+        self.assertEqual(controller.active, 0)
+        controller.acquire()
+        self.assertEqual(controller.active, 1)
+
+
+class PipelineTests(SimpleTestCase):
+    def test_independent_stages_run_together_and_feed_dependents(self):
+        def slow(value):
+            return lambda values: time.sleep(0.2) or value
+
+        pipeline = Pipeline([
+            Stage("intent", slow("dmv")),
+            Stage("retrieval", slow(["chunk"])),
+            Stage("answer", lambda values: f"{values['intent']}:{len(values['retrieval'])}:{values['message']}",
+                  deps=("intent", "retrieval"), inline=True),
+        ], max_workers=4)
+        result = pipeline.run({"message": "hi"})
+
+        self.assertEqual(result["answer"], "dmv:1:hi")
+        self.assertLess(result.total_ms, 350)
+        self.assertGreaterEqual(result.serial_ms, 400)
+
+    def test_failed_stage_uses_its_fallback(self):
+        def fail(values):
+            raise ValueError("no model")
+
+        pipeline = Pipeline([
+            Stage("intent", fail, fallback="general"),
+            Stage("prompt", fail, fallback=lambda values, error: f"default ({error})", inline=True),
+        ])
+        result = pipeline.run({})
+
+        self.assertEqual(result["intent"], "general")
+        self.assertEqual(result["prompt"], "default (no model)")
+        self.assertEqual(sorted(result.fallbacks), ["intent", "prompt"])
+        self.assertEqual(pipeline.stats()["fallbacks"], {"intent": 1, "prompt": 1})
+
+    def test_errors_outside_fallback_on_propagate(self):
+        def fail(values):
+            raise KeyError("form")
+
+        pipeline = Pipeline([Stage("extract", fail, fallback={}, fallback_on=(TimeoutError,))])
+        with self.assertRaises(KeyError):
+            pipeline.run({})
+        self.assertEqual(pipeline.stats()["errors"], 1)
+
+    def test_timed_out_stage_is_cancelled_and_falls_back(self):
+        stopped = threading.Event()
+
+        def generate(values):
+            values["cancelled"].wait(5)
+            stopped.set()
+            return "late answer"
+
+        pipeline = Pipeline([Stage("generation", generate, timeout=0.05,
+                                   fallback=lambda values, error: type(error).__name__)])
+        started = time.monotonic()
+        result = pipeline.run({})
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(result["generation"], "StageTimeout")
+        self.assertEqual(pipeline.stats()["timeouts"], {"generation": 1})
+        self.assertTrue(stopped.wait(5))
+
+    def test_timeout_without_fallback_raises(self):
+        pipeline = Pipeline([Stage("generation", lambda values: values["cancelled"].wait(5), timeout=0.05)])
+        with self.assertRaises(StageTimeout):
+            pipeline.run({})
+
+    def test_when_false_skips_the_stage(self):
+        pipeline = Pipeline([
+            Stage("cached", lambda values: "cached answer", inline=True),
+            Stage("generation", lambda values: "fresh answer", deps=("cached",),
+                  when=lambda values: values["cached"] is None),
+        ])
+        result = pipeline.run({})
+
+        self.assertIsNone(result["generation"])
+        self.assertEqual(result.skipped, ["generation"])
+
+
+class SubmissionWriterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.writer = SubmissionWriter(os.path.join(directory.name, "submissions.sqlite3"), batch_size=2,
+                                       flush_interval=0.01)
+
+    def test_flush_waits_until_every_submission_is_stored(self):
+        ids = self.writer.submit_many([("address_change", {"full_name": f"Resident {i}"}) for i in range(5)])
+
+        self.assertTrue(self.writer.flush(timeout=5))
+        for submission_id in ids:
+            self.assertEqual(self.writer.status(submission_id)["status"], "stored")
+        self.assertEqual(self.writer.stats["stored"], 5)
+        self.assertGreaterEqual(self.writer.stats["transactions"], 3)
+        self.assertIsNone(self.writer.status("unknown"))
+
+    def test_dead_writer_thread_is_restarted_without_losing_submissions(self):
+        write = self.writer._write
+        calls = []
+
+        def die_once(*args, **kwargs):
+            if not calls:
+                calls.append(1)
+                raise SystemExit
+            return write(*args, **kwargs)
+
+        self.writer._write = die_once
+        submission_id = self.writer.submit("real_id", {"full_name": "Ana Lopez"})
+        self.writer._thread.join(5)
+        self.assertFalse(self.writer._thread.is_alive())
+        self.assertEqual(self.writer.status(submission_id)["status"], "queued")
+
+        self.assertTrue(self.writer.flush(timeout=5))
+        self.assertEqual(self.writer.status(submission_id)["status"], "stored")
+        self.assertEqual(self.writer.stats["restarts"], 1)
+
+    def test_row_sqlite_refuses_is_reported_failed_from_the_set_aside_file(self):
+        connect = self.writer._connect
+
+        def refusing_connect():
+            connection = connect()
+            connection.execute("CREATE TEMP TRIGGER refuse BEFORE INSERT ON form_submissions WHEN NEW.form_type = 'bad' "
+                               "BEGIN SELECT RAISE(ABORT, 'refused'); END")
+            return connection
+
+        self.writer._connect = refusing_connect
+        with mock.patch("chatbot.submissions.MAX_WRITE_ATTEMPTS", 0):
+            stored_id, refused_id = self.writer.submit_many([("real_id", {"full_name": "Ana Lopez"}), ("bad", {})])
+            self.assertTrue(self.writer.flush(timeout=5))
+
+        self.assertEqual(self.writer.status(stored_id)["status"], "stored")
+        self.assertEqual(self.writer.status(refused_id)["status"], "failed")
+        self.assertEqual(self.writer.stats["set_aside"], 1)
+        # Nothing about set-aside rows is kept in memory; a new writer finds them too
+        self.assertEqual(SubmissionWriter(self.writer.path).status(refused_id)["status"], "failed")
+
+
+class AppointmentSchedulerTests(SimpleTestCase):
+    OFFICES = [{"id": "fresno", "name": "Fresno DMV", "city": "Fresno", "county": "Fresno",
+                "hours": {day: "08:00-17:00" for day in ("mon", "tue", "wed", "thu", "fri", "sat", "sun")},
+                "capacity": {"driving_test": 2, "driver_license": 1}}]
+    SERVICES = {"driving_test": {"name": "Drive Test", "minutes": 15},
+                "driver_license": {"name": "Driver License", "minutes": 30}}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "appointments.sqlite3")
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        self.start = datetime.combine(tomorrow, datetime.min.time()).replace(hour=10)
+
+    def scheduler(self, **kwargs):
+        return AppointmentScheduler(self.OFFICES, self.SERVICES, path=self.path, horizon_days=7, **kwargs)
+
+    def test_holds_take_capacity_until_cancelled(self):
+        scheduler = self.scheduler()
+        first = scheduler.hold("fresno", "driving_test", self.start)
+        scheduler.hold("fresno", "driving_test", self.start)
+        with self.assertRaises(SlotUnavailable):
+            scheduler.hold("fresno", "driving_test", self.start)
+        self.assertNotIn(self.start, scheduler.available("fresno", "driving_test", self.start, self.start + timedelta(hours=1)))
+
+        self.assertTrue(scheduler.cancel(first["hold_id"]))
+        scheduler.hold("fresno", "driving_test", self.start)
+        self.assertFalse(scheduler.cancel(first["hold_id"]))
+
+    def test_confirmed_appointments_survive_a_restart_and_can_be_cancelled(self):
+        scheduler = self.scheduler()
+        appointments = [scheduler.confirm(scheduler.hold("fresno", "driving_test", self.start)["hold_id"], {"name": "A"})
+                        for _ in range(2)]
+
+        restarted = self.scheduler()
+        with self.assertRaises(SlotUnavailable):
+            restarted.hold("fresno", "driving_test", self.start)
+        self.assertTrue(restarted.cancel(appointments[0]["appointment_id"]))
+        restarted.hold("fresno", "driving_test", self.start)
+
+    def test_expired_hold_gives_back_its_slot(self):
+        scheduler = self.scheduler(hold_seconds=0.0)
+        hold = scheduler.hold("fresno", "driver_license", self.start)
+        # The next call sees the hold has lapsed
+        scheduler.hold("fresno", "driver_license", self.start)
+        self.assertEqual(scheduler.stats["expired"], 1)
+        with self.assertRaises(KeyError):
+            scheduler.confirm(hold["hold_id"])
+
+    def test_longer_services_need_consecutive_free_slots(self):
+        scheduler = self.scheduler()
+        scheduler.hold("fresno", "driver_license", self.start + timedelta(minutes=15))
+        with self.assertRaises(SlotUnavailable):
+            scheduler.hold("fresno", "driver_license", self.start)
+        earliest = scheduler.earliest("driver_license", after=self.start)
+        self.assertEqual(earliest[0]["start"], self.start + timedelta(minutes=45))
+
+    def test_rejects_times_with_an_offset_or_off_the_slot_grid(self):
+        scheduler = self.scheduler()
+        with self.assertRaises(ValueError):
+            scheduler.hold("fresno", "driving_test", self.start.replace(tzinfo=timezone.utc))
+        with self.assertRaises(ValueError):
+            scheduler.hold("fresno", "driving_test", self.start + timedelta(minutes=5))
+        with self.assertRaises(SlotUnavailable):
+            scheduler.hold("fresno", "driving_test", self.start.replace(hour=20))
+
+
+class DocumentFieldTests(SimpleTestCase):
+    BILL = "\n".join(["Pacific Gas and Electric Company", "Statement Date: 09/14/2026", "Account Holder: Maria Lopez",
+                      "Service Address:", "1234 Oak Street Apt 5", "Sacramento, CA 95814", "Electric usage 412 kWh"])
+    LICENSE = "\n".join(["NEVADA DRIVER LICENSE", "DL NO B1234567", "LN GARCIA", "FN JOSE LUIS", "DOB 04/02/1988",
+                         "EXP 04/02/2029", "500 Desert Rd", "Las Vegas, NV 89101"])
+
+    def test_utility_bill(self):
+        document_type, fields = detect_fields(self.BILL)
+
+        self.assertEqual(document_type, "utility_bill")
+        self.assertEqual(fields["full_name"], "Maria Lopez")
+        self.assertEqual(fields["document_date"], "09/14/2026")
+        self.assertEqual(fields["address"], {"street": "1234 Oak Street Apt 5", "city": "Sacramento", "state": "CA",
+                                             "zip": "95814"})
+
+    def test_driver_license(self):
+        document_type, fields = detect_fields(self.LICENSE)
+
+        self.assertEqual(document_type, "driver_license")
+        self.assertEqual(fields["full_name"], "Jose Luis Garcia")
+        self.assertEqual(fields["license_number"], "B1234567")
+        self.assertEqual(fields["date_of_birth"], "04/02/1988")
+        self.assertEqual(fields["expiration_date"], "04/02/2029")
+        self.assertEqual(fields["address"]["city"], "Las Vegas")
+
+    def test_unrecognized_text(self):
+        self.assertEqual(detect_fields("Thank you for your purchase."), ("unknown", {}))
+
+    def test_detected_fields_fill_only_the_form_fields(self):
+        document_type, fields = detect_fields(self.BILL)
+        values = document_form_data(document_type, fields, ["full_name", "current_address", "proof_of_residence"])
+
+        self.assertEqual(values["full_name"], "Maria Lopez")
+        self.assertEqual(values["current_address"]["zip"], "95814")
+        self.assertEqual(values["proof_of_residence"], "Utility bill dated 09/14/2026")
+        self.assertEqual(document_form_data(*detect_fields(self.LICENSE), ["out_of_state_license"]),
+                         {"out_of_state_license": "B1234567"})
+
+    def pdf_text(self, *streams):
+        """Builtin PDF text of a file made of these Flate-compressed content streams."""
+        parts = [b"%PDF-1.4\n"]
+        for number, content in enumerate(streams, 1):
+            data = zlib.compress(content)
+            parts.append(b"%d 0 obj\n<< /Length %d /Filter /FlateDecode >>\nstream\n" % (number, len(data)))
+            parts.append(data + b"\nendstream\nendobj\n")
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(b"".join(parts))
+        self.addCleanup(os.unlink, f.name)
+        return pdf_text_builtin(f.name)
+
+    def test_pdf_stream_that_inflates_past_the_cap_is_skipped(self):
+        bomb = b"BT (hidden) Tj ET\n" + b" " * MAX_STREAM_BYTES
+        self.assertEqual(self.pdf_text(bomb, b"BT (Account Summary) Tj ET"), "Account Summary")
+
+    def test_pdf_text_is_capped_per_document(self):
+        page = b"BT " + (b"(" + b"x" * 1000 + b") Tj T* ") * 150 + b"ET"
+        self.assertEqual(len(self.pdf_text(page, page)), MAX_DOCUMENT_TEXT_CHARS)
+
+    def test_media_type_comes_from_the_file_bytes(self):
+        self.assertEqual(sniff_media_type(b"%PDF-1.7\n"), ("application/pdf", ".pdf"))
+        self.assertEqual(sniff_media_type(b"\xff\xd8\xff\xe0"), ("image/jpeg", ".jpg"))
+        self.assertIsNone(sniff_media_type(b"<html>"))
+
+
+class FakeRetrievalSystem:
+    """The parts of RAGSystem that ConversationMemory uses, counting searches."""
+
+    class Router:
+        max_top_k = 2
+
+    class Embeddings:
+        def __init__(self, vectors):
+            self.vectors = vectors
+
+        def cached(self, text):
+            return self.vectors.get(text)
+
+        def embed_query(self, text):
+            return self.vectors.get(text, [0.0, 1.0])
+
+    class Jurisdictions:
+        @staticmethod
+        def resolve(location):
+            return None
+
+    def __init__(self, vectors=None):
+        self.router = self.Router()
+        self.embeddings = self.Embeddings(vectors or {})
+        self.jurisdictions = self.Jurisdictions()
+        self.retriever = None
+        self.generation = 1
+        self.searches = []
+
+    def retrieve_scored(self, query, top_k=5, location=None):
+        self.searches.append(query)
+        return [(Document(page_content=f"about {query}"), 0.5)]
+
+    def search_by_vectors(self, vectors, top_k):
+        self.searches.append("vector")
+        return [[(Document(page_content="extended"), 0.4)]]
+
+
+class ConversationFollowupTests(SimpleTestCase):
+    def setUp(self):
+        self.rag_system = FakeRetrievalSystem({"How do I renew my driver's license?": [1.0, 0.0],
+                                               "What about the tax deadline for that?": [0.0, 1.0]})
+        self.memory = ConversationMemory()
+        self.turn("How do I renew my driver's license?", depth=0)
+
+    def turn(self, message, depth=1):
+        followup = self.memory.classify("client", message, "California", self.rag_system.generation, depth,
+                                        vector=self.rag_system.embeddings.cached(message))
+        scored = self.memory.retrieve(self.rag_system, "client", message, "California", followup=followup)
+        return followup[0], scored
+
+    def test_covered_question_that_refers_back_reuses_the_context(self):
+        decision, scored = self.turn("How long does it take to renew that license?")
+
+        self.assertEqual(decision, "continue")
+        self.assertEqual(self.rag_system.searches, ["How do I renew my driver's license?"])
+        self.assertEqual(scored[0][0].page_content, "about How do I renew my driver's license?")
+
+    def test_question_that_refers_back_with_new_terms_extends_the_context(self):
+        decision, scored = self.turn("What about motorcycles?")
+
+        self.assertEqual(decision, "extend")
+        self.assertEqual(self.rag_system.searches[-1], "vector")
+        self.assertEqual({doc.page_content for doc, _ in scored},
+                         {"about How do I renew my driver's license?", "extended"})
+
+    def test_off_topic_questions_after_a_dmv_turn_search_again(self):
+        for message in ("When is the tax filing deadline?", "How do I apply for CalFresh?",
+                        "How do I transfer a vehicle title?", "What documents do I need for REAL ID?"):
+            decision, _ = self.turn(message)
+            self.assertEqual(decision, "shift", message)
+            self.assertEqual(self.rag_system.searches[-1], message)
+
+    def test_cue_with_a_distant_query_vector_is_a_shift(self):
+        decision, _ = self.turn("What about the tax deadline for that?")
+        self.assertEqual(decision, "shift")
+
+    def test_first_turn_is_new(self):
+        decision, _ = self.memory.classify("other", "How do I renew my driver's license?", "California", 1, 0)
+        self.assertEqual(decision, "new")
+
+
+class ChatSocketHandshakeTests(SimpleTestCase):
+    def handshake(self, headers, scheme="ws"):
+        """Messages the app sends for a handshake with these headers, up to its first message or close."""
+        app = ChatSocketApp(lambda data, emit: None, allowed_hosts=["govchat.example.gov"],
+                            allowed_origins=["https://app.example.gov"])
+        sent = []
+
+        async def receive():
+            if not sent:
+                return {"type": "websocket.connect"}
+            return {"type": "websocket.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "websocket", "path": "/ws/chat/", "scheme": scheme, "client": ("10.0.0.1", 5000),
+                 "query_string": b"", "headers": [(name.encode(), value.encode()) for name, value in headers.items()]}
+        asyncio.run(app(scope, receive, send))
+        return sent
+
+    def test_cross_origin_handshake_is_refused(self):
+        sent = self.handshake({"host": "govchat.example.gov", "origin": "https://evil.example.gov",
+                               "cookie": "govchat_documents=signed"})
+        self.assertEqual(sent[-1]["type"], "websocket.close")
+        self.assertEqual(sent[-1]["code"], CLOSE_FORBIDDEN)
+
+    def test_missing_origin_or_unknown_host_is_refused(self):
+        for headers in ({"host": "govchat.example.gov"},
+                        {"host": "attacker.test", "origin": "http://attacker.test"}):
+            self.assertEqual(self.handshake(headers)[-1]["code"], CLOSE_FORBIDDEN, headers)
+
+    def test_own_and_trusted_origins_are_accepted(self):
+        for headers, scheme in (({"host": "govchat.example.gov", "origin": "https://govchat.example.gov"}, "wss"),
+                                ({"host": "govchat.example.gov:443", "origin": "https://app.example.gov"}, "wss")):
+            sent = self.handshake(headers, scheme)
+            self.assertEqual(sent[0]["type"], "websocket.accept")
+            self.assertIn('"ready"', sent[1]["text"])
+
+
+class JurisdictionLayerTests(SimpleTestCase):
+    class Registry(JurisdictionIndexRegistry):
+        """Builds a stand-in store once `release` is set, instead of embedding documents."""
+
+        def __init__(self, jurisdictions_dir):
+            super().__init__(jurisdictions_dir, embeddings=None, process_document=lambda path: [])
+            self.release = threading.Event()
+            self.built = []
+
+        def _load(self, slug):
+            self.release.wait(5)
+            self.built.append(slug)
+            return SimpleNamespace(index=SimpleNamespace(ntotal=1, d=4), docstore=SimpleNamespace(_dict={}))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        os.makedirs(os.path.join(directory.name, "san-jose"))
+        with open(os.path.join(directory.name, "san-jose", "parking.md"), "w") as f:
+            f.write("# Parking permits\n")
+        self.registry = self.Registry(directory.name)
+
+    def test_cold_layer_is_built_in_the_background(self):
+        self.assertIsNone(self.registry.get("San Jose"))
+        self.assertIsNone(self.registry.get("san-jose"))
+        self.assertEqual(self.registry.stats["deferred"], 2)
+        self.registry.release.set()
+        self.assertTrue(wait_until(lambda: self.registry.get("san-jose") is not None))
+        self.assertEqual(self.registry.built, ["san-jose"])
+
+    def test_wait_builds_in_the_caller(self):
+        self.registry.release.set()
+        self.assertIsNotNone(self.registry.get("san-jose", wait=True))
+        self.assertEqual(self.registry.stats["deferred"], 0)
+
+    def test_layer_built_across_an_invalidate_is_not_kept(self):
+        self.assertIsNone(self.registry.get("san-jose"))
+        self.registry.invalidate("san-jose")
+        self.registry.release.set()
+        self.assertTrue(wait_until(lambda: self.registry.built == ["san-jose"]))
+        self.assertTrue(wait_until(lambda: not self.registry._building))
+        self.assertIsNone(self.registry.get("san-jose"))
+        self.assertTrue(wait_until(lambda: self.registry.get("san-jose") is not None))
+
+
+class KnowledgeBaseWatcherTests(SimpleTestCase):
+    def test_jurisdiction_edit_invalidates_only_that_layer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jurisdictions_dir = os.path.join(directory, "jurisdictions")
+            os.makedirs(os.path.join(jurisdictions_dir, "san-jose"))
+            with open(os.path.join(directory, "dmv_services.md"), "w") as f:
+                f.write("# DMV\n")
+            county_file = os.path.join(jurisdictions_dir, "san-jose", "parking.md")
+            with open(county_file, "w") as f:
+                f.write("# Parking\n")
+            invalidated = []
+            rag_system = SimpleNamespace(
+                knowledge_base_dir=directory,
+                jurisdictions=SimpleNamespace(jurisdictions_dir=jurisdictions_dir, invalidate=invalidated.append))
+            watcher = KnowledgeBaseWatcher(rag_system, debounce=0)
+
+            with open(county_file, "a") as f:
+                f.write("Permits cost $40.\n")
+            for _ in range(2):
+                watcher._poll_jurisdictions()
+                self.assertFalse(watcher._poll())
+        self.assertEqual(invalidated, ["san-jose"])
+
+
+class QueryLogTests(SimpleTestCase):
+    def test_questions_with_redacted_data_are_neither_logged_nor_warmed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "queries.jsonl")
+            log = QueryLog(path)
+            for _ in range(2):
+                log.record("How do I renew my registration?", "San Jose")
+                log.record("Is license A1234567 suspended?", "San Jose")
+                log.record("Is the office open today?", "Fresno, CA 93721")
+            with open(path) as f:
+                logged = f.read()
+            # Entries written before redacted questions were skipped
+            with open(path, "a") as f:
+                f.write('{"query": "status of case <number>", "location": "California", "ts": 0}\n' * 2)
+
+            frequent = load_frequent_queries(path)
+        self.assertNotIn("<", logged)
+        self.assertEqual(frequent, [("how do i renew my registration", "San Jose", 2)])
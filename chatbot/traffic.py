@@ -0,0 +1,207 @@
+"""
+Traffic recording for GovFlowAI capacity planning
+
+Records one anonymized JSON line per chat request so a production load
+shape can be replayed later (see chatbot.replay):
+1. Personal data (emails, phone numbers, license numbers, street
+   addresses, dates, long digit runs) in the question and the location is
+   replaced with placeholders before anything is written
+2. Views add what they know (intent, per-stage pipeline timings, cache
+   hits) to the record of the request in flight with annotate()
+3. Records go to a size-rotated JSONL file (records.jsonl, .1, .2, ...)
+
+Django: add TrafficRecorderMiddleware to MIDDLEWARE and set
+TRAFFIC_RECORD_PATH (without it the middleware removes itself).
+Flask: call install_flask_recorder(app, recorder).
+"""
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+_REDACTIONS = [
+    (re.compile(r'[\w\.-]+@[\w\.-]+\.\w+'), '<email>'),
+    (re.compile(r'\b[A-Za-z]{1,2}\d{6,8}\b'), '<license>'),
+    (re.compile(r'\(?\b\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}\b'), '<phone>'),
+    (re.compile(r'\b\d+\s+[A-Za-z0-9\s.#-]+?\b(?:Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Lane|Ln|Drive|Dr|Court|Ct|Circle|Cir|Way|Place|Pl)\b\.?', re.IGNORECASE), '<address>'),
+    (re.compile(r'\b\d{1,4}[/-]\d{1,2}[/-]\d{1,4}\b'), '<date>'),
+    (re.compile(r'\b\d{5,}\b'), '<number>'),
+]
+REDACTION_PLACEHOLDERS = tuple(placeholder for _, placeholder in _REDACTIONS)
+
+DEFAULT_RECORDED_PATHS = ('/api/chat/', '/api/chat', '/chat')
+
+_current_record: contextvars.ContextVar = contextvars.ContextVar("traffic_record", default=None)
+
+
+def anonymize(text: str) -> str:
+    """Replace personal data in free text with placeholders."""
+    for pattern, placeholder in _REDACTIONS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def is_redacted(text: str) -> bool:
+    """Whether anonymize() replaced anything in text."""
+    return any(placeholder in text for placeholder in REDACTION_PLACEHOLDERS)
+
+
+def annotate(**fields: Any) -> None:
+    """Add fields to the record of the request being handled, if it is recorded."""
+    record = _current_record.get()
+    if record is not None:
+        record.update(fields)
+
+
+class RotatingJsonlWriter:
+    """Thread-safe JSONL appender that rotates by size."""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5):
+        """
+        Initialize the writer.
+
+        Args:
+            path: File to append to
+            max_bytes: Size at which the file is rotated
+            backup_count: Rotated files kept (path.1 is the newest)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+        self._file = None
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(line)
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class TrafficRecorder:
+    """
+    Build and write anonymized request records.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5,
+                 paths: Iterable[str] = DEFAULT_RECORDED_PATHS):
+        self.writer = RotatingJsonlWriter(path, max_bytes=max_bytes, backup_count=backup_count)
+        self.paths = frozenset(paths)
+        self.stats = {"recorded": 0, "errors": 0}
+
+    def wants(self, method: str, path: str) -> bool:
+        return method == 'POST' and path in self.paths
+
+    def begin(self, path: str, body: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Start the record of a request and make it the target of annotate()."""
+        body = body if isinstance(body, dict) else {}
+        record = {
+            "ts": time.time(),
+            "path": path,
+            "query": anonymize(str(body.get("message", ""))),
+            "location": anonymize(str(body.get("location") or "California")),
+        }
+        for field in ("mode", "conversation_depth"):
+            if field in body:
+                record[field] = body[field]
+        record["_started"] = time.monotonic()
+        record["_token"] = _current_record.set(record)
+        return record
+
+    def finish(self, record: Dict[str, Any], status: int) -> None:
+        """Complete a record with the response status and duration, and write it."""
+        _current_record.reset(record.pop("_token"))
+        record["duration_ms"] = round((time.monotonic() - record.pop("_started")) * 1000.0, 2)
+        record["status"] = status
+        try:
+            self.writer.write(record)
+            self.stats["recorded"] += 1
+        except OSError as e:
+            self.stats["errors"] += 1
+            print(f"Could not write traffic record ({e})")
+
+
+def _json_body(raw: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(raw or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class TrafficRecorderMiddleware:
+    """Django middleware recording chat requests to TRAFFIC_RECORD_PATH."""
+
+    def __init__(self, get_response):
+        from django.conf import settings
+        from django.core.exceptions import MiddlewareNotUsed
+
+        if not getattr(settings, 'TRAFFIC_RECORD_PATH', ''):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.recorder = TrafficRecorder(
+            settings.TRAFFIC_RECORD_PATH,
+            max_bytes=settings.TRAFFIC_RECORD_MAX_BYTES,
+            backup_count=settings.TRAFFIC_RECORD_BACKUPS
+        )
+
+    def __call__(self, request):
+        if not self.recorder.wants(request.method, request.path):
+            return self.get_response(request)
+        record = self.recorder.begin(request.path, _json_body(request.body))
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            self.recorder.finish(record, status)
+
+
+def install_flask_recorder(app, recorder: TrafficRecorder) -> None:
+    """Record a Flask app's chat requests with before/after request hooks."""
+    from flask import g, request
+
+    @app.before_request
+    def _begin_traffic_record():
+        if recorder.wants(request.method, request.path):
+            g.traffic_record = recorder.begin(request.path, request.get_json(silent=True))
+
+    @app.after_request
+    def _finish_traffic_record(response):
+        record = g.pop('traffic_record', None)
+        if record is not None:
+            recorder.finish(record, response.status_code)
+        return response
+
+    @app.teardown_request
+    def _finish_failed_traffic_record(error=None):
+        # after_request is skipped when the view raised
+        record = g.pop('traffic_record', None)
+        if record is not None:
+            recorder.finish(record, 500)
@@ -4,5 +4,19 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('api/chat/', views.chat, name='chat'),
+    path('api/chat/prefetch/', views.prefetch, name='prefetch'),
     path('api/dmv/submit/', views.submit_dmv_form, name='submit_dmv_form'),
+    path('api/dmv/submit/bulk/', views.submit_dmv_forms_bulk, name='submit_dmv_forms_bulk'),
+    path('api/dmv/submissions/<str:submission_id>/', views.submission_status, name='submission_status'),
+    path('api/appointments/availability/', views.appointment_availability, name='appointment_availability'),
+    path('api/appointments/hold/', views.hold_appointment, name='hold_appointment'),
+    path('api/appointments/confirm/', views.confirm_appointment, name='confirm_appointment'),
+    path('api/appointments/<str:appointment_id>/cancel/', views.cancel_appointment, name='cancel_appointment'),
+    path('api/documents/', views.upload_document, name='upload_document'),
+    path('api/documents/<str:job_id>/', views.document_status, name='document_status'),
+    path('api/offices/nearest/', views.nearest_offices, name='nearest_offices'),
+    path('api/metrics/', views.metrics, name='metrics'),
+    path('api/ready/', views.ready, name='ready'),
+    path('api/profiles/', views.profiles, name='profiles'),
+    path('api/profiles/<str:request_id>/', views.profile_detail, name='profile_detail'),
 ]
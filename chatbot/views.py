@@ -1,3 +1,5 @@
+from django.core import signing
+from django.http import HttpResponse, parse_cookie
 from django.shortcuts import render
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -6,14 +8,40 @@ import openai
 import json
 import re
 import os
+import uuid
+from datetime import datetime, timedelta
 from pathlib import Path
 
 # Import the RAG system
-from .rag_system import RAGSystem
+from .admission import PRIORITY_FAQ, PRIORITY_FORM, Deadline, Overloaded, current_deadline, deadline_scope
+from .appointments import SlotUnavailable
+from .documents import IntakeBusy, UnsupportedDocument, UploadTooLarge, document_form_data
+from .pipeline import Pipeline, Stage, rag_stages
+from .rag_system import ANSWER_MODES
+from .response_cache import response_key
+from .services import (get_admission_controller, get_answer_store, get_appointment_scheduler, get_cache_warmer, get_chat_sockets,
+                       get_conversation_memory, get_document_intake, get_memory_accountant, get_office_locator, get_prefetcher, get_query_log, get_rag_system,
+                       get_request_profiler, get_response_cache, get_submission_writer)
+from .singleflight import SingleFlight, prompt_version
+from .submissions import QueueFull, compile_schemas
+from .traffic import annotate
 
 # Configure OpenAI
 openai.api_key = settings.OPENAI_API_KEY
 
+# Identical questions that arrive while one is already being answered share its result
+response_flight = SingleFlight()
+COALESCE_TIMEOUT_SECONDS = 60
+FORM_EXTRACTION_TIMEOUT_SECONDS = 1.0
+MAX_CLIENT_ID_LENGTH = 64
+MAX_BULK_FORMS = 5000
+# Signed cookie naming the server-issued owner of a session's uploaded documents
+DOCUMENT_OWNER_COOKIE = 'govchat_documents'
+DOCUMENT_OWNER_SALT = 'chatbot.documents'
+# Closest DMV offices whose appointment slots are offered
+NEARBY_APPOINTMENT_OFFICES = 5
+MAX_NEAREST_OFFICES = 20
+
 # California DMV specific intents and their corresponding forms
 CA_DMV_INTENTS = {
     'address_change': {
@@ -54,22 +82,29 @@ CA_DMV_INTENTS = {
     },
     'fix_it_ticket': {
         'name': 'Fix-It Ticket Information',
-        'fields': []  # No form for this, just info
+        'fields': [],  # No form for this, just info
+        'faq_question': 'How do I take care of a fix-it ticket?'
     },
     'speeding_ticket': {
         'name': 'Speeding Ticket Information',
-        'fields': []  # No form for this, just info
+        'fields': [],  # No form for this, just info
+        'faq_question': 'What should I do about a speeding ticket?'
     },
     'registration_expired': {
         'name': 'Expired Registration Information',
-        'fields': []  # No form for this, just info
+        'fields': [],  # No form for this, just info
+        'faq_question': 'My vehicle registration expired. What do I need to do?'
     },
     'smog_check': {
         'name': 'Smog Check Information',
-        'fields': []  # No form for this, just info
+        'fields': [],  # No form for this, just info
+        'faq_question': 'How do I get a smog check for my vehicle?'
     }
 }
 
+# Validators compiled once per form type, see submissions.py
+FORM_SCHEMAS = compile_schemas(CA_DMV_INTENTS)
+
 # Intent recognition patterns - Made more robust
 INTENT_PATTERNS = {
     'address_change': r'(?:change|update|new|modify)\s+(?:my\s+)?address|(?:i\s+)?moved|moving|relocat(?:e|ing)|address\s+form',
@@ -96,6 +131,35 @@ def extract_intent(message):
     return None
 
 
+def extract_intents(message):
+    """Every intent whose pattern matches the message, in pattern order."""
+    message = message.lower()
+    return [intent for intent, pattern in INTENT_PATTERNS.items() if re.search(pattern, message)]
+
+
+DEFAULT_SYSTEM_PROMPT = """You are a helpful government services assistant. You can help users with various government services and forms.
+        When users want to update their address, collect the following information:
+        - Current address
+        - New address
+        - License number (format: DL1234567)
+        - Phone number
+        - Email address
+        
+        Guide users through the process by asking for one piece of information at a time.
+        If you receive multiple pieces of information, acknowledge them all.
+        Once you have all the information, inform the user that they can submit the form."""
+
+
+def load_system_prompt():
+    """Load the chatbot system prompt, falling back to a built-in default."""
+    try:
+        system_prompt_path = Path(__file__).resolve().parent.parent / 'mcp_location_prompt.txt'
+        with open(system_prompt_path, 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return DEFAULT_SYSTEM_PROMPT
+
+
 def get_form_template(intent):
     if intent not in CA_DMV_INTENTS:
         return None
@@ -213,149 +277,696 @@ def home(request):
     return render(request, 'chatbot/index.html')
 
 
+def degraded_chat_data(intent, form_template, form_data, user_location):
+    """Fast answer used when a chat request is shed under load."""
+    message = ("We're experiencing very high demand right now and couldn't answer your question in time. "
+               "Please try again in a moment.")
+    if form_template:
+        message += f" In the meantime you can start the {form_template['form_name']}."
+    return {
+        'response': message,
+        'intent': intent,
+        'form_template': form_template,
+        'form_data': form_data,
+        'location': user_location,
+        'sources': [],
+        'degraded': True
+    }
+
+
+def lookup_precomputed(values):
+    """Precomputed answer for an info-only intent with an unambiguous match, if any."""
+    intent = values['intent']
+    if not intent or CA_DMV_INTENTS[intent]['fields'] or extract_intents(values['message']) != [intent]:
+        return None
+    return get_answer_store().lookup(intent, values['location'], prompt_version(values['system_prompt']))
+
+
+def classify_followup(values):
+    """How the message relates to the client's previous turn (a local check, no model call)."""
+    rag_system = get_rag_system()
+    return get_conversation_memory().classify(
+        values.get('client_id'), values['message'], values['location'],
+        rag_system.generation, values['conversation_depth'],
+        vector=rag_system.embeddings.cached(values['message'])
+    )
+
+
+def uses_session_context(values):
+    """Whether the answer depends on the conversation, so it must not be shared."""
+    return values['followup'][0] in ('continue', 'extend')
+
+
+def lookup_cached(values):
+    """Cached answer to a general question; form flows and follow-ups are never cached."""
+    if values['form_intent'] or uses_session_context(values):
+        return None
+    key = response_key(values['message'], values['location'], values['system_prompt'], values['mode'])
+    return get_response_cache().get(key, get_rag_system().generation)
+
+
+def lookup_prefetched(values):
+    """Chunks prefetched while the user was typing, if close enough to the final message."""
+    client_id = values.get('client_id')
+    if not client_id:
+        return None
+    return get_prefetcher().lookup(client_id, values['message'], values['location'], get_rag_system().generation)
+
+
+def parse_preferred_date(text):
+    """A preferred date as the form extraction finds it (MM/DD/YYYY) or ISO; None if absent or unreadable."""
+    for date_format in ('%m/%d/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text or '', date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def slot_json(slot):
+    return {'office_id': slot['office_id'], 'office': slot['office'], 'start': slot['start'].isoformat(timespec='minutes')}
+
+
+def appointment_offices(scheduler, location):
+    """The DMV offices closest to a location, else those it names; None means every office."""
+    nearby = [office['id'] for office, _ in get_office_locator().nearest(location, 'dmv', NEARBY_APPOINTMENT_OFFICES)
+              if office['id'] in scheduler.offices]
+    return nearby or scheduler.offices_in(location)
+
+
+def earliest_appointments(values):
+    """Earliest open slots near the user for an appointment request, from the in-memory calendars."""
+    scheduler = get_appointment_scheduler()
+    form_data = values['form_data'] or {}
+    service = scheduler.resolve_service(form_data.get('service_type')) or scheduler.resolve_service(values['message'])
+    if service is None:
+        return None
+    slots = scheduler.earliest(service, appointment_offices(scheduler, values['location']),
+                               after=parse_preferred_date(form_data.get('preferred_date')), limit=3)
+    return {'service': service, 'slots': [slot_json(slot) for slot in slots]}
+
+
+def signed_document_owner(value):
+    """The document owner id in a signed cookie value, or '' if missing, forged or expired."""
+    if not value:
+        return ''
+    signer = signing.get_cookie_signer(salt=DOCUMENT_OWNER_COOKIE + DOCUMENT_OWNER_SALT)
+    try:
+        return signer.unsign(value, max_age=settings.DOCUMENT_JOB_TTL)
+    except signing.BadSignature:
+        return ''
+
+
+def request_document_owner(request):
+    """The server-issued document owner of an HTTP request's session, or ''."""
+    return signed_document_owner(request.COOKIES.get(DOCUMENT_OWNER_COOKIE, ''))
+
+
+def uploaded_document_fields(values):
+    """Form fields read from the session's uploaded documents (later uploads win)."""
+    form_fields = FORM_SCHEMAS[values['intent']].fields
+    merged = {}
+    for document_type, fields in get_document_intake().fields_for(values['document_owner']):
+        merged.update(document_form_data(document_type, fields, form_fields))
+    return merged
+
+
+def merged_form_data(values):
+    """Extracted form fields; what the user typed takes precedence over what was read from their documents."""
+    return {**(values['document_fields'] or {}), **(values['form_data'] or {})}
+
+
+def send_form_fields(values):
+    """Stream the intent and extracted form fields ahead of the answer."""
+    message = {'type': 'form', 'intent': values['intent'], 'form_template': values['form_template'],
+               'form_data': merged_form_data(values)}
+    if values['appointments']:
+        message['appointments'] = values['appointments']
+    values['emit'](message)
+    return True
+
+
+def admit_turn(values):
+    """
+    Take an admission slot before retrieval, in the request's own thread, so
+    an overloaded server sheds the turn before paying for an embedding or a
+    search. Form flows are admitted ahead of general questions. The slot is
+    recorded in the "admission_slots" input and run_chat_turn gives it back when
+    the turn ends.
+    """
+    priority = PRIORITY_FORM if values['form_intent'] else PRIORITY_FAQ
+    get_admission_controller().acquire(priority, current_deadline())
+    values['admission_slots'].append(priority)
+    return True
+
+
+def coalesced_generation(values, answer):
+    """Run the completion, sharing it with identical in-flight questions."""
+    # Streamed answers go to their own client token by token, so they are not shared
+    if uses_session_context(values) or values.get('emit'):
+        return answer()
+    deadline = current_deadline()
+    flight_key = response_key(values['message'], values['location'], values['system_prompt'], values['mode'])
+    return response_flight.do(
+        flight_key, answer,
+        timeout=min(COALESCE_TIMEOUT_SECONDS, deadline.remaining()) if deadline else COALESCE_TIMEOUT_SECONDS
+    )
+
+
+# Intent detection and form extraction run alongside retrieval; generation
+# waits for retrieval and the system prompt. Precomputed and cached answers skip both.
+chat_pipeline = Pipeline([
+    Stage('intent', lambda v: extract_intent(v['message']), inline=True),
+    Stage('form_template', lambda v: get_form_template(v['intent']) if v['intent'] else None, deps=('intent',), inline=True),
+    Stage('form_intent', lambda v: bool(v['form_template'] and v['form_template']['required_fields']), deps=('form_template',), inline=True),
+    Stage('form_data', lambda v: extract_form_data(v['message'], v['intent']) if v['intent'] else {},
+          deps=('intent',), timeout=FORM_EXTRACTION_TIMEOUT_SECONDS, fallback=lambda v, e: {}),
+    Stage('system_prompt', lambda v: load_system_prompt(), timeout=1.0, fallback=DEFAULT_SYSTEM_PROMPT),
+    Stage('precomputed', lookup_precomputed, deps=('intent', 'system_prompt'), fallback=None),
+    Stage('followup', classify_followup, inline=True, fallback=('new', None)),
+    Stage('cached', lookup_cached, deps=('form_intent', 'system_prompt', 'followup'), inline=True, fallback=None),
+    Stage('prefetched', lookup_prefetched, inline=True, fallback=None),
+    Stage('appointments', earliest_appointments, deps=('intent', 'form_data'), inline=True, fallback=None,
+          when=lambda v: v['intent'] == 'dmv_appointment'),
+    Stage('document_fields', uploaded_document_fields, deps=('intent',), fallback=lambda v, e: {},
+          when=lambda v: bool(v['document_owner']) and v['intent'] in FORM_SCHEMAS),
+    Stage('form_message', send_form_fields, deps=('form_template', 'form_data', 'document_fields', 'appointments'),
+          inline=True, fallback=None, when=lambda v: v.get('emit') is not None and v['intent'] is not None),
+    # No fallback: Overloaded propagates and run_chat_turn answers with a degraded 503
+    Stage('admission', admit_turn, deps=('form_intent', 'precomputed', 'cached'), inline=True,
+          when=lambda v: v['precomputed'] is None and v['cached'] is None),
+    *rag_stages(
+        get_rag_system,
+        retrieval_deps=('form_intent', 'precomputed', 'cached', 'prefetched', 'followup', 'admission'),
+        generation_deps=('system_prompt',),
+        when=lambda v: v['precomputed'] is None and v['cached'] is None,
+        generate=coalesced_generation,
+        conversation=get_conversation_memory
+    ),
+], max_workers=settings.CHAT_PIPELINE_WORKERS, name='chat-pipeline')
+
+
 @api_view(['POST'])
 def chat(request):
-    # Parse request data
-    data = request.data
+    profiler = get_request_profiler()
+    if not profiler.should_profile(request.headers.get('X-Profile-Token')):
+        return answer_chat(request)
+    
+    with profiler.profile(path=request.path, location=request.data.get('location', 'California')) as profile:
+        response = answer_chat(request)
+    profile.meta['status'] = response.status_code
+    annotate(profile_id=profile.request_id)
+    response['X-Profile-Id'] = profile.request_id
+    return response
+
+
+def answer_chat(request):
+    response_data, status = run_chat_turn(request.data, document_owner=request_document_owner(request))
+    response = Response(response_data, status=status)
+    if response_data.get('degraded'):
+        response['Retry-After'] = '5'
+    return response
+
+
+def run_chat_turn(data, emit=None, document_owner=''):
+    """
+    Answer one chat turn; shared by the HTTP view and the chat socket.
+
+    Args:
+        data: The turn's fields (message, location, mode, conversation_depth, client_id)
+        emit: Optional callable streaming the turn's messages ("form",
+            "sources", "token") as they are produced
+        document_owner: Verified owner id from the session's signed document
+            cookie; fields of that owner's uploads fill in form data
+
+    Returns:
+        (response data, HTTP status)
+    """
     user_message = data.get('message', '')
     user_location = data.get('location', 'California')
-    
-    # Extract intent
-    intent = extract_intent(user_message)
-    
-    # Get form template if an intent is detected
-    form_template = None
-    if intent:
-        form_template = get_form_template(intent)
-        
-    # Extract form data if an intent is detected
-    form_data = {}
-    if intent:
-        form_data = extract_form_data(user_message, intent)
-    
-    # Load the system prompt for the chatbot
+    answer_mode = data.get('mode', settings.CHAT_ANSWER_MODE)
+    if answer_mode not in ANSWER_MODES:
+        return {'error': f'Invalid mode: {answer_mode}'}, 400
     try:
-        system_prompt_path = Path(__file__).resolve().parent.parent / 'mcp_location_prompt.txt'
-        with open(system_prompt_path, 'r') as f:
-            system_prompt = f.read()
-    except FileNotFoundError:
-        system_prompt = """You are a helpful government services assistant. You can help users with various government services and forms.
-        When users want to update their address, collect the following information:
-        - Current address
-        - New address
-        - License number (format: DL1234567)
-        - Phone number
-        - Email address
-        
-        Guide users through the process by asking for one piece of information at a time.
-        If you receive multiple pieces of information, acknowledge them all.
-        Once you have all the information, inform the user that they can submit the form."""
+        conversation_depth = max(0, int(data.get('conversation_depth', 0)))
+    except (TypeError, ValueError):
+        return {'error': 'conversation_depth must be an integer'}, 400
+    
+    # The embedding and LLM clients size their timeouts from the deadline
+    deadline = Deadline(settings.CHAT_REQUEST_DEADLINE)
+    # Filled by the admission stage when the turn takes a slot
+    admission = []
     
     try:
-        # Initialize the RAG system
-        knowledge_base_dir = os.path.join(Path(__file__).resolve().parent.parent, 'knowledge_base')
-        rag_system = RAGSystem(knowledge_base_dir=knowledge_base_dir, openai_api_key=settings.OPENAI_API_KEY)
+        with deadline_scope(deadline):
+            result = chat_pipeline.run({
+                'message': user_message,
+                'location': user_location,
+                'mode': answer_mode,
+                'conversation_depth': conversation_depth,
+                'client_id': str(data.get('client_id', ''))[:MAX_CLIENT_ID_LENGTH],
+                'document_owner': document_owner,
+                'admission_slots': admission,
+                'emit': emit
+            })
         
-        # Generate response using RAG
-        bot_response, sources = rag_system.generate_response(
-            user_query=user_message,
-            system_prompt=system_prompt,
-            location=user_location
+        intent = result['intent']
+        annotate(
+            intent=intent,
+            stages={name: round(ms, 2) for name, ms in result.timings.items()},
+            fallbacks=result.fallbacks,
+            route=result['retrieval'][0].name if result['retrieval'] else None,
+            precomputed=bool(result['precomputed']),
+            cached=bool(result['cached']),
+            prefetched=result['prefetched'] is not None,
+            followup=result['followup'][0]
         )
+        response_data = {
+            'intent': intent,
+            'form_template': result['form_template'],
+            'form_data': merged_form_data(result),
+            'location': user_location
+        }
+        if result['appointments']:
+            response_data['appointments'] = result['appointments']
         
-        # If RAG fails, fall back to standard OpenAI completion
+        answer = result['precomputed']
+        if answer:
+            response_data.update(response=answer['response'], sources=answer['sources'], precomputed=True)
+            return response_data, 200
+        
+        # Recurring general questions (never form flows, which carry personal data,
+        # or follow-ups, which depend on the conversation) feed the cache warm-up
+        shareable = not result['form_intent'] and not uses_session_context(result)
+        query_log = get_query_log()
+        if query_log and shareable and not result['form_data']:
+            query_log.record(user_message, user_location)
+        
+        if result['cached']:
+            bot_response, sources = result['cached']
+            response_data.update(response=bot_response, sources=list(sources), cached=True)
+            return response_data, 200
+        
+        bot_response, sources = result['generation']
+        sources = list(sources)
+        if bot_response and shareable and 'generation' not in result.fallbacks:
+            key = response_key(user_message, user_location, result['system_prompt'], answer_mode)
+            get_response_cache().put(key, get_rag_system().generation, (bot_response, sources))
+        
+        # If the model returned nothing, answer from the retrieved context rather
+        # than paying for a second sequential completion
         if not bot_response:
-            # Add location context to the system message
-            system_message = f"{system_prompt}\n\nCurrent user location: {user_location}"
-            
-            # Prepare messages for the API call
-            messages = [
-                {"role": "system", "content": system_message}
-            ]
-            
-            # Add message specifying the intent if detected
-            if intent:
-                intent_message = f"The user is asking about {intent.replace('_', ' ')}. "
-                if form_template:
-                    intent_message += f"This requires the {form_template['form_name']}. "
-                    intent_message += f"Required fields: {', '.join(form_template['required_fields'])}"
-                messages.append({"role": "system", "content": intent_message})
-            
-            # Add the user's message
-            messages.append({"role": "user", "content": user_message})
-            
-            # Make the API call to OpenAI
-            response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
+            route, relevant_docs = result['retrieval']
+            bot_response, sources = get_rag_system().answer_with_context(
+                user_message, result['system_prompt'], user_location, route, relevant_docs, mode="extractive"
             )
-            
-            # Extract the response
-            bot_response = response.choices[0].message.content
-            sources = []
         
         # Return the response along with any form data and sources
-        response_data = {
-            'response': bot_response,
-            'intent': intent,
-            'form_template': form_template,
-            'form_data': form_data,
-            'location': user_location,
-            'sources': sources
-        }
-        
-        return Response(response_data)
-
+        response_data.update(response=bot_response, sources=sources)
+        return response_data, 200
+
+    except (Overloaded, TimeoutError):
+        annotate(degraded=True)
+        intent = extract_intent(user_message)
+        form_template = get_form_template(intent) if intent else None
+        form_data = extract_form_data(user_message, intent) if intent else {}
+        return degraded_chat_data(intent, form_template, form_data, user_location), 503
     except Exception as e:
-        return Response({'error': str(e)}, status=500)
+        return {'error': str(e)}, 500
+    finally:
+        if admission:
+            get_admission_controller().release()
+
+
+def stream_chat_turn(data, emit):
+    """
+    Answer a chat socket turn, streaming its messages through emit: "form"
+    and "sources" as soon as they are known, "token" as the model writes,
+    then "done" with everything not already sent (the full response only
+    when it differs from the streamed tokens), or "error".
+    """
+    sent = {'tokens': [], 'sources': False, 'form': False}
+
+    def forward(message):
+        if message['type'] == 'token':
+            sent['tokens'].append(message['content'])
+        else:
+            sent[message['type']] = True
+        emit(message)
+
+    # The transport passes the connection's Cookie header; the client payload can't set it
+    cookie = parse_cookie(data.pop('cookie', '')).get(DOCUMENT_OWNER_COOKIE, '')
+    response_data, status = run_chat_turn(data, emit=forward, document_owner=signed_document_owner(cookie))
+    if status != 200 and not response_data.get('degraded'):
+        emit({'type': 'error', 'status': status, 'error': response_data.get('error')})
+        return
+    text = response_data.pop('response', '')
+    sources = response_data.pop('sources', [])
+    if not sent['sources']:
+        emit({'type': 'sources', 'sources': sources})
+    if not sent['tokens']:
+        # Precomputed, cached and degraded answers arrive whole
+        emit({'type': 'token', 'content': text})
+    elif ''.join(sent['tokens']) != text:
+        response_data['response'] = text
+    if sent['form']:
+        for field in ('form_template', 'form_data', 'appointments'):
+            response_data.pop(field, None)
+    emit(dict(response_data, type='done'))
+
+
+@api_view(['POST'])
+def prefetch(request):
+    """Warm retrieval for the query the user is still typing."""
+    data = request.data
+    client_id = str(data.get('client_id', ''))[:MAX_CLIENT_ID_LENGTH]
+    partial = str(data.get('partial', ''))
+    location = data.get('location', 'California')
+    if not client_id:
+        return Response({'error': 'client_id is required'}, status=400)
+    
+    # Never compete with real chat requests for capacity
+    if get_admission_controller().queued:
+        return Response({'status': 'busy'})
+    
+    status = get_prefetcher().submit(client_id, partial, location, rate_key=request.META.get('REMOTE_ADDR'))
+    if status == 'rate_limited':
+        response = Response({'status': status}, status=429)
+        response['Retry-After'] = '1'
+        return response
+    return Response({'status': status}, status=202 if status == 'accepted' else 200)
+
+
+@api_view(['GET'])
+def ready(request):
+    """Readiness probe: 200 once the index is loaded and cache warm-up has finished."""
+    get_rag_system()
+    warmer = get_cache_warmer()
+    if warmer and not warmer.done.is_set():
+        return Response({'ready': False, 'cache_warmup': warmer.snapshot()}, status=503)
+    return Response({'ready': True})
+
+
+@api_view(['GET'])
+def profiles(request):
+    """List the stored request profiles (admin token required)."""
+    profiler = get_request_profiler()
+    if not profiler.is_admin(request.headers.get('X-Profile-Token')):
+        return Response({'error': 'Not found'}, status=404)
+    return Response({'profiles': profiler.list()})
+
+
+@api_view(['GET'])
+def profile_detail(request, request_id):
+    """Fetch one request profile as speedscope JSON or, with ?format=collapsed, collapsed stacks."""
+    profiler = get_request_profiler()
+    if not profiler.is_admin(request.headers.get('X-Profile-Token')):
+        return Response({'error': 'Not found'}, status=404)
+    profile = profiler.get(request_id)
+    if profile is None:
+        return Response({'error': f'No profile {request_id}'}, status=404)
+    if request.query_params.get('format') == 'collapsed':
+        return HttpResponse(profile.collapsed(), content_type='text/plain; charset=utf-8')
+    response = Response(profile.speedscope())
+    response['Content-Disposition'] = f'inline; filename="{request_id}.speedscope.json"'
+    return response
+
+
+@api_view(['GET'])
+def metrics(request):
+    """Runtime metrics for this worker process."""
+    data = {
+        'response_coalescing': dict(response_flight.stats),
+    }
+    admission = get_admission_controller()
+    data['admission'] = dict(admission.stats, active=admission.active, queued=admission.queued)
+    data['precomputed_answers'] = dict(get_answer_store().stats)
+    rag_system = get_rag_system()
+    data['knowledge_base_generation'] = rag_system.generation
+    data['query_embedding_batches'] = rag_system.embeddings.stats()
+    data['jurisdiction_indexes'] = dict(rag_system.jurisdictions.stats)
+    data['model_routes'] = rag_system.router.stats()
+    if rag_system.reranker is not None:
+        data['rerank'] = rag_system.reranker.snapshot()
+    data['chat_pipeline'] = chat_pipeline.stats()
+    data['prefetch'] = get_prefetcher().snapshot()
+    data['conversations'] = get_conversation_memory().snapshot()
+    data['form_submissions'] = get_submission_writer().snapshot()
+    data['appointments'] = get_appointment_scheduler().snapshot()
+    data['geodata'] = get_office_locator().snapshot()
+    data['documents'] = get_document_intake().snapshot()
+    data['chat_sockets'] = get_chat_sockets().snapshot()
+    data['response_cache'] = dict(get_response_cache().stats, entries=len(get_response_cache()))
+    warmer = get_cache_warmer()
+    if warmer:
+        data['cache_warmup'] = warmer.snapshot()
+    data['memory'] = get_memory_accountant().report()
+    return Response(data)
+
+
+def validate_form(form_data):
+    """
+    Validate one submitted form against its precompiled schema.
+
+    Returns:
+        (form_type, record, error message); record is None for an
+        info-only form type, error is None for a valid form
+    """
+    if not isinstance(form_data, dict):
+        return None, None, 'Invalid form type'
+    form_type = form_data.get('form_type')
+    if not form_type or form_type not in CA_DMV_INTENTS:
+        return form_type, None, 'Invalid form type'
+    schema = FORM_SCHEMAS.get(form_type)
+    if schema is None:
+        # Info-only intents have no form to store
+        return form_type, None, None
+    record, missing_fields = schema.validate(form_data)
+    if missing_fields:
+        return form_type, None, f'Missing required fields: {", ".join(missing_fields)}'
+    return form_type, record, None
+
+
+def submission_queue_full():
+    response = Response({'success': False, 'message': 'Too many submissions right now. Please try again shortly.'}, status=503)
+    response['Retry-After'] = '5'
+    return response
 
 
 @api_view(['POST'])
 def submit_dmv_form(request):
     try:
-        form_data = request.data
-        form_type = form_data.get('form_type')
-
-        if not form_type or form_type not in CA_DMV_INTENTS:
-            return Response({'error': 'Invalid form type'}, status=400)
-
-        # Check if the intent has fields defined before validating
-        if CA_DMV_INTENTS[form_type].get('fields'):
-            # Validate required fields
-            required_fields = CA_DMV_INTENTS[form_type]['fields']
-            missing_fields = [
-                field for field in required_fields if not form_data.get(field)]
-
-            # Handle nested address fields specifically for validation
-            if form_type in ['address_change', 'license_replacement', 'vehicle_registration', 'vehicle_transfer', 'license_renewal', 'vehicle_title', 'new_resident', 'real_id']:
-                address_types = ['current_address', 'new_address'] if form_type == 'address_change' else [
-                    'current_address']
-                for addr_type in address_types:
-                    if addr_type in form_data:
-                        # Check essential address fields within the nested object
-                        # County is optional
-                        for addr_part in ['street', 'city', 'state', 'zip']:
-                            if not form_data[addr_type].get(addr_part):
-                                missing_fields.append(
-                                    f'{addr_type}.{addr_part}')
-                    elif addr_type in [field['id'] for field in CA_DMV_INTENTS[form_type]['fields'] if 'addressType' in field]:
-                        # If the entire address object is missing but fields are required
-                        missing_fields.append(addr_type)
-
-            if missing_fields:
-                return Response({
-                    'success': False,
-                    'message': f'Missing required fields: {", ".join(missing_fields)}'
-                })
-
-        # In a real application, you would save this to a database
-        # For now, we'll just return success
-        return Response({
+        form_type, record, error = validate_form(request.data)
+        if form_type not in CA_DMV_INTENTS:
+            return Response({'error': error}, status=400)
+        if error:
+            return Response({'success': False, 'message': error})
+
+        data = {
             'success': True,
             'message': f'Your {CA_DMV_INTENTS[form_type]["name"]} has been submitted successfully.'
-        })
+        }
+        if record is not None:
+            # Queued for the background writer; the request never waits on disk
+            data['submission_id'] = get_submission_writer().submit(form_type, record)
+        return Response(data)
 
+    except QueueFull:
+        return submission_queue_full()
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+def submit_dmv_forms_bulk(request):
+    """
+    Submit a batch of forms (kiosks, partner offices). Valid forms are
+    queued together; invalid ones are reported by their index in the batch.
+    """
+    forms = request.data.get('forms') if isinstance(request.data, dict) else None
+    if not isinstance(forms, list) or not forms:
+        return Response({'error': 'forms must be a non-empty list'}, status=400)
+    if len(forms) > MAX_BULK_FORMS:
+        return Response({'error': f'At most {MAX_BULK_FORMS} forms per request'}, status=413)
+
+    accepted = []
+    accepted_indexes = []
+    rejected = []
+    for index, form_data in enumerate(forms):
+        form_type, record, error = validate_form(form_data)
+        if error is None and record is None:
+            error = 'Form type takes no submission'
+        if error:
+            rejected.append({'index': index, 'message': error})
+        else:
+            accepted.append((form_type, record))
+            accepted_indexes.append(index)
+
+    try:
+        submission_ids = get_submission_writer().submit_many(accepted) if accepted else []
+    except QueueFull:
+        return submission_queue_full()
+    return Response({
+        'accepted': [{'index': index, 'submission_id': submission_id}
+                     for index, submission_id in zip(accepted_indexes, submission_ids)],
+        'rejected': rejected
+    }, status=202 if accepted else 400)
+
+
+@api_view(['GET'])
+def submission_status(request, submission_id):
+    """Whether a submission is still queued or already stored."""
+    status = get_submission_writer().status(submission_id)
+    if status is None:
+        return Response({'error': 'Unknown submission'}, status=404)
+    return Response(status)
+
+
+@api_view(['GET'])
+def appointment_availability(request):
+    """
+    Open appointment slots. With ?office= the free start times at that office
+    over ?days= days from ?date=; otherwise the earliest slot at the five
+    soonest offices near ?location=.
+    """
+    scheduler = get_appointment_scheduler()
+    params = request.query_params
+    service = scheduler.resolve_service(params.get('service'))
+    if service is None:
+        return Response({'error': f'Unknown service; choose one of: {", ".join(scheduler.services)}'}, status=400)
+    after = parse_preferred_date(params.get('date'))
+    if params.get('date') and after is None:
+        return Response({'error': 'date must be YYYY-MM-DD'}, status=400)
+
+    office_id = params.get('office')
+    if office_id:
+        if office_id not in scheduler.offices:
+            return Response({'error': 'Unknown office'}, status=404)
+        try:
+            days = min(max(1, int(params.get('days', 1))), scheduler.horizon_days)
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=400)
+        start = after or datetime.now()
+        times = scheduler.available(office_id, service, start, start + timedelta(days=days))
+        return Response({'service': service, 'office_id': office_id,
+                         'times': [when.isoformat(timespec='minutes') for when in times]})
+
+    slots = scheduler.earliest(service, appointment_offices(scheduler, params.get('location')), after=after, limit=5)
+    return Response({'service': service, 'slots': [slot_json(slot) for slot in slots]})
+
+
+@api_view(['POST'])
+def hold_appointment(request):
+    """Hold a slot while the user fills in their details."""
+    scheduler = get_appointment_scheduler()
+    data = request.data
+    service = scheduler.resolve_service(data.get('service'))
+    try:
+        start = datetime.fromisoformat(str(data.get('start', '')))
+    except ValueError:
+        return Response({'error': 'start must be an ISO date and time'}, status=400)
+    if start.tzinfo is not None:
+        return Response({'error': 'start must be the office\'s local time, without a UTC offset'}, status=400)
+    if service is None or data.get('office_id') not in scheduler.offices:
+        return Response({'error': 'Unknown office or service'}, status=400)
+    try:
+        hold = scheduler.hold(data['office_id'], service, start, str(data.get('client_id', ''))[:MAX_CLIENT_ID_LENGTH])
+    except (KeyError, ValueError):
+        return Response({'error': 'That office does not offer this service at that time'}, status=400)
+    except SlotUnavailable as e:
+        return Response({'error': str(e)}, status=409)
+    hold['start'] = hold['start'].isoformat(timespec='minutes')
+    return Response(hold, status=201)
+
+
+@api_view(['POST'])
+def confirm_appointment(request):
+    """Book a held slot; the remaining fields (name, contact details) are stored with it."""
+    data = {key: value for key, value in request.data.items()}
+    hold_id = str(data.pop('hold_id', ''))
+    try:
+        appointment = get_appointment_scheduler().confirm(hold_id, data)
+    except KeyError:
+        return Response({'error': 'The hold has expired; please pick a slot again'}, status=404)
+    except SlotUnavailable as e:
+        return Response({'error': str(e)}, status=409)
+    appointment['start'] = appointment['start'].isoformat(timespec='minutes')
+    return Response(appointment, status=201)
+
+
+@api_view(['POST'])
+def cancel_appointment(request, appointment_id):
+    """Cancel an appointment or release a hold."""
+    if not get_appointment_scheduler().cancel(appointment_id):
+        return Response({'error': 'Unknown appointment'}, status=404)
+    return Response({'cancelled': appointment_id})
+
+
+@api_view(['GET'])
+def nearest_offices(request):
+    """The offices of ?kind= (dmv, tax, benefits) closest to ?location=, resolved offline."""
+    locator = get_office_locator()
+    kind = request.query_params.get('kind', 'dmv')
+    if kind not in locator.grids:
+        return Response({'error': f'kind must be one of: {", ".join(locator.grids)}'}, status=400)
+    try:
+        k = min(max(1, int(request.query_params.get('k', 3))), MAX_NEAREST_OFFICES)
+    except ValueError:
+        return Response({'error': 'k must be an integer'}, status=400)
+    location = request.query_params.get('location', '')
+    offices = locator.nearest(location, kind, k)
+    if not offices:
+        return Response({'error': 'Location not recognized; try a California city or ZIP code'}, status=404)
+    return Response({'location': location, 'kind': kind,
+                     'offices': [dict(office, miles=round(miles, 1)) for office, miles in offices]})
+
+
+@api_view(['POST'])
+def upload_document(request):
+    """
+    Upload a proof of residence or ID document as the raw request body
+    (Content-Type application/pdf, image/png, image/jpeg or image/tiff).
+    ?form_type= names the form it is for. The document belongs to the
+    session in the signed document cookie, which is issued here on the
+    first upload; only that session's chat turns and status polls see its
+    fields. The body is streamed to disk, never buffered; extraction runs
+    in the background, so the response is 202 with a job to poll.
+    """
+    form_type = request.query_params.get('form_type', '')
+    if form_type not in FORM_SCHEMAS:
+        return Response({'error': f'form_type must be one of: {", ".join(FORM_SCHEMAS)}'}, status=400)
+    owner = request_document_owner(request) or uuid.uuid4().hex
+    if request.stream is None:
+        return Response({'error': 'Send the document as the request body'}, status=400)
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0) or None
+    except ValueError:
+        content_length = None
+    try:
+        # request.stream is the unparsed body; request.data would read it all into memory
+        job = get_document_intake().receive(request.stream, form_type, owner, content_length)
+    except IntakeBusy:
+        response = Response({'error': 'Too many documents are being processed. Please try again shortly.'}, status=503)
+        response['Retry-After'] = '10'
+        return response
+    except UploadTooLarge as e:
+        return Response({'error': str(e)}, status=413)
+    except UnsupportedDocument as e:
+        return Response({'error': str(e)}, status=415)
+    response = Response(job, status=202)
+    response['Location'] = f'/api/documents/{job["job_id"]}/'
+    response.set_signed_cookie(DOCUMENT_OWNER_COOKIE, owner, salt=DOCUMENT_OWNER_SALT, max_age=int(settings.DOCUMENT_JOB_TTL),
+                               httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE)
+    return response
+
+
+@api_view(['GET'])
+def document_status(request, job_id):
+    """A document job's status and, once done, the form fields read from it."""
+    job = get_document_intake().status(job_id)
+    # Another session's job is reported as unknown, not as forbidden
+    if job is None or job.pop('owner') != request_document_owner(request):
+        return Response({'error': 'Unknown document job'}, status=404)
+    if job['status'] == 'done':
+        job['form_data'] = document_form_data(job['document_type'], job['fields'], FORM_SCHEMAS[job['form_type']].fields)
+    return Response(job)
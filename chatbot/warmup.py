@@ -0,0 +1,170 @@
+"""
+Cache warm-up from recorded query logs for GovFlowAI
+
+After a deploy or index rebuild the query-embedding and response caches are
+empty, so the first minutes of traffic pay full LLM latency. This module:
+1. Records general (non-form) chat questions to a JSONL query log
+2. Picks the top-N most frequent normalized (query, location) pairs from it
+3. Warms the caches ahead of traffic: all query embeddings in batched
+   requests, then retrieval and a cached answer per query, with completions
+   paced by a token bucket
+
+Workers report ready (GET /api/ready/) only once warm-up has finished, so a
+load balancer can hold traffic until then. The report records the warm-up
+duration and the response cache hit rate over the first requests after it.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+from .prefetch import TokenBucket
+from .response_cache import ResponseCache, response_key
+from .singleflight import normalize_question
+from .traffic import anonymize, is_redacted
+
+
+class QueryLog:
+    """
+    Append-only JSONL log of the general questions users ask, anonymized
+    like recorded traffic. Questions that needed redacting are not logged:
+    with "<number>" in place of a plate or ZIP they never match a real
+    request, so warming them is wasted work. When the file passes max_bytes
+    it is moved to `<path>.1` (replacing the previous one).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def record(self, query: str, location: str) -> None:
+        query, location = normalize_question(anonymize(query)), anonymize(location or "")
+        if is_redacted(query) or is_redacted(location):
+            return
+        line = json.dumps({"query": query, "location": location, "ts": int(time.time())})
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+                size = f.tell()
+            if size > self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+
+
+def load_frequent_queries(path: str, top_n: int = 200, min_count: int = 2) -> List[Tuple[str, str, int]]:
+    """
+    Read a query log (and its rotated predecessor) and return its most
+    frequent questions. Entries with redaction placeholders, written before
+    QueryLog skipped them, are ignored.
+
+    Args:
+        path: JSONL file with "query" and "location" on each line
+        top_n: Most (query, location) pairs to return
+        min_count: Pairs seen fewer times than this are skipped
+
+    Returns:
+        (query, location, count) tuples, most frequent first
+    """
+    counts: Counter = Counter()
+    for log_path in (f"{path}.1", path):
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                query = normalize_question(entry.get("query", ""))
+                location = entry.get("location") or "California"
+                if query and not is_redacted(query) and not is_redacted(location):
+                    counts[(query, location)] += 1
+    return [(query, location, count) for (query, location), count in counts.most_common(top_n) if count >= min_count]
+
+
+class CacheWarmer:
+    """
+    Fill the query-embedding and response caches from a query log.
+    """
+
+    def __init__(self, rag_system, response_cache: ResponseCache, query_log_path: str,
+                 get_system_prompt: Callable[[], str], mode: str = "llm",
+                 top_n: int = 200, completions_per_second: float = 2.0, report_window: int = 200):
+        """
+        Initialize the warmer.
+
+        Args:
+            rag_system: RAGSystem whose embedding cache is filled
+            response_cache: Cache the answers are stored in
+            query_log_path: JSONL query log written by QueryLog
+            get_system_prompt: Returns the system prompt the chat view uses
+            mode: Answer mode the chat view uses
+            top_n: Most frequent (query, location) pairs to warm
+            completions_per_second: Pace of the LLM completions
+            report_window: Lookups after warm-up over which the hit rate is reported
+        """
+        self.rag_system = rag_system
+        self.response_cache = response_cache
+        self.query_log_path = query_log_path
+        self.get_system_prompt = get_system_prompt
+        self.mode = mode
+        self.top_n = top_n
+        self.bucket = TokenBucket(completions_per_second, 1)
+        self.report_window = report_window
+        self.done = threading.Event()
+        self.report: Dict[str, Any] = {"state": "pending"}
+
+    def start(self) -> "CacheWarmer":
+        threading.Thread(target=self.run, name="cache-warmer", daemon=True).start()
+        return self
+
+    def run(self) -> Dict[str, Any]:
+        """Warm the caches and return the report."""
+        started_at = time.monotonic()
+        report = self.report = {"state": "running", "queries": 0, "embedded": 0, "answered": 0, "errors": 0}
+        try:
+            if not os.path.exists(self.query_log_path):
+                report["state"] = "skipped"
+                return report
+            queries = load_frequent_queries(self.query_log_path, self.top_n)
+            report["queries"] = len(queries)
+
+            # One batched embedding pass for everything
+            self.rag_system.embeddings.embed_queries([query for query, _, _ in queries])
+            report["embedded"] = len(queries)
+
+            system_prompt = self.get_system_prompt()
+            generation = self.rag_system.generation
+            for query, location, _ in queries:
+                key = response_key(query, location, system_prompt, self.mode)
+                while not self.bucket.take():
+                    time.sleep(1.0 / self.bucket.rate)
+                try:
+                    route, docs = self.rag_system.prepare_context(query, location)
+                    answer = self.rag_system.answer_with_context(query, system_prompt, location, route, docs, mode=self.mode)
+                except Exception as e:
+                    print(f"Cache warm-up failed for {query!r} ({type(e).__name__}: {e})")
+                    report["errors"] += 1
+                    continue
+                self.response_cache.put(key, generation, answer)
+                report["answered"] += 1
+            report["state"] = "done"
+        except Exception as e:
+            print(f"Cache warm-up aborted ({type(e).__name__}: {e})")
+            report["state"] = "failed"
+            report["error"] = str(e)
+        finally:
+            report["duration_seconds"] = round(time.monotonic() - started_at, 3)
+            self.response_cache.start_window(self.report_window)
+            self.done.set()
+            print(f"Cache warm-up {report['state']}: {report.get('answered', 0)} answers, "
+                  f"{report.get('embedded', 0)} embeddings in {report['duration_seconds']}s")
+        return report
+
+    def snapshot(self) -> Dict[str, Any]:
+        report = dict(self.report)
+        report["post_warmup"] = self.response_cache.window_stats()
+        return report
@@ -0,0 +1,442 @@
+"""
+WebSocket chat transport for GovFlowAI
+
+Over HTTP, every chat turn is a separate POST that re-sends its context, and
+the answer arrives only once it is complete. A chat socket keeps one
+connection per session instead:
+1. The server remembers the session (client id, location, turn count) on
+   the connection, so a turn only carries the new message
+2. Each turn's results are pushed as they become available: "form" (intent
+   and extracted form fields), "sources", "token" messages as the model
+   writes, then "done"
+3. Heartbeats: one sweeper per process pings every open connection and
+   closes the ones that have gone quiet, rather than a timer per connection
+4. Backpressure: a turn may have only a small window of messages not yet
+   handed to the client's socket; beyond it the turn's thread waits, so a
+   slow reader slows its own model stream instead of growing a buffer, and a
+   reader that stalls for too long is disconnected
+5. Limits on connections per process and per client address, on message
+   size and on turns running at once; refusals tell the client to retry
+6. Handshakes are checked like Django checks a POST: the Host must be an
+   allowed host and the Origin the server's own or a trusted one, since
+   WebSockets get no CORS or CSRF protection and the handshake carries the
+   browser's cookies. Other handshakes are closed with 4403
+
+The transport is a plain ASGI application (no Channels dependency), mounted
+next to Django by govchat/asgi.py. Turns are handled by a synchronous
+callable, handler(data, emit), run in a thread pool.
+
+Client messages: {"type": "chat", "message", "location"?, "mode"?, "id"?},
+{"type": "cancel"}, {"type": "ping"} and {"type": "pong"}. Server messages
+carry the turn's "id" when the client sent one.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from .memory import sampled_sizeof
+
+# Close codes
+CLOSE_NORMAL = 1000
+CLOSE_TOO_BIG = 1009
+CLOSE_TRY_AGAIN = 1013
+CLOSE_IDLE = 4000
+CLOSE_SLOW_CONSUMER = 4001
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+
+MAX_CLIENT_ID_LENGTH = 64
+
+
+def host_allowed(host: str, patterns) -> bool:
+    """Whether a host (without port) matches ALLOWED_HOSTS-style patterns ("*", ".example.gov", "example.gov")."""
+    host = host.lower().rstrip(".")
+    for pattern in patterns:
+        pattern = pattern.lower()
+        if pattern == "*" or host == pattern or (pattern.startswith(".") and (host.endswith(pattern) or host == pattern[1:])):
+            return True
+    return False
+
+
+def _split_host(netloc: str) -> str:
+    """Host part of "host[:port]" or "[v6]:port"."""
+    if netloc.startswith("["):
+        return netloc[:netloc.find("]") + 1]
+    return netloc.rsplit(":", 1)[0]
+
+
+class TurnCancelled(Exception):
+    """Raised in a turn's thread when its connection is gone or the turn was cancelled."""
+
+
+class ChatConnection:
+    """One client's socket and session state."""
+
+    def __init__(self, send: Callable, loop: asyncio.AbstractEventLoop, client_id: str, address: str, cookie: str = ""):
+        self.send = send
+        self.loop = loop
+        self.client_id = client_id
+        self.address = address
+        # Cookie header of the handshake, for the handler to verify (e.g. signed session cookies)
+        self.cookie = cookie
+        self.location = "California"
+        self.turns = 0
+        self.last_seen = time.monotonic()
+        self.turn: Optional[asyncio.Future] = None
+        self.cancelled = False
+        self.closed = False
+        self.ping_pending = False
+        self.window: Optional[threading.Semaphore] = None
+        self.sending: set = set()
+        self._send_lock = asyncio.Lock()
+
+    async def send_json(self, message: Dict[str, Any]) -> None:
+        if self.closed:
+            raise TurnCancelled()
+        async with self._send_lock:
+            await self.send({"type": "websocket.send", "text": json.dumps(message)})
+
+    async def close(self, code: int, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.cancelled = True
+        # Sends stuck on a client that is not reading would hold the lock forever
+        for task in list(self.sending):
+            task.cancel()
+        async with self._send_lock:
+            await self.send({"type": "websocket.close", "code": code, "reason": reason})
+
+    @property
+    def busy(self) -> bool:
+        return self.turn is not None and not self.turn.done()
+
+
+class ChatSocketApp:
+    """
+    ASGI application serving persistent chat connections.
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any], Callable[[Dict[str, Any]], None]], None],
+                 max_connections: int = 1000, max_per_client: int = 20, heartbeat_interval: float = 20.0,
+                 idle_timeout: float = 60.0, send_timeout: float = 10.0, send_window: int = 32,
+                 turn_workers: int = 32, max_message_bytes: int = 16 * 1024,
+                 allowed_hosts: Optional[Iterable[str]] = None, allowed_origins: Iterable[str] = ()):
+        """
+        Initialize the transport.
+
+        Args:
+            handler: Runs one turn: handler(data, emit), where data has
+                "message", "location", "mode", "conversation_depth",
+                "client_id" and "cookie" (the handshake's Cookie header),
+                and emit(message) sends a message to the client
+            max_connections: Open connections allowed in this process
+            max_per_client: Open connections allowed per client address
+            heartbeat_interval: Seconds between server pings
+            idle_timeout: Seconds without any client message before closing
+            send_timeout: Seconds a turn waits for a client to take a message
+                before the client is disconnected as too slow
+            send_window: Messages of a turn that may be waiting to be sent
+            turn_workers: Threads running turns (further turns wait for one)
+            max_message_bytes: Largest client message accepted
+            allowed_hosts: Host header patterns accepted (as in ALLOWED_HOSTS);
+                None skips the Host and Origin checks (e.g. benchmarks)
+            allowed_origins: Origins trusted besides the server's own, e.g.
+                "https://app.example.gov"
+        """
+        self.handler = handler
+        self.max_connections = max_connections
+        self.max_per_client = max_per_client
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self.send_window = send_window
+        self.turn_workers = turn_workers
+        self.max_message_bytes = max_message_bytes
+        self.allowed_hosts = None if allowed_hosts is None else tuple(allowed_hosts)
+        self.allowed_origins = frozenset(origin.lower().rstrip("/") for origin in allowed_origins)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=turn_workers, thread_name_prefix="chat-socket")
+        self._connections: Dict[int, ChatConnection] = {}
+        self._per_client: Counter = Counter()
+        self._lock = threading.Lock()
+        self._turns_running = 0
+        self._sweeper: Optional[asyncio.Task] = None
+        self.stats = {"accepted": 0, "refused": 0, "peak": 0, "turns": 0, "turns_refused": 0, "turn_errors": 0,
+                      "cancelled": 0, "messages_sent": 0, "idle_closed": 0, "slow_closed": 0, "too_big_closed": 0, "forbidden": 0}
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "websocket":
+            return
+        if (await receive())["type"] != "websocket.connect":
+            return
+        forbidden = self._handshake_check(scope)
+        if forbidden:
+            self.stats["forbidden"] += 1
+            await send({"type": "websocket.accept"})
+            await send({"type": "websocket.close", "code": CLOSE_FORBIDDEN, "reason": forbidden})
+            return
+        address = (scope.get("client") or ("", 0))[0]
+        refusal = self._register_check(address)
+        if refusal:
+            # Accept then close, so the client sees "try again later" rather than a bare 403
+            await send({"type": "websocket.accept"})
+            await send({"type": "websocket.close", "code": CLOSE_TRY_AGAIN, "reason": refusal})
+            return
+
+        loop = asyncio.get_running_loop()
+        cookie = b"; ".join(value for name, value in scope.get("headers", ()) if name.lower() == b"cookie")
+        connection = ChatConnection(send, loop, self._client_id(scope), address, cookie.decode("latin-1"))
+        with self._lock:
+            self._connections[id(connection)] = connection
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = loop.create_task(self._sweep())
+        try:
+            await send({"type": "websocket.accept"})
+            await connection.send_json({"type": "ready", "client_id": connection.client_id,
+                                        "heartbeat": self.heartbeat_interval})
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message["type"] != "websocket.receive":
+                    continue
+                connection.last_seen = time.monotonic()
+                if not await self._on_message(connection, message):
+                    break
+        except (TurnCancelled, OSError):
+            pass
+        finally:
+            connection.closed = True
+            connection.cancelled = True
+            with self._lock:
+                self._connections.pop(id(connection), None)
+                self._per_client[address] -= 1
+                if self._per_client[address] <= 0:
+                    del self._per_client[address]
+
+    def _handshake_check(self, scope: Dict[str, Any]) -> Optional[str]:
+        """Why a handshake's Host or Origin is not accepted, or None."""
+        if self.allowed_hosts is None:
+            return None
+        headers = {name.lower(): value.decode("latin-1") for name, value in scope.get("headers", ())}
+        host = headers.get(b"host", "")
+        if not host or not host_allowed(_split_host(host), self.allowed_hosts):
+            return "host not allowed"
+        origin = headers.get(b"origin", "").lower().rstrip("/")
+        own = ("https" if scope.get("scheme") == "wss" else "http") + "://" + host.lower()
+        if not origin or (origin != own and origin not in self.allowed_origins):
+            return "origin not allowed"
+        return None
+
+    def _register_check(self, address: str) -> Optional[str]:
+        """Count a new connection in, or return why it is refused."""
+        with self._lock:
+            if len(self._connections) >= self.max_connections:
+                refusal = "server at connection limit"
+            elif self._per_client[address] >= self.max_per_client:
+                refusal = "too many connections from this address"
+            else:
+                self._per_client[address] += 1
+                self.stats["accepted"] += 1
+                self.stats["peak"] = max(self.stats["peak"], len(self._connections) + 1)
+                return None
+            self.stats["refused"] += 1
+            return refusal
+
+    @staticmethod
+    def _client_id(scope: Dict[str, Any]) -> str:
+        for pair in scope.get("query_string", b"").decode("latin-1").split("&"):
+            name, _, value = pair.partition("=")
+            if name == "client_id" and value:
+                return value[:MAX_CLIENT_ID_LENGTH]
+        return uuid.uuid4().hex
+
+    async def _on_message(self, connection: ChatConnection, message: Dict[str, Any]) -> bool:
+        """Handle one client message; False closes the connection."""
+        text = message.get("text")
+        if text is None:
+            text = (message.get("bytes") or b"").decode("utf-8", errors="replace")
+        if len(text) > self.max_message_bytes:
+            self.stats["too_big_closed"] += 1
+            await connection.close(CLOSE_TOO_BIG, f"messages are limited to {self.max_message_bytes} bytes")
+            return False
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            await connection.send_json({"type": "error", "error": "Messages must be JSON objects"})
+            return True
+
+        kind = payload.get("type")
+        if kind == "ping":
+            await connection.send_json({"type": "pong"})
+        elif kind == "pong":
+            connection.ping_pending = False
+        elif kind == "cancel":
+            if connection.busy:
+                connection.cancelled = True
+                self.stats["cancelled"] += 1
+        elif kind == "chat":
+            await self._start_turn(connection, payload)
+        else:
+            await connection.send_json({"type": "error", "error": f"Unknown message type: {kind}"})
+        return True
+
+    async def _start_turn(self, connection: ChatConnection, payload: Dict[str, Any]) -> None:
+        turn_id = payload.get("id")
+        if connection.busy:
+            await connection.send_json({"type": "error", "id": turn_id, "error": "A turn is already in progress"})
+            return
+        with self._lock:
+            # Let a bounded number of turns wait for a thread; beyond that, shed
+            if self._turns_running >= self.turn_workers * 2:
+                self.stats["turns_refused"] += 1
+                refused = True
+            else:
+                self._turns_running += 1
+                refused = False
+        if refused:
+            await connection.send_json({"type": "error", "id": turn_id, "error": "Server busy", "retry_after": 2})
+            return
+        connection.cancelled = False
+        connection.window = threading.Semaphore(self.send_window)
+        connection.turn = connection.loop.run_in_executor(self._executor, self._run_turn, connection, payload)
+        connection.turn.add_done_callback(self._turn_done)
+
+    def _turn_done(self, future: asyncio.Future) -> None:
+        with self._lock:
+            self._turns_running -= 1
+
+    def _run_turn(self, connection: ChatConnection, payload: Dict[str, Any]) -> None:
+        """Run one turn in a worker thread, sending its messages as they are produced."""
+        turn_id = payload.get("id")
+
+        def emit(message: Dict[str, Any]) -> None:
+            if connection.cancelled or connection.closed:
+                raise TurnCancelled()
+            if turn_id is not None:
+                message = dict(message, id=turn_id)
+            self._send(connection, message)
+
+        if connection.closed:
+            return
+        location = payload.get("location") or connection.location
+        connection.location = location
+        data = {
+            "message": str(payload.get("message", "")),
+            "location": location,
+            "conversation_depth": payload.get("conversation_depth", connection.turns),
+            "client_id": connection.client_id,
+            "cookie": connection.cookie,
+        }
+        if payload.get("mode"):
+            data["mode"] = payload["mode"]
+        with self._lock:
+            self.stats["turns"] += 1
+        try:
+            self.handler(data, emit)
+            connection.turns += 1
+        except TurnCancelled:
+            if not connection.closed:
+                self._send_quietly(connection, {"type": "cancelled", "id": turn_id})
+        except Exception as e:
+            with self._lock:
+                self.stats["turn_errors"] += 1
+            print(f"Chat socket turn failed ({type(e).__name__}: {e})")
+            self._send_quietly(connection, {"type": "error", "id": turn_id, "error": "Internal error"})
+
+    def _send(self, connection: ChatConnection, message: Dict[str, Any]) -> None:
+        """Queue a message for the client's socket, waiting while the turn's send window is full."""
+        if not connection.window.acquire(timeout=self.send_timeout):
+            with self._lock:
+                self.stats["slow_closed"] += 1
+            asyncio.run_coroutine_threadsafe(
+                connection.close(CLOSE_SLOW_CONSUMER, "client is not reading"), connection.loop
+            )
+            raise TurnCancelled()
+        if connection.closed:
+            connection.window.release()
+            raise TurnCancelled()
+        connection.loop.call_soon_threadsafe(self._dispatch, connection, connection.window, message)
+
+    def _dispatch(self, connection: ChatConnection, window: threading.Semaphore, message: Dict[str, Any]) -> None:
+        # Tasks start in the order they are created and take the send lock first come,
+        # first served, so messages go out in the order they were emitted
+        task = connection.loop.create_task(connection.send_json(message))
+        connection.sending.add(task)
+        task.add_done_callback(lambda done: self._sent(connection, window, done))
+
+    def _sent(self, connection: ChatConnection, window: threading.Semaphore, task: asyncio.Task) -> None:
+        connection.sending.discard(task)
+        window.release()
+        if task.cancelled() or task.exception() is not None:
+            connection.cancelled = True
+        else:
+            self.stats["messages_sent"] += 1
+
+    def _send_quietly(self, connection: ChatConnection, message: Dict[str, Any]) -> None:
+        try:
+            self._send(connection, message)
+        except TurnCancelled:
+            pass
+
+    async def _sweep(self) -> None:
+        """Ping every connection each heartbeat interval and close the idle ones."""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            with self._lock:
+                connections = list(self._connections.values())
+            if not connections:
+                continue
+            for connection in connections:
+                if connection.closed:
+                    continue
+                if now - connection.last_seen > self.idle_timeout and not connection.busy:
+                    self.stats["idle_closed"] += 1
+                    asyncio.ensure_future(connection.close(CLOSE_IDLE, "no heartbeat"))
+                elif not connection.ping_pending:
+                    connection.ping_pending = True
+                    asyncio.ensure_future(self._ping(connection))
+
+    async def _ping(self, connection: ChatConnection) -> None:
+        try:
+            await connection.send_json({"type": "ping"})
+        except (TurnCancelled, OSError):
+            pass
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes of per-connection session state (socket buffers are the server's)."""
+        with self._lock:
+            count = len(self._connections)
+            sample = [(c.client_id, c.location, c.address, c.turns, c.last_seen)
+                      for c in islice(self._connections.values(), 32)]
+        return {"chat_sockets": sampled_sizeof(sample, count)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, open=len(self._connections), turns_running=self._turns_running,
+                        addresses=len(self._per_client))
+
+
+def route_websockets(http_application: Callable, routes: Dict[str, Callable]) -> Callable:
+    """ASGI application sending WebSocket paths to routes and everything else to http_application."""
+    async def application(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "websocket":
+            await http_application(scope, receive, send)
+            return
+        handler = routes.get(scope["path"])
+        if handler is None:
+            await receive()
+            await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+            return
+        await handler(scope, receive, send)
+    return application
@@ -2,6 +2,10 @@
 ASGI config for govchat project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides Django's HTTP views it serves the WebSocket chat transport at
+/ws/chat/ (see chatbot/websocket.py), e.g.:
+
+    uvicorn govchat.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +17,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'govchat.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up: the chat socket runs the views' chat pipeline
+from chatbot.services import get_chat_sockets  # noqa: E402
+from chatbot.websocket import route_websockets  # noqa: E402
+
+# HTTP goes to Django; /ws/chat/ is the streaming chat transport
+application = route_websockets(django_application, {'/ws/chat/': get_chat_sockets()})
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'chatbot.traffic.TrafficRecorderMiddleware',
 ]
 
 ROOT_URLCONF = 'govchat.urls'
@@ -145,6 +146,97 @@ CORS_ALLOWED_ORIGINS = [
 # OpenAI settings
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Knowledge base settings
+KNOWLEDGE_BASE_DIR = BASE_DIR / 'knowledge_base'
+# Answers for info-only intents, written by `python manage.py regenerate_answers`
+PRECOMPUTED_ANSWERS_PATH = BASE_DIR / 'precomputed_answers.json'
+# Seconds between checks for edited knowledge base files; 0 disables hot reload
+KNOWLEDGE_BASE_WATCH_INTERVAL = float(os.getenv('KNOWLEDGE_BASE_WATCH_INTERVAL', '5'))
+# Comma-separated Unix socket paths of retrieval sidecars (python -m chatbot.retrieval_sidecar).
+# When set, workers query the sidecars instead of building their own index; several paths
+# are treated as shards.
+RETRIEVAL_SIDECAR_SOCKETS = [path for path in os.getenv('RETRIEVAL_SIDECAR_SOCKETS', '').split(',') if path]
+
+# Chat admission control
+CHAT_MAX_CONCURRENT = int(os.getenv('CHAT_MAX_CONCURRENT', '8'))  # RAG calls running at once per worker
+CHAT_MAX_QUEUE = int(os.getenv('CHAT_MAX_QUEUE', '32'))  # requests allowed to wait for a slot
+CHAT_QUEUE_TIMEOUT = float(os.getenv('CHAT_QUEUE_TIMEOUT', '2'))  # seconds before a waiting request is shed
+CHAT_REQUEST_DEADLINE = float(os.getenv('CHAT_REQUEST_DEADLINE', '30'))  # seconds per chat request overall
+CHAT_PIPELINE_WORKERS = int(os.getenv('CHAT_PIPELINE_WORKERS', '64'))  # threads running chat pipeline stages
+# "llm", "extractive" (no model call) or "auto" (skip the model for confident FAQ matches)
+CHAT_ANSWER_MODE = os.getenv('CHAT_ANSWER_MODE', 'auto')
+# Speculative retrieval while the user types (POST /api/chat/prefetch/)
+PREFETCH_CLIENT_RATE = float(os.getenv('PREFETCH_CLIENT_RATE', '2'))  # prefetches per second per client address
+PREFETCH_GLOBAL_RATE = float(os.getenv('PREFETCH_GLOBAL_RATE', '20'))  # prefetches per second per worker
+# Answers to general (non-form) questions are cached per worker
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2048'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))  # seconds
+# JSONL log of general questions; when set, questions are recorded there and the most
+# frequent ones warm the caches at worker start-up (GET /api/ready/ waits for it)
+QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH', '')
+CACHE_WARM_TOP_N = int(os.getenv('CACHE_WARM_TOP_N', '200'))
+CACHE_WARM_RATE = float(os.getenv('CACHE_WARM_RATE', '2'))  # warm-up completions per second
+# Submitted DMV forms are queued in memory and written to this SQLite file (WAL mode) in batches
+FORM_SUBMISSIONS_DB = os.getenv('FORM_SUBMISSIONS_DB', str(BASE_DIR / 'form_submissions.sqlite3'))
+FORM_SUBMISSION_BATCH_SIZE = int(os.getenv('FORM_SUBMISSION_BATCH_SIZE', '500'))  # forms per transaction
+FORM_SUBMISSION_MAX_PENDING = int(os.getenv('FORM_SUBMISSION_MAX_PENDING', '100000'))  # queued forms before 503s
+# DMV appointment slots: offices/services JSON (empty uses the built-in offices), confirmed
+# appointments in SQLite, and how far ahead and how long a held slot is kept
+APPOINTMENT_OFFICES_FILE = os.getenv('APPOINTMENT_OFFICES_FILE', '')
+APPOINTMENTS_DB = os.getenv('APPOINTMENTS_DB', str(BASE_DIR / 'appointments.sqlite3'))
+APPOINTMENT_HORIZON_DAYS = int(os.getenv('APPOINTMENT_HORIZON_DAYS', '90'))
+APPOINTMENT_HOLD_SECONDS = float(os.getenv('APPOINTMENT_HOLD_SECONDS', '300'))
+# Offline geodata: the nearest DMV, tax and benefits offices to the request location are added
+# to prompts. Optional JSON of office kind to offices, and CSV (name,lat,lon) of extra places/ZIPs
+NEARBY_OFFICES_IN_PROMPT = os.getenv('NEARBY_OFFICES_IN_PROMPT', 'True') == 'True'
+GEODATA_OFFICES_FILE = os.getenv('GEODATA_OFFICES_FILE', '')
+GEODATA_GAZETTEER_FILE = os.getenv('GEODATA_GAZETTEER_FILE', '')
+# Document uploads (proof of residence, ID) are spooled here and deleted once read; job state and
+# the fields found are kept in SQLite for DOCUMENT_JOB_TTL seconds. pdftotext/tesseract are used when installed
+DOCUMENT_UPLOAD_DIR = os.getenv('DOCUMENT_UPLOAD_DIR', str(MEDIA_ROOT / 'document_uploads'))
+DOCUMENTS_DB = os.getenv('DOCUMENTS_DB', str(BASE_DIR / 'documents.sqlite3'))
+DOCUMENT_WORKERS = int(os.getenv('DOCUMENT_WORKERS', '2'))  # extraction processes per web worker
+DOCUMENT_MAX_BYTES = int(os.getenv('DOCUMENT_MAX_BYTES', str(20 * 1024 * 1024)))
+DOCUMENT_MAX_PENDING = int(os.getenv('DOCUMENT_MAX_PENDING', '64'))  # uploads in flight before 503s
+DOCUMENT_JOB_TTL = float(os.getenv('DOCUMENT_JOB_TTL', '86400'))
+# WebSocket chat at /ws/chat/ (ASGI only: uvicorn govchat.asgi:application); limits are per worker
+WEBSOCKET_MAX_CONNECTIONS = int(os.getenv('WEBSOCKET_MAX_CONNECTIONS', '5000'))
+WEBSOCKET_MAX_PER_CLIENT = int(os.getenv('WEBSOCKET_MAX_PER_CLIENT', '20'))  # open connections per client address
+WEBSOCKET_HEARTBEAT_INTERVAL = float(os.getenv('WEBSOCKET_HEARTBEAT_INTERVAL', '20'))  # seconds between server pings
+WEBSOCKET_IDLE_TIMEOUT = float(os.getenv('WEBSOCKET_IDLE_TIMEOUT', '60'))  # seconds of client silence before closing
+WEBSOCKET_SEND_TIMEOUT = float(os.getenv('WEBSOCKET_SEND_TIMEOUT', '10'))  # seconds a stalled reader is waited for
+WEBSOCKET_TURN_WORKERS = int(os.getenv('WEBSOCKET_TURN_WORKERS', '32'))  # threads running socket chat turns
+# Origins besides the server's own that may open chat sockets (comma-separated, e.g. https://app.example.gov)
+WEBSOCKET_ALLOWED_ORIGINS = [origin.strip() for origin in os.getenv('WEBSOCKET_ALLOWED_ORIGINS', '').split(',') if origin.strip()]
+# Follow-up turns reuse the previous turn's retrieved context, kept per client
+CONVERSATION_MAX_SESSIONS = int(os.getenv('CONVERSATION_MAX_SESSIONS', '10000'))
+CONVERSATION_TTL = float(os.getenv('CONVERSATION_TTL', '1800'))  # seconds of inactivity before a conversation starts over
+# Anonymized JSONL records of chat requests for replay (python -m chatbot.replay); empty disables
+TRAFFIC_RECORD_PATH = os.getenv('TRAFFIC_RECORD_PATH', '')
+TRAFFIC_RECORD_MAX_BYTES = int(os.getenv('TRAFFIC_RECORD_MAX_BYTES', str(50 * 1024 * 1024)))
+TRAFFIC_RECORD_BACKUPS = int(os.getenv('TRAFFIC_RECORD_BACKUPS', '5'))
+# Request profiling: X-Profile-Token with this value profiles a chat request and unlocks
+# /api/profiles/; empty disables both. PROFILE_SAMPLE_RATE profiles a random fraction of requests
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))  # milliseconds between stack samples
+PROFILE_MAX_STORED = int(os.getenv('PROFILE_MAX_STORED', '50'))  # profiles kept per worker
+# Memory budgets per component as "name=size,..." (e.g. "index_vectors=1GB,response_cache=64MB";
+# names as reported under "memory" in /api/metrics/) and for the whole process RSS ("0" disables)
+MEMORY_BUDGETS = os.getenv('MEMORY_BUDGETS', '')
+MEMORY_TOTAL_BUDGET = os.getenv('MEMORY_TOTAL_BUDGET', '0')
+MEMORY_CHECK_INTERVAL = float(os.getenv('MEMORY_CHECK_INTERVAL', '60'))  # seconds between budget checks
+# JSON file of model routes (see chatbot.routing.DEFAULT_ROUTES); empty uses the defaults
+CHAT_MODEL_ROUTES_FILE = os.getenv('CHAT_MODEL_ROUTES_FILE', '')
+# Reranking: first-stage chunks rescored per query ("0" disables) and the stage's latency
+# budget, after which the first-stage order is used
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '50'))
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '20'))
+RERANK_FEATURE_CACHE = int(os.getenv('RERANK_FEATURE_CACHE', '8192'))  # chunks whose features are cached
+RERANK_MIN_RELATIVE_SCORE = float(os.getenv('RERANK_MIN_RELATIVE_SCORE', '0.5'))  # drop chunks below this fraction of the best
+# Optional sentence-transformers cross-encoder used within the budget (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2)
+RERANK_MODEL = os.getenv('RERANK_MODEL', '')
+
 # Rest Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -26,6 +26,10 @@ def test_rag_system():
     # Build the index
     print("Building the vector index...")
     rag_system.build_index()
+    if rag_system.dedup_stats:
+        stats = rag_system.dedup_stats
+        print(f"Deduplication: {stats['chunks_in']} -> {stats['chunks_out']} chunks "
+              f"({stats['reduction']:.1%} smaller index)")
     
     # Test queries
     test_queries = [
@@ -51,6 +55,9 @@ def test_rag_system():
         relevant_docs = rag_system.retrieve_context(query)
         
         print(f"Found {len(relevant_docs)} relevant document chunks")
+        merged = sum(1 for doc in relevant_docs if doc.metadata.get("sources"))
+        if merged:
+            print(f"{merged} of them stand in for near-duplicate chunks")
         if relevant_docs:
             print("\nTop retrieved context:")
             for j, doc in enumerate(relevant_docs[:2]):  # Show top 2 for brevity